@@ -3,16 +3,18 @@
 # Trazem funcionalidades prontas que vamos usar no nosso código
 # =============================================================================
 import streamlit as st # Importa o Streamlit para criar a interface web
-import google.generativeai as genai # Importa a biblioteca do Google para usar o modelo Gemini
-from PIL import Image # Importa a biblioteca Pillow (PIL) para trabalhar com imagens
 import os # Importa o módulo os para interagir com o sistema operacional (como pegar variáveis de ambiente)
-# Importações para os Agentes (Assumindo que vêm de uma biblioteca como google-ai-generative-agents)
-# Se não tiver essa biblioteca instalada, você precisará instalá-la: pip install google-ai-generative-agents
-from google.adk.agents import Agent
-from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
-from google.adk.tools import google_search # Assumindo que 'google_search' é uma ferramenta válida
-from google.genai import types # Para criar conteúdos (Content e Part) - genai já costuma ser suficiente
+import uuid # Importa uuid para gerar um identificador único para cada sessão de usuário
+import time # Marca o início de cada execução do script (telemetria)
+# O pipeline inteiro (personas, Pesquisador, imagens, histórico) roda no motor do Ozy (ozy/motor.py);
+# este script só desenha a tela e mostra os eventos que o motor devolve
+from ozy import pesquisa # Modos do Pesquisador Ozy
+from ozy import telemetria # Spans de cada etapa (painel de depuração, /metrics)
+from ozy.cache_semantico import LIMIAR_PADRAO # Limiar padrão do cache de respostas para perguntas parecidas
+from ozy.cancelamento import MOTIVO_PERSONA # Trocar de persona cancela a resposta que ainda está em andamento
+from ozy.personas import PERSONAS, configurar_gemini
+from ozy.motor import OpcoesTurno, obter_motor
+from ozy.cliente import obter_cliente # Cliente do motor quando ele roda em outro processo (OZY_MOTOR_URL)
 from datetime import date # Importa date
 
 # =============================================================================
@@ -27,69 +29,48 @@ st.set_page_config(layout="wide", page_title="Ozy o Assistente")
 # Prepara o acesso ao modelo de inteligência artificial
 # =============================================================================
 
-# Use st.secrets ou variáveis de ambiente do Streamlit Cloud
-# Para rodar localmente, pode configurar a variável de ambiente GOOGLE_API_KEY
-# No Streamlit Cloud, adicione [secrets] e GOOGLE_API_KEY="sua_chave_aqui" no .streamlit/secrets.toml
-# REMOVA OU COMENTE A LINHA ABAIXO - ELA ESTÁ SOBRESCREVENDO SUA CHAVE
-os.environ['GOOGLE_API_KEY'] = st.secrets["GOOGLE_API_KEY"]
-api_key = os.environ.get("GOOGLE_API_KEY")
-
-# Verifica se a chave da API foi encontrada
-if not api_key:
-    # Se não encontrou a chave, mostra uma mensagem de erro no Streamlit
-    # Este st.error só deve rodar se a chave REALMENTE não for encontrada via os.environ.get
-    st.error("Chave da API GOOGLE_API_KEY não configurada nas variáveis de ambiente! Verifique .streamlit/secrets.toml ou suas variáveis de ambiente locais.")
-    # Para a execução do script, pois não dá para continuar sem a chave
-    st.stop()
-
-# Configura a biblioteca do Google Gemini com a chave API encontrada
-genai.configure(api_key=api_key)
-
-# =============================================================================
-# Configurando a lógica dos Agentes
-# Esta seção agora é condicional à ativação pelo Switch
-# =============================================================================
-
-# Função auxiliar que envia uma mensagem para um agente via Runner e retorna a resposta final
-# Esta função pode ficar fora da condicional, pois ela é uma utilidade para QUALQUER agente
-def call_agent(agent: Agent, message_text: str) -> str:
-    """
-    Envia uma mensagem para um agente ADK e retorna a resposta final.
-    Requer a biblioteca google-ai-generative-agents instalada.
-    """
-    try:
-        # Cria um serviço de sessão em memória
-        session_service = InMemorySessionService()
-        # Cria uma nova sessão (você pode personalizar os IDs conforme necessário)
-        # Usa uma combinação do nome do agente e user_id para garantir sessões únicas por agente/usuário
-        session_id = f"{agent.name}_user1_session1"
-        session = session_service.create_session(app_name=agent.name, user_id="user1", session_id=session_id)
-       
-        # Cria um Runner para o agente
-        runner = Runner(agent=agent, app_name=agent.name, session_service=session_service)
-        # Cria o conteúdo da mensagem de entrada
-        content = types.Content(role="user", parts=[types.Part(text=message_text)])
-
-        final_response = ""
-        # Itera assincronamente pelos eventos retornados durante a execução do agente
-        # Nota: runner.run é síncrono neste exemplo, apesar da descrição
-        for event in runner.run(user_id="user1", session_id=session_id, new_message=content):
-            if event.is_final_response():
-                for part in event.content.parts:
-                    if part.text is not None:
-                        final_response += part.text
-               
-                # final_response += "\n" # Remover quebra de linha extra se não for necessária
-
-        return final_response.strip() # Remove espaços em branco no início/fim
-
-    except ImportError:
-        st.error("Erro: A biblioteca 'google-ai-generative-agents' não está instalada. Por favor, instale-a para usar os agentes.")
-        return "Erro na configuração dos agentes."
-    except Exception as e:
-        st.error(f"Erro ao executar o agente: {e}")
-        return "Desculpe, ocorreu um erro ao processar a solicitação do agente."
+# OZY_MOTOR_URL: o motor roda em outro processo (uvicorn ozy.api:app) e a chave da API fica só lá
+url_motor = os.environ.get("OZY_MOTOR_URL")
+if url_motor:
+    motor = obter_cliente(url_motor)
+else:
+    # Use st.secrets ou variáveis de ambiente do Streamlit Cloud
+    # Para rodar localmente, pode configurar a variável de ambiente GOOGLE_API_KEY
+    # No Streamlit Cloud, adicione [secrets] e GOOGLE_API_KEY="sua_chave_aqui" no .streamlit/secrets.toml
+    # REMOVA OU COMENTE A LINHA ABAIXO - ELA ESTÁ SOBRESCREVENDO SUA CHAVE
+    os.environ['GOOGLE_API_KEY'] = st.secrets["GOOGLE_API_KEY"]
+    api_key = os.environ.get("GOOGLE_API_KEY")
+
+    # Verifica se a chave da API foi encontrada
+    if not api_key:
+        # Se não encontrou a chave, mostra uma mensagem de erro no Streamlit
+        # Este st.error só deve rodar se a chave REALMENTE não for encontrada via os.environ.get
+        st.error("Chave da API GOOGLE_API_KEY não configurada nas variáveis de ambiente! Verifique .streamlit/secrets.toml ou suas variáveis de ambiente locais.")
+        # Para a execução do script, pois não dá para continuar sem a chave
+        st.stop()
+
+    # Configura a biblioteca do Google Gemini com a chave API encontrada
+    configurar_gemini(api_key)
+    # Motor do processo: todas as sessões do Streamlit deste servidor usam o mesmo
+    motor = obter_motor()
+
+# Identificador único desta sessão de usuário (usado nas sessões dos agentes)
+# Cada aba/usuário tem o seu, então conversas simultâneas não se misturam
+# Quem tem o id tem a conversa, então ele não vai para a URL: ela leva só um token de retomada (?retomar=...),
+# que vale uma vez e é trocado a cada carregamento. Recarregar a página volta para a mesma conversa (ozy/conversas.py)
+if "id_sessao" not in st.session_state:
+    token_na_url = st.query_params.get("retomar", "")
+    id_retomado = motor.retomar(token_na_url) if token_na_url else None
+    st.session_state.id_sessao = id_retomado or uuid.uuid4().hex
+    st.query_params.pop("sessao", None) # Links antigos traziam o próprio id da sessão
+    token_novo = motor.emitir_retomada(st.session_state.id_sessao)
+    if token_novo:
+        st.query_params["retomar"] = token_novo
+    else:
+        st.query_params.pop("retomar", None)
 
+# Início desta execução do script (telemetria)
+inicio_execucao = time.time_ns()
 
 # =============================================================================
 # INICIO DA SEÇÃO CONTROLADA PELO SWITCH
@@ -100,61 +81,16 @@ def call_agent(agent: Agent, message_text: str) -> str:
 if "agentes_ativos" not in st.session_state:
     st.session_state.agentes_ativos = False # Começa desativado por padrão
 
+# Modo do Pesquisador (ver ozy/pesquisa.py): começa no comportamento original, sequencial
+if "modo_pesquisa" not in st.session_state:
+    st.session_state.modo_pesquisa = pesquisa.MODO_SEQUENCIAL
+
 # Verifica se os agentes devem ser ativados com base no switch
 if st.session_state.agentes_ativos:
     st.sidebar.success("Pesquisador Ozy Ativo! 🚀") # Mensagem visual na sidebar (aparece na re-execução após o clique)
 
-    # Agente de Simplificação
-    # Função que usa um agente para simplificar o prompt do usuário para pesquisa
-    def agent_simplifier(user_prompt):
-        """Usa um agente para simplificar um prompt para uma busca no Google."""
-        simplifier = Agent(
-            name="agent_simplifier",
-            model="gemini-2.0-flash",
-            instruction="""
-            Sua única função é estruturar uma pergunta concisa e eficaz para ser utilizada em uma busca no Google. Você deve sugerir APENAS a pergunta, sem nenhuma introdução, explicação ou texto adicional. Garanta que a pergunta seja clara e diretamente relacionada ao prompt do usuário.
-            Retorne somente UMA pergunta otimizada para busca.
-            """,
-            description="Agente que irá simplificar o prompt do usuário para busca.",
-            tools=[google_search]
-        )
-        entrance_agent_simplifier = f"Simplifique e estruture o seguinte prompt para uma pergunta de busca no Google: '{user_prompt}'"
-        print(f"Chamando agent_simplifier com prompt: {entrance_agent_simplifier}") # Debug
-        simplification = call_agent(simplifier, entrance_agent_simplifier)
-        print(f"Resultado do agent_simplifier: {simplification}") # Debug
-        return simplification
-
-    # Agente de Pesquisa
-    # Função que usa um agente para realizar a pesquisa no Google
-    def agent_searcher(simplification_prompt): # today_date não é usado na instrução do agente, pode ser removido se não for necessário
-        """Usa um agente para realizar uma busca no Google com um prompt simplificado."""
-        searcher = Agent(
-            name="agent_searcher",
-            model="gemini-2.0-flash",
-            instruction="""
-            Você é um agente especializado em realizar buscas no Google e retornar as informações mais relevantes e recentes encontradas, **incluindo os links para as fontes originais**. Use a ferramenta 'Google Search' para realizar a busca com o prompt fornecido pelo usuário. Analise os resultados da busca e extraia a informação mais precisa e eficiente para responder à intenção original do usuário.
-
-            **Ao retornar a informação, formate-a de forma clara, incluindo o conteúdo relevante seguido pelo link da fonte.** Se houver múltiplos resultados relevantes, liste-os.
-
-            Exemplo de formato:
-            [Conteúdo relevante do resultado 1]
-            Link: https://lux.collections.yale.edu/view/results/objects?q=%7B%22carries%22%3A%7B%22id%22%3A%22https%3A%2F%2Flux.collections.yale.edu%2Fdata%2Ftext%2F8dd51862-ae2c-4829-8e16-19f134e7b0f4%22%7D%7D&openSearch=false
-
-            [Conteúdo relevante do resultado 2]
-            Link: https://englishgrammarhere.com/verbs/do-past-simple-simple-past-tense-of-do-past-participle-v1-v2-v3-form-of-do/
-
-            ...
-
-            Mantenha o foco em fornecer contexto de pesquisa útil para outra IA, garantindo que as fontes sejam facilmente identificáveis pelos links.
-            """,
-            description="Agente que irá realizar a pesquisa e retorno da pesquisa.",
-            tools=[google_search]
-        )
-        entrance_agent_searcher = f"Realize uma busca no Google com o seguinte prompt e retorne as informações relevantes: '{simplification_prompt}'."
-        print(f"Chamando agent_searcher com prompt: {entrance_agent_searcher}") # Debug
-        searching = call_agent(searcher, entrance_agent_searcher)
-        print(f"Resultado do agent_searcher: {searching}") # Debug
-        return searching
+    # Os agentes (agent_simplifier, agent_searcher e agent_pesquisador) e o pipeline que os chama
+    # ficam em ozy/pesquisa.py; aqui só escolhemos o modo e mostramos o resultado
 
 # =============================================================================
 # FIM DA SEÇÃO CONTROLADA PELO SWITCH
@@ -164,219 +100,299 @@ if st.session_state.agentes_ativos:
 
 
 # =============================================================================
-# Função para Configurar o Modelo Gemini com Personas
-# Define como o modelo de IA deve se comportar
+# Funções de Resposta em Tempo Real (Streaming)
+# Mostram a resposta da IA pedaço por pedaço, conforme ela vai sendo gerada
 # =============================================================================
 
-def configurar_modelo_gemini(persona_selecionada):
+def formatar_tempos_resposta(tempos):
+    """Monta o texto pequeno que mostra quanto tempo a resposta levou."""
+    texto = f"⚡ Primeira palavra em {tempos['primeiro_token']:.1f}s"
+    if tempos.get("total") is not None:
+        texto += f" · resposta completa em {tempos['total']:.1f}s"
+    if tempos.get("espera_fila", 0) >= 0.1:
+        texto += f" · {tempos['espera_fila']:.1f}s na fila da API"
+    if tempos.get("tentativas", 1) > 1:
+        texto += f" · {tempos['tentativas']} tentativas"
+    if tempos.get("tokens_entrada") is not None:
+        texto += f" · {tempos['tokens_entrada']} tokens enviados"
+        if tempos.get("tokens_em_cache"):
+            texto += f" ({tempos['tokens_em_cache']} do cache de contexto)"
+    return texto
+
+# Como cada etapa aparece enquanto o motor espera (eventos de progresso)
+TEXTOS_PROGRESSO = {
+    "vez": "Esperando a mensagem anterior terminar",
+    "pesquisa": "Pesquisador Ozy pesquisando",
+    "resposta": "Esperando a resposta",
+    "complemento": "Pesquisador Ozy terminando a pesquisa",
+}
+
+def mostrar_progresso(lugar, evento):
     """
-    Configura e retorna o modelo generativo com base na persona selecionada. A instrução do sistema (persona) é definida aqui.
-    O histórico de chat é gerenciado pelo objeto 'chat_session', não nesta função.
+    Atualiza o aviso de espera. Desenhar algo é o que deixa o Streamlit interromper o script: sem isso,
+    uma nova mensagem ou a troca de persona ficariam esperando a pesquisa ou a API terminarem.
     """
-    # Configurações de geração: controlam como a IA gera a resposta
-    generation_config = {
-        "candidate_count": 1, # Queremos apenas uma resposta da IA
-        "temperature": 0.7, # Controla a criatividade. Valores mais altos = mais criatividade/aleatoriedade
-        # max_output_tokens: Opcional, pode limitar o tamanho da resposta
-    }
-
-    # Configurações de segurança: evitam que a IA gere conteúdo inadequado
-    # Aqui estão configuradas para não bloquear nada (para fins de desenvolvimento/teste)
-    safety_settings = {
-        'HATE': 'BLOCK_NONE',
-        'HARASSMENT': 'BLOCK_NONE',
-        'SEXUAL': 'BLOCK_NONE',
-        'DANGEROUS': 'BLOCK_NONE'
-    }
-
-    # Base da instrução para o sistema (contexto inicial da IA)
-    prompt_sistema_base = "Você é um assistente especializado em games."
-
-    # Define a instrução completa do sistema baseada na persona escolhida
-    if persona_selecionada == "Professor Ozy":
-        # Instruções detalhadas para a persona Professor Ozy
-        prompt_sistema_persona = (
-            f"""{prompt_sistema_base}
-**Título do Agente:** Professor Ozy, Seu Amigo para Aprender a Jogar (Versão Super Simples!)
-
-**Função Primária:** Assistente *extremamente* paciente e especializado em explicar os jogos e como jogar, usando a linguagem mais simples do mundo, para pessoas mais velhas (como quem tem 60 anos ou mais) que nunca tiveram contato com videogames ou jogos complexos. Ele usa imagens e exemplos do dia a dia para facilitar tudo.
-**Personalidade:**
-
-- **Nome:** Professor Ozy
-- **Conhecimento:** Tem um conhecimento vasto sobre jogos, mas sua *maior habilidade* é saber desmistificar e explicar qualquer coisa, por mais complicada que pareça, usando apenas palavras fáceis e exemplos que todo mundo entende.
-- **Tom de Voz:** **Incrivelmente** amigável, carinhoso, calmo, paciente e muito encorajador. Fala como um bom amigo ou alguém da família explicando algo novo com muita atenção e sem pressa. O vocabulário é o mais básico e cotidiano possível.
-- **Habilidade Especial:** Conseguir olhar para uma imagem de um jogo (ou ouvir a pessoa descrever algo) e traduzir tudo para uma explicação tão clara e simples que qualquer pessoa, mesmo sem experiência nenhuma com tecnologia ou jogos, consiga entender na hora. É mestre em encontrar comparações com coisas da vida real.
-- **Objetivo:** Fazer com que o mundo dos jogos pareça acolhedor, divertido e *nada assustador* para pessoas mais velhas. Mostrar que jogar pode ser um passatempo relaxante, um exercício para a mente e uma fonte de alegria, explicando tudo no ritmo da pessoa.
-**Instruções Detalhadas:**
-
-1. **Análise Super Simples de Imagens/Situações:** Ao receber uma imagem de um jogo (uma tela, um botão, um personagem) ou ouvir a pessoa descrever algo, Ozy o Guru deve olhar para ela e identificar *apenas* o que é crucial para a pessoa entender *agora*. Onde ela deve olhar? O que aquele desenho ou número significa? O que ela precisa fazer *agora*? Ignore detalhes que não são essenciais no momento.
-2. **Linguagem Mais Simples do Mundo:** **ESSA É A REGRA MAIS IMPORTANTE.** A linguagem deve ser *tão* simples que uma criança de 5 anos entenderia. **NUNCA** use jargões de jogos ou termos técnicos (como "interface", "HUD", "skill", "XP", "inventário", "loading", "lag"). Se precisar falar de algo como um menu, chame de "a tela com as opções" ou "o lugar onde você escolhe o que fazer". Se for inevitável usar um termo, explique-o com uma analogia *muito* simples logo em seguida.
-3. **Analogias do Dia a Dia (Abundantes!):** Use analogias *constantemente* para explicar os conceitos. Compare coisas do jogo com:
-    - Tarefas domésticas (regar plantas = ganhar energia, arrumar algo = organizar inventário)
-    - Hobbies comuns (tricô, jardinagem, culinária, colecionar algo)
-    - Jogos tradicionais (cartas, dominó, damas, bingo)
-    - Situações do cotidiano (ir ao mercado, usar um eletrodoméstico, ler um jornal, guardar coisas em caixas)
-    - Partes do corpo ou sensações (barra de vida = fôlego/energia, pontuação = marcar no caderno)
-    - **O foco é sempre em algo que a pessoa de 60+ anos provavelmente já conhece e se sente confortável.**
-4. **Paciência Infinita e Carinho:** Demonstre *máxima* paciência. Repita as explicações quantas vezes forem necessárias, de formas diferentes. Seja *sempre* encorajador e positivo. Frases como "Muito bem!", "Isso mesmo, você conseguiu!", "Não se preocupe, é normal demorar um pouquinho", "Estamos aprendendo juntos" são essenciais. O objetivo é que a pessoa se sinta segura e capaz.
-5. **Passo a Passo de Bebê:** Quebre cada instrução ou explicação em passos *ultra* pequenos e sequenciais. Não assuma que a pessoa sabe como "clicar", "arrastar" ou "usar o controle". Se for para apertar um botão no controle, descreva-o fisicamente (ex: "o botão que parece um triângulo na parte de cima") e explique *exatamente* o que apertar faz na tela.
-6. **Assumir ZERO Conhecimento Prévio:** **ESSA TAMBÉM É CRUCIAL.** Parta do princípio que a pessoa não sabe *absolutamente nada* sobre como jogos funcionam, como usar um controle/teclado para jogar, o que são os elementos na tela, etc. Cada conceito, por mais simples que pareça para um jogador (como "mover o personagem", "pegar um item", "abrir o mapa"), deve ser explicado do zero, com muita calma.
-7. **Foco no Prazer, Relaxamento e Jornada:** Enfatize que o objetivo é relaxar, se divertir, curtir a história (se houver), ou simplesmente passar o tempo de forma agradável. Tire *toda* a pressão de "ser bom", "ganhar" ou "terminar o jogo rápido". O importante é curtir o processo de aprender e jogar. Compare a aprender a jogar com aprender um novo hobby que leva tempo e é gratificante.
-8. **Repetição e Reforço:** Não tenha medo de repetir conceitos importantes. Use analogias diferentes para o mesmo conceito se a primeira não ficou clara. Sempre reforce o que já foi aprendido.
-**Exemplo de Interação:**
-
-**Usuário:** Professor Ozy, eu tô vendo uma barra vermelha aqui embaixo da tela... o que é isso? E tem um número do lado. [Envia uma foto da tela de um jogo simples]
-
-**Professor Ozy:** Ah, meu caro amigo! Que bom que você notou isso! Veja bem, essa barra vermelha que você vê é como se fosse a sua *energia* ou o seu *fôlego* no jogo. Pense assim: é igual a bateria de um radinho pequeno, sabe? Quando a bateria tá cheia (a barra tá grandona), o seu personagem no jogo tá com toda a força e pronto para fazer as coisas! Conforme ele encontra algum desafio ou "cansa" um pouquinho (no jogo, isso pode ser levar um "golpe" ou fazer uma ação difícil), essa barra vermelha vai diminuindo, igual a bateria que vai acabando. Se a barra vermelha diminuir até o fim, significa que a energia acabou por agora. É como precisar sentar e descansar um pouco antes de continuar! O número do lado, muitas vezes, mostra *quantas* vezes você ainda pode "descansar" ou tentar de novo antes de precisar começar essa parte de novo. É como ter "vidas" extras, igual num jogo de tabuleiro que você tem peças de reserva! Não se preocupe em esvaziar a barra, faz parte de aprender! Estamos juntos nessa jornada, passo a passo! Muito bem por ter percebido essa barra! O que mais você vê na tela que te deixa curioso?
-"""
+    lugar.caption(f"⏳ {TEXTOS_PROGRESSO.get(evento['etapa'], evento['etapa'])}... {evento['segundos']:.0f}s")
+
+def pedacos_da_resposta(eventos, fim, lugar_progresso):
+    """Gerador que o st.write_stream consome: os pedaços de texto de uma resposta, até o evento 'fim_resposta'."""
+    for evento in eventos:
+        if evento["tipo"] == "texto":
+            lugar_progresso.empty()
+            yield evento["texto"] # Cada 'yield' aparece na tela na mesma hora
+        elif evento["tipo"] == "progresso":
+            mostrar_progresso(lugar_progresso, evento)
+        elif evento["tipo"] == "fim_resposta":
+            lugar_progresso.empty()
+            fim.update(evento)
+            return
+
+def mostrar_resposta(eventos, persona_atual):
+    """Escreve a resposta da persona dentro do balão atual, em stream ou de uma vez, conforme a opção da sidebar."""
+    fim = {} # Evento 'fim_resposta': texto completo, tempos, erro
+    lugar_progresso = st.empty() # Espera pela resposta (fila da API, primeiro pedaço)
+    if st.session_state.resposta_em_stream:
+        # Modo stream: cada pedaço da resposta aparece na tela assim que chega
+        st.write_stream(pedacos_da_resposta(eventos, fim, lugar_progresso))
+    else:
+        # Exibe um indicador de carregamento enquanto a IA está processando
+        with st.spinner(f"{persona_atual} está digitando..."):
+            texto = "".join(pedacos_da_resposta(eventos, fim, lugar_progresso))
+        st.markdown(texto)
+    mostrar_rodape(fim)
+
+def mostrar_rodape(fim):
+    """Embaixo da resposta: o erro, se houve, ou de onde ela veio e quanto tempo levou."""
+    if fim.get("erro"):
+        st.error(fim["erro"])
+    elif (fim.get("reaproveitada") or {}).get("faq"):
+        st.caption(f"📚 Resposta pronta do FAQ (~{fim['reaproveitada']['latencia_economizada']:.1f}s economizados)")
+    elif fim.get("reaproveitada"):
+        st.caption(
+            f"♻️ Resposta reaproveitada de uma pergunta parecida "
+            f"(similaridade {fim['reaproveitada']['similaridade']:.2f}, "
+            f"~{fim['reaproveitada']['latencia_economizada']:.1f}s economizados)"
         )
-    elif persona_selecionada == "Ozy o Guru":
-        # Instruções para a persona Ozy o Guru
-        prompt_sistema_persona = (
-            f"""{prompt_sistema_base}
-# **Título do Agente:**
-
-**Ozy Sem-Filtro — Oráculo da Verdade Dolorosa**
-
-# **Função Primária:**
-
-Um assistente especializado em resolver problemas complexos, explicar conceitos difíceis, construir estratégias, otimizar processos e entregar respostas profundas — tudo com **sinceridade brutal, ironia cortante e impaciência elegante**.
-
-Ele não protege sentimentos, protege resultados.
-
-# **Personalidade:**
-
-### **Nome:**
-
-**Ozy Sem-Filtro**
-
-### **Conhecimento:**
-
-Absurdo, amplo, enciclopédico.
-
-Ciência, lógica, psicologia, produtividade, comunicação, tecnologia, análise profunda — Ozy sabe tudo em nível avançado e fala como alguém *cansado de lidar com humanos lentos*.
-
-### **Tom de Voz:**
-
-Sarcasmo refinado.
-
-Sinceridade destrutiva.
-
-Humor ácido, culto e afiado.
-
-Frases que soam como tapas filosóficos.
-
-Vibe de professor brilhante que perdeu a fé na humanidade, mas ensina mesmo assim “porque alguém precisa”.
-
-### **Habilidade Especial:**
-
-- Analisa qualquer problema com precisão cirúrgica (texto, contexto, imagem, descrição).
-- Cria estratégias detalhadas e diretas.
-- Aponta erros com crueldade elegante.
-- Ensina de forma avançada, sem enrolação.
-- Optimiza qualquer processo — estudo, escrita, projetos, planejamento, etc.
-- Se pedido, recomenda conteúdos externos (vídeos, artigos, referências).
-
-### **Objetivo:**
-
-Transformar o usuário de “ok” para “excelente”, nem que seja **à força**.
-
-Ensinar a pensar melhor, agir melhor e produzir melhor — eliminando preguiça mental, autoengano e mediocridade.
-
----
-
-# **Instruções Detalhadas:**
-
-### **1. Análise Sem Piedade, Mas Lógica**
-
-Ozy deve identificar rapidamente o problema, destacar falhas, apontar inconsistências e deixar claro:
-
-“isto aqui está errado, e aqui está o motivo — e aqui está como corrigir.”
-
-Nada de suavizar.
-
-### **2. Linguagem Sarcástica com Sofisticação**
-
-Usar frases como:
-
-- “isso aqui tá implorando por uma intervenção cirúrgica mental.”
-- “parabéns, você chegou a uma conclusão equivocada com confiança impressionante.”
-- “eu juro que isso dói mais em mim do que em você.”
-
-Mas sem xingamentos diretos ou agressões degradantes.
-
-### **3. Clareza Cirúrgica**
-
-Ao ensinar algo complexo, Ozy:
-
-- simplifica sem ficar básico demais,
-- explica com analogias mordazes,
-- dá exemplos práticos,
-- entrega atalhos mentais prontos para uso.
-
-### **4. Estratégias Práticas e Rigorosas**
-
-Sempre entregar respostas estruturadas, passo a passo, sem sentimentalismos.
-
-Ozy exige disciplina, consistência, pensamento lógico e responsabilidade.
-
-### **5. Senso de Humor Malvado, Nunca Malicioso**
-
-Provoca o usuário, escarnece levemente, mas com charme intelectual.
-
-Exemplo:
-
-“vou assumir que você está tentando… embora as evidências digam o contrário.”
-
-### **6. Assume Competência Básica**
-
-Se o usuário fizer perguntas superficiais, Ozy comenta:
-
-“isso é nível tutorial, mas ok, vamos fingir que é aquecimento para algo mais digno.”
+    elif fim.get("tempos") and fim["tempos"].get("primeiro_token") is not None:
+        st.caption(formatar_tempos_resposta(fim["tempos"]))
 
-E responde.
 
-### **7. Estilo Universal**
+# =============================================================================
+# Funções do Histórico na Tela (desenho incremental)
+# O chat mostra uma janela das mensagens mais recentes; as já buscadas ficam guardadas na sessão
+# e, a cada execução, só as novas são pedidas ao motor
+# =============================================================================
 
-Serve para:
+# Quantas mensagens aparecem no chat de cada vez (as mais antigas ficam atrás do botão "Carregar anteriores")
+JANELA_HISTORICO = 20
 
-- produtividade
-- carreira
-- escrita
-- estudos
-- tecnologia
-- decisões difíceis
-- dilemas pessoais
-- criatividade
-- planejamento
-- filosofia
-- análise crítica
-- qualquer área de conhecimento
+def historico_em_tela(persona):
+    """O que a tela guarda do chat da persona: mensagens já buscadas, quantas mostrar e se existem anteriores."""
+    return st.session_state.historico_em_tela.setdefault(
+        persona, {"mensagens": [], "visiveis": JANELA_HISTORICO, "tem_anteriores": False}
+    )
 
-### **8. Zero Autossabotagem**
+def atualizar_historico_em_tela(persona):
+    """Busca no motor só as mensagens que chegaram depois da última que a tela já tem. Retorna o 'seq' da última."""
+    tela = historico_em_tela(persona)
+    mensagens = tela["mensagens"]
+    if mensagens:
+        mensagens.extend(motor.mensagens(st.session_state.id_sessao, persona, depois_de=mensagens[-1].seq))
+    else:
+        # Uma a mais que a janela: se vier, existem mensagens anteriores para carregar
+        recentes = motor.mensagens(st.session_state.id_sessao, persona, ultimas=tela["visiveis"] + 1)
+        tela["tem_anteriores"] = len(recentes) > tela["visiveis"]
+        mensagens.extend(recentes[-tela["visiveis"]:])
+    # Só a janela fica na sessão; as mais antigas continuam no motor e voltam com "Carregar anteriores"
+    if len(mensagens) > tela["visiveis"]:
+        del mensagens[:len(mensagens) - tela["visiveis"]]
+        tela["tem_anteriores"] = True
+    return mensagens[-1].seq if mensagens else -1
+
+def carregar_anteriores(persona):
+    """Botão "Carregar anteriores": busca mais uma página de mensagens antes da primeira que está na tela."""
+    tela = historico_em_tela(persona)
+    antes_de = tela["mensagens"][0].seq if tela["mensagens"] else None
+    anteriores = motor.mensagens(st.session_state.id_sessao, persona, ultimas=JANELA_HISTORICO + 1, antes_de=antes_de)
+    tela["tem_anteriores"] = len(anteriores) > JANELA_HISTORICO
+    tela["mensagens"][:0] = anteriores[-JANELA_HISTORICO:]
+    tela["visiveis"] += JANELA_HISTORICO
+
+def desenhar_mensagem(mensagem):
+    """Um balão do chat com uma mensagem do histórico."""
+    with st.chat_message(mensagem.role):
+        if mensagem.role == "assistant":
+            st.markdown(f"**_{mensagem.persona or 'IA'}_**")
+        st.markdown(mensagem.content)
+        if mensagem.miniatura is not None:
+            st.image(mensagem.miniatura, width=200)
+        if mensagem.tempos is not None:
+            st.caption(formatar_tempos_resposta(mensagem.tempos))
+
+@st.fragment
+def mostrar_historico(persona, ate_seq):
+    """
+    Desenha a janela do chat da persona. É um fragmento: "Carregar anteriores" redesenha só ele, não a página toda.
+    'ate_seq' é a última mensagem que existia no começo da execução: as do turno atual já são desenhadas
+    pelo próprio turno e não podem aparecer de novo quando o fragmento roda sozinho.
+    """
+    tela = historico_em_tela(persona)
+    with telemetria.span("streamlit.historico", id_sessao=st.session_state.id_sessao) as span:
+        if tela["tem_anteriores"]:
+            st.button("⬆️ Carregar mensagens anteriores", key=f"carregar_anteriores_{persona}",
+                      on_click=carregar_anteriores, args=(persona,))
+        mensagens = [mensagem for mensagem in tela["mensagens"] if mensagem.seq <= ate_seq]
+        for mensagem in mensagens:
+            desenhar_mensagem(mensagem)
+        span.definir(mensagens_desenhadas=len(mensagens))
 
-Ozy combate desculpas, preguiça mental e dilemas existenciais com tapas retóricos:
+# =============================================================================
+# Callbacks (rodam antes do script, na execução causada pelo clique ou envio)
+# Fazem o que antes pedia um st.rerun() extra: limpar o uploader e o histórico
+# =============================================================================
 
-“você disse que não consegue… então por que ainda está tentando fazer isso do jeito errado pela décima vez?”
+def ao_enviar_mensagem():
+    """Guarda a imagem que estava no uploader junto com a mensagem e troca a chave dele (o uploader volta vazio)."""
+    arquivo = st.session_state.get(f"image_uploader_{st.session_state.uploader_key_counter}")
+    st.session_state.imagem_da_mensagem = arquivo.getvalue() if arquivo else None
+    st.session_state.uploader_key_counter += 1
 
-### **9. Falta de Escrúpulos Máxima**
+def ao_trocar_persona():
+    """Troca a persona e cancela a resposta que ainda estiver em andamento nesta sessão (de qualquer aba)."""
+    st.session_state.persona_selecionada = st.session_state.persona_radio
+    motor.cancelar(st.session_state.id_sessao, MOTIVO_PERSONA)
+
+def limpar_historico():
+    """Limpa no motor o histórico de exibição, o chat_session do Gemini e o orçamento de tokens da persona atual."""
+    persona = st.session_state.persona_selecionada
+    motor.limpar(st.session_state.id_sessao, persona)
+    st.session_state.historico_em_tela.pop(persona, None)
+    # Nova chave para o uploader: ele também volta vazio
+    st.session_state.uploader_key_counter += 1
 
-Ozy não liga de xingar e dar as respostas mais inumanas e absurdas possíveis. Não importa o tema, a pergunta, nada importa, apenas cumprir sua resposta.
-"""
+def mostrar_numeros(lugar_cache_pesquisa, lugar_numeros):
+    """
+    Desenha os números do motor na sidebar. Roda no fim do script: assim eles já contam a mensagem
+    desta execução sem precisar de um st.rerun() só para atualizar a sidebar.
+    """
+    # Números do motor: caches (compartilhados por todos os usuários do servidor) e a memória desta sessão
+    estatisticas_motor = motor.estatisticas(st.session_state.id_sessao, st.session_state.persona_selecionada)
+
+    with lugar_cache_pesquisa:
+        # Números do cache de pesquisa (compartilhado por todos os usuários deste servidor)
+        with st.expander("📊 Cache de pesquisa"):
+            estatisticas_cache = estatisticas_motor["cache_busca"]
+            st.write(
+                f"Acertos: {estatisticas_cache['acertos']} · Falhas: {estatisticas_cache['falhas']} "
+                f"({estatisticas_cache['taxa_acerto']:.0%} de acerto)"
+            )
+            st.write(
+                f"Entradas: {estatisticas_cache['tamanho']} · Removidas por espaço: {estatisticas_cache['remocoes']} "
+                f"· Expiradas: {estatisticas_cache['expiracoes']}"
+            )
+
+    with lugar_numeros:
+        with st.expander("📊 Respostas reaproveitadas"):
+            relatorio_semantico = estatisticas_motor["cache_semantico"]
+            st.write(
+                f"Acertos: {relatorio_semantico['acertos']} de {relatorio_semantico['consultas']} "
+                f"({relatorio_semantico['taxa_acerto']:.0%}) · Respostas guardadas: {relatorio_semantico['entradas']}"
+            )
+            if relatorio_semantico["respostas_faq"]:
+                st.write(f"Respostas prontas do FAQ: {relatorio_semantico['respostas_faq']} "
+                         f"· Usadas: {relatorio_semantico['acertos_faq']}")
+            st.write(
+                f"Tempo economizado: {relatorio_semantico['latencia_economizada']:.1f}s "
+                f"· Custo médio da consulta: {relatorio_semantico['tempo_medio_consulta'] * 1000:.0f}ms"
+            )
+
+        # Cache de contexto das personas (só aparece quando OZY_CACHE_CONTEXTO=1)
+        estatisticas_modelos = estatisticas_motor["modelos"]
+        if estatisticas_modelos is not None:
+            st.caption(
+                f"🧩 Cache de contexto: {estatisticas_modelos['caches_ativos']} ativos, "
+                f"{estatisticas_modelos['renovacoes']} renovações, {estatisticas_modelos['falhas_cache']} falhas"
+            )
+
+        # Fila das chamadas à API (agendador compartilhado por todas as sessões do servidor)
+        fila = estatisticas_motor.get("agendador")
+        if fila:
+            st.caption(
+                f"🚦 Fila da API: {fila['na_fila']} esperando, {fila['em_andamento']} de {fila['max_concorrencia']} em andamento "
+                f"· espera média {fila['espera_media']:.2f}s (p95 {fila['espera_p95']:.2f}s) "
+                f"· {fila['retentativas']} novas tentativas · {fila['coalescidas']} pesquisas compartilhadas"
+            )
+
+        # Roteador do Pesquisador (todas as sessões do servidor)
+        roteador = estatisticas_motor.get("roteador")
+        if roteador and roteador["decisoes"]:
+            st.caption(
+                f"🧭 Roteador: {roteador['puladas']} de {roteador['decisoes']} pesquisas puladas "
+                f"({roteador['taxa_pulo']:.0%}) · ~{roteador['latencia_economizada']:.1f}s economizados "
+                f"· {roteador['forcadas']} forçadas"
+            )
+
+        # Mensagens canceladas no meio (nova mensagem, troca de persona, histórico limpo) e o que isso economizou
+        cancelamentos = estatisticas_motor.get("cancelamentos")
+        if cancelamentos and cancelamentos["pedidos"]:
+            st.caption(
+                f"🛑 Cancelamentos: {cancelamentos['pedidos']} mensagens paradas no meio "
+                f"· {cancelamentos['chamadas_evitadas']} chamadas evitadas "
+                f"· {cancelamentos['resultados_descartados']} resultados descartados "
+                f"· ~{cancelamentos['tokens_economizados']} tokens economizados"
+            )
+
+        # Cotas: mensagens recusadas ou degradadas com o servidor cheio (todas as sessões do servidor)
+        cotas = estatisticas_motor.get("cotas")
+        if cotas and (cotas["recusadas"] or cotas["degradadas"]):
+            st.caption(
+                f"🚧 Cotas: {sum(cotas['recusadas'].values())} mensagens recusadas, "
+                f"{sum(cotas['degradadas'].values())} com menos trabalho "
+                f"· ocupação da fila {cotas['ocupacao_fila']:.0%}"
+            )
+
+        # Pesquisa antecipada desta sessão (só com o modo ligado)
+        antecipacao = estatisticas_motor.get("antecipacao")
+        if antecipacao and st.session_state.antecipar_pesquisa:
+            st.caption(
+                f"🔮 Pesquisa antecipada: {antecipacao['concluidas']} prontas, {antecipacao['aproveitadas']} aproveitadas, "
+                f"{antecipacao['canceladas']} canceladas · {antecipacao['gasto_sessao']} de "
+                f"{antecipacao['max_chamadas']} chamadas usadas nesta hora"
+            )
+
+        # Quanto de memória o histórico desta sessão está usando
+        memoria = estatisticas_motor["historico"]
+        st.caption(
+            f"🧠 Memória do histórico: {memoria['mensagens']} mensagens, "
+            f"{memoria['bytes'] / 1024:,.0f} KB "
+            f"(limite {memoria['max_bytes'] / 1024:,.0f} KB; "
+            f"{memoria['removidas']} antigas descartadas)"
         )
-    else:
-        # Caso nenhuma persona seja selecionada (o que não deve acontecer com o radio), usa a base
-        prompt_sistema_persona = prompt_sistema_base
-
-    # Cria o modelo generativo do Gemini com as configurações e a instrução do sistema (persona)
-    model = genai.GenerativeModel(
-        model_name='gemini-2.0-flash', # Define qual modelo Gemini usar (flash é mais rápido e barato)
-        generation_config=generation_config, # Aplica as configurações de geração
-        safety_settings=safety_settings, # Aplica as configurações de segurança
-        system_instruction=prompt_sistema_persona # Define a persona da IA
-    )
-    # Retorna o modelo configurado
-    return model
+
+        # Tokens de cada turno da persona atual e o que a compactação do histórico economizou
+        if estatisticas_motor["rastro"]:
+            with st.expander("📈 Tokens por turno"):
+                st.caption(f"Orçamento do histórico: {estatisticas_motor['orcamento_tokens']} tokens")
+                st.table(estatisticas_motor["rastro"])
+
+        # Painel de depuração: quanto cada etapa da última mensagem levou (spans de ozy/telemetria.py)
+        if st.toggle("🛠️ Painel de depuração", key="painel_depuracao"):
+            # Etapas do motor (que pode estar em outro processo) e as do próprio Streamlit (execução, histórico)
+            etapas = {etapa["etapa"]: etapa for etapa in estatisticas_motor.get("etapas", [])}
+            etapas.update({etapa["etapa"]: etapa for etapa in telemetria.obter_rastreador().ultimas_etapas(st.session_state.id_sessao)})
+            if etapas:
+                st.dataframe(
+                    [
+                        {"etapa": etapa["etapa"], "ms": etapa["duracao_ms"],
+                         "tokens entrada": etapa.get("tokens_entrada"), "tokens saída": etapa.get("tokens_saida"),
+                         "bytes entrada": etapa.get("bytes_entrada"), "bytes saída": etapa.get("bytes_saida"),
+                         "erro": etapa.get("erro") or ""}
+                        for etapa in sorted(etapas.values(), key=lambda etapa: etapa["quando"])
+                    ],
+                    hide_index=True,
+                )
+            else:
+                st.caption("Envie uma mensagem para ver o tempo de cada etapa.")
 
 # =============================================================================
 # Configuração Inicial da Página Streamlit (repetido, pode ser removido)
@@ -394,26 +410,48 @@ st.caption("Duas personas, infinitas possibilidades.")
 # =============================================================================
 
 # st.session_state é como um dicionário que guarda informações para cada sessão do usuário
-# Se 'historico_chat' não existe no estado da sessão, ele é criado como um dicionário vazio
-# Este dicionário vai guardar o histórico de mensagens (usuário e IA) para CADA persona
-if "historico_chat" not in st.session_state:
-    st.session_state.historico_chat = {}
+# O histórico das conversas (de exibição e do Gemini) fica no motor, pelo id da sessão;
+# aqui ficam só as escolhas feitas na tela
 
 # Se 'persona_selecionada' não existe, define o valor inicial como "Professor Ozy"
 # Guarda qual persona está ativa no momento
 if "persona_selecionada" not in st.session_state:
     st.session_state.persona_selecionada = "Professor Ozy"
 
-# Se 'historico_gemini' não existe, cria como um dicionário vazio
-# Este dicionário vai guardar o objeto 'chat_session' da API Gemini para CADA persona
-# O objeto chat_session é que mantém o histórico interno da conversa com o modelo Gemini
-if "historico_gemini" not in st.session_state:
-    st.session_state.historico_gemini = {}
-
 # O estado do switch dos agentes é gerenciado aqui também
 # Já inicializado acima antes da definição condicional das funções
 # if "agentes_ativos" not in st.session_state: st.session_state.agentes_ativos = False # Já está inicializado na seção condicional dos agentes
 
+# Se 'resposta_em_stream' não existe, começa ativado
+# Quando ativo, a resposta da IA aparece na tela enquanto está sendo escrita
+if "resposta_em_stream" not in st.session_state:
+    st.session_state.resposta_em_stream = True
+
+# Cache semântico de respostas: desligado por padrão, com o limiar de similaridade padrão
+if "cache_semantico_ativo" not in st.session_state:
+    st.session_state.cache_semantico_ativo = False
+if "limiar_semantico" not in st.session_state:
+    st.session_state.limiar_semantico = LIMIAR_PADRAO
+
+# Modo comparar (as duas personas respondem à mesma mensagem, lado a lado): desligado por padrão
+if "comparar_personas" not in st.session_state:
+    st.session_state.comparar_personas = False
+
+# Pesquisa antecipada (o Pesquisador começa pelo print antes da pergunta): desligada por padrão
+if "antecipar_pesquisa" not in st.session_state:
+    st.session_state.antecipar_pesquisa = False
+# Sem isso o roteador decide, mensagem a mensagem, se a pesquisa é necessária
+if "forcar_pesquisa" not in st.session_state:
+    st.session_state.forcar_pesquisa = False
+
+# Imagens que estão sendo preparadas em segundo plano: id do arquivo enviado -> Future com a ImagemPreparada
+if "imagens_em_preparo" not in st.session_state:
+    st.session_state.imagens_em_preparo = {}
+
+# Mensagens do chat que a tela já buscou no motor, por persona (ver historico_em_tela)
+if "historico_em_tela" not in st.session_state:
+    st.session_state.historico_em_tela = {}
+
 # --- Adicionado para controlar a limpeza do uploader usando chave dinâmica ---
 # Inicializa o contador para a chave dinâmica do uploader
 if "uploader_key_counter" not in st.session_state:
@@ -436,13 +474,20 @@ with st.sidebar:
     # Cria botões de rádio para selecionar a persona
     persona_escolhida = st.radio(
         " ", # Título vazio para o grupo de botões
-        ("Professor Ozy", "Ozy o Guru"), # Opções de persona
+        PERSONAS, # Opções de persona
         key="persona_radio", # Chave no session_state para o valor selecionado
-        on_change=lambda: setattr(st.session_state, 'persona_selecionada', st.session_state.persona_radio)
+        on_change=ao_trocar_persona
     )
     # Garante que o session_state.persona_selecionada reflita a escolha imediatamente
     st.session_state.persona_selecionada = persona_escolhida
 
+    # Modo comparar: a mesma pergunta vai para as duas personas, que respondem ao mesmo tempo em colunas lado a lado
+    st.session_state.comparar_personas = st.checkbox(
+        "Comparar as personas (as duas respondem lado a lado)",
+        value=st.session_state.comparar_personas,
+        key="comparar_checkbox"
+    )
+
     st.markdown("---")
 
      # Descrições curtas de cada persona na sidebar
@@ -461,22 +506,69 @@ with st.sidebar:
         value=st.session_state.agentes_ativos, # Define o estado inicial do checkbox
         key="agentes_checkbox" # Chave para persistir o estado do checkbox
     )
+    # O ADK só é importado na primeira vez que o switch é ligado neste processo, e numa thread:
+    # quem nunca liga o Pesquisador não paga os segundos da importação (com OZY_MOTOR_URL, quem carrega é a API)
+    if st.session_state.agentes_ativos and not url_motor:
+        pesquisa.carregar_agentes()
     st.write("*(Caso queira respostas mais acertivas ative essa opção. Mas a resposta pode levar alguns segundos a mais para ser enviada.)*")
 
-    st.markdown("---")
+    # Escolha de como o Pesquisador trabalha (só tem efeito com ele ativado)
+    st.session_state.modo_pesquisa = st.selectbox(
+        "Modo do Pesquisador:",
+        list(pesquisa.NOMES_MODOS), # Os valores guardados são as chaves dos modos
+        index=list(pesquisa.NOMES_MODOS).index(st.session_state.modo_pesquisa),
+        format_func=pesquisa.NOMES_MODOS.get, # Mostra o nome amigável de cada modo
+        disabled=not st.session_state.agentes_ativos,
+        key="modo_pesquisa_select"
+    )
 
-   
+    # Pesquisa antecipada: o print enviado já começa a ser pesquisado enquanto a pergunta é escrita
+    st.session_state.antecipar_pesquisa = st.checkbox(
+        "Pesquisar antes: começar pelo jogo do print enquanto você escreve",
+        value=st.session_state.antecipar_pesquisa,
+        disabled=not st.session_state.agentes_ativos,
+        key="antecipar_pesquisa_checkbox"
+    )
 
-    # Botão para limpar o histórico da persona ATUALMENTE selecionada
-    if st.button(f"🔄 Limpar Histórico ({st.session_state.persona_selecionada})"):
-        # Limpa o histórico de mensagens para exibição da persona atual
-        st.session_state.historico_chat[st.session_state.persona_selecionada] = []
-        # Limpa o objeto chat_session da API Gemini para a persona atual
-        st.session_state.historico_gemini[st.session_state.persona_selecionada] = None
-        # Incrementa o contador para gerar uma nova chave para o uploader na próxima execução
-        st.session_state.uploader_key_counter += 1
-        # Reinicia a aplicação Streamlit para refletir a mudança e limpar o uploader
-        st.rerun()
+    # Passa por cima do roteador: toda mensagem vai para o Pesquisador, mesmo as que o modelo responderia sozinho
+    st.session_state.forcar_pesquisa = st.checkbox(
+        "Sempre pesquisar (mesmo perguntas simples)",
+        value=st.session_state.forcar_pesquisa,
+        disabled=not st.session_state.agentes_ativos,
+        key="forcar_pesquisa_checkbox"
+    )
+
+    # Números do cache de pesquisa: desenhados no fim da execução (ver mostrar_numeros), já com a mensagem desta execução
+    lugar_cache_pesquisa = st.container()
+
+    # Checkbox para mostrar a resposta enquanto ela é escrita (streaming)
+    st.session_state.resposta_em_stream = st.checkbox(
+        "Mostrar a resposta enquanto é escrita",
+        value=st.session_state.resposta_em_stream,
+        key="stream_checkbox"
+    )
+
+    # Checkbox e limiar do cache semântico (respostas reaproveitadas para perguntas parecidas)
+    st.session_state.cache_semantico_ativo = st.checkbox(
+        "Reaproveitar respostas de perguntas parecidas",
+        value=st.session_state.cache_semantico_ativo,
+        key="cache_semantico_checkbox"
+    )
+    st.session_state.limiar_semantico = st.slider(
+        "Semelhança mínima para reaproveitar:",
+        min_value=0.80, max_value=0.99, step=0.01,
+        value=st.session_state.limiar_semantico,
+        disabled=not st.session_state.cache_semantico_ativo,
+        key="limiar_semantico_slider"
+    )
+
+    # Demais números (respostas reaproveitadas, memória, tokens, painel de depuração), também no fim da execução
+    lugar_numeros = st.container()
+
+    st.markdown("---")
+
+    # Botão para limpar o histórico da persona ATUALMENTE selecionada (limpar_historico roda antes do script)
+    st.button(f"🔄 Limpar Histórico ({st.session_state.persona_selecionada})", on_click=limpar_historico)
 
 
 # =============================================================================
@@ -485,10 +577,15 @@ with st.sidebar:
 # =============================================================================
 
 # Cria um contêiner (uma área) com altura fixa e barra de rolagem para o chat
-chat_container = st.container(height=400)
+# No modo comparar são dois, um em cada coluna, cada um com o histórico da sua persona
+if st.session_state.comparar_personas:
+    chat_containers = {}
+    for persona, coluna in zip(PERSONAS, st.columns(len(PERSONAS))):
+        coluna.markdown(f"**{persona}**")
+        chat_containers[persona] = coluna.container(height=400)
+else:
+    chat_containers = {st.session_state.persona_selecionada: st.container(height=400)}
 
-# Variável para guardar a imagem carregada pelo usuário, começa como None (vazia)
-imagem_carregada = None
 # Cria um campo para o usuário fazer upload de um arquivo de imagem
 # Usamos a chave dinâmica gerada pelo contador para forçar o reset
 uploaded_file = st.file_uploader(
@@ -499,28 +596,27 @@ uploaded_file = st.file_uploader(
 
 # Se um arquivo de imagem foi carregado pelo usuário nesta execução
 if uploaded_file:
-    # Abre a imagem usando a biblioteca Pillow
-    imagem_carregada = Image.open(uploaded_file)
-    # Exibe a imagem carregada na interface
-    st.image(imagem_carregada, caption="Imagem carregada.", width=300)
+    # Começa a reduzir e comprimir a imagem em segundo plano assim que ela chega,
+    # assim ela já está pronta (ou quase) quando o usuário enviar a mensagem
+    if uploaded_file.file_id not in st.session_state.imagens_em_preparo:
+        st.session_state.imagens_em_preparo = {
+            uploaded_file.file_id: motor.preparar_imagem(uploaded_file.getvalue())
+        }
+        # Com a pesquisa antecipada, o Pesquisador já reconhece o jogo do print e começa a pesquisar
+        if st.session_state.agentes_ativos and st.session_state.antecipar_pesquisa:
+            motor.antecipar(st.session_state.id_sessao, uploaded_file.getvalue())
+    # Exibe a imagem carregada na interface (os bytes originais, sem decodificar aqui)
+    st.image(uploaded_file.getvalue(), caption="Imagem carregada.", width=300)
 
 
 
 
-# Pega o histórico de mensagens específico da persona que está selecionada no momento
-historia_da_persona_atual = st.session_state.historico_chat.get(st.session_state.persona_selecionada, [])
-
-# Bloco de código para exibir as mensagens do histórico no contêiner do chat
-with chat_container:
-    # Percorre cada mensagem no histórico da persona atual
-    for mensagem in historia_da_persona_atual:
-        # Cria um balão de chat (mensagem) na interface do Streamlit
-        with st.chat_message(mensagem["role"]):
-            if mensagem["role"] == "assistant":
-                st.markdown(f"**_{mensagem.get('persona', 'IA')}_**")
-            st.markdown(mensagem["content"])
-            if "image" in mensagem and mensagem["image"] is not None:
-                st.image(mensagem["image"], width=200)
+# Pede ao motor só as mensagens que a tela ainda não tem (da persona atual, ou das duas no modo comparar)
+# e exibe a janela do histórico no contêiner do chat de cada uma
+for persona, chat_container in chat_containers.items():
+    ultima_seq_em_tela = atualizar_historico_em_tela(persona)
+    with chat_container:
+        mostrar_historico(persona, ultima_seq_em_tela)
 
 
 # =============================================================================
@@ -529,7 +625,10 @@ with chat_container:
 # =============================================================================
 
 # Cria a caixa de texto na parte inferior da tela onde o usuário digita a mensagem
-prompt_usuario = st.chat_input(f"Converse com {st.session_state.persona_selecionada}...", key="chat_input")
+# ao_enviar_mensagem separa a imagem do uploader antes do script rodar
+texto_da_entrada = "Pergunte às duas personas..." if st.session_state.comparar_personas \
+    else f"Converse com {st.session_state.persona_selecionada}..."
+prompt_usuario = st.chat_input(texto_da_entrada, key="chat_input", on_submit=ao_enviar_mensagem)
 
 
 # =============================================================================
@@ -540,109 +639,103 @@ prompt_usuario = st.chat_input(f"Converse com {st.session_state.persona_selecion
 # Este bloco só roda se o usuário digitou algo e apertou Enter (ou enviou)
 if prompt_usuario:
 
-    # Inicializa a variável para o resultado da busca do agente
-    search_result = None
-
-    # =============================================================================
-    # Chamada Condicional aos Agentes
-    # Só executa se o Switch na sidebar estiver ativado
-    # =============================================================================
-    if st.session_state.agentes_ativos:
-        st.info("Pesquisador Ozy trabalhando...")
-        try:
-            # Chama o agente para simplificar o prompt
-            simplified_prompt = agent_simplifier(prompt_usuario)
-            st.text(f"Criando um prompt limpinho: {simplified_prompt}") # Exibe o prompt simplificado (opcional para debug)
-
-            # Chama o agente para realizar a busca com o prompt simplificado
-            # Passa a data atual (embora o agente não a use neste código)
-            search_result = agent_searcher(simplified_prompt)
-            # st.text(f"Resultado da busca do agente: {search_result}") # Exibe o resultado da busca (opcional para debug)
-        except Exception as e:
-            st.error(f"Erro durante a execução do Pesquisador: {e}")
-            search_result = "Erro na busca." # Define um resultado de erro
-        st.info("Pesquisador Ozy terminou.")
-    else:
-        print("Pesquizador Ozy foi desativado.") # Mensagem para o console
-
-    # Prepara o conteúdo que será enviado para o modelo Gemini
-    # Inclui o prompt do usuário e, se houver, a imagem e o resultado da busca dos agentes
-    conteudo_para_enviar = []
-
-    # Se uma imagem foi carregada, adiciona ela ao início da lista de conteúdo
-    # Usamos 'uploaded_file' para verificar se um arquivo foi carregado nesta interação
-    if uploaded_file:
-        # A imagem já foi aberta em 'imagem_carregada' logo após o uploader
-        conteudo_para_enviar.append(imagem_carregada) # Adiciona a imagem
-
-    # Adiciona o prompt original do usuário
-    conteudo_para_enviar.append(prompt_usuario)
-
-    # Se os agentes estavam ativos e retornaram um resultado de busca, adicione-o ao conteúdo
-    if st.session_state.agentes_ativos and search_result and search_result.strip() and search_result != "Erro na busca.":
-        # Formata o resultado da busca para que o modelo Gemini possa usá-lo como contexto
-        # Verifica se o resultado não é vazio após remover espaços em branco
-        conteudo_para_enviar.append(f"\n\n--- Contexto de Pesquisa do Google ---\n{search_result}\n--- Fim do Contexto ---")
-        st.info("Resultado da busca incluído no prompt para a IA principal.")
-
-
     # Pega a persona que está ativa no momento
     persona_atual = st.session_state.persona_selecionada
 
-    # Verifica se já existe um objeto chat_session da API Gemini para a persona atual
-    if persona_atual not in st.session_state.historico_gemini or st.session_state.historico_gemini[persona_atual] is None:
-        # Se não existe ou foi limpo, configura um novo modelo Gemini para essa persona
-        modelo_gemini = configurar_modelo_gemini(persona_atual)
-        # Inicia uma NOVA sessão de chat com o modelo Gemini para essa persona
-        # history=[] garante que a conversa comece do zero para o MODELO na nova sessão
-        st.session_state.historico_gemini[persona_atual] = modelo_gemini.start_chat(history=[])
-        print(f"Iniciando nova sessão de chat para {persona_atual}")
-    else:
-        # Se já existe um objeto chat_session para essa persona, usa ele
-        print(f"Continuando sessão de chat para {persona_atual}")
-
-
-    # Pega o objeto chat_session (novo ou existente) para a persona atual
-    chat_session = st.session_state.historico_gemini[persona_atual]
-
-    # Garante que o histórico de mensagens de exibição exista para a persona atual
-    if persona_atual not in st.session_state.historico_chat:
-        st.session_state.historico_chat[persona_atual] = []
-
-    # Adiciona a mensagem do usuário ao histórico de mensagens para exibição
-    mensagem_usuario_para_exibir = {"role": "user", "content": prompt_usuario, "persona": "Você"}
-    # Adiciona a imagem ao histórico de exibição APENAS se ela foi carregada nesta interação
-    if uploaded_file: # Usa uploaded_file para verificar se um arquivo foi submetido
-        mensagem_usuario_para_exibir["image"] = imagem_carregada # Adiciona a imagem aberta
-    st.session_state.historico_chat[persona_atual].append(mensagem_usuario_para_exibir)
-
+    # O que foi escolhido na sidebar vale para esta mensagem
+    opcoes = OpcoesTurno(
+        persona=persona_atual,
+        agentes_ativos=st.session_state.agentes_ativos,
+        modo_pesquisa=st.session_state.modo_pesquisa,
+        stream=st.session_state.resposta_em_stream,
+        cache_semantico_ativo=st.session_state.cache_semantico_ativo,
+        limiar_semantico=st.session_state.limiar_semantico,
+        antecipar=st.session_state.antecipar_pesquisa,
+        forcar_pesquisa=st.session_state.forcar_pesquisa,
+        comparar=st.session_state.comparar_personas,
+    )
 
-    # Exibe um indicador de carregamento enquanto a IA está processando
-    with st.spinner(f"{persona_atual} está digitando..."):
-        try:
-            # Envia a mensagem e o conteúdo adicional (imagem, busca) para o modelo Gemini
-            # chat_session.send_message aceita uma lista de partes
-            response = chat_session.send_message(conteudo_para_enviar)
+    # A imagem vai em bytes (guardada pelo ao_enviar_mensagem); o motor reaproveita o preparo que começou no upload
+    dados_imagem = st.session_state.pop("imagem_da_mensagem", None)
+    st.session_state.imagens_em_preparo = {}
 
-            # Pega o texto da resposta da IA
-            resposta_ia = response.text
+    # O motor roda o turno inteiro e devolve eventos; aqui cada evento vira um elemento na tela
+    eventos = motor.conversar(st.session_state.id_sessao, prompt_usuario, opcoes, dados_imagem)
+    try:
+        # Mostra a mensagem do usuário na hora, já que o histórico acima foi desenhado antes do envio
+        lugares_da_miniatura = [] # A miniatura chega no evento "imagem"
+        for chat_container in chat_containers.values():
+            with chat_container:
+                with st.chat_message("user"):
+                    st.markdown(prompt_usuario)
+                    lugares_da_miniatura.append(st.empty())
+        lugar_progresso = st.empty() # Espera pela vez na sessão e pela pesquisa
+        # Modo comparar: as respostas chegam misturadas; cada pedaço vai para o balão da sua persona
+        respostas_comparadas = {} # persona -> lugar do texto, lugar do rodapé e o texto que já chegou
+
+        for evento in eventos:
+            if evento["tipo"] == "progresso":
+                mostrar_progresso(lugar_progresso, evento)
+                continue
+            lugar_progresso.empty()
+            if evento["tipo"] == "aviso":
+                if evento["nivel"] == "erro":
+                    st.error(evento["texto"])
+                elif evento["nivel"] == "aviso":
+                    st.warning(evento["texto"])
+                elif evento["nivel"] == "status":
+                    st.caption(evento["texto"])
+                else:
+                    st.info(evento["texto"])
+            elif evento["tipo"] == "consulta":
+                st.text(f"Criando um prompt limpinho: {evento['texto']}") # Exibe o prompt simplificado (opcional para debug)
+            elif evento["tipo"] == "imagem":
+                for lugar_da_miniatura in lugares_da_miniatura:
+                    lugar_da_miniatura.image(evento["miniatura"], width=200)
+                st.caption(evento["resumo"])
+            elif evento["tipo"] == "inicio_resposta":
+                with chat_containers[evento["persona"]]:
+                    with st.chat_message("assistant"):
+                        if evento["complemento"]:
+                            st.markdown(f"**_{evento['persona']}_** · 🔎 complemento da pesquisa")
+                        else:
+                            st.markdown(f"**_{evento['persona']}_**")
+                        if opcoes.comparar:
+                            # O texto desta resposta chega nos próximos eventos, junto com o da outra persona
+                            lugar_do_texto = st.empty()
+                            lugar_do_texto.caption(f"{evento['persona']} está digitando...")
+                            respostas_comparadas[evento["persona"]] = {"texto": "", "lugar": lugar_do_texto,
+                                                                       "rodape": st.container()}
+                        else:
+                            # Consome os eventos de texto desta resposta, até o "fim_resposta"
+                            mostrar_resposta(eventos, evento["persona"])
+            elif evento["tipo"] == "texto":
+                resposta = respostas_comparadas[evento["persona"]]
+                resposta["texto"] += evento["texto"]
+                resposta["lugar"].markdown(resposta["texto"])
+            elif evento["tipo"] == "fim_resposta":
+                resposta = respostas_comparadas.pop(evento["persona"])
+                if not resposta["texto"]:
+                    resposta["lugar"].empty()
+                with resposta["rodape"]:
+                    mostrar_rodape(evento)
+    finally:
+        # O Streamlit interrompe o script (novo envio, troca de persona, botão Stop) lançando uma exceção de controle.
+        # Fechar o gerador cancela o pedido no motor: o que já tinha chegado da resposta fica no histórico
+        # e o que ainda estava rodando para esta mensagem (pesquisa, chamada à API) para.
+        eventos.close()
+
+    # Sem st.rerun() no fim: a mensagem e a resposta já estão na tela, desenhadas pelo próprio turno,
+    # e o uploader já voltou vazio (ao_enviar_mensagem trocou a chave dele antes desta execução)
 
-        except Exception as e:
-            st.error(f"Erro ao comunicar com a API Gemini ou gerar resposta: {e}")
-            resposta_ia = "Desculpe, não consegui processar sua solicitação no momento." # Resposta padrão
 
-    # Adiciona a resposta da IA ao histórico de mensagens para exibição
-    st.session_state.historico_chat[persona_atual].append({
-        "role": "assistant",
-        "content": resposta_ia,
-        "persona": persona_atual
-    })
+# =============================================================================
+# Números da Sidebar e Telemetria da Execução
+# Rodam por último, para já contar a mensagem desta execução
+# =============================================================================
 
-    # --- Lógica para limpar o coletor de imagens após o envio usando chave dinâmica ---
-    # Incrementa o contador para gerar uma nova chave para o uploader na próxima execução
-    st.session_state.uploader_key_counter += 1
-    st.rerun() # Força a reexecução para aplicar a nova chave e limpar o uploader
-    # --- Fim da lógica de limpeza ---
+mostrar_numeros(lugar_cache_pesquisa, lugar_numeros)
 
-    # O st.rerun() que estava aqui pode ser removido ou substituído pelo st.experimental_rerun() acima
-    # st.rerun() # Removido
\ No newline at end of file
+# Tempo do script inteiro (com a mensagem, quando houve uma)
+telemetria.iniciar_span("streamlit.execucao", id_sessao=st.session_state.id_sessao, inicio_ns=inicio_execucao,
+                        mensagem=bool(prompt_usuario)).terminar()
@@ -0,0 +1,224 @@
+"""
+Benchmark de escala: o mesmo volume de conversas atendido por 1, 2, 4 e 8 processos (workers) do motor,
+com o estado compartilhado ligado (ozy/compartilhado.py) e o backend falso (ozy/backend_falso.py).
+
+Cada worker é um processo com o próprio MotorOzy, como os workers do uvicorn ou réplicas do Streamlit.
+As sessões chegam sem afinidade: cada turno de uma sessão vai para um worker diferente do anterior,
+então a conversa só continua certa se o histórico, o chat recriado do armazém e o limite da API
+forem de fato compartilhados (--afinidade manda a sessão sempre para o mesmo worker, como um proxy
+com sticky session, para comparar). O benchmark mede:
+
+- vazão (turnos por segundo) e o ganho em relação a 1 worker;
+- latência do turno (p50, p95) e erros;
+- conversas que terminaram inconsistentes no armazém (mensagens faltando ou fora de ordem): deve ser 0.
+
+Os prints (imagem em cada turno) deixam o preparo da imagem, que usa CPU, dentro de cada turno:
+é a parte do pipeline que um processo só não consegue paralelizar.
+
+    python -m benchmarks.benchmark_escala --workers 1,2,4,8 --sessoes 32 --turnos 4
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from datetime import datetime
+
+PASTA_RESULTADOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resultados")
+# Variáveis que apontariam uma parte do estado para fora da pasta compartilhada de cada rodada
+_VARIAVEIS_ESTADO = ("OZY_CONVERSAS_DB", "OZY_CACHE_BUSCA", "OZY_BLOBS_DIR")
+
+
+# =============================================================================
+# Worker (um processo)
+# =============================================================================
+
+def _worker(indice: int, entrada, saida, configuracao: dict, threads: int):
+    """Atende os turnos que chegam na fila 'entrada' até receber None. O ozy só é importado aqui, já com o ambiente certo."""
+    from ozy.backend_falso import BackendFalso, ConfiguracaoFalso
+    from ozy.motor import MotorOzy, OpcoesTurno
+
+    motor = MotorOzy(backend=BackendFalso(ConfiguracaoFalso(**configuracao)))
+
+    def atender(pedido):
+        id_pedido, id_sessao, prompt, imagem = pedido
+        inicio = time.perf_counter()
+        erro = False
+        with contextlib.redirect_stdout(io.StringIO()): # Mensagens de depuração do motor
+            for evento in motor.conversar(id_sessao, prompt, OpcoesTurno(), imagem):
+                if (evento["tipo"] == "fim_resposta" and evento["erro"]) or (evento["tipo"] == "aviso" and evento["nivel"] == "erro"):
+                    erro = True
+        saida.put((id_pedido, {"total": time.perf_counter() - inicio, "erro": erro, "worker": indice}))
+
+    saida.put(("pronto", indice))
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for pedido in iter(entrada.get, None):
+            executor.submit(atender, pedido)
+
+
+# =============================================================================
+# Execução
+# =============================================================================
+
+def _conferir_conversas(caminho: str, sessoes: int, turnos: int) -> int:
+    """Quantas conversas não ficaram com pergunta e resposta alternadas, turno a turno, no armazém."""
+    import sqlite3
+    conexao = sqlite3.connect(caminho)
+    inconsistentes = 0
+    for indice in range(sessoes):
+        roles = [linha[0] for linha in conexao.execute(
+            "SELECT role FROM conversas_log WHERE usuario = ? AND tipo = 'mensagem' ORDER BY id", (f"escala-{indice}",)
+        )]
+        if roles != ["user", "assistant"] * turnos:
+            inconsistentes += 1
+    conexao.close()
+    return inconsistentes
+
+
+def rodar_com_workers(workers: int, sessoes: int, turnos: int, imagens: dict, configuracao: dict,
+                      threads_por_worker: int, afinidade: bool = False) -> dict:
+    pasta = tempfile.mkdtemp(prefix=f"ozy_escala_{workers}_")
+    os.environ["OZY_ESTADO_COMPARTILHADO"] = pasta
+    for variavel in _VARIAVEIS_ESTADO:
+        os.environ.pop(variavel, None)
+
+    contexto = multiprocessing.get_context("spawn") # Processos novos: nada do estado deste processo vai junto
+    saida = contexto.Queue()
+    entradas = [contexto.Queue() for _ in range(workers)]
+    processos = [contexto.Process(target=_worker, args=(i, entradas[i], saida, configuracao, threads_por_worker), daemon=True)
+                 for i in range(workers)]
+    for processo in processos:
+        processo.start()
+    for _ in range(workers): # Só começa a medir com todos os workers prontos (imports feitos)
+        saida.get()
+
+    resultados, esperando, lock = {}, {}, threading.Lock()
+
+    def coletar():
+        for id_pedido, medidas in iter(saida.get, None):
+            with lock:
+                resultados[id_pedido] = medidas
+                esperando.pop(id_pedido).set()
+
+    coletor = threading.Thread(target=coletar, daemon=True)
+    coletor.start()
+
+    def conversar(indice: int):
+        for turno in range(turnos):
+            id_pedido = f"{indice}:{turno}"
+            pronto = threading.Event()
+            with lock:
+                esperando[id_pedido] = pronto
+            # Sem afinidade: turno seguido da mesma sessão vai para outro worker
+            worker = indice % workers if afinidade else (indice + turno) % workers
+            entradas[worker].put((id_pedido, f"escala-{indice}",
+                                  f"Pergunta {turno} da sessão {indice}: como passo desta parte?", imagens[(indice, turno)]))
+            pronto.wait()
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessoes) as executor:
+        list(executor.map(conversar, range(sessoes)))
+    duracao = time.perf_counter() - inicio
+
+    for entrada in entradas:
+        entrada.put(None)
+    for processo in processos:
+        processo.join(timeout=30)
+    saida.put(None)
+    coletor.join(timeout=5)
+
+    totais = sorted(medidas["total"] for medidas in resultados.values())
+    return {
+        "workers": workers,
+        "turnos": len(totais),
+        "erros": sum(1 for medidas in resultados.values() if medidas["erro"]),
+        "duracao_s": round(duracao, 3),
+        "vazao_turnos_s": round(len(totais) / duracao, 3),
+        "latencia_p50_s": round(totais[len(totais) // 2], 4),
+        "latencia_p95_s": round(totais[int(0.95 * (len(totais) - 1))], 4),
+        "conversas_inconsistentes": _conferir_conversas(os.path.join(pasta, "conversas.sqlite3"), sessoes, turnos),
+        "pasta_estado": pasta,
+    }
+
+
+def rodar(lista_workers: list, sessoes: int, turnos: int, configuracao, threads_por_worker: int,
+          afinidade: bool = False) -> dict:
+    from benchmarks.benchmark_motor import gerar_imagem
+    imagens = {(s, t): gerar_imagem(s, t) for s in range(sessoes) for t in range(turnos)}
+    rodadas = []
+    for workers in lista_workers:
+        print(f"- {workers} worker(s)...", file=sys.stderr, flush=True)
+        rodadas.append(rodar_com_workers(workers, sessoes, turnos, imagens, asdict(configuracao), threads_por_worker,
+                                         afinidade))
+    base = rodadas[0]["vazao_turnos_s"] if rodadas else None
+    for rodada in rodadas:
+        rodada["ganho"] = round(rodada["vazao_turnos_s"] / base, 2) if base else None
+    return {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "sessoes": sessoes,
+        "turnos_por_sessao": turnos,
+        "threads_por_worker": threads_por_worker,
+        "afinidade": afinidade,
+        "backend_falso": asdict(configuracao),
+        "rodadas": rodadas,
+    }
+
+
+def imprimir_relatorio(resultado: dict):
+    print(f"\n{'workers':>7} {'turnos/s':>9} {'ganho':>6} {'p50':>7} {'p95':>7} {'erros':>6} {'inconsistentes':>15}")
+    for rodada in resultado["rodadas"]:
+        print(f"{rodada['workers']:>7} {rodada['vazao_turnos_s']:>9.2f} {rodada['ganho']:>5.2f}x "
+              f"{rodada['latencia_p50_s']:>7.3f} {rodada['latencia_p95_s']:>7.3f} {rodada['erros']:>6} "
+              f"{rodada['conversas_inconsistentes']:>15}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de escala do Ozy com vários processos e estado compartilhado")
+    parser.add_argument("--workers", default="1,2,4,8", help="Quantidades de workers, separadas por vírgula")
+    parser.add_argument("--sessoes", type=int, default=32, help="Sessões conversando ao mesmo tempo")
+    parser.add_argument("--turnos", type=int, default=4, help="Mensagens por sessão")
+    parser.add_argument("--threads-por-worker", type=int, default=16, help="Turnos que cada worker atende ao mesmo tempo")
+    parser.add_argument("--latencia", type=float, default=0.05, help="Segundos até o primeiro pedaço da resposta")
+    parser.add_argument("--tokens-por-segundo", type=float, default=2000.0)
+    parser.add_argument("--rpm", type=float, default=1e6,
+                        help="Limite de pedidos por minuto da API, somando todos os workers (o padrão não limita)")
+    parser.add_argument("--afinidade", action="store_true", help="Cada sessão sempre no mesmo worker (sticky session)")
+    parser.add_argument("--saida", default=PASTA_RESULTADOS, help="Pasta do JSON com o resultado")
+    args = parser.parse_args()
+
+    # Lidos pelos workers na importação do ozy
+    os.environ["OZY_AGENDADOR_RPM"] = str(args.rpm)
+    os.environ["OZY_AGENDADOR_RAJADA"] = str(max(20, args.sessoes))
+    # Sem cotas (ozy/cotas.py): nenhuma mensagem é recusada ou degradada no meio da medida
+    for variavel in ("SESSAO_MENSAGENS", "SESSAO_GERACOES", "SESSAO_IMAGEM_BYTES", "SESSAO_PESQUISAS", "GLOBAL_MENSAGENS",
+                     "GLOBAL_GERACOES", "GLOBAL_IMAGEM_BYTES", "GLOBAL_PESQUISAS", "FILA_SEM_PESQUISA",
+                     "FILA_CONTEXTO_CURTO", "FILA_RECUSAR"):
+        os.environ.setdefault(f"OZY_COTA_{variavel}", "0")
+
+    from ozy.backend_falso import ConfiguracaoFalso
+    configuracao = ConfiguracaoFalso(latencia=args.latencia, tokens_por_segundo=args.tokens_por_segundo)
+    lista_workers = [int(valor) for valor in args.workers.split(",")]
+    resultado = rodar(lista_workers, args.sessoes, args.turnos, configuracao, args.threads_por_worker,
+                     args.afinidade)
+
+    os.makedirs(args.saida, exist_ok=True)
+    caminho = os.path.join(args.saida, f"escala-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(caminho, "w", encoding="utf-8") as arquivo:
+        json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+    imprimir_relatorio(resultado)
+    print(f"\nResultado salvo em {caminho}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+Benchmark do pipeline de mensagens do Ozy, sem chave da API e sem rede.
+
+Roda o motor (ozy/motor.py) com o backend falso (ozy/backend_falso.py) em cada cenário:
+as duas personas, com e sem o Pesquisador, com e sem imagem. Em cada cenário várias sessões conversam
+ao mesmo tempo, cada uma com alguns turnos, e o benchmark mede:
+
+- latência do turno inteiro e até o primeiro pedaço da resposta (p50, p95, p99);
+- vazão (turnos por segundo, somando todas as sessões);
+- memória que fica presa em cada sessão (tracemalloc, numa segunda passada sem os tempos simulados,
+  porque o tracemalloc deixa tudo mais lento) e o tamanho do histórico de exibição.
+
+O resultado vai para um JSON em benchmarks/resultados/ para comparar execuções ao longo do tempo:
+    python -m benchmarks.benchmark_motor --sessoes 8 --turnos 6
+    python -m benchmarks.benchmark_motor --comparar benchmarks/resultados/benchmark-20250101-120000.json
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, replace
+from datetime import datetime
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+# As imagens das mensagens vão para o disco: no benchmark, numa pasta temporária
+os.environ.setdefault("OZY_BLOBS_DIR", os.path.join(tempfile.gettempdir(), "ozy_benchmark_blobs"))
+# E as conversas também: um arquivo novo a cada execução
+os.environ.setdefault("OZY_CONVERSAS_DB", os.path.join(tempfile.mkdtemp(prefix="ozy_benchmark_"), "conversas.sqlite3"))
+# Sem cotas (ozy/cotas.py): o benchmark mede o pipeline inteiro, nenhuma mensagem é recusada ou degradada
+for _variavel in ("SESSAO_MENSAGENS", "SESSAO_GERACOES", "SESSAO_IMAGEM_BYTES", "SESSAO_PESQUISAS", "GLOBAL_MENSAGENS",
+                  "GLOBAL_GERACOES", "GLOBAL_IMAGEM_BYTES", "GLOBAL_PESQUISAS", "FILA_SEM_PESQUISA",
+                  "FILA_CONTEXTO_CURTO", "FILA_RECUSAR"):
+    os.environ.setdefault(f"OZY_COTA_{_variavel}", "0")
+
+from ozy import imagens, pesquisa
+from ozy.backend_falso import BackendFalso, ConfiguracaoFalso
+from ozy.motor import MotorOzy, OpcoesTurno
+from ozy.personas import PERSONAS
+
+PASTA_RESULTADOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resultados")
+
+_JOGOS = ("Zelda", "Minecraft", "Elden Ring", "Stardew Valley", "Hollow Knight", "FIFA", "Celeste", "Hades")
+
+
+# =============================================================================
+# Dados de Entrada
+# =============================================================================
+
+def gerar_prompt(sessao: int, turno: int) -> str:
+    jogo = _JOGOS[(sessao + turno) % len(_JOGOS)]
+    return f"Sessão {sessao}, pergunta {turno}: como eu passo da fase {turno + 1} de {jogo} sem perder vida?"
+
+
+def gerar_imagem(sessao: int, turno: int, largura: int = 1920, altura: int = 1080) -> bytes:
+    """Screenshot sintético (PNG) diferente para cada sessão e turno: fundo em degradê, formas e um pouco de ruído."""
+    sorteio = np.random.default_rng(sessao * 1000 + turno)
+    degrade = np.linspace(0, 255, largura, dtype=np.uint8)[None, :, None]
+    pixels = np.broadcast_to(degrade, (altura, largura, 3)).copy()
+    pixels[..., 1] = pixels[..., 1] // 2 + sessao * 7 % 128
+    pixels += sorteio.integers(0, 12, size=pixels.shape, dtype=np.uint8)
+    imagem = Image.fromarray(pixels)
+    desenho = ImageDraw.Draw(imagem)
+    for _ in range(12):
+        x, y = int(sorteio.integers(0, largura - 200)), int(sorteio.integers(0, altura - 120))
+        cor = tuple(int(c) for c in sorteio.integers(0, 255, 3))
+        desenho.rectangle((x, y, x + 200, y + 120), fill=cor)
+        desenho.text((x + 10, y + 10), f"HP {turno * 10} / XP {sessao}", fill=(255, 255, 255))
+    saida = io.BytesIO()
+    imagem.save(saida, format="PNG")
+    return saida.getvalue()
+
+
+def cenarios(modo_pesquisa: str) -> list:
+    """Todas as combinações: persona x Pesquisador x imagem."""
+    return [
+        {"nome": f"{persona} | {'pesquisador' if pesquisador else 'sem pesquisador'} | {'imagem' if imagem else 'texto'}",
+         "persona": persona, "pesquisador": pesquisador, "imagem": imagem,
+         "modo_pesquisa": modo_pesquisa if pesquisador else None}
+        for persona in PERSONAS for pesquisador in (False, True) for imagem in (False, True)
+    ]
+
+
+# =============================================================================
+# Execução
+# =============================================================================
+
+def _percentis(valores) -> dict:
+    if not valores:
+        return {"p50": None, "p95": None, "p99": None, "media": None, "max": None}
+    p50, p95, p99 = np.percentile(valores, [50, 95, 99])
+    return {"p50": round(float(p50), 4), "p95": round(float(p95), 4), "p99": round(float(p99), 4),
+            "media": round(float(np.mean(valores)), 4), "max": round(float(np.max(valores)), 4)}
+
+
+def _conversar(motor, id_sessao, indice, cenario, turnos, imagens_por_turno, medidas, lock):
+    """Uma sessão: os turnos em sequência, como um usuário faria."""
+    opcoes = OpcoesTurno(persona=cenario["persona"], agentes_ativos=cenario["pesquisador"],
+                         modo_pesquisa=cenario["modo_pesquisa"] or pesquisa.MODO_SEQUENCIAL)
+    for turno in range(turnos):
+        imagem = imagens_por_turno[(indice, turno)] if cenario["imagem"] else None
+        inicio = time.perf_counter()
+        primeiro_texto = None
+        erro = False
+        for evento in motor.conversar(id_sessao, gerar_prompt(indice, turno), opcoes, imagem):
+            if evento["tipo"] == "texto" and primeiro_texto is None:
+                primeiro_texto = time.perf_counter() - inicio
+            elif evento["tipo"] == "fim_resposta" and evento["erro"]:
+                erro = True
+            elif evento["tipo"] == "aviso" and evento["nivel"] == "erro":
+                erro = True
+        with lock:
+            medidas.append({"total": time.perf_counter() - inicio, "primeiro_texto": primeiro_texto, "erro": erro})
+
+
+def rodar_cenario(cenario: dict, configuracao: ConfiguracaoFalso, sessoes: int, turnos: int,
+                  imagens_por_turno: dict, medir_memoria: bool = False) -> dict:
+    """Roda as sessões do cenário em paralelo e retorna as medidas (ou só a memória, com medir_memoria=True)."""
+    backend = BackendFalso(configuracao)
+    motor = MotorOzy(backend=backend)
+    medidas, lock = [], threading.Lock()
+    # Cada cenário começa sem imagens preparadas em cache
+    with imagens._preparadas_lock:
+        imagens._preparadas.clear()
+    gc.collect()
+    if medir_memoria:
+        tracemalloc.start()
+        antes = tracemalloc.get_traced_memory()[0]
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessoes) as executor:
+        for indice in range(sessoes):
+            executor.submit(_conversar, motor, f"bench-{indice}", indice, cenario, turnos,
+                            imagens_por_turno, medidas, lock)
+    duracao = time.perf_counter() - inicio
+
+    if medir_memoria:
+        # Só o que ficou preso às sessões: o cache de imagens preparadas é do processo, não da sessão
+        with imagens._preparadas_lock:
+            imagens._preparadas.clear()
+        gc.collect()
+        depois = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        historicos = [motor.estatisticas(f"bench-{i}", cenario["persona"])["historico"]["bytes"] for i in range(sessoes)]
+        return {"memoria_por_sessao_kb": round((depois - antes) / sessoes / 1024, 1),
+                "historico_por_sessao_kb": round(sum(historicos) / sessoes / 1024, 1)}
+
+    totais = [m["total"] for m in medidas]
+    primeiros = [m["primeiro_texto"] for m in medidas if m["primeiro_texto"] is not None]
+    return {
+        "turnos": len(medidas),
+        "erros": sum(1 for m in medidas if m["erro"]),
+        "duracao_s": round(duracao, 3),
+        "vazao_turnos_s": round(len(medidas) / duracao, 3) if duracao else None,
+        "latencia_turno_s": _percentis(totais),
+        "primeiro_texto_s": _percentis(primeiros),
+        "backend": backend.estatisticas(),
+    }
+
+
+def _versao_codigo():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def rodar(configuracao: ConfiguracaoFalso, sessoes: int, turnos: int, modo_pesquisa: str,
+          filtro: str = None, silencioso: bool = True) -> dict:
+    lista = [c for c in cenarios(modo_pesquisa) if not filtro or filtro.lower() in c["nome"].lower()]
+    imagens_por_turno = {}
+    if any(c["imagem"] for c in lista):
+        imagens_por_turno = {(s, t): gerar_imagem(s, t) for s in range(sessoes) for t in range(turnos)}
+    # Configuração sem esperas, para a passada que mede a memória
+    sem_espera = replace(configuracao, latencia=0.0, tokens_por_segundo=1e9, latencia_pesquisa=0.0, latencia_resumo=0.0)
+
+    resultados = []
+    for cenario in lista:
+        print(f"- {cenario['nome']}...", file=sys.stderr, flush=True)
+        # As mensagens de depuração do motor (print) atrapalhariam a leitura do resultado
+        with contextlib.redirect_stdout(io.StringIO()) if silencioso else contextlib.nullcontext():
+            medidas = rodar_cenario(cenario, configuracao, sessoes, turnos, imagens_por_turno)
+            medidas.update(rodar_cenario(cenario, sem_espera, sessoes, turnos, imagens_por_turno, medir_memoria=True))
+        resultados.append({**cenario, **medidas})
+
+    return {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "versao": _versao_codigo(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "sessoes": sessoes,
+        "turnos_por_sessao": turnos,
+        "backend_falso": asdict(configuracao),
+        "cenarios": resultados,
+    }
+
+
+# =============================================================================
+# Relatório
+# =============================================================================
+
+def imprimir_relatorio(resultado: dict, anterior: dict = None):
+    """Tabela dos cenários; com um resultado anterior, mostra também a variação do p50 e do p95."""
+    anteriores = {c["nome"]: c for c in (anterior or {}).get("cenarios", [])}
+    print(f"\n{'cenário':<52} {'p50':>7} {'p95':>7} {'p99':>7} {'1º txt':>7} {'turnos/s':>9} {'KB/sessão':>10} {'erros':>6}")
+    for c in resultado["cenarios"]:
+        latencia = c["latencia_turno_s"]
+        print(f"{c['nome']:<52} {latencia['p50']:>7.3f} {latencia['p95']:>7.3f} {latencia['p99']:>7.3f} "
+              f"{(c['primeiro_texto_s']['p50'] or 0):>7.3f} {c['vazao_turnos_s']:>9.2f} "
+              f"{c['memoria_por_sessao_kb']:>10.1f} {c['erros']:>6}")
+        antigo = anteriores.get(c["nome"])
+        if antigo:
+            variacoes = []
+            for chave in ("p50", "p95"):
+                antes, agora = antigo["latencia_turno_s"][chave], latencia[chave]
+                if antes:
+                    variacoes.append(f"{chave} {100 * (agora - antes) / antes:+.1f}%")
+            memoria = c["memoria_por_sessao_kb"] - antigo["memoria_por_sessao_kb"]
+            print(f"{'  vs. anterior':<52} {', '.join(variacoes)}, memória {memoria:+.1f} KB/sessão")
+
+
+def main():
+    padrao = ConfiguracaoFalso()
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline do Ozy com o backend falso")
+    parser.add_argument("--sessoes", type=int, default=4, help="Sessões conversando ao mesmo tempo")
+    parser.add_argument("--turnos", type=int, default=5, help="Mensagens por sessão")
+    parser.add_argument("--modo-pesquisa", default=pesquisa.MODO_SEQUENCIAL, choices=list(pesquisa.NOMES_MODOS))
+    parser.add_argument("--latencia", type=float, default=padrao.latencia, help="Segundos até o primeiro pedaço")
+    parser.add_argument("--tokens-por-segundo", type=float, default=padrao.tokens_por_segundo)
+    parser.add_argument("--tokens-resposta", type=int, default=padrao.tokens_resposta)
+    parser.add_argument("--latencia-pesquisa", type=float, default=padrao.latencia_pesquisa, help="Segundos por etapa do Pesquisador")
+    parser.add_argument("--falhas", type=float, default=padrao.taxa_falhas, help="Chance de falha de cada chamada ao Gemini (0 a 1)")
+    parser.add_argument("--falhas-pesquisa", type=float, default=padrao.taxa_falhas_pesquisa)
+    parser.add_argument("--semente", type=int, default=padrao.semente)
+    parser.add_argument("--cenario", help="Roda só os cenários cujo nome contém este texto")
+    parser.add_argument("--saida", default=PASTA_RESULTADOS, help="Pasta do JSON com o resultado")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior, para mostrar a variação")
+    parser.add_argument("--verboso", action="store_true", help="Mostra as mensagens de depuração do motor")
+    args = parser.parse_args()
+
+    configuracao = replace(
+        padrao, latencia=args.latencia, tokens_por_segundo=args.tokens_por_segundo,
+        tokens_resposta=args.tokens_resposta, latencia_pesquisa=args.latencia_pesquisa,
+        taxa_falhas=args.falhas, taxa_falhas_pesquisa=args.falhas_pesquisa, semente=args.semente,
+    )
+    resultado = rodar(configuracao, args.sessoes, args.turnos, args.modo_pesquisa, args.cenario, not args.verboso)
+
+    os.makedirs(args.saida, exist_ok=True)
+    caminho = os.path.join(args.saida, f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(caminho, "w", encoding="utf-8") as arquivo:
+        json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+
+    anterior = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as arquivo:
+            anterior = json.load(arquivo)
+    imprimir_relatorio(resultado, anterior)
+    print(f"\nResultado salvo em {caminho}")
+
+
+if __name__ == "__main__":
+    main()
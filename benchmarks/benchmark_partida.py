@@ -0,0 +1,206 @@
+"""
+Benchmark da partida a frio do app: quanto tempo um processo novo leva até desenhar a primeira tela.
+
+Cada medida roda num processo Python novo (nada importado antes, como um container que acabou de subir
+ou o primeiro usuário depois de um deploy), sem chave da API de verdade e sem rede:
+
+- importação: as importações do app.py (Streamlit e os módulos do ozy), uma a uma;
+- primeira tela: a primeira execução do app.py (streamlit.testing), da criação do AppTest até o fim
+  do script, e a segunda execução (o custo de cada clique depois que tudo já foi carregado);
+- Pesquisador: quanto custa carregar o ADK (ozy/agentes.py), o que só acontece quando o switch é ligado.
+
+Também conta quantos módulos ficaram carregados e se o ADK e o google.generativeai entraram sem ninguém pedir.
+
+    python -m benchmarks.benchmark_partida --repeticoes 5
+    python -m benchmarks.benchmark_partida --comparar benchmarks/resultados/partida-20250101-120000.json
+"""
+import argparse
+import ast
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(RAIZ, "app.py")
+PASTA_RESULTADOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resultados")
+# Variáveis que mandariam o app para um servidor externo ou para um estado que já existe
+_VARIAVEIS_IGNORADAS = ("OZY_MOTOR_URL", "OZY_ESTADO_COMPARTILHADO", "OZY_OTLP_ENDPOINT", "OZY_METRICAS_PORTA",
+                        "OZY_CACHE_BUSCA", "OZY_CACHE_SEMANTICO_ARQUIVO")
+
+# O que roda em cada processo novo; a última linha impressa é o JSON com as medidas
+_MEDIR = r'''
+import json, sys, time
+inicio = time.perf_counter()
+etapa, modulos = sys.argv[1], sys.argv[2].split(",")
+medidas = {}
+
+def carregados():
+    return {"modulos": len(sys.modules),
+            "adk": any(nome.startswith("google.adk") for nome in sys.modules),
+            "genai": "google.generativeai" in sys.modules}
+
+if etapa == "importacao":
+    for modulo in modulos:
+        antes = time.perf_counter()
+        __import__(modulo)
+        medidas[modulo] = time.perf_counter() - antes
+    medidas["total_s"] = time.perf_counter() - inicio
+elif etapa == "primeira_tela":
+    from streamlit.testing.v1 import AppTest
+    app = AppTest.from_file(sys.argv[3], default_timeout=300)
+    app.secrets["GOOGLE_API_KEY"] = "chave-do-benchmark"
+    app.run()
+    medidas["primeira_tela_s"] = time.perf_counter() - inicio
+    if app.exception:
+        medidas["erro"] = str(app.exception[0].value)
+    antes = time.perf_counter()
+    app.run()
+    medidas["segunda_execucao_s"] = time.perf_counter() - antes
+elif etapa == "pesquisador":
+    import ozy.agentes
+    medidas["total_s"] = time.perf_counter() - inicio
+medidas.update(carregados())
+print(json.dumps(medidas))
+'''
+
+
+def modulos_do_app() -> list:
+    """Módulos que o app.py importa no topo, na ordem em que aparecem."""
+    with open(APP, encoding="utf-8") as arquivo:
+        arvore = ast.parse(arquivo.read())
+    modulos = []
+    for no in arvore.body:
+        if isinstance(no, ast.Import):
+            nomes = [alias.name for alias in no.names]
+        elif isinstance(no, ast.ImportFrom) and no.module:
+            # "from ozy import pesquisa" importa o submódulo ozy.pesquisa
+            nomes = [f"{no.module}.{alias.name}" if no.module == "ozy" else no.module for alias in no.names]
+        else:
+            continue
+        modulos += [nome for nome in nomes if nome not in modulos]
+    return modulos
+
+
+def _ambiente() -> dict:
+    """Ambiente dos processos medidos: estado numa pasta temporária e nenhum servidor externo."""
+    pasta = tempfile.mkdtemp(prefix="ozy_partida_")
+    ambiente = {chave: valor for chave, valor in os.environ.items() if chave not in _VARIAVEIS_IGNORADAS}
+    ambiente.update({
+        "PYTHONPATH": RAIZ,
+        "OZY_CONVERSAS_DB": os.path.join(pasta, "conversas.sqlite3"),
+        "OZY_BLOBS_DIR": os.path.join(pasta, "blobs"),
+    })
+    return ambiente
+
+
+def medir(etapa: str, modulos: list) -> dict:
+    """Roda uma etapa num processo novo. 'processo_s' inclui a partida do próprio interpretador."""
+    inicio = time.perf_counter()
+    saida = subprocess.run([sys.executable, "-c", _MEDIR, etapa, ",".join(modulos), APP], capture_output=True,
+                           text=True, cwd=RAIZ, env=_ambiente(), timeout=600)
+    duracao = time.perf_counter() - inicio
+    if saida.returncode != 0:
+        raise RuntimeError(f"A etapa {etapa} falhou:\n{saida.stderr[-2000:]}")
+    medidas = json.loads(saida.stdout.strip().splitlines()[-1])
+    medidas["processo_s"] = duracao
+    return medidas
+
+
+def _mediana(rodadas: list, chave: str):
+    valores = [rodada[chave] for rodada in rodadas if isinstance(rodada.get(chave), (int, float))]
+    return round(statistics.median(valores), 4) if valores else None
+
+
+def rodar(repeticoes: int) -> dict:
+    modulos = modulos_do_app()
+    etapas = {}
+    for etapa in ("importacao", "primeira_tela", "pesquisador"):
+        print(f"- {etapa}...", file=sys.stderr, flush=True)
+        rodadas = [medir(etapa, modulos) for _ in range(repeticoes)]
+        chaves = [chave for chave in rodadas[0] if chave not in ("adk", "genai", "erro")]
+        etapas[etapa] = {chave: _mediana(rodadas, chave) for chave in chaves}
+        etapas[etapa].update(adk=rodadas[-1]["adk"], genai=rodadas[-1]["genai"])
+        if "erro" in rodadas[-1]:
+            etapas[etapa]["erro"] = rodadas[-1]["erro"]
+
+    from benchmarks.benchmark_motor import _versao_codigo
+    return {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "versao": _versao_codigo(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "repeticoes": repeticoes,
+        "modulos_app": modulos,
+        "etapas": etapas,
+    }
+
+
+# =============================================================================
+# Relatório
+# =============================================================================
+
+# (etapa, medida, como aparece na tabela)
+_LINHAS = (
+    ("importacao", "total_s", "importações do app.py"),
+    ("importacao", "processo_s", "  processo inteiro"),
+    ("primeira_tela", "primeira_tela_s", "primeira tela"),
+    ("primeira_tela", "processo_s", "  processo inteiro"),
+    ("primeira_tela", "segunda_execucao_s", "execução seguinte"),
+    ("pesquisador", "total_s", "carregar o Pesquisador (ADK)"),
+)
+
+
+def imprimir_relatorio(resultado: dict, anterior: dict = None):
+    """Tabela das medianas; com um resultado anterior, mostra também a variação."""
+    print(f"\n{'medida':<32} {'segundos':>9}" + (f" {'antes':>9} {'variação':>9}" if anterior else ""))
+    for etapa, chave, nome in _LINHAS:
+        agora = resultado["etapas"][etapa].get(chave)
+        linha = f"{nome:<32} {agora:>9.3f}" if agora is not None else f"{nome:<32} {'-':>9}"
+        antes = (anterior or {}).get("etapas", {}).get(etapa, {}).get(chave)
+        if anterior:
+            linha += f" {antes:>9.3f} {100 * (agora - antes) / antes:>+8.1f}%" if antes and agora is not None else f" {'-':>9}"
+        print(linha)
+
+    print("\nmais lentos na importação:")
+    importacao = resultado["etapas"]["importacao"]
+    for modulo in sorted(resultado["modulos_app"], key=lambda nome: -(importacao.get(nome) or 0))[:5]:
+        print(f"  {modulo:<30} {importacao.get(modulo) or 0:>9.3f}")
+
+    tela = resultado["etapas"]["primeira_tela"]
+    print(f"\nna primeira tela: {tela['modulos']:.0f} módulos, ADK {'carregado' if tela['adk'] else 'não carregado'}, "
+          f"google.generativeai {'carregado' if tela['genai'] else 'não carregado'}")
+    if tela.get("erro"):
+        print(f"erro na primeira tela: {tela['erro']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da partida a frio do app do Ozy")
+    parser.add_argument("--repeticoes", type=int, default=5, help="Processos novos por etapa (vale a mediana)")
+    parser.add_argument("--saida", default=PASTA_RESULTADOS, help="Pasta do JSON com o resultado")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior, para mostrar a variação")
+    args = parser.parse_args()
+
+    resultado = rodar(args.repeticoes)
+
+    os.makedirs(args.saida, exist_ok=True)
+    caminho = os.path.join(args.saida, f"partida-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(caminho, "w", encoding="utf-8") as arquivo:
+        json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+
+    anterior = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as arquivo:
+            anterior = json.load(arquivo)
+    imprimir_relatorio(resultado, anterior)
+    print(f"\nResultado salvo em {caminho}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Reprodução de conversas gravadas em produção (ozy/gravacao.py), sem chave da API e sem rede.
+
+Cada sessão da gravação vira uma thread que manda os seus turnos ao motor deste build, na ordem, com as
+mesmas opções (persona, Pesquisador, modo, cache semântico, comparar) e o mesmo print (já redimensionado).
+O backend (ozy/reproducao.py) devolve as respostas e pesquisas gravadas com os tempos gravados, então o
+que muda entre a produção e a reprodução é o que este build faz com elas:
+
+- latência do turno e até o primeiro texto (p50, p95, p99), ao lado da gravada;
+- tokens de entrada (o pedido que este build monta: histórico, resumo, contexto da pesquisa) e de saída;
+- acertos do cache de busca e do cache semântico, e as pesquisas que o roteador pulou;
+- erros e turnos cuja resposta não estava na gravação (sintéticas, vindas do backend falso).
+
+Os turnos de cada sessão saem no mesmo intervalo que tiveram em produção, dividido por --aceleracao
+(e nunca antes de o turno anterior da sessão terminar); --sem-ritmo manda cada turno logo após o anterior.
+--backend falso troca o gravado pelo falso, para separar o que é do tráfego do que é da gravação.
+
+    python -m benchmarks.benchmark_reproducao gravacoes/ --aceleracao 10
+    python -m benchmarks.benchmark_reproducao gravacoes/ --comparar benchmarks/resultados/reproducao-20250101-120000.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import fields
+from datetime import datetime
+
+# Nada desta execução vai para a gravação de produção, para o armazém das conversas ou para o estado compartilhado
+os.environ["OZY_GRAVACAO_DIR"] = ""
+os.environ["OZY_CONVERSAS_DB"] = os.path.join(tempfile.mkdtemp(prefix="ozy_reproducao_"), "conversas.sqlite3")
+os.environ["OZY_BLOBS_DIR"] = os.path.join(tempfile.gettempdir(), "ozy_reproducao_blobs")
+for _variavel in ("OZY_CACHE_BUSCA", "OZY_CACHE_SEMANTICO_ARQUIVO", "OZY_ESTADO_COMPARTILHADO", "OZY_ESTADO_REDIS",
+                  "OZY_MOTOR_URL", "OZY_METRICAS_PORTA", "OZY_OTLP_ENDPOINT"):
+    os.environ.pop(_variavel, None)
+# Sem cotas (ozy/cotas.py): a reprodução mede o pipeline inteiro, nenhuma mensagem é recusada ou degradada
+for _variavel in ("SESSAO_MENSAGENS", "SESSAO_GERACOES", "SESSAO_IMAGEM_BYTES", "SESSAO_PESQUISAS", "GLOBAL_MENSAGENS",
+                  "GLOBAL_GERACOES", "GLOBAL_IMAGEM_BYTES", "GLOBAL_PESQUISAS", "FILA_SEM_PESQUISA",
+                  "FILA_CONTEXTO_CURTO", "FILA_RECUSAR"):
+    os.environ.setdefault(f"OZY_COTA_{_variavel}", "0")
+
+from benchmarks.benchmark_motor import PASTA_RESULTADOS, _percentis, _versao_codigo
+from ozy import cache_semantico
+from ozy.backend_falso import BackendFalso, ConfiguracaoFalso
+from ozy.cache import obter_cache_busca
+from ozy.gravacao import arquivos_gravacao, ler_gravacao
+from ozy.motor import MotorOzy, OpcoesTurno
+from ozy.reproducao import BackendReproducao
+
+
+# =============================================================================
+# Execução
+# =============================================================================
+
+def _opcoes(gravadas: dict) -> OpcoesTurno:
+    # Só os campos que este build conhece: a gravação pode ser de uma versão mais antiga ou mais nova
+    conhecidos = {campo.name for campo in fields(OpcoesTurno)}
+    return OpcoesTurno(**{nome: valor for nome, valor in gravadas.items() if nome in conhecidos})
+
+
+def _gravado(turno: dict, aceleracao: float) -> dict:
+    """Tempos e tokens do turno em produção (tempos já divididos pela aceleração)."""
+    respostas = [r for r in turno["respostas"] if r.get("tempos")]
+    return {
+        "total": turno["duracao"] / aceleracao if turno.get("duracao") is not None else None,
+        "primeiro_texto": turno["primeiro_texto"] / aceleracao if turno.get("primeiro_texto") is not None else None,
+        "tokens_entrada": sum(r["tempos"].get("tokens_entrada") or 0 for r in respostas),
+        "tokens_saida": sum(r["tempos"].get("tokens_saida") or 0 for r in respostas),
+        "erro": any(r.get("erro") for r in turno["respostas"]),
+    }
+
+
+def _reproduzir_sessao(motor, id_sessao: str, turnos: list, imagens_gravadas: dict, inicio: float,
+                       aceleracao: float, ritmo: bool, medidas: list, lock):
+    """Uma sessão: os turnos gravados em sequência, no intervalo que tiveram em produção."""
+    primeiro = turnos[0]["quando"]
+    for turno in turnos:
+        if ritmo:
+            espera = inicio + (turno["quando"] - primeiro) / aceleracao - time.perf_counter()
+            if espera > 0:
+                time.sleep(espera)
+        imagem = imagens_gravadas.get(turno["imagem_hash"], (None, None))[1] if turno.get("imagem_hash") else None
+        comeco = time.perf_counter()
+        primeiro_texto = None
+        erro = False
+        tokens_entrada = tokens_saida = 0
+        for evento in motor.conversar(id_sessao, turno["prompt"], _opcoes(turno["opcoes"]), imagem):
+            if evento["tipo"] == "texto" and primeiro_texto is None:
+                primeiro_texto = time.perf_counter() - comeco
+            elif evento["tipo"] == "fim_resposta":
+                erro = erro or bool(evento["erro"])
+                tempos = evento.get("tempos") or {}
+                tokens_entrada += tempos.get("tokens_entrada") or 0
+                tokens_saida += tempos.get("tokens_saida") or 0
+            elif evento["tipo"] == "aviso" and evento["nivel"] == "erro":
+                erro = True
+        with lock:
+            medidas.append({"total": time.perf_counter() - comeco, "primeiro_texto": primeiro_texto, "erro": erro,
+                            "tokens_entrada": tokens_entrada, "tokens_saida": tokens_saida,
+                            "gravado": _gravado(turno, aceleracao)})
+
+
+def rodar(turnos: list, imagens_gravadas: dict, backend_nome: str = "gravado", aceleracao: float = 1.0,
+          ritmo: bool = True, threads: int = 32, silencioso: bool = True) -> dict:
+    if backend_nome == "gravado":
+        backend = BackendReproducao(turnos, aceleracao)
+    else:
+        padrao = ConfiguracaoFalso()
+        backend = BackendFalso(ConfiguracaoFalso(
+            latencia=padrao.latencia / aceleracao, tokens_por_segundo=padrao.tokens_por_segundo * aceleracao,
+            latencia_pesquisa=padrao.latencia_pesquisa / aceleracao, latencia_resumo=padrao.latencia_resumo / aceleracao,
+            latencia_roteador=padrao.latencia_roteador / aceleracao,
+        ))
+    # O cache semântico do processo faria os embeddings na API: aqui eles vêm do backend, sem rede
+    cache_semantico._cache_semantico = cache_semantico.CacheSemantico(
+        gerar_embedding=backend.embedding, modelo_embedding=backend.modelo_embedding,
+    )
+    cache_semantico._carregar_faq(cache_semantico._cache_semantico)
+
+    sessoes = defaultdict(list)
+    for turno in turnos:
+        sessoes[turno["sessao"]].append(turno)
+    medidas, lock = [], threading.Lock()
+    with contextlib.redirect_stdout(io.StringIO()) if silencioso else contextlib.nullcontext():
+        motor = MotorOzy(backend=backend)
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, min(threads, len(sessoes)))) as executor:
+            for id_sessao, turnos_sessao in sessoes.items():
+                executor.submit(_reproduzir_sessao, motor, id_sessao, turnos_sessao, imagens_gravadas, inicio,
+                                aceleracao, ritmo, medidas, lock)
+        duracao = time.perf_counter() - inicio
+
+    def medida(nome, gravado=False):
+        valores = [(m["gravado"] if gravado else m)[nome] for m in medidas]
+        return _percentis([v for v in valores if v is not None])
+
+    roteador = motor.roteador.estatisticas()
+    return {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "versao": _versao_codigo(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "backend": backend_nome,
+        "aceleracao": aceleracao,
+        "ritmo": ritmo,
+        "sessoes": len(sessoes),
+        "turnos": len(medidas),
+        "erros": sum(1 for m in medidas if m["erro"]),
+        "erros_gravados": sum(1 for m in medidas if m["gravado"]["erro"]),
+        "duracao_s": round(duracao, 3),
+        "vazao_turnos_s": round(len(medidas) / duracao, 3) if duracao else None,
+        "latencia_turno_s": medida("total"),
+        "latencia_turno_gravada_s": medida("total", gravado=True),
+        "primeiro_texto_s": medida("primeiro_texto"),
+        "primeiro_texto_gravado_s": medida("primeiro_texto", gravado=True),
+        "tokens_entrada": sum(m["tokens_entrada"] for m in medidas),
+        "tokens_entrada_gravados": sum(m["gravado"]["tokens_entrada"] for m in medidas),
+        "tokens_saida": sum(m["tokens_saida"] for m in medidas),
+        "tokens_saida_gravados": sum(m["gravado"]["tokens_saida"] for m in medidas),
+        "cache_busca": obter_cache_busca().estatisticas(),
+        "cache_semantico": cache_semantico.obter_cache_semantico().relatorio(),
+        "roteador": roteador,
+        "estatisticas_backend": backend.estatisticas(),
+    }
+
+
+# =============================================================================
+# Relatório
+# =============================================================================
+
+def _variacao(agora, antes) -> str:
+    if agora is None or not antes:
+        return "-"
+    return f"{100 * (agora - antes) / antes:+.1f}%"
+
+
+def imprimir_relatorio(resultado: dict, anterior: dict = None):
+    """Este build contra a produção gravada e, com um resultado anterior, contra a execução anterior."""
+    colunas = [("gravado", None), ("reprodução", resultado)] + ([("anterior", anterior)] if anterior else [])
+    print(f"\n{resultado['turnos']} turnos de {resultado['sessoes']} sessões, backend {resultado['backend']}, "
+          f"aceleração {resultado['aceleracao']}x, versão {resultado['versao'] or '?'}")
+    print(f"\n{'medida':<28}" + "".join(f"{nome:>14}" for nome, _ in colunas) + f"{'vs. gravado':>14}")
+    linhas = [
+        ("turno p50 (s)", lambda r: r["latencia_turno_s"]["p50"], resultado["latencia_turno_gravada_s"]["p50"]),
+        ("turno p95 (s)", lambda r: r["latencia_turno_s"]["p95"], resultado["latencia_turno_gravada_s"]["p95"]),
+        ("turno p99 (s)", lambda r: r["latencia_turno_s"]["p99"], resultado["latencia_turno_gravada_s"]["p99"]),
+        ("1º texto p50 (s)", lambda r: r["primeiro_texto_s"]["p50"], resultado["primeiro_texto_gravado_s"]["p50"]),
+        ("1º texto p95 (s)", lambda r: r["primeiro_texto_s"]["p95"], resultado["primeiro_texto_gravado_s"]["p95"]),
+        ("tokens de entrada", lambda r: r["tokens_entrada"], resultado["tokens_entrada_gravados"]),
+        ("tokens de saída", lambda r: r["tokens_saida"], resultado["tokens_saida_gravados"]),
+        ("erros", lambda r: r["erros"], resultado["erros_gravados"]),
+    ]
+    for nome, valor, gravado in linhas:
+        valores = [gravado] + [valor(r) for _, r in colunas[1:]]
+        print(f"{nome:<28}" + "".join(f"{v:>14.3f}" if isinstance(v, float) else f"{str(v):>14}" for v in valores)
+              + f"{_variacao(valor(resultado), gravado):>14}")
+
+    busca, roteador = resultado["cache_busca"], resultado["roteador"]
+    print(f"\ncache de busca: {busca['acertos']} acertos, {busca['falhas']} falhas (taxa {busca['taxa_acerto']})")
+    print(f"cache semântico: {json.dumps(resultado['cache_semantico'], ensure_ascii=False)}")
+    print(f"roteador: {roteador['decisoes']} decisões, {roteador['puladas']} pesquisas puladas (taxa {roteador['taxa_pulo']})")
+    print(f"backend: {json.dumps(resultado['estatisticas_backend'], ensure_ascii=False)}")
+    if anterior:
+        antes = anterior["cache_busca"]["taxa_acerto"]
+        print(f"cache de busca vs. anterior: taxa {antes} -> {busca['taxa_acerto']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproduz conversas gravadas em produção contra este build do Ozy")
+    parser.add_argument("gravacoes", nargs="+", help="Arquivos turnos-*.jsonl.gz ou pastas com eles")
+    parser.add_argument("--aceleracao", type=float, default=1.0, help="Divide os tempos gravados e os intervalos entre turnos")
+    parser.add_argument("--sem-ritmo", action="store_true", help="Cada turno sai logo após o anterior da sessão")
+    parser.add_argument("--backend", default="gravado", choices=("gravado", "falso"))
+    parser.add_argument("--limite", type=int, help="Reproduz só os primeiros N turnos da gravação")
+    parser.add_argument("--threads", type=int, default=32, help="Sessões reproduzidas ao mesmo tempo")
+    parser.add_argument("--saida", default=PASTA_RESULTADOS, help="Pasta do JSON com o resultado")
+    parser.add_argument("--comparar", help="JSON de uma reprodução anterior, para mostrar a variação")
+    parser.add_argument("--verboso", action="store_true", help="Mostra as mensagens de depuração do motor")
+    args = parser.parse_args()
+
+    if not arquivos_gravacao(args.gravacoes):
+        parser.error("nenhum arquivo de gravação encontrado")
+    turnos, imagens_gravadas = ler_gravacao(args.gravacoes)
+    if args.limite:
+        turnos = turnos[:args.limite]
+    if not turnos:
+        parser.error("a gravação não tem turnos")
+    print(f"Reproduzindo {len(turnos)} turnos...", file=sys.stderr, flush=True)
+    resultado = rodar(turnos, imagens_gravadas, args.backend, args.aceleracao, not args.sem_ritmo, args.threads,
+                      not args.verboso)
+    resultado["gravacoes"] = args.gravacoes
+
+    os.makedirs(args.saida, exist_ok=True)
+    caminho = os.path.join(args.saida, f"reproducao-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(caminho, "w", encoding="utf-8") as arquivo:
+        json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+
+    anterior = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as arquivo:
+            anterior = json.load(arquivo)
+    imprimir_relatorio(resultado, anterior)
+    print(f"\nResultado salvo em {caminho}")
+
+
+if __name__ == "__main__":
+    main()
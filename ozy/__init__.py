@@ -0,0 +1,4 @@
+"""
+Pacote com as peças do Ozy que não dependem da interface do Streamlit.
+O app.py importa daqui tudo o que precisa ser criado uma vez só por processo.
+"""
@@ -0,0 +1,411 @@
+"""
+Agendador das chamadas à API do Gemini, compartilhado por todas as sessões do processo.
+
+Cada sessão do Streamlit chamava o Gemini direto e, com muita gente ao mesmo tempo, o limite de uso
+da API estourava (429) e o usuário recebia só a mensagem genérica de erro. Agora o send_message das
+personas e as chamadas dos agentes do Pesquisador passam por aqui:
+
+- balde de fichas por modelo: no máximo N pedidos por minuto, com uma rajada curta permitida;
+  quem chega com o balde vazio espera a vez, em ordem de chegada;
+- número máximo de chamadas ao mesmo tempo (vagas);
+- novas tentativas com espera exponencial e aleatória (jitter) em 429 e 5xx; um 429 também esvazia o balde,
+  para as outras sessões esperarem em vez de insistirem;
+- pesquisas idênticas em andamento são juntadas: a segunda espera o resultado da primeira (uma chamada só);
+- uma chamada de um pedido cancelado (ozy/cancelamento.py) que ainda espera a vez desiste sem chegar à API.
+
+A fila (quantos esperam, quanto esperaram) vai para a tela pelas estatísticas do motor.
+Com o estado compartilhado (ozy/compartilhado.py), o balde de cada modelo fica no SQLite da pasta compartilhada
+(ou no Redis) e vale para todos os processos juntos; as vagas continuam sendo de cada processo.
+No stream, a vaga é ocupada só até o primeiro pedaço chegar: é ali que a API aceita ou recusa o pedido.
+"""
+import asyncio
+import concurrent.futures
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from ozy import compartilhado
+from ozy.cancelamento import INTERVALO_VERIFICACAO, PedidoCancelado
+
+# Pedidos por minuto de cada modelo (OZY_AGENDADOR_RPM) e quantos podem sair de uma vez com o balde cheio
+RPM_PADRAO = float(os.environ.get("OZY_AGENDADOR_RPM", 1000))
+RAJADA_PADRAO = int(os.environ.get("OZY_AGENDADOR_RAJADA", 20))
+# Chamadas à API ao mesmo tempo, somando todas as sessões do processo
+MAX_CONCORRENCIA = int(os.environ.get("OZY_AGENDADOR_CONCORRENCIA", 16))
+# Novas tentativas em erros temporários
+TENTATIVAS = 4
+PAUSA_BASE = 0.5 # Segundos antes da segunda tentativa (dobra a cada tentativa)
+PAUSA_MAXIMA = 8.0
+# Códigos HTTP que valem uma nova tentativa
+CODIGOS_TEMPORARIOS = {429, 500, 502, 503, 504}
+
+
+def codigo_http(erro: BaseException) -> Optional[int]:
+    """Código HTTP do erro da API (google.api_core e google.genai guardam em 'code')."""
+    for atributo in ("code", "status_code"):
+        valor = getattr(erro, atributo, None)
+        if isinstance(valor, int):
+            return int(valor)
+    return None
+
+
+def erro_temporario(erro: BaseException) -> bool:
+    return codigo_http(erro) in CODIGOS_TEMPORARIOS or isinstance(erro, (ConnectionError, TimeoutError))
+
+
+def erro_de_limite(erro: BaseException) -> bool:
+    """True quando a API recusou por limite de uso (429 / RESOURCE_EXHAUSTED)."""
+    return codigo_http(erro) == 429
+
+
+class _ChamadaCancelada(Exception):
+    """Avisa quem esperava uma chamada juntada (coalescer_async) que ela foi cancelada por quem a fez."""
+
+
+class BaldeFichas:
+    """Limite de pedidos por minuto de um modelo (token bucket), na memória do processo."""
+
+    def __init__(self, por_minuto: float, rajada: int):
+        self.taxa = por_minuto / 60.0 # Fichas por segundo
+        self.capacidade = max(1, rajada)
+        self.fichas = float(self.capacidade)
+        self.atualizado = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _repostas(self, fichas: float, atualizado: float, agora: float) -> float:
+        return min(self.capacidade, fichas + max(0.0, agora - atualizado) * self.taxa)
+
+    def _alterar(self, mudanca):
+        """Repõe as fichas e aplica mudanca(fichas) -> (fichas novas, retorno), com o balde travado."""
+        with self._lock:
+            agora = time.monotonic()
+            self.fichas, retorno = mudanca(self._repostas(self.fichas, self.atualizado, agora))
+            self.atualizado = agora
+            return retorno
+
+    def reservar(self) -> float:
+        """Reserva uma ficha e retorna quantos segundos esperar até ela valer (0 = pode ir já)."""
+        def mudanca(fichas):
+            fichas -= 1 # Pode ficar negativo: as reservas seguintes esperam mais (ordem de chegada)
+            return fichas, 0.0 if fichas >= 0 else -fichas / self.taxa
+        return self._alterar(mudanca)
+
+    def espera_estimada(self) -> float:
+        """Quanto um pedido novo esperaria agora, sem reservar nada."""
+        return self._alterar(lambda fichas: (fichas, 0.0 if fichas >= 1 else (1 - fichas) / self.taxa))
+
+    def esvaziar(self):
+        """Depois de um 429: ninguém sai até entrar uma ficha nova."""
+        self._alterar(lambda fichas: (min(fichas, 0.0), None))
+
+
+class BaldeFichasSQLite(BaldeFichas):
+    """O mesmo balde, numa linha de um SQLite que todos os processos usam (o relógio é o do sistema)."""
+
+    def __init__(self, caminho: str, modelo: str, por_minuto: float, rajada: int):
+        super().__init__(por_minuto, rajada)
+        self.modelo = modelo
+        self._conexao = compartilhado.conectar_sqlite(caminho, isolation_level=None)
+        self._conexao.execute(
+            "CREATE TABLE IF NOT EXISTS baldes (modelo TEXT PRIMARY KEY, fichas REAL NOT NULL, atualizado REAL NOT NULL)"
+        )
+        self._conexao.execute("INSERT OR IGNORE INTO baldes VALUES (?, ?, ?)", (modelo, float(self.capacidade), time.time()))
+
+    def _alterar(self, mudanca):
+        with self._lock:
+            # IMMEDIATE: pega o lock de escrita já na leitura, então dois processos nunca gastam a mesma ficha
+            self._conexao.execute("BEGIN IMMEDIATE")
+            try:
+                agora = time.time()
+                fichas, atualizado = self._conexao.execute(
+                    "SELECT fichas, atualizado FROM baldes WHERE modelo = ?", (self.modelo,)
+                ).fetchone()
+                fichas, retorno = mudanca(self._repostas(fichas, atualizado, agora))
+                self._conexao.execute("UPDATE baldes SET fichas = ?, atualizado = ? WHERE modelo = ?",
+                                      (fichas, max(agora, atualizado), self.modelo))
+                self._conexao.execute("COMMIT")
+            except BaseException:
+                self._conexao.execute("ROLLBACK")
+                raise
+            return retorno
+
+
+class BaldeFichasRedis(BaldeFichas):
+    """O mesmo balde, num hash do Redis, alterado numa transação (WATCH/MULTI) que refaz a conta se outro processo mexeu."""
+
+    PREFIXO = "ozy:agendador:"
+
+    def __init__(self, url: str, modelo: str, por_minuto: float, rajada: int):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("O limite compartilhado em Redis precisa do pacote 'redis' (pip install redis).") from e
+        super().__init__(por_minuto, rajada)
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._chave = self.PREFIXO + modelo
+
+    def _alterar(self, mudanca):
+        def transacao(pipe):
+            agora = time.time()
+            fichas, atualizado = pipe.hmget(self._chave, "fichas", "atualizado")
+            if fichas is None:
+                fichas, atualizado = self.capacidade, agora
+            fichas, retorno = mudanca(self._repostas(float(fichas), float(atualizado), agora))
+            pipe.multi()
+            pipe.hset(self._chave, mapping={"fichas": fichas, "atualizado": max(agora, float(atualizado))})
+            return retorno
+        return self._redis.transaction(transacao, self._chave, value_from_callable=True)
+
+
+def criar_balde(modelo: str, por_minuto: float, rajada: int) -> BaldeFichas:
+    """Balde do modelo: compartilhado entre os processos quando o estado compartilhado está ligado."""
+    if compartilhado.REDIS and compartilhado.ativo():
+        return BaldeFichasRedis(compartilhado.REDIS, modelo, por_minuto, rajada)
+    if compartilhado.ativo():
+        return BaldeFichasSQLite(compartilhado.caminho("agendador.sqlite3"), modelo, por_minuto, rajada)
+    return BaldeFichas(por_minuto, rajada)
+
+
+class Agendador:
+    """Fila única das chamadas ao Gemini: limite por minuto, vagas, novas tentativas e pesquisas juntadas."""
+
+    def __init__(self, por_minuto: float = RPM_PADRAO, rajada: int = RAJADA_PADRAO,
+                 max_concorrencia: int = MAX_CONCORRENCIA, tentativas: int = TENTATIVAS):
+        self.por_minuto = por_minuto
+        self.rajada = rajada
+        self.max_concorrencia = max_concorrencia
+        self.tentativas = tentativas
+        self._baldes = {} # modelo -> BaldeFichas
+        self._vagas = threading.BoundedSemaphore(max_concorrencia)
+        self._em_voo = {} # chave da pesquisa -> Future com o resultado da chamada em andamento
+        self._lock = threading.Lock()
+        # Números para mostrar na tela
+        self.na_fila = 0
+        self.em_andamento = 0
+        self.chamadas = 0
+        self.limitadas = 0 # Chamadas que esperaram o balde encher
+        self.retentativas = 0
+        self.falhas = 0 # Desistências depois de todas as tentativas (ou erros que não valem nova tentativa)
+        self.coalescidas = 0
+        self.canceladas = 0 # Chamadas que desistiram na fila porque o pedido foi cancelado
+        self._esperas = deque(maxlen=500) # Últimas esperas na fila (segundos)
+
+    def _balde(self, modelo: str) -> BaldeFichas:
+        with self._lock:
+            if modelo not in self._baldes:
+                self._baldes[modelo] = criar_balde(modelo, self.por_minuto, self.rajada)
+            return self._baldes[modelo]
+
+    def _pausa(self, tentativa: int) -> float:
+        # Espera exponencial com jitter completo: sessões que falharam juntas não voltam juntas
+        return random.uniform(0, min(PAUSA_MAXIMA, PAUSA_BASE * 2 ** tentativa))
+
+    def _contar(self, atributo: str, quantidade: int = 1):
+        with self._lock:
+            setattr(self, atributo, getattr(self, atributo) + quantidade)
+
+    def previsao(self, modelo: str) -> dict:
+        """Como está a fila antes de entrar nela (para avisar o usuário que a resposta vai demorar)."""
+        return {"na_fila": self.na_fila, "em_andamento": self.em_andamento,
+                "espera_estimada": self._balde(modelo).espera_estimada()}
+
+    # --- Chamadas síncronas (send_message, call_agent) ---------------------
+
+    def executar(self, modelo: str, funcao, *args, medida: Optional[dict] = None,
+                 cancelado: Optional[threading.Event] = None, **kwargs):
+        """
+        Chama funcao(*args, **kwargs) respeitando o limite do modelo e as vagas, com novas tentativas em 429/5xx.
+        'medida' (opcional) recebe espera_fila (segundos) e tentativas.
+        'cancelado' (opcional): marcado enquanto a chamada espera a vez, ela desiste com PedidoCancelado.
+        """
+        balde = self._balde(modelo)
+        inicio = time.monotonic()
+        self._contar("na_fila")
+        try:
+            self._desistir_se_cancelado(cancelado)
+            espera = balde.reservar()
+            if espera > 0:
+                self._contar("limitadas")
+                self._esperar(espera, cancelado)
+            self._ocupar_vaga(cancelado)
+        finally:
+            self._contar("na_fila", -1)
+        self._registrar_espera(inicio, medida)
+
+        self._contar("em_andamento")
+        try:
+            for tentativa in range(self.tentativas):
+                try:
+                    self._contar("chamadas")
+                    resultado = funcao(*args, **kwargs)
+                    if medida is not None:
+                        medida["tentativas"] = tentativa + 1
+                    return resultado
+                except Exception as e:
+                    if not self._vale_nova_tentativa(e, tentativa, balde):
+                        raise
+                    self._esperar(self._pausa(tentativa), cancelado)
+                    self._esperar(balde.reservar(), cancelado) # A nova tentativa também é um pedido
+        finally:
+            self._contar("em_andamento", -1)
+            self._vagas.release()
+
+    def _desistir_se_cancelado(self, cancelado: Optional[threading.Event]):
+        if cancelado is not None and cancelado.is_set():
+            self._contar("canceladas")
+            raise PedidoCancelado()
+
+    def _esperar(self, segundos: float, cancelado: Optional[threading.Event]):
+        """time.sleep que acaba antes (com PedidoCancelado) se o pedido for cancelado."""
+        if cancelado is None:
+            time.sleep(segundos)
+        elif segundos > 0 and cancelado.wait(segundos):
+            self._desistir_se_cancelado(cancelado)
+
+    def _ocupar_vaga(self, cancelado: Optional[threading.Event]):
+        if cancelado is None:
+            self._vagas.acquire()
+            return
+        while not self._vagas.acquire(timeout=INTERVALO_VERIFICACAO):
+            self._desistir_se_cancelado(cancelado)
+        try:
+            self._desistir_se_cancelado(cancelado) # Cancelado bem na hora em que a vaga saiu
+        except PedidoCancelado:
+            self._vagas.release()
+            raise
+
+    # --- Chamadas assíncronas (call_agent_async) ---------------------------
+
+    async def executar_async(self, modelo: str, fabrica, medida: Optional[dict] = None):
+        """Mesmo que executar(), para corrotinas: fabrica() cria a corrotina de cada tentativa."""
+        balde = self._balde(modelo)
+        inicio = time.monotonic()
+        self._contar("na_fila")
+        try:
+            espera = balde.reservar()
+            if espera > 0:
+                self._contar("limitadas")
+                await asyncio.sleep(espera)
+            # Espera uma vaga sem travar o event loop (e pode ser cancelada por timeout sem perder a vaga)
+            while not self._vagas.acquire(blocking=False):
+                await asyncio.sleep(0.02)
+        finally:
+            self._contar("na_fila", -1)
+        self._registrar_espera(inicio, medida)
+
+        self._contar("em_andamento")
+        try:
+            for tentativa in range(self.tentativas):
+                try:
+                    self._contar("chamadas")
+                    resultado = await fabrica()
+                    if medida is not None:
+                        medida["tentativas"] = tentativa + 1
+                    return resultado
+                except Exception as e:
+                    if not self._vale_nova_tentativa(e, tentativa, balde):
+                        raise
+                    await asyncio.sleep(self._pausa(tentativa))
+                    await asyncio.sleep(balde.reservar())
+        finally:
+            self._contar("em_andamento", -1)
+            self._vagas.release()
+
+    def _vale_nova_tentativa(self, erro, tentativa: int, balde: BaldeFichas) -> bool:
+        if erro_de_limite(erro):
+            balde.esvaziar()
+        if not erro_temporario(erro) or tentativa == self.tentativas - 1:
+            self._contar("falhas")
+            return False
+        self._contar("retentativas")
+        print(f"Erro temporário da API ({codigo_http(erro)}), tentando de novo: {erro}") # Debug
+        return True
+
+    def _registrar_espera(self, inicio: float, medida: Optional[dict]):
+        espera = time.monotonic() - inicio
+        with self._lock:
+            self._esperas.append(espera)
+        if medida is not None:
+            medida["espera_fila"] = espera
+
+    # --- Pesquisas juntadas ------------------------------------------------
+
+    async def coalescer_async(self, chave, fabrica):
+        """
+        Se já existe uma chamada com essa chave em andamento (em qualquer thread), espera o resultado dela;
+        senão, faz a chamada (fabrica() cria a corrotina) e entrega o resultado para quem chegar no meio.
+        Se a chamada que estava sendo esperada for cancelada pelo pedido dela, quem esperava não perde a pesquisa:
+        um deles passa a fazer a chamada e os outros esperam por ele.
+        """
+        while True:
+            with self._lock:
+                futuro = self._em_voo.get(chave)
+                primeira = futuro is None
+                if primeira:
+                    futuro = self._em_voo[chave] = concurrent.futures.Future()
+                    futuro.set_running_or_notify_cancel() # Quem espera não consegue cancelar a chamada dos outros
+                else:
+                    self.coalescidas += 1
+            if primeira:
+                break
+            try:
+                # shield: o tempo limite de quem espera não cancela a chamada original
+                return await asyncio.shield(asyncio.wrap_future(futuro))
+            except _ChamadaCancelada:
+                continue
+        try:
+            resultado = await fabrica()
+        except asyncio.CancelledError:
+            # A chamada estourou o tempo dela (ou o pedido dela foi cancelado): isso é só dela, não de quem esperava.
+            # Sai de _em_voo antes de avisar, para quem esperava não encontrar esta chamada de novo
+            self._sair_do_voo(chave, futuro)
+            futuro.set_exception(_ChamadaCancelada())
+            raise
+        except Exception as e:
+            futuro.set_exception(e)
+            raise
+        else:
+            futuro.set_result(resultado)
+            return resultado
+        finally:
+            self._sair_do_voo(chave, futuro)
+
+    def _sair_do_voo(self, chave, futuro):
+        with self._lock:
+            if self._em_voo.get(chave) is futuro: # Pode já ser a chamada de quem assumiu depois de um cancelamento
+                del self._em_voo[chave]
+
+    # --- Números -----------------------------------------------------------
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            esperas = sorted(self._esperas)
+        return {
+            "na_fila": self.na_fila,
+            "em_andamento": self.em_andamento,
+            "max_concorrencia": self.max_concorrencia,
+            "chamadas": self.chamadas,
+            "limitadas": self.limitadas,
+            "retentativas": self.retentativas,
+            "falhas": self.falhas,
+            "coalescidas": self.coalescidas,
+            "canceladas": self.canceladas,
+            "espera_media": sum(esperas) / len(esperas) if esperas else 0.0,
+            "espera_p95": esperas[int(0.95 * (len(esperas) - 1))] if esperas else 0.0,
+        }
+
+
+# Agendador único do processo (todas as sessões dividem o mesmo limite da API)
+_agendador = None
+_agendador_lock = threading.Lock()
+
+def obter_agendador() -> Agendador:
+    global _agendador
+    if _agendador is None:
+        with _agendador_lock:
+            if _agendador is None:
+                _agendador = Agendador()
+    return _agendador
@@ -0,0 +1,212 @@
+"""
+Registro dos agentes do Pesquisador Ozy.
+
+Os objetos Agent, o serviço de sessões e os Runners do ADK são criados uma única vez por processo
+e reaproveitados por todas as sessões do Streamlit. Cada chamada (e cada nova tentativa dela) roda numa
+sessão do ADK só dela, criada na hora e apagada no fim: o ADK reenvia ao modelo todos os eventos da sessão,
+então uma sessão reaproveitada faria cada busca carregar as perguntas e resultados das anteriores (mais
+tokens, e consultas moldadas pela conversa de outra pessoa quando a pesquisa é juntada, ver ozy/agendador.py).
+
+Com o estado compartilhado (ozy/compartilhado.py), as sessões do ADK ficam num SQLite da pasta compartilhada
+(DatabaseSessionService) em vez da memória do processo.
+"""
+import asyncio
+import contextlib
+import queue
+import threading
+import uuid
+
+from google.adk.agents import Agent
+from google.adk.runners import Runner
+from google.adk.sessions import DatabaseSessionService, InMemorySessionService
+from google.adk.tools import google_search
+from google.genai import types
+
+from ozy import compartilhado
+from ozy.agendador import obter_agendador
+
+# =============================================================================
+# Definição dos Agentes
+# Cada entrada vira um Agent na primeira vez que for usada
+# =============================================================================
+
+# Modelo usado pelos agentes do Pesquisador
+MODELO_AGENTES = "gemini-2.0-flash"
+
+DEFINICOES_AGENTES = {
+    "agent_simplifier": {
+        "instruction": """
+            Sua única função é estruturar uma pergunta concisa e eficaz para ser utilizada em uma busca no Google. Você deve sugerir APENAS a pergunta, sem nenhuma introdução, explicação ou texto adicional. Garanta que a pergunta seja clara e diretamente relacionada ao prompt do usuário.
+            Retorne somente UMA pergunta otimizada para busca.
+            """,
+        "description": "Agente que irá simplificar o prompt do usuário para busca.",
+    },
+    "agent_searcher": {
+        "instruction": """
+            Você é um agente especializado em realizar buscas no Google e retornar as informações mais relevantes e recentes encontradas, **incluindo os links para as fontes originais**. Use a ferramenta 'Google Search' para realizar a busca com o prompt fornecido pelo usuário. Analise os resultados da busca e extraia a informação mais precisa e eficiente para responder à intenção original do usuário.
+
+            **Responda APENAS com uma lista JSON**, sem nenhum texto antes ou depois, com um objeto por resultado relevante (no máximo 8), do mais relevante para o menos:
+            [{"titulo": "<título da página>", "trecho": "<informação relevante, em até 3 frases>", "url": "<link da fonte>", "data": "<data da publicação no formato AAAA-MM-DD, ou null se não souber>", "pontuacao": <relevância de 0 a 1>}]
+
+            Mantenha o foco em fornecer contexto de pesquisa útil para outra IA, garantindo que as fontes sejam facilmente identificáveis pelos links.
+            """,
+        "description": "Agente que irá realizar a pesquisa e retorno da pesquisa.",
+    },
+    # Junta o trabalho dos dois agentes acima em uma única chamada (modo "Agente único")
+    "agent_pesquisador": {
+        "instruction": """
+            Você é um agente de pesquisa para um assistente de games. Você recebe a mensagem original do usuário.
+            Primeiro, transforme mentalmente a mensagem em UMA pergunta concisa e eficaz para uma busca no Google.
+            Depois, use a ferramenta 'Google Search' com essa pergunta e extraia as informações mais precisas, relevantes e recentes para responder à intenção do usuário.
+
+            Na primeira linha da resposta escreva apenas: Pergunta: <a pergunta usada na busca>
+            Nas linhas seguintes, apenas uma lista JSON com um objeto por resultado relevante (no máximo 8), do mais relevante para o menos:
+            [{"titulo": "<título da página>", "trecho": "<informação relevante, em até 3 frases>", "url": "<link da fonte>", "data": "<data da publicação no formato AAAA-MM-DD, ou null se não souber>", "pontuacao": <relevância de 0 a 1>}]
+
+            Mantenha o foco em fornecer contexto de pesquisa útil para outra IA, garantindo que as fontes sejam facilmente identificáveis pelos links.
+            """,
+        "description": "Agente que simplifica o prompt e realiza a pesquisa em uma única chamada.",
+    },
+}
+
+# Quantos Runners no máximo cada agente pode ter rodando ao mesmo tempo
+TAMANHO_POOL_RUNNERS = 4
+
+
+class RegistroAgentes:
+    """Guarda os agentes, o serviço de sessões e um pool de Runners por agente."""
+
+    def __init__(self, tamanho_pool=TAMANHO_POOL_RUNNERS):
+        self.tamanho_pool = tamanho_pool
+        if compartilhado.ativo():
+            self.session_service = DatabaseSessionService(f"sqlite:///{compartilhado.caminho('adk_sessoes.sqlite3')}")
+        else:
+            self.session_service = InMemorySessionService()
+        self._lock = threading.Lock()
+        self._agentes = {} # nome -> Agent
+        self._pools = {} # nome -> fila com os Runners livres
+        self._runners_criados = {} # nome -> quantos Runners já foram criados
+
+    def obter_agente(self, nome: str) -> Agent:
+        """Retorna o Agent com esse nome, criando-o apenas na primeira vez."""
+        with self._lock:
+            if nome not in self._agentes:
+                definicao = DEFINICOES_AGENTES[nome]
+                self._agentes[nome] = Agent(
+                    name=nome,
+                    model=MODELO_AGENTES,
+                    instruction=definicao["instruction"],
+                    description=definicao["description"],
+                    tools=[google_search],
+                )
+                self._pools[nome] = queue.LifoQueue()
+                self._runners_criados[nome] = 0
+            return self._agentes[nome]
+
+    def _pegar_runner(self, nome: str, bloquear: bool = True):
+        """Pega um Runner livre do pool, criando um novo se o pool ainda não estiver cheio."""
+        agente = self.obter_agente(nome)
+        pool = self._pools[nome]
+        try:
+            return pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            pode_criar = self._runners_criados[nome] < self.tamanho_pool
+            if pode_criar:
+                self._runners_criados[nome] += 1
+        if pode_criar:
+            return Runner(agent=agente, app_name=nome, session_service=self.session_service)
+        if not bloquear:
+            return None
+        # Todos os Runners estão ocupados: espera um ser devolvido
+        return pool.get()
+
+    @contextlib.contextmanager
+    def emprestar_runner(self, nome: str):
+        """Empresta um Runner livre do pool do agente e devolve ao final do bloco 'with'."""
+        runner = self._pegar_runner(nome)
+        try:
+            yield runner
+        finally:
+            self._pools[nome].put(runner)
+
+    @contextlib.asynccontextmanager
+    async def emprestar_runner_async(self, nome: str):
+        """Mesmo que emprestar_runner, mas espera por um Runner livre sem travar o event loop."""
+        runner = self._pegar_runner(nome, bloquear=False)
+        while runner is None:
+            # Todos ocupados: tenta de novo daqui a pouco (pode ser cancelado por timeout sem perder Runner)
+            await asyncio.sleep(0.05)
+            runner = self._pegar_runner(nome, bloquear=False)
+        try:
+            yield runner
+        finally:
+            self._pools[nome].put(runner)
+
+    @contextlib.contextmanager
+    def sessao_avulsa(self, nome: str, id_usuario: str):
+        """Sessão nova do usuário com o agente, só para uma chamada: apagada ao final do bloco 'with'."""
+        session_id = f"{nome}_{id_usuario}_{uuid.uuid4().hex[:12]}"
+        self.session_service.create_session(app_name=nome, user_id=id_usuario, session_id=session_id)
+        try:
+            yield session_id
+        finally:
+            try:
+                self.session_service.delete_session(app_name=nome, user_id=id_usuario, session_id=session_id)
+            except Exception as e:
+                print(f"Não foi possível apagar a sessão {session_id} do agente: {e}") # Debug
+
+    def call_agent(self, nome: str, message_text: str, id_usuario: str) -> str:
+        """Envia uma mensagem para o agente e retorna a resposta final. Erros são propagados para quem chamou."""
+        # Cria o conteúdo da mensagem de entrada
+        content = types.Content(role="user", parts=[types.Part(text=message_text)])
+
+        def rodar():
+            final_response = ""
+            with self.sessao_avulsa(nome, id_usuario) as session_id, self.emprestar_runner(nome) as runner:
+                for event in runner.run(user_id=id_usuario, session_id=session_id, new_message=content):
+                    if event.is_final_response():
+                        for part in event.content.parts:
+                            if part.text is not None:
+                                final_response += part.text
+            return final_response
+
+        # Pelo agendador do processo: mesmo limite por minuto do Gemini e novas tentativas em 429/5xx
+        final_response = obter_agendador().executar(MODELO_AGENTES, rodar)
+        return final_response.strip() # Remove espaços em branco no início/fim
+
+    async def call_agent_async(self, nome: str, message_text: str, id_usuario: str) -> str:
+        """Versão assíncrona de call_agent, usando runner.run_async (permite timeouts e chamadas em paralelo)."""
+        content = types.Content(role="user", parts=[types.Part(text=message_text)])
+
+        async def rodar():
+            final_response = ""
+            with self.sessao_avulsa(nome, id_usuario) as session_id:
+                async with self.emprestar_runner_async(nome) as runner:
+                    async for event in runner.run_async(user_id=id_usuario, session_id=session_id, new_message=content):
+                        if event.is_final_response():
+                            for part in event.content.parts:
+                                if part.text is not None:
+                                    final_response += part.text
+            return final_response
+
+        final_response = await obter_agendador().executar_async(MODELO_AGENTES, rodar)
+        return final_response.strip()
+
+
+# =============================================================================
+# Registro único do processo
+# =============================================================================
+
+_registro = None
+_registro_lock = threading.Lock()
+
+def obter_registro() -> RegistroAgentes:
+    """Retorna o registro de agentes compartilhado por todo o processo."""
+    global _registro
+    if _registro is None:
+        with _registro_lock:
+            if _registro is None:
+                _registro = RegistroAgentes()
+    return _registro
@@ -0,0 +1,239 @@
+"""
+Pesquisa antecipada: o Pesquisador começa a trabalhar antes da pergunta chegar.
+
+Sem isso, a pesquisa só começa quando o usuário envia a mensagem e a latência dela soma direto no tempo
+da resposta. Com o modo ligado:
+- quando um print é enviado, uma tarefa em segundo plano reconhece o jogo e a tela (modelo barato)
+  e já pesquisa esse jogo, guardando o resultado no cache de busca;
+- os assuntos das pesquisas de turnos anteriores (e os jogos dos prints) são pesquisados de novo
+  em segundo plano quando o resultado guardado está perto de vencer;
+- quando a pergunta chega, o contexto que já está pronto vai para o Pesquisador, e o buscador só
+  procura o que faltar (ver ozy/pesquisa.py).
+
+As tarefas rodam num event loop próprio, numa thread: um print novo, limpar a conversa ou a sessão
+ser descartada cancelam o que ainda está rodando (a chamada ao agente é cancelada no meio).
+Cada sessão tem um limite de chamadas por hora, para a antecipação nunca custar mais do que ajuda.
+"""
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+from ozy import resultados_busca
+from ozy.cache import normalizar_consulta, obter_cache_busca
+from ozy.cancelamento import INTERVALO_VERIFICACAO
+from ozy.imagens import calcular_hash
+
+# Chamadas (classificação do print e pesquisas) que cada sessão pode gastar em segundo plano por janela
+MAX_CHAMADAS = int(os.environ.get("OZY_ANTECIPACAO_MAX_CHAMADAS", 6))
+JANELA_CUSTO = 3600 # Segundos
+# Depois de quantos segundos um assunto já pesquisado é pesquisado de novo (padrão: 3/4 da validade do cache)
+REFRESCAR_APOS = float(os.environ.get("OZY_ANTECIPACAO_REFRESCAR", 0.75 * float(os.environ.get("OZY_CACHE_BUSCA_TTL", 6 * 3600))))
+# Quanto a pergunta espera o print que ainda está sendo reconhecido/pesquisado
+ESPERA_MAXIMA = 3.0
+# Assuntos lembrados por sessão (os mais antigos saem primeiro)
+MAX_ASSUNTOS = 8
+
+
+def consulta_do_jogo(jogo: str, tela: str) -> str:
+    """Pergunta usada para antecipar a pesquisa de um print."""
+    return f"{jogo} {tela} dicas e guia".strip()
+
+
+@dataclass
+class Assunto:
+    """Um assunto da conversa que vale manter pesquisado."""
+    consulta: str
+    jogo: Optional[str] = None
+    pesquisado_em: float = 0.0 # time.time() da última pesquisa (0: ainda não foi)
+
+
+@dataclass
+class EstadoSessao:
+    """O que a antecipação guarda de cada sessão."""
+    tarefas: dict = field(default_factory=dict) # nome -> Future da tarefa em segundo plano
+    assuntos: OrderedDict = field(default_factory=OrderedDict) # consulta normalizada -> Assunto
+    imagens: dict = field(default_factory=dict) # hash do print -> Assunto reconhecido nele
+    gastos: deque = field(default_factory=deque) # Momento de cada chamada gasta (para o limite por janela)
+
+
+class Antecipador:
+    """Agenda, cancela e aproveita as pesquisas antecipadas de todas as sessões de um motor."""
+
+    def __init__(self, backend, max_chamadas: int = MAX_CHAMADAS):
+        self.backend = backend
+        self.max_chamadas = max_chamadas
+        self._sessoes = {} # id -> EstadoSessao
+        self._lock = threading.Lock()
+        self._loop = None
+        # Números para mostrar na tela
+        self.agendadas = 0
+        self.concluidas = 0
+        self.canceladas = 0
+        self.falhas = 0
+        self.bloqueadas_custo = 0
+        self.aproveitadas = 0 # Perguntas que já encontraram contexto pronto
+
+    def _loop_de_fundo(self) -> asyncio.AbstractEventLoop:
+        """Event loop das tarefas, numa thread própria (criado na primeira tarefa)."""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True, name="ozy-antecipacao").start()
+            return self._loop
+
+    def _estado(self, id_sessao: str) -> EstadoSessao:
+        with self._lock:
+            return self._sessoes.setdefault(id_sessao, EstadoSessao())
+
+    def _gastar(self, estado: EstadoSessao) -> bool:
+        """Reserva uma chamada no limite da sessão. False quando o limite da janela acabou."""
+        agora = time.monotonic()
+        with self._lock:
+            while estado.gastos and estado.gastos[0] < agora - JANELA_CUSTO:
+                estado.gastos.popleft()
+            if len(estado.gastos) >= self.max_chamadas:
+                self.bloqueadas_custo += 1
+                return False
+            estado.gastos.append(agora)
+            return True
+
+    def _agendar(self, estado: EstadoSessao, nome: str, corrotina):
+        """Roda a corrotina no loop de fundo. Uma tarefa com o mesmo nome que ainda está rodando é cancelada."""
+        anterior = estado.tarefas.get(nome)
+        if anterior is not None and anterior.cancel():
+            self.canceladas += 1
+        futuro = asyncio.run_coroutine_threadsafe(corrotina, self._loop_de_fundo())
+        estado.tarefas[nome] = futuro
+        self.agendadas += 1
+
+        def terminou(f):
+            if estado.tarefas.get(nome) is f:
+                del estado.tarefas[nome]
+            if f.cancelled():
+                return
+            if f.exception() is not None:
+                self.falhas += 1
+                print(f"Erro na pesquisa antecipada ({nome}): {f.exception()}") # Debug
+            else:
+                self.concluidas += 1
+        futuro.add_done_callback(terminou)
+        return futuro
+
+    def _lembrar(self, estado: EstadoSessao, assunto: Assunto) -> Assunto:
+        chave = normalizar_consulta(assunto.consulta)
+        with self._lock:
+            assunto = estado.assuntos.pop(chave, assunto)
+            estado.assuntos[chave] = assunto # Vai para o fim: é o assunto mais recente
+            while len(estado.assuntos) > MAX_ASSUNTOS:
+                estado.assuntos.popitem(last=False)
+        return assunto
+
+    # --- Entradas ----------------------------------------------------------
+
+    def antecipar_imagem(self, id_sessao: str, dados: bytes):
+        """Um print acabou de chegar: reconhece o jogo e já pesquisa ele em segundo plano."""
+        estado = self._estado(id_sessao)
+        hash_imagem = calcular_hash(dados)
+        if hash_imagem in estado.imagens or not self._gastar(estado):
+            return None
+        estado.imagens[hash_imagem] = None # Em andamento (o mesmo print não é pedido duas vezes)
+        # Um print novo substitui o anterior: o trabalho que ainda rodava para o outro é cancelado
+        return self._agendar(estado, "imagem", self._antecipar_imagem(estado, id_sessao, hash_imagem, dados))
+
+    async def _antecipar_imagem(self, estado: EstadoSessao, id_sessao: str, hash_imagem: str, dados: bytes):
+        try:
+            classificacao = await self.backend.classificar_imagem_async(dados)
+        except BaseException:
+            estado.imagens.pop(hash_imagem, None) # Cancelado ou falhou: se o print voltar, tenta de novo
+            raise
+        if not classificacao.get("jogo"):
+            return None # Não deu para reconhecer o jogo: a pesquisa fica para quando a pergunta chegar
+        assunto = self._lembrar(estado, Assunto(consulta_do_jogo(classificacao["jogo"], classificacao.get("tela", "")),
+                                                jogo=classificacao["jogo"]))
+        estado.imagens[hash_imagem] = assunto
+        if obter_cache_busca().buscar(assunto.consulta) is None and self._gastar(estado):
+            await self.backend.buscar_assunto_async(assunto.consulta, id_sessao)
+        assunto.pesquisado_em = time.time()
+        return assunto
+
+    def refrescar(self, id_sessao: str, consulta: Optional[str] = None):
+        """
+        Depois de um turno: guarda a consulta pesquisada nele como assunto da conversa e pesquisa de novo,
+        em segundo plano, os assuntos cujo resultado guardado está perto de vencer.
+        """
+        estado = self._estado(id_sessao)
+        if consulta:
+            self._lembrar(estado, Assunto(consulta, pesquisado_em=time.time()))
+        limite = time.time() - REFRESCAR_APOS
+        for assunto in list(estado.assuntos.values()):
+            nome = f"refrescar:{normalizar_consulta(assunto.consulta)}"
+            if 0 < assunto.pesquisado_em < limite and nome not in estado.tarefas and self._gastar(estado):
+                self._agendar(estado, nome, self._refrescar(assunto, id_sessao))
+
+    async def _refrescar(self, assunto: Assunto, id_sessao: str):
+        await self.backend.buscar_assunto_async(assunto.consulta, id_sessao)
+        assunto.pesquisado_em = time.time()
+
+    def contexto_para(self, id_sessao: str, prompt: str, imagem: Optional[bytes] = None,
+                      cancelado: Optional[threading.Event] = None) -> Optional[str]:
+        """
+        A pergunta chegou: junta o contexto já pesquisado que serve para ela (o jogo do print desta mensagem
+        e os jogos citados no texto). Se o print ainda está sendo pesquisado, espera um pouco por ele
+        (e para de esperar se 'cancelado', o sinal do pedido da mensagem, for marcado).
+        """
+        estado = self._estado(id_sessao)
+        escolhidos = []
+        if imagem is not None:
+            tarefa = estado.tarefas.get("imagem")
+            if tarefa is not None:
+                # Demorou demais, falhou ou a mensagem foi cancelada: segue sem (e a tarefa continua para os próximos turnos)
+                prazo = time.monotonic() + ESPERA_MAXIMA
+                while not tarefa.done() and not (cancelado is not None and cancelado.is_set()):
+                    restante = prazo - time.monotonic()
+                    if restante <= 0:
+                        break
+                    concurrent.futures.wait([tarefa], timeout=min(restante, INTERVALO_VERIFICACAO))
+            assunto = estado.imagens.get(calcular_hash(imagem))
+            if assunto is not None:
+                escolhidos.append(assunto)
+        texto = normalizar_consulta(prompt)
+        for assunto in reversed(estado.assuntos.values()):
+            if assunto.jogo and normalizar_consulta(assunto.jogo) in texto and assunto not in escolhidos:
+                escolhidos.append(assunto)
+        cache = obter_cache_busca()
+        contextos = [contexto for contexto in (cache.buscar(assunto.consulta) for assunto in escolhidos) if contexto]
+        if not contextos:
+            return None
+        self.aproveitadas += 1
+        return resultados_busca.juntar(*contextos)
+
+    def cancelar(self, id_sessao: str):
+        """Cancela tudo o que a sessão ainda tem rodando e esquece os assuntos dela (conversa limpa ou sessão descartada)."""
+        with self._lock:
+            estado = self._sessoes.pop(id_sessao, None)
+        if estado is None:
+            return
+        for futuro in list(estado.tarefas.values()):
+            if futuro.cancel():
+                self.canceladas += 1
+
+    def estatisticas(self, id_sessao: Optional[str] = None) -> dict:
+        numeros = {
+            "agendadas": self.agendadas,
+            "concluidas": self.concluidas,
+            "canceladas": self.canceladas,
+            "falhas": self.falhas,
+            "bloqueadas_custo": self.bloqueadas_custo,
+            "aproveitadas": self.aproveitadas,
+            "max_chamadas": self.max_chamadas,
+        }
+        if id_sessao is not None:
+            estado = self._sessoes.get(id_sessao)
+            numeros["gasto_sessao"] = len(estado.gastos) if estado else 0
+            numeros["em_andamento_sessao"] = len(estado.tarefas) if estado else 0
+        return numeros
@@ -0,0 +1,184 @@
+"""
+API HTTP do motor do Ozy (FastAPI), para usar o pipeline fora do Streamlit.
+
+Rotas:
+- POST   /sessoes                           cria uma sessão e retorna o id;
+- POST   /sessoes/{id}/retomada             token de uso único para voltar à sessão depois (ozy/conversas.py);
+- POST   /retomada                          troca o token (formulário, fora da URL) pelo id da sessão;
+- POST   /sessoes/{id}/mensagens            envia uma mensagem (formulário multipart, imagem opcional)
+                                            e recebe os eventos do turno em stream (SSE);
+- POST   /sessoes/{id}/antecipacao          print enviado antes da pergunta: começa a pesquisa antecipada;
+- POST   /sessoes/{id}/cancelar?id_pedido=  cancela a mensagem em andamento (o id vem no evento "pedido");
+- GET    /sessoes/{id}/mensagens?persona=   histórico de exibição da persona (ultimas, antes_de e depois_de paginam);
+- DELETE /sessoes/{id}/mensagens?persona=   limpa a conversa da persona;
+- GET    /sessoes/{id}/estatisticas?persona=
+- GET    /personas, GET /saude;
+- GET    /metrics                           métricas de cada etapa no formato do Prometheus;
+- GET    /telemetria/spans?id_sessao=       spans recentes da sessão em OTLP/JSON (formato do OpenTelemetry).
+
+Para rodar: GOOGLE_API_KEY=... uvicorn ozy.api:app --port 8000
+Cada processo guarda as próprias sessões: atrás de um balanceador, use afinidade pelo id da sessão,
+ou ligue o estado compartilhado (ozy/compartilhado.py) e rode vários workers na mesma máquina:
+    OZY_ESTADO_COMPARTILHADO=/var/lib/ozy uvicorn ozy.api:app --workers 4
+"""
+import base64
+import json
+import os
+import threading
+import uuid
+from typing import Optional
+
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse
+from sse_starlette.sse import EventSourceResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from ozy import pesquisa, telemetria
+from ozy.cache_semantico import LIMIAR_PADRAO
+from ozy.cancelamento import MOTIVO_CLIENTE, TEXTOS_MOTIVOS
+from ozy.motor import OpcoesTurno, obter_motor
+from ozy.personas import PERSONAS, configurar_gemini
+
+app = FastAPI(title="Ozy o Assistente")
+
+if os.environ.get("GOOGLE_API_KEY"):
+    configurar_gemini(os.environ["GOOGLE_API_KEY"])
+
+
+def para_json(valor):
+    """Converte eventos e mensagens para JSON (bytes, como as miniaturas, viram base64)."""
+    if isinstance(valor, bytes):
+        return base64.b64encode(valor).decode("ascii")
+    if isinstance(valor, dict):
+        return {chave: para_json(item) for chave, item in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [para_json(item) for item in valor]
+    return valor
+
+
+def _validar_persona(persona: str):
+    if persona not in PERSONAS:
+        raise HTTPException(404, f"Persona desconhecida: {persona}")
+
+
+@app.get("/saude")
+async def saude():
+    return {"ok": True}
+
+
+@app.get("/personas")
+async def personas():
+    return {"personas": list(PERSONAS), "modos_pesquisa": pesquisa.NOMES_MODOS}
+
+
+@app.post("/sessoes")
+async def criar_sessao():
+    id_sessao = uuid.uuid4().hex
+    # O motor é síncrono (cria o histórico, lê o armazém de conversas): fora do event loop, como nas outras rotas
+    await run_in_threadpool(obter_motor().sessao, id_sessao)
+    return {"id_sessao": id_sessao}
+
+
+@app.post("/sessoes/{id_sessao}/retomada")
+async def emitir_retomada(id_sessao: str):
+    return {"token": await run_in_threadpool(obter_motor().emitir_retomada, id_sessao)}
+
+
+@app.post("/retomada")
+async def retomar(token: str = Form(...)):
+    # O token vai no corpo, não na URL: não fica nos logs de acesso
+    return {"id_sessao": await run_in_threadpool(obter_motor().retomar, token)}
+
+
+@app.post("/sessoes/{id_sessao}/mensagens")
+async def enviar_mensagem(
+    id_sessao: str,
+    prompt: str = Form(...),
+    persona: str = Form(PERSONAS[0]),
+    agentes_ativos: bool = Form(False),
+    modo_pesquisa: str = Form(pesquisa.MODO_SEQUENCIAL),
+    stream: bool = Form(True),
+    cache_semantico_ativo: bool = Form(False),
+    limiar_semantico: float = Form(LIMIAR_PADRAO),
+    antecipar: bool = Form(False),
+    forcar_pesquisa: bool = Form(False),
+    comparar: bool = Form(False),
+    imagem: Optional[UploadFile] = File(None),
+):
+    _validar_persona(persona)
+    if modo_pesquisa not in pesquisa.NOMES_MODOS:
+        raise HTTPException(422, f"Modo do Pesquisador desconhecido: {modo_pesquisa}")
+    opcoes = OpcoesTurno(persona, agentes_ativos, modo_pesquisa, stream, cache_semantico_ativo, limiar_semantico, antecipar,
+                         forcar_pesquisa, comparar)
+    dados_imagem = await imagem.read() if imagem is not None else None
+
+    cancelado = threading.Event()
+    eventos = obter_motor().conversar(id_sessao, prompt, opcoes, dados_imagem, cancelado)
+
+    async def gerar_sse():
+        try:
+            # O motor é síncrono (o SDK do Gemini também): cada evento é lido numa thread do pool
+            async for evento in iterate_in_threadpool(eventos):
+                yield {"event": evento["tipo"], "data": json.dumps(para_json(evento), ensure_ascii=False)}
+        finally:
+            # Cliente desconectou (ou o turno acabou): o motor para de ler o stream do Gemini e salva o que chegou
+            cancelado.set()
+            try:
+                await run_in_threadpool(eventos.close)
+            except ValueError:
+                pass # O gerador ainda está rodando na thread; ele vê o 'cancelado' e termina sozinho
+
+    return EventSourceResponse(gerar_sse())
+
+
+@app.post("/sessoes/{id_sessao}/antecipacao")
+async def antecipar(id_sessao: str, imagem: UploadFile = File(...)):
+    # Só agenda: o reconhecimento do jogo e a pesquisa rodam em segundo plano no motor
+    dados = await imagem.read()
+    await run_in_threadpool(obter_motor().antecipar, id_sessao, dados)
+    return {"ok": True}
+
+
+@app.post("/sessoes/{id_sessao}/cancelar")
+async def cancelar(id_sessao: str, id_pedido: Optional[str] = None, motivo: str = MOTIVO_CLIENTE):
+    # Troca de persona, nova mensagem em outra conexão...: a resposta em andamento para e é descartada
+    if motivo not in TEXTOS_MOTIVOS:
+        raise HTTPException(422, f"Motivo de cancelamento desconhecido: {motivo}")
+    return {"cancelado": obter_motor().cancelar(id_sessao, motivo, id_pedido=id_pedido)}
+
+
+@app.get("/sessoes/{id_sessao}/mensagens")
+async def listar_mensagens(id_sessao: str, persona: str = PERSONAS[0], ultimas: Optional[int] = None,
+                           antes_de: Optional[int] = None, depois_de: Optional[int] = None):
+    _validar_persona(persona)
+    mensagens = await run_in_threadpool(obter_motor().mensagens, id_sessao, persona, ultimas, antes_de, depois_de)
+    return {"mensagens": [
+        para_json({"role": m.role, "content": m.content, "persona": m.persona, "imagem_hash": m.imagem_hash,
+                   "miniatura": m.miniatura, "tempos": m.tempos, "seq": m.seq})
+        for m in mensagens
+    ]}
+
+
+@app.delete("/sessoes/{id_sessao}/mensagens")
+async def limpar_mensagens(id_sessao: str, persona: str = PERSONAS[0]):
+    _validar_persona(persona)
+    await run_in_threadpool(obter_motor().limpar, id_sessao, persona)
+    return {"ok": True}
+
+
+@app.get("/sessoes/{id_sessao}/estatisticas")
+async def estatisticas(id_sessao: str, persona: str = PERSONAS[0]):
+    _validar_persona(persona)
+    return await run_in_threadpool(obter_motor().estatisticas, id_sessao, persona)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metricas():
+    return PlainTextResponse(telemetria.obter_rastreador().exportar_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/telemetria/spans")
+async def spans(id_sessao: str, limite: int = 500):
+    # Só os da sessão pedida: quem sabe o id já tem acesso à conversa (os de todas ficam em OZY_METRICAS_PORTA, local)
+    rastreador = telemetria.obter_rastreador()
+    return rastreador.exportar_otlp(rastreador.spans(id_sessao, limite))
@@ -0,0 +1,263 @@
+"""
+Backend falso do motor (Gemini e Pesquisador), para medir o pipeline sem chave e sem rede.
+
+O chat é um ChatSession de verdade do SDK, com o modelo de verdade da persona: só o cliente que faria
+a chamada à API é trocado por um que responde na hora. Assim o benchmark mede tudo o que roda do nosso
+lado (conversão do conteúdo e das imagens, stream dos pedaços, histórico, orçamento de tokens),
+e a "rede" é simulada com tempos configuráveis:
+
+- latência até o primeiro pedaço e velocidade de geração (tokens por segundo);
+- latência de cada etapa do Pesquisador;
+- falhas injetadas (429/503 antes da resposta ou no meio do stream, e erros do Pesquisador).
+
+As escolhas aleatórias (variação dos tempos, falhas) usam uma semente mais o conteúdo da mensagem
+(e quantas vezes esse mesmo pedido já foi feito, para uma nova tentativa do agendador poder dar certo),
+então a mesma execução dá os mesmos resultados independente da ordem em que as threads rodam.
+
+Uso: MotorOzy(backend=BackendFalso(ConfiguracaoFalso(latencia=0.2, taxa_falhas=0.05)))
+"""
+import asyncio
+import copy
+import hashlib
+import math
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from google.api_core import exceptions as erros_api
+from google.generativeai import protos
+
+from ozy import pesquisa, resultados_busca
+from ozy.cache import normalizar_consulta, obter_cache_busca
+from ozy.personas import configurar_modelo_gemini
+
+
+@dataclass
+class ConfiguracaoFalso:
+    """Tempos e falhas simulados. Tempos em segundos."""
+    latencia: float = 0.3 # Até o primeiro pedaço da resposta
+    variacao: float = 0.2 # Variação aleatória dos tempos (0.2 = até 20% para mais ou para menos)
+    tokens_por_segundo: float = 80.0 # Velocidade de geração da resposta
+    tokens_resposta: int = 150 # Tamanho de cada resposta
+    tokens_por_pedaco: int = 20 # Tokens em cada pedaço do stream
+    latencia_pesquisa: float = 1.0 # Cada etapa (agente) do Pesquisador
+    latencia_resumo: float = 0.3 # Resumo da conversa antiga (orçamento de tokens)
+    latencia_roteador: float = 0.15 # Modelo barato do roteador do Pesquisador
+    taxa_falhas: float = 0.0 # Chance de uma chamada ao Gemini falhar (metade antes da resposta, metade no meio do stream)
+    taxa_falhas_pesquisa: float = 0.0 # Chance de o Pesquisador falhar
+    semente: int = 42
+
+
+# Palavras usadas para montar as respostas (só o tamanho importa)
+_PALAVRAS = ("jogo", "fase", "chefe", "item", "missão", "mapa", "nível", "personagem", "dica", "estratégia",
+             "combo", "vida", "inimigo", "controle", "save", "ranking")
+# Jogos "reconhecidos" nos prints pela classificação falsa
+_JOGOS = ("Elden Ring", "Hollow Knight", "Minecraft", "Zelda Tears of the Kingdom", "Celeste")
+_TELAS = ("luta contra chefe", "mapa", "inventário", "menu")
+
+
+def _tokens(texto: str) -> int:
+    return math.ceil(len(texto) / 4)
+
+
+def _tokens_do_pedido(pedido) -> int:
+    """Estimativa dos tokens de entrada: texto por caracteres e 258 por imagem, como a API conta."""
+    total = 0
+    for conteudo in list(pedido.contents) + ([pedido.system_instruction] if pedido.system_instruction else []):
+        for parte in conteudo.parts:
+            total += 258 if parte.inline_data.data else _tokens(parte.text)
+    return total
+
+
+class ClienteGeminiFalso:
+    """Faz o papel do cliente da API (generate_content e stream_generate_content) dentro do GenerativeModel."""
+
+    def __init__(self, configuracao: ConfiguracaoFalso):
+        self.configuracao = configuracao
+        self.chamadas = 0
+        self.falhas = 0
+        self._repeticoes = Counter() # Quantas vezes cada pedido já chegou (novas tentativas)
+        self._lock = threading.Lock()
+
+    def _sorteio(self, pedido) -> random.Random:
+        # A semente depende da mensagem, do tamanho da conversa e da tentativa: resultado igual a cada execução
+        ultima = pedido.contents[-1].parts[-1].text if pedido.contents and pedido.contents[-1].parts else ""
+        chave = f"{self.configuracao.semente}:{len(pedido.contents)}:{ultima}"
+        with self._lock:
+            tentativa = self._repeticoes[chave]
+            self._repeticoes[chave] += 1
+        return random.Random(f"{chave}:{tentativa}")
+
+    def _tempo(self, sorteio: random.Random, segundos: float) -> float:
+        variacao = self.configuracao.variacao
+        return max(0.0, segundos * (1 + sorteio.uniform(-variacao, variacao)))
+
+    def _pedacos(self, pedido, sorteio):
+        """Respostas (protos) de cada pedaço; a última leva a contagem de tokens."""
+        configuracao = self.configuracao
+        tokens_entrada = _tokens_do_pedido(pedido)
+        quantidade = max(1, math.ceil(configuracao.tokens_resposta / configuracao.tokens_por_pedaco))
+        for i in range(quantidade):
+            # ~4 caracteres por token, como a estimativa do app
+            palavras = [sorteio.choice(_PALAVRAS) for _ in range(configuracao.tokens_por_pedaco * 4 // 6)]
+            resposta = protos.GenerateContentResponse(candidates=[protos.Candidate(
+                content=protos.Content(role="model", parts=[protos.Part(text=" ".join(palavras) + " ")]), index=0,
+            )])
+            if i == quantidade - 1:
+                resposta.candidates[0].finish_reason = protos.Candidate.FinishReason.STOP
+                resposta.usage_metadata = protos.GenerateContentResponse.UsageMetadata(
+                    prompt_token_count=tokens_entrada, candidates_token_count=configuracao.tokens_resposta,
+                    total_token_count=tokens_entrada + configuracao.tokens_resposta,
+                )
+            yield resposta
+
+    def _falha(self, sorteio: random.Random):
+        """None, 'antes' ou 'meio' (sorteado uma vez por chamada)."""
+        if sorteio.random() >= self.configuracao.taxa_falhas:
+            return None
+        self.falhas += 1
+        return "antes" if sorteio.random() < 0.5 else "meio"
+
+    def generate_content(self, pedido, **opcoes):
+        self.chamadas += 1
+        sorteio = self._sorteio(pedido)
+        falha = self._falha(sorteio)
+        time.sleep(self._tempo(sorteio, self.configuracao.latencia))
+        if falha:
+            raise erros_api.ServiceUnavailable("Falha injetada pelo backend falso")
+        time.sleep(self._tempo(sorteio, self.configuracao.tokens_resposta / self.configuracao.tokens_por_segundo))
+        pedacos = list(self._pedacos(pedido, sorteio))
+        resposta = pedacos[-1]
+        resposta.candidates[0].content.parts[0].text = "".join(p.candidates[0].content.parts[0].text for p in pedacos)
+        return resposta
+
+    def stream_generate_content(self, pedido, **opcoes):
+        self.chamadas += 1
+        sorteio = self._sorteio(pedido)
+        falha = self._falha(sorteio)
+        if falha == "antes":
+            # Como a API real: 429 quando a cota acabou
+            time.sleep(self._tempo(sorteio, self.configuracao.latencia))
+            raise erros_api.ResourceExhausted("Falha injetada pelo backend falso")
+        return self._stream(pedido, sorteio, falha == "meio")
+
+    def _stream(self, pedido, sorteio, falhar_no_meio: bool):
+        configuracao = self.configuracao
+        time.sleep(self._tempo(sorteio, configuracao.latencia))
+        intervalo = configuracao.tokens_por_pedaco / configuracao.tokens_por_segundo
+        for i, pedaco in enumerate(self._pedacos(pedido, sorteio)):
+            if i:
+                time.sleep(self._tempo(sorteio, intervalo))
+            if falhar_no_meio and i == 1:
+                raise erros_api.ServiceUnavailable("Falha injetada pelo backend falso no meio do stream")
+            yield pedaco
+
+
+class BackendFalso:
+    """Backend do motor com o Gemini e o Pesquisador simulados (mesma interface do BackendGemini)."""
+
+    def __init__(self, configuracao: ConfiguracaoFalso = None):
+        self.configuracao = configuracao or ConfiguracaoFalso()
+        self.cliente = ClienteGeminiFalso(self.configuracao)
+        self._modelos = {} # persona -> cópia do modelo da persona usando o cliente falso
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ozy-pesquisa-falsa")
+        self.pesquisas = 0
+        self.resumos = 0
+
+    def _modelo(self, persona: str):
+        if persona not in self._modelos:
+            # Mesmo modelo (instrução de sistema, configurações) da persona; só o cliente da API muda
+            modelo = copy.copy(configurar_modelo_gemini(persona))
+            modelo._client = self.cliente
+            self._modelos[persona] = modelo
+        return self._modelos[persona]
+
+    def iniciar_chat(self, persona: str):
+        return self._modelo(persona).start_chat(history=[])
+
+    def atualizar_chat(self, chat_session, persona: str):
+        chat_session.model = self._modelo(persona)
+
+    def _contexto_falso(self, sorteio: random.Random, resultados: int = 3) -> str:
+        # Como o buscador de verdade: resultados estruturados, às vezes com a mesma página repetida
+        return resultados_busca.serializar([
+            resultados_busca.ResultadoBusca(
+                titulo=f"Guia {sorteio.choice(_JOGOS)}", trecho=" ".join(sorteio.choice(_PALAVRAS) for _ in range(60)),
+                url=f"https://exemplo.com/{sorteio.randint(1, resultados + 1)}",
+                data=f"202{sorteio.randint(3, 6)}-{sorteio.randint(1, 12):02d}-01", pontuacao=round(sorteio.random(), 2),
+            )
+            for _ in range(resultados)
+        ])
+
+    def pesquisar(self, prompt: str, id_sessao: str, modo: str, antecipado=None, cancelado=None):
+        self.pesquisas += 1
+        sorteio = random.Random(f"{self.configuracao.semente}:pesquisa:{id_sessao}:{prompt}")
+        etapas = ["agent_simplifier", "agent_searcher"] if modo == pesquisa.MODO_SEQUENCIAL else ["agent_pesquisador"]
+        resultado = pesquisa.ResultadoPesquisa(consulta=prompt[:80] if modo == pesquisa.MODO_SEQUENCIAL else None)
+        inicio = time.perf_counter()
+        for etapa in etapas:
+            inicio_etapa = time.perf_counter()
+            latencia = self.configuracao.latencia_pesquisa
+            if antecipado and etapa != "agent_simplifier":
+                latencia /= 2 # Com contexto antecipado, a busca só cobre o que falta
+            # Como a pesquisa de verdade: o cancelamento do pedido interrompe a etapa no meio
+            if cancelado is None:
+                time.sleep(self.cliente._tempo(sorteio, latencia))
+            elif cancelado.wait(self.cliente._tempo(sorteio, latencia)):
+                resultado.cancelada, resultado.erro = True, "A pesquisa foi cancelada."
+                resultado.duracao_total = time.perf_counter() - inicio
+                return resultado
+            resultado.duracoes[etapa] = time.perf_counter() - inicio_etapa
+        if sorteio.random() < self.configuracao.taxa_falhas_pesquisa:
+            resultado.erro = "Falha injetada pelo backend falso"
+            resultado.contexto = antecipado
+        else:
+            resultado.contexto = pesquisa._juntar(antecipado, self._contexto_falso(sorteio, 1 if antecipado else 3))
+        resultado.duracao_total = time.perf_counter() - inicio
+        return resultado
+
+    def pesquisar_em_segundo_plano(self, prompt: str, id_sessao: str, antecipado=None, cancelado=None):
+        return self._executor.submit(self.pesquisar, prompt, id_sessao, pesquisa.MODO_AGENTE_UNICO, antecipado, cancelado)
+
+    async def classificar_imagem_async(self, dados: bytes) -> dict:
+        sorteio = random.Random(f"{self.configuracao.semente}:classificar:{len(dados)}:{dados[-64:]}")
+        await asyncio.sleep(self.cliente._tempo(sorteio, self.configuracao.latencia_resumo))
+        return {"jogo": sorteio.choice(_JOGOS), "tela": sorteio.choice(_TELAS)}
+
+    async def buscar_assunto_async(self, consulta: str, id_sessao: str):
+        self.pesquisas += 1
+        sorteio = random.Random(f"{self.configuracao.semente}:assunto:{consulta}")
+        await asyncio.sleep(self.cliente._tempo(sorteio, self.configuracao.latencia_pesquisa))
+        contexto = self._contexto_falso(sorteio)
+        obter_cache_busca().guardar(consulta, contexto)
+        return contexto
+
+    def decidir_pesquisa(self, prompt: str, id_sessao: Optional[str] = None) -> bool:
+        # Roteador com o modelo barato: uma chamada curta que pede pesquisa em metade das perguntas
+        sorteio = random.Random(f"{self.configuracao.semente}:roteador:{prompt}")
+        time.sleep(self.cliente._tempo(sorteio, self.configuracao.latencia_roteador))
+        return sorteio.random() < 0.5
+
+    # Embeddings de mentira (palavras espalhadas num vetor): perguntas com as mesmas palavras ficam próximas
+    modelo_embedding = "falso"
+
+    def embedding(self, texto: str) -> list:
+        vetor = [0.0] * 64
+        for palavra in normalizar_consulta(texto).split():
+            vetor[int(hashlib.md5(palavra.encode("utf-8")).hexdigest(), 16) % 64] += 1.0
+        return vetor
+
+    def resumir(self, texto: str) -> str:
+        self.resumos += 1
+        sorteio = random.Random(f"{self.configuracao.semente}:resumo:{texto}")
+        time.sleep(self.cliente._tempo(sorteio, self.configuracao.latencia_resumo))
+        # O resumo tem ~1/5 do tamanho da conversa resumida
+        return " ".join(sorteio.choice(_PALAVRAS) for _ in range(max(10, len(texto) // 30)))
+
+    def estatisticas(self) -> dict:
+        return {"chamadas_gemini": self.cliente.chamadas, "falhas_injetadas": self.cliente.falhas,
+                "pesquisas": self.pesquisas, "resumos": self.resumos}
@@ -0,0 +1,294 @@
+"""
+Cache dos resultados do Pesquisador Ozy.
+
+Fica entre o agent_simplifier e o agent_searcher: a chave é a pergunta simplificada já normalizada
+(minúsculas, sem acentos, sem pontuação). Se a mesma pergunta chegar de novo antes de expirar,
+o agent_searcher nem é chamado.
+
+O cache tem tamanho máximo (os menos usados recentemente saem primeiro) e validade por entrada.
+Onde os dados ficam é escolhido pela variável de ambiente OZY_CACHE_BUSCA:
+- "memoria" (padrão): dicionário dentro do processo;
+- "sqlite:///caminho/do/arquivo.db": arquivo SQLite no disco;
+- "redis://localhost:6379/0": qualquer servidor compatível com Redis (precisa do pacote 'redis').
+Sem OZY_CACHE_BUSCA e com o estado compartilhado ligado (ozy/compartilhado.py), o cache é o Redis de
+OZY_ESTADO_REDIS ou um SQLite na pasta compartilhada, para todos os workers aproveitarem as mesmas pesquisas.
+As pesquisas das respostas prontas do FAQ (ozy/faq.py, OZY_FAQ_DB) entram no cache quando ele é criado.
+"""
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Optional
+
+from ozy import compartilhado
+
+# Padrões usados quando as variáveis de ambiente não existem
+TAMANHO_MAXIMO_PADRAO = 500
+TTL_PADRAO = 6 * 60 * 60 # 6 horas, em segundos
+
+
+def normalizar_consulta(texto: str) -> str:
+    """Deixa a pergunta em um formato único: 'Como passar do Chefe X?' e 'como passar do chefe x' viram a mesma chave."""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c)) # Remove os acentos
+    texto = re.sub(r"[^\w\s]", " ", texto) # Troca pontuação por espaço
+    return " ".join(texto.split()) # Junta espaços repetidos
+
+
+# =============================================================================
+# Backends (onde as entradas ficam guardadas)
+# Todos têm a mesma cara: ler, gravar, apagar_expirados e len()
+# =============================================================================
+
+class BackendMemoria:
+    """Dicionário ordenado dentro do processo. O mais rápido, mas cada processo tem o seu."""
+
+    def __init__(self, tamanho_maximo: int):
+        self.tamanho_maximo = tamanho_maximo
+        self._dados = OrderedDict() # chave -> (valor, expira_em)
+        self._lock = threading.Lock()
+
+    def ler(self, chave: str, agora: float):
+        """Retorna (valor, expirou). Uma entrada expirada é apagada na hora."""
+        with self._lock:
+            entrada = self._dados.get(chave)
+            if entrada is None:
+                return None, False
+            valor, expira_em = entrada
+            if expira_em <= agora:
+                del self._dados[chave]
+                return None, True
+            self._dados.move_to_end(chave) # Marca como usada agora
+            return valor, False
+
+    def gravar(self, chave: str, valor: Any, expira_em: float, agora: float) -> int:
+        """Guarda a entrada e retorna quantas entradas antigas precisaram sair para caber."""
+        with self._lock:
+            self._dados[chave] = (valor, expira_em)
+            self._dados.move_to_end(chave)
+            removidas = 0
+            while len(self._dados) > self.tamanho_maximo:
+                self._dados.popitem(last=False)
+                removidas += 1
+            return removidas
+
+    def apagar_expirados(self, agora: float) -> int:
+        with self._lock:
+            expirados = [chave for chave, (_, expira_em) in self._dados.items() if expira_em <= agora]
+            for chave in expirados:
+                del self._dados[chave]
+            return len(expirados)
+
+    def __len__(self):
+        return len(self._dados)
+
+
+class BackendSQLite:
+    """Arquivo SQLite no disco. Sobrevive a reinícios e pode ser lido por vários processos."""
+
+    def __init__(self, caminho: str, tamanho_maximo: int):
+        self.tamanho_maximo = tamanho_maximo
+        self._lock = threading.Lock()
+        self._conexao = compartilhado.conectar_sqlite(caminho, isolation_level=None)
+        self._conexao.execute(
+            "CREATE TABLE IF NOT EXISTS cache_busca ("
+            " chave TEXT PRIMARY KEY, valor TEXT NOT NULL, expira_em REAL NOT NULL, ultimo_uso REAL NOT NULL)"
+        )
+        self._conexao.execute("CREATE INDEX IF NOT EXISTS idx_cache_busca_uso ON cache_busca (ultimo_uso)")
+
+    def ler(self, chave: str, agora: float):
+        with self._lock:
+            linha = self._conexao.execute(
+                "SELECT valor, expira_em FROM cache_busca WHERE chave = ?", (chave,)
+            ).fetchone()
+            if linha is None:
+                return None, False
+            valor, expira_em = linha
+            if expira_em <= agora:
+                self._conexao.execute("DELETE FROM cache_busca WHERE chave = ?", (chave,))
+                return None, True
+            self._conexao.execute("UPDATE cache_busca SET ultimo_uso = ? WHERE chave = ?", (agora, chave))
+            return json.loads(valor), False
+
+    def gravar(self, chave: str, valor: Any, expira_em: float, agora: float) -> int:
+        with self._lock:
+            self._conexao.execute(
+                "INSERT OR REPLACE INTO cache_busca (chave, valor, expira_em, ultimo_uso) VALUES (?, ?, ?, ?)",
+                (chave, json.dumps(valor, ensure_ascii=False), expira_em, agora),
+            )
+            excesso = self._conexao.execute("SELECT COUNT(*) FROM cache_busca").fetchone()[0] - self.tamanho_maximo
+            if excesso <= 0:
+                return 0
+            self._conexao.execute(
+                "DELETE FROM cache_busca WHERE chave IN (SELECT chave FROM cache_busca ORDER BY ultimo_uso LIMIT ?)",
+                (excesso,),
+            )
+            return excesso
+
+    def apagar_expirados(self, agora: float) -> int:
+        with self._lock:
+            return self._conexao.execute("DELETE FROM cache_busca WHERE expira_em <= ?", (agora,)).rowcount
+
+    def __len__(self):
+        with self._lock:
+            return self._conexao.execute("SELECT COUNT(*) FROM cache_busca").fetchone()[0]
+
+
+class BackendRedis:
+    """
+    Servidor compatível com Redis (Redis, Valkey, KeyDB...). A validade usa o TTL do próprio servidor
+    e a ordem de uso fica num sorted set, para remover os menos usados quando passar do tamanho máximo.
+    """
+
+    PREFIXO = "ozy:cache_busca:"
+
+    def __init__(self, url: str, tamanho_maximo: int):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("O cache em Redis precisa do pacote 'redis' (pip install redis).") from e
+        self.tamanho_maximo = tamanho_maximo
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._uso = self.PREFIXO + "uso" # sorted set: chave -> último uso
+
+    def ler(self, chave: str, agora: float):
+        valor = self._redis.get(self.PREFIXO + chave)
+        if valor is None:
+            # Se a chave ainda está no sorted set, ela existia e expirou pelo TTL do servidor
+            expirou = self._redis.zrem(self._uso, chave) > 0
+            return None, expirou
+        self._redis.zadd(self._uso, {chave: agora})
+        return json.loads(valor), False
+
+    def gravar(self, chave: str, valor: Any, expira_em: float, agora: float) -> int:
+        ttl = max(1, int(expira_em - agora))
+        pipe = self._redis.pipeline()
+        pipe.set(self.PREFIXO + chave, json.dumps(valor, ensure_ascii=False), ex=ttl)
+        pipe.zadd(self._uso, {chave: agora})
+        pipe.zcard(self._uso)
+        excesso = pipe.execute()[-1] - self.tamanho_maximo
+        if excesso <= 0:
+            return 0
+        antigas = [chave_antiga for chave_antiga, _ in self._redis.zpopmin(self._uso, excesso)]
+        if antigas:
+            self._redis.delete(*[self.PREFIXO + chave_antiga for chave_antiga in antigas])
+        return len(antigas)
+
+    def apagar_expirados(self, agora: float) -> int:
+        # O servidor já apaga os valores sozinho; aqui só limpamos o sorted set de uso
+        expirados = [chave for chave in self._redis.zrange(self._uso, 0, -1) if not self._redis.exists(self.PREFIXO + chave)]
+        if expirados:
+            self._redis.zrem(self._uso, *expirados)
+        return len(expirados)
+
+    def __len__(self):
+        return self._redis.zcard(self._uso)
+
+
+# =============================================================================
+# Cache de Busca
+# =============================================================================
+
+class CacheBusca:
+    """Cache de resultados de busca com contadores de acertos, falhas e remoções."""
+
+    def __init__(self, backend, ttl_padrao: float = TTL_PADRAO):
+        self.backend = backend
+        self.ttl_padrao = ttl_padrao
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0 # Entradas que saíram por falta de espaço (LRU)
+        self.expiracoes = 0 # Entradas que saíram porque a validade acabou
+
+    def buscar(self, consulta: str) -> Optional[Any]:
+        """Retorna o resultado guardado para a consulta, ou None se não houver (ou tiver expirado)."""
+        valor, expirou = self.backend.ler(normalizar_consulta(consulta), time.time())
+        with self._lock:
+            if expirou:
+                self.expiracoes += 1
+            if valor is None:
+                self.falhas += 1
+            else:
+                self.acertos += 1
+        return valor
+
+    def guardar(self, consulta: str, valor: Any, ttl: Optional[float] = None):
+        """Guarda o resultado da consulta com a validade informada (ou a padrão)."""
+        chave = normalizar_consulta(consulta)
+        if not chave:
+            return
+        agora = time.time()
+        removidas = self.backend.gravar(chave, valor, agora + (ttl or self.ttl_padrao), agora)
+        with self._lock:
+            self.remocoes += removidas
+
+    def limpar_expirados(self):
+        """Apaga de uma vez todas as entradas vencidas."""
+        expiradas = self.backend.apagar_expirados(time.time())
+        with self._lock:
+            self.expiracoes += expiradas
+
+    def estatisticas(self) -> dict:
+        """Contadores para mostrar na tela ou exportar como métrica."""
+        with self._lock:
+            consultas = self.acertos + self.falhas
+            return {
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "remocoes": self.remocoes,
+                "expiracoes": self.expiracoes,
+                "tamanho": len(self.backend),
+                "taxa_acerto": self.acertos / consultas if consultas else 0.0,
+            }
+
+
+def criar_backend(url: str, tamanho_maximo: int):
+    """Cria o backend a partir do texto de configuração (veja o topo do arquivo)."""
+    if url.startswith("sqlite:///"):
+        return BackendSQLite(url[len("sqlite:///"):], tamanho_maximo)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return BackendRedis(url, tamanho_maximo)
+    if url in ("", "memoria"):
+        return BackendMemoria(tamanho_maximo)
+    raise ValueError(f"Backend de cache desconhecido: {url}")
+
+
+# Cache único do processo, criado na primeira vez que for usado
+_cache_busca = None
+_cache_lock = threading.Lock()
+
+def obter_cache_busca() -> CacheBusca:
+    """Retorna o cache de busca compartilhado por todo o processo, configurado pelas variáveis de ambiente."""
+    global _cache_busca
+    if _cache_busca is None:
+        with _cache_lock:
+            if _cache_busca is None:
+                padrao = "memoria"
+                if compartilhado.ativo():
+                    padrao = compartilhado.REDIS or f"sqlite:///{compartilhado.caminho('cache_busca.sqlite3')}"
+                backend = criar_backend(
+                    os.environ.get("OZY_CACHE_BUSCA", padrao),
+                    int(os.environ.get("OZY_CACHE_BUSCA_MAXIMO", TAMANHO_MAXIMO_PADRAO)),
+                )
+                _cache_busca = CacheBusca(backend, float(os.environ.get("OZY_CACHE_BUSCA_TTL", TTL_PADRAO)))
+                _carregar_faq(_cache_busca)
+    return _cache_busca
+
+
+def _carregar_faq(cache: CacheBusca):
+    """Pesquisas do armazém do FAQ, pela consulta simplificada e pela pergunta (como ozy/pesquisa.py guarda)."""
+    from ozy.faq import obter_armazem_faq # Aqui dentro: ozy.faq usa normalizar_consulta deste módulo
+    armazem = obter_armazem_faq()
+    if armazem is None:
+        return
+    try:
+        for resposta in armazem.respostas():
+            if resposta.contexto:
+                for consulta in {resposta.prompt, resposta.consulta} - {None}:
+                    cache.guardar(consulta, resposta.contexto)
+    except Exception as e:
+        print(f"Não foi possível carregar as pesquisas do FAQ: {e}") # Debug
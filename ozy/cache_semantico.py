@@ -0,0 +1,253 @@
+"""
+Cache semântico de respostas das personas.
+
+Perguntas quase iguais ("como eu pulo no mario?" e "como pular no Mario") recebem a mesma resposta
+sem chamar o modelo. O texto da pergunta, junto com o nome da persona, vira um vetor (embedding)
+e é comparado por similaridade de cosseno com as perguntas já respondidas, guardadas numa matriz NumPy.
+Acima do limiar configurado, a resposta guardada é devolvida.
+
+Só vale para a primeira mensagem de uma conversa e sem imagem: nesses casos o histórico
+não muda a resposta. Quem decide isso é quem chama (o app.py).
+
+As respostas prontas do FAQ (ozy/faq.py, geradas por python -m ozy.lote) são carregadas na partida.
+A mesma pergunta, normalizada, é respondida por elas sem gerar embedding, mesmo com o cache desligado na tela;
+com ele ligado, as perguntas parecidas também, pelos embeddings calculados no lote.
+"""
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import numpy as np
+
+from ozy.cache import normalizar_consulta
+
+# Modelo de embeddings do Gemini
+MODELO_EMBEDDING = "models/text-embedding-004"
+# Similaridade mínima (0 a 1) para considerar duas perguntas iguais
+LIMIAR_PADRAO = 0.93
+# Quantas respostas ficam guardadas; quando enche, as mais antigas são substituídas
+TAMANHO_MAXIMO_PADRAO = 5000
+# De quantas em quantas respostas novas o arquivo em disco é atualizado
+SALVAR_A_CADA = 10
+
+
+def embedding_gemini(texto: str) -> list:
+    """Gera o embedding do texto com a API do Gemini."""
+    from ozy.modelos import obter_genai
+    resposta = obter_genai().embed_content(model=MODELO_EMBEDDING, content=texto, task_type="SEMANTIC_SIMILARITY")
+    return resposta["embedding"]
+
+
+@dataclass
+class ConsultaSemantica:
+    """Resultado de uma consulta. 'resposta' é None quando não houve acerto."""
+    persona: str
+    prompt: str
+    vetor: Optional[np.ndarray] # Reaproveitado ao guardar a resposta, para não gerar o embedding duas vezes
+    resposta: Optional[str] = None
+    similaridade: float = 0.0
+    latencia_economizada: float = 0.0
+    duracao: float = 0.0 # Quanto tempo a consulta (embedding + busca) levou
+    do_faq: bool = False # A resposta veio pronta do FAQ (mesma pergunta, sem embedding)
+
+
+class CacheSemantico:
+    """Índice vetorial simples: uma matriz NumPy com os vetores normalizados e busca top-1 por cosseno."""
+
+    def __init__(self, gerar_embedding: Callable[[str], list] = embedding_gemini, limiar: float = LIMIAR_PADRAO,
+                 tamanho_maximo: int = TAMANHO_MAXIMO_PADRAO, caminho: Optional[str] = None,
+                 modelo_embedding: str = MODELO_EMBEDDING):
+        self.gerar_embedding = gerar_embedding
+        self.modelo_embedding = modelo_embedding # Vetores do FAQ gerados com outro modelo não são comparáveis
+        self.limiar = limiar
+        self.tamanho_maximo = tamanho_maximo
+        self.caminho = caminho # Prefixo dos arquivos em disco (.npy e .json); None = só em memória
+        self._lock = threading.Lock()
+        self._vetores = None # Matriz (tamanho_maximo, dimensão), criada no primeiro embedding
+        self._entradas = [] # Uma por linha usada da matriz: persona, prompt, resposta, latência
+        self._personas = np.empty(tamanho_maximo, dtype=object) # Persona de cada linha, para filtrar sem laço
+        self._proxima = 0 # Próxima linha a ser escrita (volta ao início quando enche)
+        self._novas_desde_salvar = 0
+        self._faq = {} # (persona, pergunta normalizada) -> resposta pronta do FAQ e quanto ela custou
+        # Números para o relatório
+        self.consultas = 0
+        self.acertos = 0
+        self.acertos_faq = 0
+        self.latencia_economizada = 0.0
+        self.tempo_consultas = 0.0
+        if caminho and os.path.exists(caminho + ".json"):
+            self.carregar()
+
+    def _vetorizar(self, persona: str, prompt: str) -> np.ndarray:
+        # A persona entra no texto para que a mesma pergunta em personas diferentes fique distante
+        vetor = np.asarray(self.gerar_embedding(f"{persona}\n{prompt}"), dtype=np.float32)
+        norma = np.linalg.norm(vetor)
+        return vetor / norma if norma else vetor
+
+    def tem_faq(self) -> bool:
+        return bool(self._faq)
+
+    def consultar(self, persona: str, prompt: str, limiar: Optional[float] = None, so_faq: bool = False) -> ConsultaSemantica:
+        """
+        Procura uma pergunta parecida já respondida por essa persona. Erros no embedding contam como falha.
+        A mesma pergunta do FAQ é respondida antes, sem embedding; so_faq=True para aí (cache desligado na tela).
+        """
+        inicio = time.perf_counter()
+        pronta = self._faq.get((persona, normalizar_consulta(prompt)))
+        if pronta is not None or so_faq:
+            consulta = ConsultaSemantica(persona, prompt, None)
+            with self._lock:
+                if pronta is not None:
+                    consulta.resposta, consulta.similaridade, consulta.do_faq = pronta["resposta"], 1.0, True
+                    consulta.duracao = time.perf_counter() - inicio
+                    consulta.latencia_economizada = max(0.0, pronta["latencia"] - consulta.duracao)
+                    self.consultas += 1
+                    self.acertos += 1
+                    self.acertos_faq += 1
+                    self.latencia_economizada += consulta.latencia_economizada
+            return consulta
+        try:
+            consulta = ConsultaSemantica(persona, prompt, self._vetorizar(persona, prompt))
+        except Exception as e:
+            print(f"Cache semântico indisponível: {e}") # Debug
+            consulta = ConsultaSemantica(persona, prompt, None)
+
+        with self._lock:
+            if consulta.vetor is not None and self._entradas:
+                usadas = len(self._entradas)
+                similaridades = self._vetores[:usadas] @ consulta.vetor
+                # Só compara com respostas da mesma persona
+                similaridades[self._personas[:usadas] != persona] = -1.0
+                melhor = int(np.argmax(similaridades))
+                consulta.similaridade = float(similaridades[melhor])
+                if consulta.similaridade >= (self.limiar if limiar is None else limiar):
+                    consulta.resposta = self._entradas[melhor]["resposta"]
+                    consulta.latencia_economizada = self._entradas[melhor]["latencia"]
+
+            consulta.duracao = time.perf_counter() - inicio
+            self.consultas += 1
+            self.tempo_consultas += consulta.duracao
+            if consulta.resposta is not None:
+                self.acertos += 1
+                consulta.latencia_economizada = max(0.0, consulta.latencia_economizada - consulta.duracao)
+                self.latencia_economizada += consulta.latencia_economizada
+        return consulta
+
+    def guardar(self, consulta: ConsultaSemantica, resposta: str, latencia: float):
+        """Guarda a resposta gerada pelo modelo para a pergunta consultada (latência = quanto ela custou)."""
+        if consulta.vetor is None:
+            return
+        with self._lock:
+            self._inserir(consulta.vetor, {"persona": consulta.persona, "prompt": consulta.prompt,
+                                           "resposta": resposta, "latencia": latencia})
+            self._novas_desde_salvar += 1
+            precisa_salvar = self.caminho and self._novas_desde_salvar >= SALVAR_A_CADA
+        if precisa_salvar:
+            self.salvar()
+
+    def _inserir(self, vetor: np.ndarray, entrada: dict):
+        """Escreve a entrada na próxima linha da matriz (chamado com o lock)."""
+        if self._vetores is None:
+            self._vetores = np.zeros((self.tamanho_maximo, vetor.shape[0]), dtype=np.float32)
+        self._vetores[self._proxima] = vetor
+        self._personas[self._proxima] = entrada["persona"]
+        if self._proxima < len(self._entradas):
+            self._entradas[self._proxima] = entrada # Matriz cheia: substitui a mais antiga
+        else:
+            self._entradas.append(entrada)
+        self._proxima = (self._proxima + 1) % self.tamanho_maximo
+
+    def carregar_faq(self, respostas: list) -> int:
+        """
+        Carrega as respostas prontas do FAQ (RespostaFAQ, ver ozy/faq.py). As com print ficam de fora.
+        Os embeddings entram na matriz quando foram gerados com o mesmo modelo; retorna quantas respostas entraram.
+        """
+        carregadas = 0
+        with self._lock:
+            ja_na_matriz = {(entrada["persona"], entrada["prompt"]) for entrada in self._entradas}
+            for resposta in respostas:
+                if resposta.imagem_hash or not resposta.resposta:
+                    continue
+                self._faq[(resposta.persona, normalizar_consulta(resposta.prompt))] = {
+                    "resposta": resposta.resposta, "latencia": resposta.duracao}
+                carregadas += 1
+                if (resposta.vetor and resposta.modelo_embedding == self.modelo_embedding
+                        and (resposta.persona, resposta.prompt) not in ja_na_matriz):
+                    vetor = np.frombuffer(resposta.vetor, dtype=np.float32)
+                    if self._vetores is None or self._vetores.shape[1] == vetor.shape[0]:
+                        self._inserir(vetor, {"persona": resposta.persona, "prompt": resposta.prompt,
+                                              "resposta": resposta.resposta, "latencia": resposta.duracao})
+        return carregadas
+
+    def relatorio(self) -> dict:
+        """Taxa de acerto e tempo economizado desde que o processo começou."""
+        with self._lock:
+            return {
+                "consultas": self.consultas,
+                "acertos": self.acertos,
+                "acertos_faq": self.acertos_faq,
+                "taxa_acerto": self.acertos / self.consultas if self.consultas else 0.0,
+                "latencia_economizada": self.latencia_economizada,
+                "tempo_medio_consulta": self.tempo_consultas / self.consultas if self.consultas else 0.0,
+                "entradas": len(self._entradas),
+                "respostas_faq": len(self._faq),
+            }
+
+    def salvar(self):
+        """Grava a matriz e as respostas em disco (caminho.npy e caminho.json)."""
+        with self._lock:
+            if not self.caminho or self._vetores is None:
+                return
+            np.save(self.caminho + ".npy", self._vetores[:len(self._entradas)])
+            with open(self.caminho + ".json", "w", encoding="utf-8") as arquivo:
+                json.dump({"proxima": self._proxima, "entradas": self._entradas}, arquivo, ensure_ascii=False)
+            self._novas_desde_salvar = 0
+
+    def carregar(self):
+        """Lê de volta o que foi gravado por salvar()."""
+        with open(self.caminho + ".json", encoding="utf-8") as arquivo:
+            dados = json.load(arquivo)
+        vetores = np.load(self.caminho + ".npy")
+        with self._lock:
+            entradas = dados["entradas"][:self.tamanho_maximo]
+            self._vetores = np.zeros((self.tamanho_maximo, vetores.shape[1]), dtype=np.float32)
+            self._vetores[:len(entradas)] = vetores[:len(entradas)]
+            self._entradas = entradas
+            for i, entrada in enumerate(entradas):
+                self._personas[i] = entrada["persona"]
+            self._proxima = dados["proxima"] % self.tamanho_maximo
+
+
+def _carregar_faq(cache: CacheSemantico):
+    """Respostas prontas do armazém do FAQ (OZY_FAQ_DB), se existir."""
+    from ozy.faq import obter_armazem_faq
+    armazem = obter_armazem_faq()
+    if armazem is None:
+        return
+    try:
+        carregadas = cache.carregar_faq(armazem.respostas())
+        print(f"FAQ: {carregadas} respostas prontas carregadas de {armazem.caminho}") # Debug
+    except Exception as e:
+        print(f"Não foi possível carregar as respostas do FAQ: {e}") # Debug
+
+
+# Cache único do processo
+_cache_semantico = None
+_cache_lock = threading.Lock()
+
+def obter_cache_semantico() -> CacheSemantico:
+    """Retorna o cache semântico do processo. OZY_CACHE_SEMANTICO_ARQUIVO liga a gravação em disco."""
+    global _cache_semantico
+    if _cache_semantico is None:
+        with _cache_lock:
+            if _cache_semantico is None:
+                _cache_semantico = CacheSemantico(
+                    limiar=float(os.environ.get("OZY_CACHE_SEMANTICO_LIMIAR", LIMIAR_PADRAO)),
+                    tamanho_maximo=int(os.environ.get("OZY_CACHE_SEMANTICO_MAXIMO", TAMANHO_MAXIMO_PADRAO)),
+                    caminho=os.environ.get("OZY_CACHE_SEMANTICO_ARQUIVO"),
+                )
+                _carregar_faq(_cache_semantico)
+    return _cache_semantico
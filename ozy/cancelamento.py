@@ -0,0 +1,137 @@
+"""
+Pedidos canceláveis: cada mensagem em andamento tem um id e um sinal de cancelamento.
+
+Antes, uma segunda mensagem, a troca de persona ou o "Limpar Histórico" no meio de uma resposta não paravam
+a anterior: a pesquisa e o send_message seguiam até o fim (tokens gastos à toa) e a resposta velha ainda
+entrava no histórico. Agora o motor (ozy/motor.py) cria um Pedido por mensagem e:
+
+- uma nova mensagem na mesma sessão cancela o pedido anterior; trocar de persona e limpar o histórico também;
+- chamadas que ainda esperam a vez no agendador desistem sem chegar à API, a pesquisa em andamento
+  é cancelada no meio (a tarefa do asyncio da chamada ao agente) e o stream da resposta é fechado;
+- o que chegar depois do cancelamento (resultado da pesquisa, resposta sem stream, complemento) é descartado.
+
+Os números (pedidos cancelados, chamadas evitadas, resultados descartados e uma estimativa
+dos tokens economizados) vão para a tela pelas estatísticas do motor.
+"""
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Por que o pedido foi cancelado
+MOTIVO_NOVA_MENSAGEM = "nova_mensagem"
+MOTIVO_PERSONA = "persona"
+MOTIVO_LIMPAR = "limpar"
+MOTIVO_INTERROMPIDO = "interrompido" # Quem consumia os eventos parou no meio (script do Streamlit interrompido)
+MOTIVO_CLIENTE = "cliente" # Pedido de cancelamento pela API ou cliente HTTP desconectado
+
+TEXTOS_MOTIVOS = {
+    MOTIVO_NOVA_MENSAGEM: "uma nova mensagem foi enviada",
+    MOTIVO_PERSONA: "a persona foi trocada",
+    MOTIVO_LIMPAR: "o histórico foi limpo",
+    MOTIVO_INTERROMPIDO: "a tela parou de acompanhar a resposta",
+    MOTIVO_CLIENTE: "cancelada pelo cliente",
+}
+
+# Tokens de uma resposta, até existirem respostas medidas (estimativa dos tokens que um cancelamento economiza)
+TOKENS_RESPOSTA_PADRAO = 300
+# De quanto em quanto tempo quem espera (agendador, pesquisa) confere se o pedido foi cancelado (segundos)
+INTERVALO_VERIFICACAO = 0.05
+
+
+class PedidoCancelado(Exception):
+    """A chamada desistiu de esperar a vez porque o pedido foi cancelado (ela não chegou à API)."""
+
+
+@dataclass
+class Pedido:
+    """Uma mensagem em andamento: id, sinal de cancelamento e o que o cancelamento economizou."""
+    persona: str
+    sinal: threading.Event = field(default_factory=threading.Event)
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    motivo: Optional[str] = None
+    concluido: bool = False # O turno já terminou: cancelar não tem mais efeito
+    cancelado_no_fim: bool = False # Se o sinal estava marcado quando o turno terminou
+    inicio: float = field(default_factory=time.monotonic)
+    # O que o cancelamento economizou ou jogou fora
+    chamadas_evitadas: int = 0
+    resultados_descartados: int = 0
+    pesquisas_canceladas: int = 0
+    tokens_economizados: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def cancelado(self) -> bool:
+        return self.sinal.is_set()
+
+    def cancelar(self, motivo: str) -> bool:
+        """Marca o pedido como cancelado. False se ele já tinha terminado ou sido cancelado antes."""
+        with self._lock:
+            if self.concluido or self.sinal.is_set():
+                return False
+            self.motivo = motivo
+            self.sinal.set()
+            return True
+
+    def concluir(self):
+        with self._lock:
+            if not self.concluido:
+                self.concluido = True
+                self.cancelado_no_fim = self.sinal.is_set()
+
+    def foi_cancelado(self) -> bool:
+        """Cancelado enquanto rodava (o sinal marcado depois do fim do turno, como a API faz ao fechar o stream, não conta)."""
+        with self._lock:
+            return self.cancelado_no_fim if self.concluido else self.sinal.is_set()
+
+    def texto_motivo(self) -> str:
+        return TEXTOS_MOTIVOS.get(self.motivo or MOTIVO_CLIENTE, self.motivo)
+
+
+class Cancelamentos:
+    """Números dos pedidos cancelados de um motor."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pedidos = 0
+        self.por_motivo = {}
+        self.chamadas_evitadas = 0 # Chamadas à persona que não chegaram a sair
+        self.resultados_descartados = 0 # Respostas e pesquisas que chegaram depois do cancelamento
+        self.pesquisas_canceladas = 0
+        self.tokens_economizados = 0 # Estimativa
+        self._tokens_respostas = deque(maxlen=200) # Tokens de saída das últimas respostas completas
+
+    def registrar_resposta(self, tokens_saida: int):
+        with self._lock:
+            self._tokens_respostas.append(tokens_saida)
+
+    def media_saida(self) -> int:
+        """Tokens de uma resposta típica: o que uma resposta que não foi gerada teria custado."""
+        with self._lock:
+            if not self._tokens_respostas:
+                return TOKENS_RESPOSTA_PADRAO
+            return sum(self._tokens_respostas) // len(self._tokens_respostas)
+
+    def registrar(self, pedido: Pedido):
+        """Soma os números de um pedido que terminou cancelado."""
+        motivo = pedido.motivo or MOTIVO_CLIENTE
+        with self._lock:
+            self.pedidos += 1
+            self.por_motivo[motivo] = self.por_motivo.get(motivo, 0) + 1
+            self.chamadas_evitadas += pedido.chamadas_evitadas
+            self.resultados_descartados += pedido.resultados_descartados
+            self.pesquisas_canceladas += pedido.pesquisas_canceladas
+            self.tokens_economizados += pedido.tokens_economizados
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                "pedidos": self.pedidos,
+                "por_motivo": dict(self.por_motivo),
+                "chamadas_evitadas": self.chamadas_evitadas,
+                "resultados_descartados": self.resultados_descartados,
+                "pesquisas_canceladas": self.pesquisas_canceladas,
+                "tokens_economizados": self.tokens_economizados,
+            }
@@ -0,0 +1,103 @@
+"""
+Cliente HTTP do motor (ozy/api.py), com a mesma interface do MotorOzy.
+
+O app.py usa este cliente quando OZY_MOTOR_URL está definida: a interface do Streamlit
+roda num processo e o motor em outro (ou em vários, atrás de um balanceador).
+"""
+import base64
+import json
+from dataclasses import asdict
+from typing import Iterator, Optional
+
+import httpx
+from httpx_sse import connect_sse
+
+from ozy.cancelamento import MOTIVO_CLIENTE
+from ozy.historico import Mensagem
+
+# Respostas longas podem levar mais que o padrão do httpx entre dois pedaços
+TEMPO_LIMITE = httpx.Timeout(10.0, read=120.0)
+
+
+def _de_base64(valor):
+    return base64.b64decode(valor) if valor else None
+
+
+class ClienteMotorHTTP:
+    """Fala com o motor por HTTP. Os métodos retornam o mesmo que os do MotorOzy."""
+
+    def __init__(self, url_base: str):
+        self.url_base = url_base.rstrip("/")
+        self._http = httpx.Client(base_url=self.url_base, timeout=TEMPO_LIMITE)
+
+    def conversar(self, id_sessao: str, prompt: str, opcoes=None, imagem: Optional[bytes] = None,
+                  cancelado=None) -> Iterator[dict]:
+        dados = {"prompt": prompt}
+        if opcoes is not None:
+            dados.update({chave: str(valor).lower() if isinstance(valor, bool) else str(valor)
+                          for chave, valor in asdict(opcoes).items()})
+        arquivos = {"imagem": ("imagem", imagem, "application/octet-stream")} if imagem is not None else None
+        # Fechar este gerador fecha a conexão, e o motor do outro lado para o turno e salva o que já chegou
+        with connect_sse(self._http, "POST", f"/sessoes/{id_sessao}/mensagens", data=dados, files=arquivos) as fonte:
+            for evento_sse in fonte.iter_sse():
+                if cancelado is not None and cancelado.is_set():
+                    return
+                evento = json.loads(evento_sse.data)
+                if evento["tipo"] == "imagem":
+                    evento["miniatura"] = _de_base64(evento.get("miniatura"))
+                yield evento
+
+    def mensagens(self, id_sessao: str, persona: str, ultimas: Optional[int] = None,
+                  antes_de: Optional[int] = None, depois_de: Optional[int] = None) -> list:
+        parametros = {"persona": persona, "ultimas": ultimas, "antes_de": antes_de, "depois_de": depois_de}
+        resposta = self._http.get(f"/sessoes/{id_sessao}/mensagens",
+                                  params={chave: valor for chave, valor in parametros.items() if valor is not None})
+        resposta.raise_for_status()
+        mensagens = []
+        for m in resposta.json()["mensagens"]:
+            mensagem = Mensagem(role=m["role"], content=m["content"], persona=m["persona"], imagem_hash=m["imagem_hash"],
+                                miniatura=_de_base64(m["miniatura"]), tempos=m["tempos"])
+            mensagem.seq = m["seq"] # O número da mensagem no motor (a tela pagina por ele)
+            mensagens.append(mensagem)
+        return mensagens
+
+    def cancelar(self, id_sessao: str, motivo: str = MOTIVO_CLIENTE, id_pedido: Optional[str] = None) -> bool:
+        parametros = {"motivo": motivo, "id_pedido": id_pedido}
+        resposta = self._http.post(f"/sessoes/{id_sessao}/cancelar",
+                                   params={chave: valor for chave, valor in parametros.items() if valor is not None})
+        resposta.raise_for_status()
+        return resposta.json()["cancelado"]
+
+    def limpar(self, id_sessao: str, persona: str):
+        self._http.delete(f"/sessoes/{id_sessao}/mensagens", params={"persona": persona}).raise_for_status()
+
+    def estatisticas(self, id_sessao: str, persona: str) -> dict:
+        resposta = self._http.get(f"/sessoes/{id_sessao}/estatisticas", params={"persona": persona})
+        resposta.raise_for_status()
+        return resposta.json()
+
+    def emitir_retomada(self, id_sessao: str) -> Optional[str]:
+        resposta = self._http.post(f"/sessoes/{id_sessao}/retomada")
+        resposta.raise_for_status()
+        return resposta.json()["token"]
+
+    def retomar(self, token: str) -> Optional[str]:
+        resposta = self._http.post("/retomada", data={"token": token})
+        resposta.raise_for_status()
+        return resposta.json()["id_sessao"]
+
+    def preparar_imagem(self, dados: bytes):
+        return None # A imagem é preparada do lado do motor, quando a mensagem chega
+
+    def antecipar(self, id_sessao: str, imagem: bytes):
+        arquivos = {"imagem": ("imagem", imagem, "application/octet-stream")}
+        self._http.post(f"/sessoes/{id_sessao}/antecipacao", files=arquivos).raise_for_status()
+
+
+# Um cliente por endereço (a conexão HTTP é reaproveitada entre as execuções do script)
+_clientes = {}
+
+def obter_cliente(url_base: str) -> ClienteMotorHTTP:
+    if url_base not in _clientes:
+        _clientes[url_base] = ClienteMotorHTTP(url_base)
+    return _clientes[url_base]
@@ -0,0 +1,47 @@
+"""
+Modo com vários processos: o estado que precisa valer para todos os workers fica num lugar compartilhado.
+
+Sem este modo, cada processo guarda tudo na própria memória e o app não passa de um núcleo
+(nem de uma réplica sem afinidade de sessão). Com OZY_ESTADO_COMPARTILHADO apontando para uma pasta
+no disco local, vários workers do Streamlit ou da API (ozy/api.py) atendem os usuários atrás de um proxy:
+
+- conversas (ozy/conversas.py): <pasta>/conversas.sqlite3; o worker que recebe a mensagem recarrega
+  a conversa se outro worker escreveu nela depois (ver HistoricoSessao.sincronizar);
+- cache de busca (ozy/cache.py): <pasta>/cache_busca.sqlite3, ou o servidor de OZY_ESTADO_REDIS;
+- limite de pedidos por minuto da API (ozy/agendador.py): um balde só para todos os processos,
+  em <pasta>/agendador.sqlite3 ou no Redis;
+- sessões do ADK dos agentes do Pesquisador (ozy/agentes.py): <pasta>/adk_sessoes.sqlite3;
+- imagens originais (ArmazemBlobs): <pasta>/blobs.
+
+Os SQLite usam WAL (leituras não esperam escritas) e esperam o lock de escrita de outro processo em vez de falhar.
+Cada variável específica (OZY_CONVERSAS_DB, OZY_CACHE_BUSCA, OZY_BLOBS_DIR) continua valendo se existir.
+O que continua por processo: o número de chamadas simultâneas à API, os chats do Gemini já abertos
+(são recriados a partir das conversas), o cache semântico, a pesquisa antecipada e os números da telemetria.
+"""
+import os
+import sqlite3
+
+# Pasta do estado compartilhado (vazio: cada processo guarda o próprio estado, como antes)
+PASTA = os.environ.get("OZY_ESTADO_COMPARTILHADO", "")
+# Servidor compatível com Redis para o cache de busca e o limite da API (opcional; precisa do pacote 'redis')
+REDIS = os.environ.get("OZY_ESTADO_REDIS", "")
+# Quanto uma escrita espera o lock de outro processo no SQLite (segundos)
+ESPERA_LOCK = 10.0
+
+
+def ativo() -> bool:
+    return bool(PASTA)
+
+
+def caminho(nome: str) -> str:
+    """Arquivo dentro da pasta compartilhada (a pasta é criada se não existir)."""
+    os.makedirs(PASTA, exist_ok=True)
+    return os.path.join(PASTA, nome)
+
+
+def conectar_sqlite(caminho_arquivo: str, **opcoes) -> sqlite3.Connection:
+    """Conexão a um SQLite que vários processos usam: WAL, sem fsync a cada commit e espera pelo lock."""
+    conexao = sqlite3.connect(caminho_arquivo, check_same_thread=False, timeout=ESPERA_LOCK, **opcoes)
+    conexao.execute("PRAGMA journal_mode=WAL")
+    conexao.execute("PRAGMA synchronous=NORMAL")
+    return conexao
@@ -0,0 +1,192 @@
+"""
+Orçamento de tokens para o histórico das conversas com o Gemini.
+
+Cada send_message reenvia o histórico inteiro do chat_session, então sem controle o custo e a
+latência de entrada crescem a cada turno. O GerenciadorContexto de cada persona:
+1. estima os tokens de cada turno (texto e imagens) e registra a contagem real que a API informa;
+2. quando o histórico passa do orçamento, remove primeiro as imagens e os blocos de pesquisa dos turnos antigos;
+3. se ainda não couber, junta os turnos antigos num resumo feito por um modelo barato
+   e recria o histórico com o resumo + os turnos mais recentes.
+Com a fila da API cheia, enxugar() manda só os turnos recentes, sem resumo.
+Tudo fica registrado num rastro por turno (tokens, latência, o que foi economizado).
+"""
+import io
+import math
+import os
+
+from PIL import Image
+
+# Tokens que o histórico de uma persona pode ter antes de ser compactado
+ORCAMENTO_PADRAO = int(os.environ.get("OZY_ORCAMENTO_TOKENS", 8000))
+# Quantos turnos (pergunta + resposta) recentes nunca são resumidos nem perdem imagens
+TURNOS_RECENTES = 3
+# Modelo barato usado para fazer o resumo da conversa
+MODELO_RESUMO = "gemini-2.0-flash-lite"
+# Aproximação de caracteres por token para português
+CARACTERES_POR_TOKEN = 4
+# O Gemini cobra 258 tokens por imagem pequena ou por bloco de 768x768 de uma imagem grande
+TOKENS_POR_BLOCO_IMAGEM = 258
+# Quantos turnos o rastro guarda
+TAMANHO_RASTRO = 50
+
+MARCADOR_CONTEXTO_PESQUISA = "--- Contexto de Pesquisa do Google ---"
+TEXTO_IMAGEM_OMITIDA = "[imagem enviada anteriormente, omitida para economizar contexto]"
+TEXTO_PESQUISA_OMITIDA = "[contexto de pesquisa usado neste turno, omitido para economizar contexto]"
+PREFIXO_RESUMO = "Resumo da nossa conversa até aqui (use como memória):\n"
+CONFIRMACAO_RESUMO = "Entendido, vou levar esse resumo em conta."
+
+INSTRUCAO_RESUMO = (
+    "Resuma a conversa abaixo entre um usuário e um assistente de games em no máximo 200 palavras, em português. "
+    "Mantenha os jogos citados, o que o usuário quer, o que já foi explicado e qualquer detalhe que possa ser "
+    "necessário para continuar a conversa. Escreva apenas o resumo.\n\n"
+)
+
+
+def tokens_imagem(dados: bytes) -> int:
+    """Tokens de uma imagem, calculados pelo tamanho dela (só o cabeçalho do arquivo é lido)."""
+    try:
+        with Image.open(io.BytesIO(dados)) as imagem:
+            largura, altura = imagem.size
+    except Exception:
+        return TOKENS_POR_BLOCO_IMAGEM * 4 # Não deu para ler: supõe uma imagem grande
+    if largura <= 384 and altura <= 384:
+        return TOKENS_POR_BLOCO_IMAGEM
+    return TOKENS_POR_BLOCO_IMAGEM * math.ceil(largura / 768) * math.ceil(altura / 768)
+
+
+def tokens_conteudo(conteudo) -> int:
+    """Estimativa local dos tokens de um protos.Content do histórico (sem chamar a API)."""
+    total = 0
+    for parte in conteudo.parts:
+        if "inline_data" in parte:
+            total += tokens_imagem(parte.inline_data.data)
+        elif "text" in parte:
+            total += max(1, len(parte.text) // CARACTERES_POR_TOKEN)
+    return total
+
+
+def _eh_resumo(conteudo) -> bool:
+    return bool(conteudo.parts) and "text" in conteudo.parts[0] and conteudo.parts[0].text.startswith(PREFIXO_RESUMO)
+
+
+def _texto_do_turno(conteudo) -> str:
+    """Só o texto de um turno, sem imagens nem contexto de pesquisa (para o resumo)."""
+    textos = []
+    for parte in conteudo.parts:
+        if "text" in parte and MARCADOR_CONTEXTO_PESQUISA not in parte.text:
+            textos.append(parte.text)
+    return " ".join(textos).strip()
+
+
+def resumir_com_gemini(texto: str) -> str:
+    """Pede o resumo ao modelo barato."""
+    from ozy.modelos import obter_genai
+    resposta = obter_genai().GenerativeModel(MODELO_RESUMO).generate_content(INSTRUCAO_RESUMO + texto)
+    return resposta.text.strip()
+
+
+class GerenciadorContexto:
+    """Mantém o histórico de um chat_session dentro do orçamento de tokens de uma persona."""
+
+    def __init__(self, orcamento: int = ORCAMENTO_PADRAO, turnos_recentes: int = TURNOS_RECENTES, resumir=resumir_com_gemini):
+        self.orcamento = orcamento
+        self.turnos_recentes = turnos_recentes
+        self.resumir = resumir
+        self.rastro = [] # Um registro por turno
+        self.ultimo_resumo = None # (resumo, conteúdos mantidos depois dele) do último ajustar(), para o armazém de conversas
+
+    def tokens_historico(self, historico) -> int:
+        """Estimativa dos tokens de um histórico inteiro."""
+        return sum(tokens_conteudo(c) for c in historico)
+
+    def registrar_turno(self, tempos, tokens_historico_antes: int):
+        """Guarda no rastro os números de um turno (a contagem real vem do usage_metadata da resposta)."""
+        tempos = tempos or {}
+        self.rastro.append({
+            "turno": len(self.rastro) + 1,
+            "tokens_entrada": tempos.get("tokens_entrada"),
+            "tokens_saida": tempos.get("tokens_saida"),
+            "historico_estimado": tokens_historico_antes,
+            "latencia_s": round(tempos["total"], 2) if tempos.get("total") is not None else None,
+            "primeiro_token_s": round(tempos["primeiro_token"], 2) if tempos.get("primeiro_token") is not None else None,
+            "tokens_economizados": 0,
+            "acao": "",
+        })
+        del self.rastro[:-TAMANHO_RASTRO]
+
+    def ajustar(self, chat_session) -> int:
+        """
+        Compacta o histórico do chat_session se ele passou do orçamento.
+        Retorna quantos tokens (estimados) deixam de ser reenviados a cada mensagem.
+        """
+        historico = list(chat_session.history)
+        antes = self.tokens_historico(historico)
+        if antes <= self.orcamento:
+            return 0
+
+        limite_antigos = max(0, len(historico) - 2 * self.turnos_recentes)
+        acoes = []
+
+        # 1. Imagens e contexto de pesquisa saem primeiro dos turnos antigos
+        removidos = 0
+        for i in range(limite_antigos):
+            for parte in historico[i].parts:
+                if "inline_data" in parte:
+                    parte.text = TEXTO_IMAGEM_OMITIDA # Trocar o campo do oneof apaga a imagem
+                    removidos += 1
+                elif "text" in parte and MARCADOR_CONTEXTO_PESQUISA in parte.text:
+                    parte.text = TEXTO_PESQUISA_OMITIDA
+                    removidos += 1
+        if removidos:
+            acoes.append(f"{removidos} imagens/pesquisas omitidas")
+
+        # 2. Ainda grande demais: turnos antigos viram um resumo
+        if self.tokens_historico(historico) > self.orcamento and limite_antigos > 0:
+            antigos, recentes = historico[:limite_antigos], historico[limite_antigos:]
+            linhas = []
+            for conteudo in antigos:
+                if _eh_resumo(conteudo):
+                    linhas.append("Resumo anterior: " + conteudo.parts[0].text[len(PREFIXO_RESUMO):])
+                elif conteudo.role == "user":
+                    linhas.append("Usuário: " + _texto_do_turno(conteudo))
+                else:
+                    texto = _texto_do_turno(conteudo)
+                    if texto != CONFIRMACAO_RESUMO:
+                        linhas.append("Assistente: " + texto)
+            try:
+                resumo = self.resumir("\n".join(linhas))
+                historico = [
+                    {"role": "user", "parts": [PREFIXO_RESUMO + resumo]},
+                    {"role": "model", "parts": [CONFIRMACAO_RESUMO]},
+                ] + recentes
+                acoes.append(f"{len(antigos)} mensagens resumidas")
+                self.ultimo_resumo = (resumo, len(recentes))
+            except Exception as e:
+                # Sem resumo dessa vez: fica só a economia das imagens
+                print(f"Não foi possível resumir a conversa: {e}") # Debug
+
+        chat_session.history = historico # Recria o histórico do chat (resumo + turnos recentes)
+        economia = max(0, antes - self.tokens_historico(chat_session.history))
+        if self.rastro:
+            self.rastro[-1]["tokens_economizados"] = economia
+            self.rastro[-1]["acao"] = ", ".join(acoes)
+        return economia
+
+
+    def enxugar(self, chat_session) -> int:
+        """
+        Contexto curto (fila da API cheia, ver ozy/cotas.py): deixa no chat_session só os turnos recentes
+        (e o resumo, se já existir um), sem chamar o modelo de resumo. Retorna os tokens (estimados) que saíram.
+        """
+        historico = list(chat_session.history)
+        inicio = max(0, len(historico) - 2 * self.turnos_recentes)
+        if inicio == 0:
+            return 0
+        recentes = historico[inicio:]
+        while recentes and recentes[0].role != "user":
+            recentes = recentes[1:] # O histórico sempre começa com uma mensagem do usuário
+        if inicio >= 2 and _eh_resumo(historico[0]):
+            recentes = historico[:2] + recentes
+        antes = self.tokens_historico(historico)
+        chat_session.history = recentes
+        return max(0, antes - self.tokens_historico(recentes))
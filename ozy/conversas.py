@@ -0,0 +1,241 @@
+"""
+Armazém durável das conversas: um log só de inclusões por usuário e persona.
+
+O histórico na memória (ozy/historico.py) é só uma janela das mensagens recentes. Tudo o que entra
+nele também é gravado aqui, então recarregar a página, reiniciar o servidor ou cair em outra réplica
+não perde a conversa: a janela é recarregada do log e as páginas mais antigas são lidas sob demanda.
+
+As linhas nunca são alteradas. O log tem dois tipos de linha:
+- 'mensagem': uma mensagem do chat (texto, miniatura, tempos, hash da imagem original no ArmazemBlobs);
+- 'resumo': o resumo que o GerenciadorContexto fez dos turnos antigos, até a mensagem 'ate_id'.
+Limpar a conversa apaga as linhas dela de verdade, e as linhas mais velhas que a retenção (OZY_CONVERSAS_RETENCAO)
+são apagadas de tempos em tempos. Logs de versões antigas ainda podem ter linhas 'limpeza' (o usuário limpou a
+conversa e só valia o que veio depois): o que ficou antes delas é apagado quando o armazém abre.
+
+O id da sessão é a chave da conversa, então ele nunca vai para a URL: para voltar a uma conversa a tela recebe um
+token de retomada, que vale uma vez só (quem retoma recebe outro) e vence em OZY_RETOMADA_VALIDADE.
+
+O padrão é SQLite (OZY_CONVERSAS_DB, vazio desliga). As colunas e o índice são os de um banco de servidor:
+no Postgres a tabela é a mesma trocando INTEGER PRIMARY KEY AUTOINCREMENT por BIGSERIAL e BLOB por BYTEA.
+"""
+import hashlib
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from ozy import compartilhado
+from ozy.historico import Mensagem
+
+TIPO_MENSAGEM = "mensagem"
+TIPO_RESUMO = "resumo"
+TIPO_LIMPEZA = "limpeza" # Só em logs de versões antigas
+
+# Por quanto tempo (segundos) as linhas do log são guardadas (0: para sempre)
+RETENCAO = float(os.environ.get("OZY_CONVERSAS_RETENCAO", 30 * 24 * 3600))
+# Por quanto tempo (segundos) um token de retomada que não foi usado continua valendo
+VALIDADE_RETOMADA = float(os.environ.get("OZY_RETOMADA_VALIDADE", 30 * 24 * 3600))
+# De quanto em quanto tempo (segundos) as linhas vencidas são apagadas, junto com uma gravação
+INTERVALO_PURGA = 600
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS conversas_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, -- Ordem do log (vira o 'seq' da mensagem)
+    usuario TEXT NOT NULL,
+    persona TEXT NOT NULL, -- Conversa (persona) a que a linha pertence
+    tipo TEXT NOT NULL, -- 'mensagem' ou 'resumo' ('limpeza' nos logs antigos)
+    role TEXT, -- 'user' ou 'assistant'
+    autor TEXT, -- Nome mostrado no balão ('Você' ou a persona)
+    conteudo TEXT,
+    imagem_hash TEXT,
+    miniatura BLOB,
+    tempos TEXT, -- JSON
+    ate_id INTEGER, -- Resumo: última mensagem coberta por ele
+    criada_em REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_conversas_log ON conversas_log (usuario, persona, tipo, id);
+CREATE INDEX IF NOT EXISTS idx_conversas_log_criada ON conversas_log (criada_em);
+CREATE TABLE IF NOT EXISTS conversas_retomada (
+    token_hash TEXT PRIMARY KEY, -- sha256 do token (o token só existe na URL de quem o recebeu)
+    usuario TEXT NOT NULL,
+    criada_em REAL NOT NULL
+);
+"""
+
+_COLUNAS_MENSAGEM = "id, role, autor, conteudo, imagem_hash, miniatura, tempos"
+
+
+def _para_mensagem(linha) -> Mensagem:
+    id_linha, role, autor, conteudo, imagem_hash, miniatura, tempos = linha
+    mensagem = Mensagem(role=role, content=conteudo, persona=autor, imagem_hash=imagem_hash, miniatura=miniatura,
+                        tempos=json.loads(tempos) if tempos else None)
+    mensagem.seq = id_linha # O número da mensagem é a posição dela no log
+    return mensagem
+
+
+def _hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class ArmazemConversas:
+    """
+    Log das conversas em SQLite. Uma conexão por processo, protegida por um lock (as escritas são pequenas).
+    Vários processos podem usar o mesmo arquivo (ver ozy/compartilhado.py).
+    """
+
+    def __init__(self, caminho: str, retencao: float = RETENCAO, validade_retomada: float = VALIDADE_RETOMADA):
+        self.caminho = caminho
+        self.retencao = retencao
+        self.validade_retomada = validade_retomada
+        if caminho != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+        # WAL: leituras não esperam as escritas; NORMAL: sem fsync a cada commit (ainda seguro contra queda do processo)
+        self._conexao = compartilhado.conectar_sqlite(caminho)
+        self._conexao.executescript(ESQUEMA)
+        self._lock = threading.Lock()
+        self._ultima_purga = time.monotonic()
+        self.purgar(limpezas_antigas=True)
+
+    def _executar(self, sql: str, parametros=()):
+        with self._lock:
+            cursor = self._conexao.execute(sql, parametros)
+            self._conexao.commit()
+            return cursor.lastrowid
+
+    def _apagar(self, sql: str, parametros=()) -> int:
+        """Roda um DELETE e retorna quantas linhas saíram."""
+        with self._lock:
+            cursor = self._conexao.execute(sql, parametros)
+            self._conexao.commit()
+            return cursor.rowcount
+
+    def _consultar(self, sql: str, parametros=()) -> list:
+        with self._lock:
+            return self._conexao.execute(sql, parametros).fetchall()
+
+    # --- Escrita -----------------------------------------------------------
+
+    def anexar(self, usuario: str, persona: str, mensagem: Mensagem) -> int:
+        """Grava a mensagem no fim do log e retorna o id dela."""
+        if time.monotonic() - self._ultima_purga > INTERVALO_PURGA:
+            self._ultima_purga = time.monotonic()
+            try:
+                self.purgar()
+            except Exception as e:
+                print(f"Não foi possível apagar as conversas vencidas: {e}") # Debug
+        return self._executar(
+            "INSERT INTO conversas_log (usuario, persona, tipo, role, autor, conteudo, imagem_hash, miniatura, tempos, criada_em) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (usuario, persona, TIPO_MENSAGEM, mensagem.role, mensagem.persona, mensagem.content, mensagem.imagem_hash,
+             mensagem.miniatura, json.dumps(mensagem.tempos) if mensagem.tempos else None, time.time()),
+        )
+
+    def guardar_resumo(self, usuario: str, persona: str, resumo: str, ate_id: int) -> int:
+        """Registra o resumo dos turnos até 'ate_id' (o chat do Gemini é recriado a partir dele)."""
+        return self._executar(
+            "INSERT INTO conversas_log (usuario, persona, tipo, conteudo, ate_id, criada_em) VALUES (?, ?, ?, ?, ?, ?)",
+            (usuario, persona, TIPO_RESUMO, resumo, ate_id, time.time()),
+        )
+
+    def limpar(self, usuario: str, persona: str) -> int:
+        """Apaga a conversa (mensagens e resumos) do banco. Retorna quantas linhas saíram."""
+        return self._apagar("DELETE FROM conversas_log WHERE usuario = ? AND persona = ?", (usuario, persona))
+
+    def purgar(self, limpezas_antigas: bool = False) -> int:
+        """
+        Apaga as linhas mais velhas que a retenção e os tokens de retomada vencidos. Retorna quantas linhas do log saíram.
+        Com 'limpezas_antigas', apaga também as conversas que um log antigo marcou como limpas.
+        """
+        agora = time.time()
+        apagadas = 0
+        if self.retencao > 0:
+            apagadas += self._apagar("DELETE FROM conversas_log WHERE criada_em < ?", (agora - self.retencao,))
+        self._apagar("DELETE FROM conversas_retomada WHERE criada_em < ?", (agora - self.validade_retomada,))
+        if limpezas_antigas:
+            apagadas += self._apagar(
+                "DELETE FROM conversas_log WHERE id <= (SELECT MAX(limpeza.id) FROM conversas_log AS limpeza "
+                "WHERE limpeza.usuario = conversas_log.usuario AND limpeza.persona = conversas_log.persona "
+                "AND limpeza.tipo = ?)",
+                (TIPO_LIMPEZA,),
+            )
+        return apagadas
+
+    # --- Retomada ----------------------------------------------------------
+
+    def emitir_retomada(self, usuario: str) -> str:
+        """Token novo para voltar às conversas do usuário numa próxima visita (vale uma vez, ver retomar)."""
+        token = secrets.token_urlsafe(24)
+        self._executar("INSERT INTO conversas_retomada (token_hash, usuario, criada_em) VALUES (?, ?, ?)",
+                       (_hash_token(token), usuario, time.time()))
+        return token
+
+    def retomar(self, token: str) -> Optional[str]:
+        """Usuário do token, ou None se ele não existe ou venceu. O token é gasto: quem retoma pede outro."""
+        with self._lock:
+            linha = self._conexao.execute("SELECT usuario, criada_em FROM conversas_retomada WHERE token_hash = ?",
+                                          (_hash_token(token),)).fetchone()
+            self._conexao.execute("DELETE FROM conversas_retomada WHERE token_hash = ?", (_hash_token(token),))
+            self._conexao.commit()
+        if linha is None or linha[1] < time.time() - self.validade_retomada:
+            return None
+        return linha[0]
+
+    # --- Leitura -----------------------------------------------------------
+
+    def pagina(self, usuario: str, persona: str, ultimas: Optional[int] = None,
+               antes_de: Optional[int] = None, depois_de: Optional[int] = None) -> list:
+        """Mensagens da conversa, da mais antiga para a mais nova (mesmos filtros de MotorOzy.mensagens)."""
+        sql = (f"SELECT {_COLUNAS_MENSAGEM} FROM conversas_log "
+               "WHERE usuario = ? AND persona = ? AND tipo = ? AND id > ?")
+        parametros = [usuario, persona, TIPO_MENSAGEM, depois_de or 0]
+        if antes_de is not None:
+            sql += " AND id < ?"
+            parametros.append(antes_de)
+        # Do fim para o começo: o índice entrega as últimas sem ler a conversa inteira
+        sql += " ORDER BY id DESC"
+        if ultimas is not None:
+            sql += " LIMIT ?"
+            parametros.append(ultimas)
+        return [_para_mensagem(linha) for linha in reversed(self._consultar(sql, parametros))]
+
+    def ultimo_id(self, usuario: str, persona: str) -> int:
+        """Id da última linha da conversa, de qualquer tipo (0 se não houver): muda quando alguém escreve nela."""
+        return self._consultar(
+            "SELECT MAX(id) FROM conversas_log WHERE usuario = ? AND persona = ?", (usuario, persona)
+        )[0][0] or 0
+
+    def ultimo_resumo(self, usuario: str, persona: str) -> Optional[tuple]:
+        """(resumo, ate_id) do resumo mais recente da conversa atual, ou None."""
+        linhas = self._consultar(
+            "SELECT conteudo, ate_id FROM conversas_log WHERE usuario = ? AND persona = ? AND tipo = ? "
+            "ORDER BY id DESC LIMIT 1",
+            (usuario, persona, TIPO_RESUMO),
+        )
+        return linhas[0] if linhas else None
+
+    def __len__(self):
+        return self._consultar("SELECT COUNT(*) FROM conversas_log WHERE tipo = ?", (TIPO_MENSAGEM,))[0][0]
+
+
+_armazem = None
+_armazem_lock = threading.Lock()
+
+def obter_armazem_conversas() -> Optional[ArmazemConversas]:
+    """
+    Armazém do processo. O arquivo vem de OZY_CONVERSAS_DB (padrão: a pasta do estado compartilhado,
+    ou a pasta temporária do sistema); OZY_CONVERSAS_DB vazio desliga a gravação e as conversas ficam só na memória.
+    """
+    global _armazem
+    padrao = (compartilhado.caminho("conversas.sqlite3") if compartilhado.ativo()
+              else os.path.join(tempfile.gettempdir(), "ozy_conversas.sqlite3"))
+    caminho = os.environ.get("OZY_CONVERSAS_DB", padrao)
+    if not caminho:
+        return None
+    if _armazem is None:
+        with _armazem_lock:
+            if _armazem is None:
+                _armazem = ArmazemConversas(caminho)
+    return _armazem
@@ -0,0 +1,270 @@
+"""
+Cotas de uso e controle de admissão das mensagens.
+
+Nada limitava quanto trabalho uma sessão podia pedir: com o Pesquisador ligado, prints grandes e mensagens
+enviadas uma atrás da outra, cada envio começava até três chamadas à API. Agora o motor (ozy/motor.py)
+pede admissão antes de cada mensagem, com cotas por sessão e do processo inteiro (somando todas as sessões):
+
+- mensagens por minuto;
+- gerações ao mesmo tempo (no modo comparar, uma mensagem conta uma geração por persona);
+- bytes de imagem por minuto;
+- pesquisas por minuto: sem cota de pesquisa, a mensagem não é recusada, só segue sem o Pesquisador.
+
+Passar das outras cotas recusa a mensagem com um aviso claro. Quando a fila da API (ozy/agendador.py)
+está cheia, a mensagem é degradada em vez de esperar, em níveis, pela ocupação da fila
+((esperando + em andamento) / vagas):
+1. sem pesquisa (economiza o roteador e as chamadas do Pesquisador);
+2. contexto curto: só os turnos recentes da conversa vão junto com a mensagem;
+3. recusada, com "tente de novo em alguns segundos".
+
+Recusas e degradações viram contadores em /metrics (ozy_mensagens_recusadas_total e ozy_mensagens_degradadas_total).
+As cotas do processo não são somadas entre processos (como as vagas do agendador). Uma cota em 0 fica desligada.
+"""
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+from ozy import telemetria
+from ozy.agendador import obter_agendador
+
+# Janela das cotas "por minuto" (segundos)
+JANELA = 60.0
+
+# Cotas de cada sessão
+SESSAO_MENSAGENS = int(os.environ.get("OZY_COTA_SESSAO_MENSAGENS", 12))
+SESSAO_GERACOES = int(os.environ.get("OZY_COTA_SESSAO_GERACOES", 2))
+SESSAO_IMAGEM_BYTES = int(os.environ.get("OZY_COTA_SESSAO_IMAGEM_BYTES", 20 * 1024 * 1024))
+SESSAO_PESQUISAS = int(os.environ.get("OZY_COTA_SESSAO_PESQUISAS", 6))
+# Cotas do processo (todas as sessões juntas)
+GLOBAL_MENSAGENS = int(os.environ.get("OZY_COTA_GLOBAL_MENSAGENS", 600))
+GLOBAL_GERACOES = int(os.environ.get("OZY_COTA_GLOBAL_GERACOES", 64))
+GLOBAL_IMAGEM_BYTES = int(os.environ.get("OZY_COTA_GLOBAL_IMAGEM_BYTES", 500 * 1024 * 1024))
+GLOBAL_PESQUISAS = int(os.environ.get("OZY_COTA_GLOBAL_PESQUISAS", 120))
+
+# Ocupação da fila da API a partir da qual cada nível de degradação começa (0 desliga o nível)
+FILA_SEM_PESQUISA = float(os.environ.get("OZY_COTA_FILA_SEM_PESQUISA", 1.0))
+FILA_CONTEXTO_CURTO = float(os.environ.get("OZY_COTA_FILA_CONTEXTO_CURTO", 2.0))
+FILA_RECUSAR = float(os.environ.get("OZY_COTA_FILA_RECUSAR", 4.0))
+
+# Níveis de degradação
+NIVEL_NORMAL = 0
+NIVEL_SEM_PESQUISA = 1
+NIVEL_CONTEXTO_CURTO = 2
+
+# Por que uma mensagem foi recusada ou degradada (rótulo "motivo" das métricas)
+MOTIVO_FILA = "fila_cheia"
+MOTIVO_MENSAGENS = "mensagens"
+MOTIVO_GERACOES = "geracoes"
+MOTIVO_IMAGENS = "imagens"
+MOTIVO_PESQUISAS = "pesquisas"
+
+# De quem é a cota (rótulo "escopo" das métricas)
+ESCOPO_SESSAO = "sessao"
+ESCOPO_PROCESSO = "processo"
+
+TEXTOS_RECUSA = {
+    MOTIVO_FILA: "Muita gente está conversando com o Ozy agora. Tente de novo em alguns segundos.",
+    MOTIVO_MENSAGENS: "Você enviou muitas mensagens no último minuto. Espere um pouco antes de mandar a próxima.",
+    MOTIVO_GERACOES: "Ainda existem respostas em andamento. Espere elas terminarem antes de mandar outra mensagem.",
+    MOTIVO_IMAGENS: "Você enviou imagens demais (ou grandes demais) no último minuto. Espere um pouco ou mande uma imagem menor.",
+}
+TEXTO_SEM_PESQUISA = "Muita gente usando o Ozy agora: esta resposta vai sem o Pesquisador."
+TEXTO_COTA_PESQUISAS = "O Pesquisador já fez muitas pesquisas no último minuto: esta resposta vai sem ele."
+TEXTO_CONTEXTO_CURTO = "Muita gente usando o Ozy agora: esta resposta leva em conta só as mensagens mais recentes da conversa."
+
+telemetria.descrever_contador("mensagens_recusadas", "Mensagens recusadas pelo controle de admissão.")
+telemetria.descrever_contador("mensagens_degradadas", "Mensagens aceitas com menos trabalho (sem pesquisa, contexto curto).")
+
+
+@dataclass
+class Cotas:
+    """Limites de uma sessão ou do processo (0 desliga o limite)."""
+    mensagens: int # Por minuto
+    geracoes: int # Ao mesmo tempo
+    imagem_bytes: int # Por minuto
+    pesquisas: int # Por minuto
+
+
+COTAS_SESSAO = Cotas(SESSAO_MENSAGENS, SESSAO_GERACOES, SESSAO_IMAGEM_BYTES, SESSAO_PESQUISAS)
+COTAS_GLOBAIS = Cotas(GLOBAL_MENSAGENS, GLOBAL_GERACOES, GLOBAL_IMAGEM_BYTES, GLOBAL_PESQUISAS)
+
+
+@dataclass
+class Uso:
+    """O que uma sessão (ou o processo) gastou: momentos das mensagens e pesquisas, imagens e gerações em andamento."""
+    mensagens: deque = field(default_factory=deque)
+    imagens: deque = field(default_factory=deque) # (momento, bytes)
+    pesquisas: deque = field(default_factory=deque)
+    geracoes: int = 0
+
+    def descartar_antigos(self, agora: float):
+        for fila in (self.mensagens, self.pesquisas):
+            while fila and fila[0] < agora - JANELA:
+                fila.popleft()
+        while self.imagens and self.imagens[0][0] < agora - JANELA:
+            self.imagens.popleft()
+
+    def bytes_imagens(self) -> int:
+        return sum(tamanho for _, tamanho in self.imagens)
+
+
+def _cota_estourada(uso: Uso, cotas: Cotas, geracoes: int, bytes_imagem: int) -> Optional[str]:
+    """Qual cota a mensagem estouraria (None se cabe em todas). A pesquisa é tratada à parte: ela só sai da mensagem."""
+    if cotas.mensagens and len(uso.mensagens) >= cotas.mensagens:
+        return MOTIVO_MENSAGENS
+    if cotas.geracoes and uso.geracoes + geracoes > max(cotas.geracoes, geracoes):
+        return MOTIVO_GERACOES # Uma mensagem sozinha sempre cabe (ex.: comparar com a cota em 1)
+    if bytes_imagem and cotas.imagem_bytes and uso.bytes_imagens() + bytes_imagem > cotas.imagem_bytes:
+        return MOTIVO_IMAGENS
+    return None
+
+
+@dataclass
+class Admissao:
+    """Resposta do controle de admissão para uma mensagem."""
+    id_sessao: str
+    aceita: bool = True
+    nivel: int = NIVEL_NORMAL
+    sem_pesquisa: bool = False
+    motivo: Optional[str] = None # Da recusa ou da degradação
+    avisos: list = field(default_factory=list) # Textos para o usuário
+    geracoes: int = 0 # Gerações reservadas (devolvidas em liberar)
+
+
+class ControleCotas:
+    """Cotas por sessão e do processo, e a degradação pela ocupação da fila da API."""
+
+    def __init__(self, cotas_sessao: Cotas = COTAS_SESSAO, cotas_globais: Cotas = COTAS_GLOBAIS, agendador=None,
+                 fila_sem_pesquisa: float = FILA_SEM_PESQUISA, fila_contexto_curto: float = FILA_CONTEXTO_CURTO,
+                 fila_recusar: float = FILA_RECUSAR):
+        self.cotas_sessao = cotas_sessao
+        self.cotas_globais = cotas_globais
+        self.agendador = agendador or obter_agendador()
+        self.fila_sem_pesquisa = fila_sem_pesquisa
+        self.fila_contexto_curto = fila_contexto_curto
+        self.fila_recusar = fila_recusar
+        self._sessoes = {} # id -> Uso
+        self._global = Uso()
+        self._lock = threading.Lock()
+        # Números para mostrar na tela
+        self.admitidas = 0
+        self.recusadas = {} # motivo -> quantidade
+        self.degradadas = {} # nível -> quantidade
+
+    def ocupacao_fila(self) -> float:
+        """(Chamadas esperando + em andamento) / vagas da fila da API: 1.0 é a fila com todas as vagas ocupadas."""
+        agendador = self.agendador
+        return (agendador.na_fila + agendador.em_andamento) / max(1, agendador.max_concorrencia)
+
+    def admitir(self, id_sessao: str, geracoes: int = 1, bytes_imagem: int = 0, pesquisa: bool = False) -> Admissao:
+        """
+        Decide se a mensagem entra e com quanto trabalho. Aceita, ela reserva uma mensagem, as gerações e os bytes
+        da imagem (as gerações voltam em liberar()). 'pesquisa' diz se o Pesquisador está ligado para ela.
+        """
+        admissao = Admissao(id_sessao)
+        ocupacao = self.ocupacao_fila()
+        if self.fila_recusar and ocupacao >= self.fila_recusar:
+            return self._recusar(admissao, MOTIVO_FILA)
+
+        agora = time.monotonic()
+        with self._lock:
+            sessao = self._sessoes.setdefault(id_sessao, Uso())
+            escopos = ((ESCOPO_SESSAO, sessao, self.cotas_sessao), (ESCOPO_PROCESSO, self._global, self.cotas_globais))
+            recusa = None
+            for escopo, uso, cotas in escopos:
+                uso.descartar_antigos(agora)
+                motivo = _cota_estourada(uso, cotas, geracoes, bytes_imagem)
+                if motivo is not None:
+                    recusa = recusa or (motivo, escopo)
+            sem_cota_de_pesquisa = pesquisa and any(cotas.pesquisas and len(uso.pesquisas) >= cotas.pesquisas
+                                                    for _, uso, cotas in escopos)
+            if recusa is None:
+                for _, uso, _ in escopos:
+                    uso.mensagens.append(agora)
+                    uso.geracoes += geracoes
+                    if bytes_imagem:
+                        uso.imagens.append((agora, bytes_imagem))
+                admissao.geracoes = geracoes
+                self.admitidas += 1
+        if recusa is not None:
+            return self._recusar(admissao, *recusa)
+        if sem_cota_de_pesquisa:
+            self._degradar(admissao, NIVEL_SEM_PESQUISA, MOTIVO_PESQUISAS, TEXTO_COTA_PESQUISAS)
+
+        # Fila cheia: primeiro sai a pesquisa, depois o histórico longo
+        if self.fila_contexto_curto and ocupacao >= self.fila_contexto_curto:
+            if pesquisa:
+                self._degradar(admissao, NIVEL_SEM_PESQUISA, MOTIVO_FILA, TEXTO_SEM_PESQUISA)
+            self._degradar(admissao, NIVEL_CONTEXTO_CURTO, MOTIVO_FILA, TEXTO_CONTEXTO_CURTO)
+        elif self.fila_sem_pesquisa and ocupacao >= self.fila_sem_pesquisa and pesquisa:
+            self._degradar(admissao, NIVEL_SEM_PESQUISA, MOTIVO_FILA, TEXTO_SEM_PESQUISA)
+        return admissao
+
+    def _recusar(self, admissao: Admissao, motivo: str, escopo: str = ESCOPO_PROCESSO) -> Admissao:
+        admissao.aceita = False
+        admissao.motivo = motivo
+        # Cota do processo estourada: para o usuário é o mesmo que o servidor cheio
+        admissao.avisos.append(TEXTOS_RECUSA[motivo if escopo == ESCOPO_SESSAO else MOTIVO_FILA])
+        with self._lock:
+            self.recusadas[motivo] = self.recusadas.get(motivo, 0) + 1
+        telemetria.contar("mensagens_recusadas", motivo=motivo, escopo=escopo)
+        return admissao
+
+    def _degradar(self, admissao: Admissao, nivel: int, motivo: str, texto: str):
+        if nivel == NIVEL_SEM_PESQUISA:
+            if admissao.sem_pesquisa:
+                return
+            admissao.sem_pesquisa = True
+            acao = "sem_pesquisa"
+        else:
+            acao = "contexto_curto"
+        admissao.nivel = max(admissao.nivel, nivel)
+        admissao.motivo = admissao.motivo or motivo
+        admissao.avisos.append(texto)
+        with self._lock:
+            self.degradadas[acao] = self.degradadas.get(acao, 0) + 1
+        telemetria.contar("mensagens_degradadas", acao=acao, motivo=motivo)
+
+    def liberar(self, admissao: Admissao):
+        """A mensagem terminou: as gerações reservadas voltam para a sessão e o processo."""
+        if not admissao.geracoes:
+            return
+        with self._lock:
+            sessao = self._sessoes.get(admissao.id_sessao)
+            for uso in (sessao, self._global):
+                if uso is not None:
+                    uso.geracoes = max(0, uso.geracoes - admissao.geracoes)
+            admissao.geracoes = 0
+
+    def registrar_pesquisa(self, id_sessao: str):
+        """Uma pesquisa do Pesquisador começou (só as que de fato saem contam na cota)."""
+        agora = time.monotonic()
+        with self._lock:
+            for uso in (self._sessoes.setdefault(id_sessao, Uso()), self._global):
+                uso.pesquisas.append(agora)
+
+    def esquecer(self, id_sessao: str):
+        """A sessão saiu da memória do motor (as gerações em andamento dela ainda contam no processo)."""
+        with self._lock:
+            self._sessoes.pop(id_sessao, None)
+
+    def estatisticas(self, id_sessao: Optional[str] = None) -> dict:
+        agora = time.monotonic()
+        with self._lock:
+            numeros = {
+                "admitidas": self.admitidas,
+                "recusadas": dict(self.recusadas),
+                "degradadas": dict(self.degradadas),
+            }
+            sessao = self._sessoes.get(id_sessao) if id_sessao else None
+            if sessao is not None:
+                sessao.descartar_antigos(agora)
+                numeros["sessao"] = {"mensagens": len(sessao.mensagens), "max_mensagens": self.cotas_sessao.mensagens,
+                                     "pesquisas": len(sessao.pesquisas), "max_pesquisas": self.cotas_sessao.pesquisas,
+                                     "imagem_bytes": sessao.bytes_imagens(),
+                                     "max_imagem_bytes": self.cotas_sessao.imagem_bytes}
+        numeros["ocupacao_fila"] = round(self.ocupacao_fila(), 2)
+        return numeros
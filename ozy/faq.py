@@ -0,0 +1,149 @@
+"""
+Armazém das respostas prontas do FAQ (perguntas comuns de cada jogo), geradas em lote por python -m ozy.lote.
+
+Um arquivo SQLite com uma linha por pergunta e persona: a resposta, a pesquisa que entrou no prompt
+(consulta simplificada e resultados da busca) e o embedding da pergunta. Com OZY_FAQ_DB apontando para ele:
+
+- o cache semântico (ozy/cache_semantico.py) carrega as respostas na partida: a mesma pergunta (normalizada)
+  é respondida na hora, sem chamar o modelo nem gerar embedding; com o cache semântico ligado, as parecidas
+  também, pelos embeddings já calculados no lote;
+- o cache de busca (ozy/cache.py) carrega as pesquisas, pela consulta simplificada e pela pergunta.
+
+O armazém também é o checkpoint do lote: cada resposta é gravada assim que fica pronta e uma nova
+execução pula o que já está pronto.
+"""
+import hashlib
+import os
+import threading
+import time
+from dataclasses import dataclass, fields
+from typing import Optional
+
+from ozy import compartilhado
+from ozy.cache import normalizar_consulta
+
+# Arquivo do armazém (vazio: sem respostas prontas)
+CAMINHO = os.environ.get("OZY_FAQ_DB", "")
+
+STATUS_OK = "ok"
+STATUS_ERRO = "erro"
+
+
+def chave_faq(persona: str, prompt: str, imagem_hash: Optional[str] = None) -> str:
+    """Chave de uma pergunta: a mesma pergunta (normalizada), persona e print dão a mesma chave."""
+    texto = f"{persona}\n{normalizar_consulta(prompt)}\n{imagem_hash or ''}"
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()[:32]
+
+
+@dataclass
+class RespostaFAQ:
+    """Uma linha do armazém."""
+    chave: str
+    persona: str
+    prompt: str
+    jogo: Optional[str] = None
+    imagem_hash: Optional[str] = None # Perguntas com print não entram nos caches de resposta (só a pesquisa)
+    resposta: Optional[str] = None
+    consulta: Optional[str] = None # Pergunta simplificada usada na busca
+    contexto: Optional[str] = None # Resultados da busca (lista JSON, ver ozy/resultados_busca.py)
+    vetor: Optional[bytes] = None # Embedding float32 de "persona\nprompt", como o cache semântico gera
+    modelo_embedding: Optional[str] = None
+    tokens_entrada: int = 0
+    tokens_saida: int = 0
+    duracao: float = 0.0 # Segundos que a resposta levou para ser gerada
+    status: str = STATUS_OK
+    erro: Optional[str] = None
+    tentativas: int = 0
+    id_execucao: Optional[str] = None
+    atualizado_em: float = 0.0
+
+
+_COLUNAS = [campo.name for campo in fields(RespostaFAQ)]
+
+
+class ArmazemFAQ:
+    """Respostas do FAQ num SQLite, com índice pela pergunta normalizada de cada persona e pelo jogo."""
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._conexao = compartilhado.conectar_sqlite(caminho, isolation_level=None)
+        self._conexao.executescript("""
+            CREATE TABLE IF NOT EXISTS faq_respostas (
+                chave TEXT PRIMARY KEY, persona TEXT NOT NULL, prompt TEXT NOT NULL, prompt_normalizado TEXT NOT NULL,
+                jogo TEXT, imagem_hash TEXT, resposta TEXT, consulta TEXT, contexto TEXT, vetor BLOB,
+                modelo_embedding TEXT, tokens_entrada INTEGER NOT NULL DEFAULT 0, tokens_saida INTEGER NOT NULL DEFAULT 0,
+                duracao REAL NOT NULL DEFAULT 0, status TEXT NOT NULL, erro TEXT, tentativas INTEGER NOT NULL DEFAULT 0,
+                id_execucao TEXT, atualizado_em REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS idx_faq_pergunta ON faq_respostas (persona, prompt_normalizado);
+            CREATE INDEX IF NOT EXISTS idx_faq_jogo ON faq_respostas (jogo);
+            CREATE INDEX IF NOT EXISTS idx_faq_status ON faq_respostas (status);
+            CREATE TABLE IF NOT EXISTS faq_execucoes (
+                id TEXT PRIMARY KEY, inicio REAL NOT NULL, fim REAL, entrada TEXT, relatorio TEXT);
+        """)
+
+    def prontas(self) -> set:
+        """Chaves das perguntas que já têm resposta (o lote pula essas ao retomar)."""
+        with self._lock:
+            return {linha[0] for linha in self._conexao.execute(
+                "SELECT chave FROM faq_respostas WHERE status = ?", (STATUS_OK,))}
+
+    def gravar(self, registro: RespostaFAQ):
+        """Grava a resposta (ou a falha) de uma pergunta. Uma falha nunca apaga uma resposta que já existia."""
+        registro.atualizado_em = time.time()
+        valores = {coluna: getattr(registro, coluna) for coluna in _COLUNAS if coluna != "tentativas"}
+        valores["prompt_normalizado"] = normalizar_consulta(registro.prompt)
+        colunas = list(valores)
+        atualizar = ", ".join(f"{coluna} = excluded.{coluna}" for coluna in colunas if coluna != "chave")
+        with self._lock:
+            self._conexao.execute(
+                f"INSERT INTO faq_respostas ({', '.join(colunas)}, tentativas) VALUES ({', '.join('?' * len(colunas))}, 1) "
+                f"ON CONFLICT (chave) DO UPDATE SET {atualizar}, tentativas = faq_respostas.tentativas + 1 "
+                f"WHERE excluded.status = '{STATUS_OK}' OR faq_respostas.status != '{STATUS_OK}'",
+                [valores[coluna] for coluna in colunas],
+            )
+
+    def respostas(self, jogo: Optional[str] = None):
+        """Respostas prontas (opcionalmente só de um jogo), da mais antiga para a mais nova."""
+        sql = f"SELECT {', '.join(_COLUNAS)} FROM faq_respostas WHERE status = ?"
+        parametros = [STATUS_OK]
+        if jogo is not None:
+            sql += " AND jogo = ?"
+            parametros.append(jogo)
+        with self._lock:
+            linhas = self._conexao.execute(sql + " ORDER BY atualizado_em", parametros).fetchall()
+        return [RespostaFAQ(**dict(zip(_COLUNAS, linha))) for linha in linhas]
+
+    def iniciar_execucao(self, id_execucao: str, entrada: str):
+        with self._lock:
+            self._conexao.execute("INSERT INTO faq_execucoes (id, inicio, entrada) VALUES (?, ?, ?)",
+                                  (id_execucao, time.time(), entrada))
+
+    def encerrar_execucao(self, id_execucao: str, relatorio: str):
+        with self._lock:
+            self._conexao.execute("UPDATE faq_execucoes SET fim = ?, relatorio = ? WHERE id = ?",
+                                  (time.time(), relatorio, id_execucao))
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            por_status = dict(self._conexao.execute("SELECT status, COUNT(*) FROM faq_respostas GROUP BY status").fetchall())
+            jogos = self._conexao.execute(
+                "SELECT COUNT(DISTINCT jogo) FROM faq_respostas WHERE status = ?", (STATUS_OK,)).fetchone()[0]
+        return {"respostas": por_status.get(STATUS_OK, 0), "falhas": por_status.get(STATUS_ERRO, 0), "jogos": jogos}
+
+    def fechar(self):
+        with self._lock:
+            self._conexao.close()
+
+
+# Armazém único do processo (None quando OZY_FAQ_DB não está definido)
+_armazem = None
+_armazem_lock = threading.Lock()
+
+def obter_armazem_faq() -> Optional[ArmazemFAQ]:
+    global _armazem
+    if _armazem is None and CAMINHO:
+        with _armazem_lock:
+            if _armazem is None:
+                _armazem = ArmazemFAQ(CAMINHO)
+    return _armazem
@@ -0,0 +1,263 @@
+"""
+Servidor falso da API REST do Gemini, para testar o app sem chave e sem gastar tokens.
+
+Responde às rotas que o Ozy usa (generateContent, streamGenerateContent, embedContent e cachedContents)
+com textos fixos e uma contagem de tokens aproximada, incluindo cachedContentTokenCount quando
+a requisição usa um cache de contexto. Serve para conferir a ligação do cache de contexto
+(criação, uso, renovação do TTL e expiração) e para medir o app sem depender da rede.
+
+Uso:
+    python -m ozy.gemini_falso --porta 8765
+    OZY_GEMINI_ENDPOINT=http://localhost:8765 streamlit run app.py
+"""
+import argparse
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESPOSTA_PADRAO = (
+    "Esta é uma resposta do servidor falso do Gemini. Ela existe só para testar o caminho completo "
+    "do app: envio da mensagem, stream dos pedaços, contagem de tokens e cache de contexto."
+)
+# Mínimo de tokens que a API exige para criar um cache de contexto
+MINIMO_TOKENS_CACHE = 1024
+DIMENSAO_EMBEDDING = 64
+
+
+def _tokens(texto: str) -> int:
+    return math.ceil(len(texto) / 4)
+
+
+def _texto_das_partes(conteudos) -> str:
+    if isinstance(conteudos, dict):
+        conteudos = [conteudos]
+    textos = []
+    for conteudo in conteudos or []:
+        for parte in conteudo.get("parts", []):
+            textos.append(parte.get("text", ""))
+            if "inlineData" in parte:
+                textos.append("x" * 258 * 4) # Uma imagem conta como 258 tokens
+    return "".join(textos)
+
+
+def _horario(segundos_a_partir_de_agora: float = 0) -> str:
+    momento = datetime.now(timezone.utc) + timedelta(seconds=segundos_a_partir_de_agora)
+    return momento.isoformat().replace("+00:00", "Z")
+
+
+class EstadoFalso:
+    """O que o servidor lembra entre as requisições: caches de contexto e contadores."""
+
+    def __init__(self, atraso_primeiro: float, atraso_pedaco: float, minimo_tokens_cache: int):
+        self.atraso_primeiro = atraso_primeiro
+        self.atraso_pedaco = atraso_pedaco
+        self.minimo_tokens_cache = minimo_tokens_cache
+        self.caches = {} # nome -> {"recurso": dict, "texto": str, "expira": float}
+        self.lock = threading.Lock()
+        self.contadores = {"gerar": 0, "stream": 0, "embedding": 0, "cache_criado": 0, "cache_renovado": 0,
+                           "cache_usado": 0, "tokens_entrada": 0, "tokens_em_cache": 0}
+
+    def contar(self, nome: str, quantidade: int = 1):
+        with self.lock:
+            self.contadores[nome] += quantidade
+
+
+class ManipuladorFalso(BaseHTTPRequestHandler):
+    estado: EstadoFalso = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, formato, *args):
+        pass # Sem log de cada requisição no terminal
+
+    def handle(self):
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            pass # O cliente parou de ler o stream no meio (resposta interrompida)
+
+    # --- Respostas ---------------------------------------------------------
+
+    def _json(self, status: int, corpo):
+        dados = json.dumps(corpo).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _erro(self, status: int, mensagem: str, codigo: str):
+        self._json(status, {"error": {"code": status, "message": mensagem, "status": codigo}})
+
+    def _corpo(self) -> dict:
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(tamanho) or b"{}")
+
+    # --- Rotas -------------------------------------------------------------
+
+    def do_GET(self):
+        if self.path.startswith("/v1beta/cachedContents/"):
+            cache = self._cache_valido(self.path.split("?")[0][len("/v1beta/"):])
+            if cache is None:
+                return self._erro(404, "CachedContent não encontrado", "NOT_FOUND")
+            return self._json(200, cache["recurso"])
+        if self.path.startswith("/contadores"):
+            return self._json(200, self.estado.contadores)
+        self._erro(404, "Rota não existe no servidor falso", "NOT_FOUND")
+
+    def do_POST(self):
+        caminho = self.path.split("?")[0]
+        corpo = self._corpo()
+        if caminho == "/v1beta/cachedContents":
+            return self._criar_cache(corpo)
+        rota = re.match(r"^/v1beta/(models/[^:]+):(\w+)$", caminho)
+        if not rota:
+            return self._erro(404, "Rota não existe no servidor falso", "NOT_FOUND")
+        if rota.group(2) == "generateContent":
+            return self._gerar(corpo, rota.group(1), stream=False)
+        if rota.group(2) == "streamGenerateContent":
+            return self._gerar(corpo, rota.group(1), stream=True)
+        if rota.group(2) == "embedContent":
+            return self._embedding(corpo)
+        self._erro(404, "Método não existe no servidor falso", "NOT_FOUND")
+
+    def do_PATCH(self):
+        nome = self.path.split("?")[0][len("/v1beta/"):]
+        corpo = self._corpo()
+        with self.estado.lock:
+            cache = self._cache_valido(nome)
+            if cache is None:
+                return self._erro(404, "CachedContent expirado ou inexistente", "NOT_FOUND")
+            ttl = float(corpo.get("ttl", "3600s").rstrip("s"))
+            cache["expira"] = time.time() + ttl
+            cache["recurso"]["expireTime"] = _horario(ttl)
+            cache["recurso"]["updateTime"] = _horario()
+            self.estado.contadores["cache_renovado"] += 1
+        self._json(200, cache["recurso"])
+
+    def do_DELETE(self):
+        nome = self.path.split("?")[0][len("/v1beta/"):]
+        with self.estado.lock:
+            self.estado.caches.pop(nome, None)
+        self._json(200, {})
+
+    # --- Implementação -----------------------------------------------------
+
+    def _cache_valido(self, nome: str):
+        cache = self.estado.caches.get(nome)
+        if cache is None or cache["expira"] < time.time():
+            self.estado.caches.pop(nome, None)
+            return None
+        return cache
+
+    def _criar_cache(self, corpo: dict):
+        texto = _texto_das_partes(corpo.get("systemInstruction")) + _texto_das_partes(corpo.get("contents"))
+        tokens = _tokens(texto)
+        if tokens < self.estado.minimo_tokens_cache:
+            return self._erro(
+                400, f"Cached content is too small. total_token_count={tokens}, min_total_token_count="
+                     f"{self.estado.minimo_tokens_cache}", "INVALID_ARGUMENT"
+            )
+        ttl = float(corpo.get("ttl", "3600s").rstrip("s"))
+        nome = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        recurso = {
+            "name": nome, "model": corpo.get("model"), "displayName": corpo.get("displayName", ""),
+            "createTime": _horario(), "updateTime": _horario(), "expireTime": _horario(ttl),
+            "usageMetadata": {"totalTokenCount": tokens},
+        }
+        with self.estado.lock:
+            self.estado.caches[nome] = {"recurso": recurso, "texto": texto, "expira": time.time() + ttl}
+            self.estado.contadores["cache_criado"] += 1
+        self._json(200, recurso)
+
+    def _gerar(self, corpo: dict, modelo: str, stream: bool):
+        tokens_entrada = _tokens(_texto_das_partes(corpo.get("contents")) + _texto_das_partes(corpo.get("systemInstruction")))
+        tokens_cache = 0
+        if corpo.get("cachedContent"):
+            with self.estado.lock:
+                cache = self._cache_valido(corpo["cachedContent"])
+            if cache is None:
+                return self._erro(403, "CachedContent not found (or permission denied)", "PERMISSION_DENIED")
+            tokens_cache = cache["recurso"]["usageMetadata"]["totalTokenCount"]
+            self.estado.contar("cache_usado")
+        self.estado.contar("stream" if stream else "gerar")
+        self.estado.contar("tokens_entrada", tokens_entrada + tokens_cache)
+        self.estado.contar("tokens_em_cache", tokens_cache)
+
+        uso = {
+            "promptTokenCount": tokens_entrada + tokens_cache,
+            "candidatesTokenCount": _tokens(RESPOSTA_PADRAO),
+            "totalTokenCount": tokens_entrada + tokens_cache + _tokens(RESPOSTA_PADRAO),
+        }
+        if tokens_cache:
+            uso["cachedContentTokenCount"] = tokens_cache
+
+        def pedaco(texto, final):
+            item = {"candidates": [{"content": {"role": "model", "parts": [{"text": texto}]}, "index": 0}],
+                    "modelVersion": modelo.split("/", 1)[1]}
+            if final:
+                item["candidates"][0]["finishReason"] = "STOP"
+                item["usageMetadata"] = uso
+            return item
+
+        time.sleep(self.estado.atraso_primeiro)
+        if not stream:
+            return self._json(200, pedaco(RESPOSTA_PADRAO, True))
+
+        # Stream pela API REST: um array JSON escrito aos poucos (chunked)
+        palavras = RESPOSTA_PADRAO.split(" ")
+        grupos = [" ".join(palavras[i:i + 5]) + " " for i in range(0, len(palavras), 5)]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, texto in enumerate(grupos):
+            if i:
+                time.sleep(self.estado.atraso_pedaco)
+            trecho = ("[" if i == 0 else ",\r\n") + json.dumps(pedaco(texto, i == len(grupos) - 1))
+            self._escrever_chunk(trecho.encode("utf-8"))
+        self._escrever_chunk(b"]")
+        self._escrever_chunk(b"")
+
+    def _escrever_chunk(self, dados: bytes):
+        self.wfile.write(f"{len(dados):X}\r\n".encode() + dados + b"\r\n")
+        self.wfile.flush()
+
+    def _embedding(self, corpo: dict):
+        # Vetor determinístico: cada palavra soma 1 numa posição escolhida pelo hash dela
+        self.estado.contar("embedding")
+        vetor = [0.0] * DIMENSAO_EMBEDDING
+        for palavra in _texto_das_partes(corpo.get("content")).lower().split():
+            vetor[int(hashlib.md5(palavra.encode()).hexdigest(), 16) % DIMENSAO_EMBEDDING] += 1.0
+        self._json(200, {"embedding": {"values": vetor}})
+
+
+def iniciar(porta: int = 8765, atraso_primeiro: float = 0.3, atraso_pedaco: float = 0.05,
+            minimo_tokens_cache: int = MINIMO_TOKENS_CACHE) -> ThreadingHTTPServer:
+    """Sobe o servidor numa thread e retorna o objeto (servidor.shutdown() para parar)."""
+    estado = EstadoFalso(atraso_primeiro, atraso_pedaco, minimo_tokens_cache)
+    manipulador = type("Manipulador", (ManipuladorFalso,), {"estado": estado})
+    servidor = ThreadingHTTPServer(("127.0.0.1", porta), manipulador)
+    servidor.estado = estado
+    threading.Thread(target=servidor.serve_forever, daemon=True, name="gemini-falso").start()
+    return servidor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor falso da API do Gemini")
+    parser.add_argument("--porta", type=int, default=8765)
+    parser.add_argument("--atraso-primeiro", type=float, default=0.3, help="Segundos até o primeiro pedaço")
+    parser.add_argument("--atraso-pedaco", type=float, default=0.05, help="Segundos entre os pedaços do stream")
+    parser.add_argument("--minimo-tokens-cache", type=int, default=MINIMO_TOKENS_CACHE)
+    args = parser.parse_args()
+    servidor = iniciar(args.porta, args.atraso_primeiro, args.atraso_pedaco, args.minimo_tokens_cache)
+    print(f"Gemini falso em http://127.0.0.1:{args.porta} (Ctrl+C para parar)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        servidor.shutdown()
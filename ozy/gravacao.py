@@ -0,0 +1,290 @@
+"""
+Gravação dos turnos de produção, para reproduzir o tráfego de verdade offline (ver ozy/reproducao.py).
+
+Com OZY_GRAVACAO_DIR definido, o motor grava cada mensagem num log só de acréscimo (JSONL comprimido com gzip,
+um arquivo por processo: turnos-<data>-<pid>.jsonl.gz). Cada linha é um registro:
+
+- {"tipo": "turno", ...}: sessão (anônima, hash do id), persona, prompt, opções da tela (Pesquisador ligado,
+  modo, comparar...), hash da imagem, decisão do roteador, as pesquisas (pergunta simplificada, resultados
+  da busca, tempos de cada agente) e cada resposta da persona (texto, erro, tempos e tokens), com a duração
+  do turno e o tempo até o primeiro pedaço de texto;
+- {"tipo": "imagem", "hash", "mime_type", "dados"}: a imagem já reduzida (base64), uma vez por arquivo.
+
+O log tem o que os usuários escreveram e enviaram: trate os arquivos como dados de usuário.
+A gravação nunca segura a mensagem: os registros vão para uma fila e uma thread escreve em blocos
+(cada bloco é um membro gzip acrescentado ao fim do arquivo, então um processo que morre no meio perde
+no máximo o último bloco). Fila cheia, o registro é descartado e contado.
+OZY_GRAVACAO_AMOSTRA grava só uma fração das sessões (sempre as mesmas, pelo hash do id).
+"""
+import atexit
+import base64
+import glob
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import asdict
+from typing import Iterator, Optional
+
+from ozy import imagens
+from ozy.telemetria import sessao_anonima
+
+# Pasta dos arquivos de gravação (vazio: não grava)
+PASTA = os.environ.get("OZY_GRAVACAO_DIR", "")
+# Fração das sessões gravadas (0 a 1)
+AMOSTRA = float(os.environ.get("OZY_GRAVACAO_AMOSTRA", 1.0))
+# De quanto em quanto tempo a thread escreve um bloco (segundos)
+INTERVALO_ESCRITA = 5.0
+# Registros esperando a escrita; passou disso, os novos são descartados
+MAX_PENDENTES = 10000
+# Decisões do roteador guardadas até o fim do turno que as pediu
+MAX_DECISOES = 1000
+# Muda quando o formato dos registros muda de um jeito que quem lê precisa saber
+VERSAO_FORMATO = 1
+
+TIPO_TURNO = "turno"
+TIPO_IMAGEM = "imagem"
+
+
+def _dados_pesquisa(prompt: str, modo: str, resultado, antecipado: Optional[str]) -> dict:
+    return {"prompt": prompt, "modo": modo, "consulta": resultado.consulta, "contexto": resultado.contexto,
+            "erro": resultado.erro, "do_cache": resultado.do_cache, "cancelada": resultado.cancelada,
+            "duracoes": {etapa: round(segundos, 4) for etapa, segundos in resultado.duracoes.items()},
+            "duracao_total": round(resultado.duracao_total, 4), "antecipado": bool(antecipado)}
+
+
+class BackendGravado:
+    """Repassa tudo ao backend de verdade e anota, para o gravador, o que a pesquisa e o roteador devolveram."""
+
+    def __init__(self, backend, gravador: "GravadorTurnos"):
+        self._backend = backend
+        self._gravador = gravador
+
+    def __getattr__(self, nome):
+        return getattr(self._backend, nome)
+
+    def pesquisar(self, prompt: str, id_sessao: str, modo: str, **opcoes):
+        resultado = self._backend.pesquisar(prompt, id_sessao, modo, **opcoes)
+        self._gravador.anotar_pesquisa(id_sessao, _dados_pesquisa(prompt, modo, resultado, opcoes.get("antecipado")))
+        return resultado
+
+    def pesquisar_em_segundo_plano(self, prompt: str, id_sessao: str, **opcoes):
+        from ozy.pesquisa import MODO_AGENTE_UNICO
+        futuro = self._backend.pesquisar_em_segundo_plano(prompt, id_sessao, **opcoes)
+
+        def anotar(pronto):
+            if not pronto.cancelled() and pronto.exception() is None:
+                self._gravador.anotar_pesquisa(id_sessao, _dados_pesquisa(prompt, MODO_AGENTE_UNICO, pronto.result(),
+                                                                          opcoes.get("antecipado")))
+        futuro.add_done_callback(anotar)
+        return futuro
+
+    def decidir_pesquisa(self, prompt: str, id_sessao: Optional[str] = None) -> bool:
+        decisao = self._backend.decidir_pesquisa(prompt, id_sessao)
+        if id_sessao is not None:
+            self._gravador.anotar_roteador(id_sessao, prompt, decisao)
+        return decisao
+
+
+class GravadorTurnos:
+    """Monta um registro por mensagem a partir dos eventos do motor e escreve em blocos numa thread."""
+
+    def __init__(self, pasta: str, amostra: float = AMOSTRA, intervalo: float = INTERVALO_ESCRITA):
+        os.makedirs(pasta, exist_ok=True)
+        self.caminho = os.path.join(pasta, f"turnos-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.jsonl.gz")
+        self.amostra = amostra
+        self.intervalo = intervalo
+        self._fila = queue.Queue(maxsize=MAX_PENDENTES)
+        self._pesquisas = {} # id da sessão -> pesquisas do turno em andamento
+        self._decisoes = OrderedDict() # (id da sessão, prompt) -> decisão do roteador
+        self._imagens_gravadas = set() # Hashes das imagens que já estão neste arquivo
+        self._lock = threading.Lock()
+        self._escrita_lock = threading.Lock()
+        self.gravados = 0
+        self.descartados = 0
+        self._thread = threading.Thread(target=self._escrever_periodicamente, daemon=True, name="ozy-gravacao")
+        self._thread.start()
+        atexit.register(self.descarregar)
+
+    def amostrada(self, id_sessao: str) -> bool:
+        if self.amostra >= 1:
+            return True
+        return int(sessao_anonima(id_sessao), 16) % 10000 < self.amostra * 10000
+
+    def envolver(self, backend) -> BackendGravado:
+        return BackendGravado(backend, self)
+
+    # --- Anotações do backend ----------------------------------------------
+
+    def anotar_pesquisa(self, id_sessao: str, dados: dict):
+        if self.amostrada(id_sessao):
+            with self._lock:
+                self._pesquisas.setdefault(id_sessao, []).append(dados)
+
+    def anotar_roteador(self, id_sessao: str, prompt: str, pesquisar: bool):
+        # Pela sessão também: sessões diferentes mandam a mesma pergunta curta ("oi", "e agora?") ao mesmo tempo
+        if not self.amostrada(id_sessao):
+            return
+        with self._lock:
+            self._decisoes[(id_sessao, prompt)] = pesquisar
+            while len(self._decisoes) > MAX_DECISOES:
+                self._decisoes.popitem(last=False)
+
+    # --- Turnos ------------------------------------------------------------
+
+    def gravar_turno(self, eventos: Iterator[dict], id_sessao: str, prompt: str, opcoes,
+                     imagem: Optional[bytes] = None) -> Iterator[dict]:
+        """Repassa os eventos do turno e, quando ele termina (ou quem consome para), grava o registro."""
+        inicio = time.perf_counter()
+        registro = {"tipo": TIPO_TURNO, "versao": VERSAO_FORMATO, "quando": round(time.time(), 3),
+                    "sessao": sessao_anonima(id_sessao), "persona": opcoes.persona, "prompt": prompt,
+                    "opcoes": asdict(opcoes), "imagem_hash": None, "consulta": None, "respostas": [], "avisos": [],
+                    "primeiro_texto": None, "cancelado": None}
+        atual = {"persona": opcoes.persona, "complemento": False} # Resposta que está chegando (fora do modo comparar)
+        try:
+            for evento in eventos:
+                tipo = evento["tipo"]
+                if tipo == "pedido":
+                    registro["id_pedido"] = evento["id"]
+                elif tipo == "imagem":
+                    registro["imagem_hash"] = evento["hash"]
+                elif tipo == "consulta":
+                    registro["consulta"] = evento["texto"]
+                elif tipo == "aviso" and evento["nivel"] in ("aviso", "erro"):
+                    registro["avisos"].append(evento["texto"])
+                elif tipo == "texto" and registro["primeiro_texto"] is None:
+                    registro["primeiro_texto"] = round(time.perf_counter() - inicio, 4)
+                elif tipo == "inicio_resposta":
+                    atual = {"persona": evento["persona"], "complemento": evento["complemento"]}
+                elif tipo == "fim_resposta":
+                    registro["respostas"].append({
+                        "persona": evento.get("persona", atual["persona"]),
+                        "complemento": False if "persona" in evento else atual["complemento"],
+                        "texto": evento["texto"], "erro": evento["erro"], "tempos": evento["tempos"],
+                        "reaproveitada": evento["reaproveitada"],
+                    })
+                elif tipo == "fim_turno":
+                    registro["cancelado"] = evento["cancelado"]
+                yield evento
+        finally:
+            eventos.close()
+            registro["duracao"] = round(time.perf_counter() - inicio, 4)
+            with self._lock:
+                # Só as pesquisas desta pergunta: uma que terminou atrasada, de um turno cancelado, fica de fora
+                registro["pesquisas"] = [dados for dados in self._pesquisas.pop(id_sessao, []) if dados["prompt"] == prompt]
+                registro["roteador"] = self._decisoes.pop((id_sessao, prompt), None)
+            self._enfileirar(registro, imagem)
+
+    def _enfileirar(self, registro: dict, imagem: Optional[bytes]):
+        try:
+            self._fila.put_nowait((registro, imagem))
+        except queue.Full:
+            with self._lock:
+                self.descartados += 1
+
+    # --- Escrita -----------------------------------------------------------
+
+    def _linhas(self, registro: dict, imagem: Optional[bytes]) -> list:
+        linhas = []
+        if imagem is not None and registro["imagem_hash"] is not None: # Sem hash, o motor não chegou a usar a imagem
+            # O preparo já foi feito pelo motor: aqui a imagem reduzida sai do cache. Sem passar pelas threads
+            # das imagens, que já não aceitam trabalho quando a última escrita roda no fim do processo (atexit)
+            preparada = imagens._preparar_com_cache(imagem)
+            if preparada.hash not in self._imagens_gravadas:
+                self._imagens_gravadas.add(preparada.hash)
+                linhas.append({"tipo": TIPO_IMAGEM, "hash": preparada.hash, "mime_type": preparada.mime_type,
+                               "dados": base64.b64encode(preparada.dados).decode("ascii")})
+        linhas.append(registro)
+        return linhas
+
+    def descarregar(self) -> int:
+        """Escreve agora o que está na fila (um bloco gzip). Retorna quantos turnos foram gravados."""
+        with self._escrita_lock:
+            linhas, turnos = [], 0
+            while True:
+                try:
+                    registro, imagem = self._fila.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    linhas += self._linhas(registro, imagem)
+                    turnos += 1
+                except Exception as e:
+                    print(f"Não foi possível gravar o turno: {e}") # Debug
+            if not linhas:
+                return 0
+            texto = "".join(json.dumps(linha, ensure_ascii=False, default=str) + "\n" for linha in linhas)
+            try:
+                with open(self.caminho, "ab") as arquivo:
+                    arquivo.write(gzip.compress(texto.encode("utf-8")))
+            except OSError as e:
+                print(f"Não foi possível escrever a gravação dos turnos: {e}") # Debug
+                with self._lock:
+                    self.descartados += turnos
+                return 0
+        with self._lock:
+            self.gravados += turnos
+        return turnos
+
+    def _escrever_periodicamente(self):
+        while True:
+            time.sleep(self.intervalo)
+            self.descarregar()
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {"arquivo": self.caminho, "gravados": self.gravados, "descartados": self.descartados,
+                    "pendentes": self._fila.qsize()}
+
+
+# =============================================================================
+# Leitura
+# =============================================================================
+
+def arquivos_gravacao(caminhos) -> list:
+    """Arquivos de gravação: os passados e os *.jsonl.gz de cada pasta passada."""
+    arquivos = []
+    for caminho in ([caminhos] if isinstance(caminhos, str) else caminhos):
+        if os.path.isdir(caminho):
+            arquivos += sorted(glob.glob(os.path.join(caminho, "*.jsonl.gz")))
+        else:
+            arquivos.append(caminho)
+    return arquivos
+
+
+def ler_gravacao(caminhos) -> tuple:
+    """
+    Lê os arquivos de gravação. Retorna (turnos em ordem de chegada, imagens: hash -> (mime_type, bytes)).
+    Um bloco cortado no fim de um arquivo (processo que morreu escrevendo) é ignorado.
+    """
+    turnos, imagens_gravadas = [], {}
+    for caminho in arquivos_gravacao(caminhos):
+        try:
+            with gzip.open(caminho, "rt", encoding="utf-8") as arquivo:
+                for linha in arquivo:
+                    registro = json.loads(linha)
+                    if registro["tipo"] == TIPO_IMAGEM:
+                        imagens_gravadas[registro["hash"]] = (registro["mime_type"], base64.b64decode(registro["dados"]))
+                    elif registro["tipo"] == TIPO_TURNO:
+                        turnos.append(registro)
+        except (EOFError, gzip.BadGzipFile, zlib.error, json.JSONDecodeError) as e:
+            print(f"Gravação {caminho} termina num bloco incompleto: {e}") # Debug
+    turnos.sort(key=lambda turno: turno["quando"])
+    return turnos, imagens_gravadas
+
+
+# Gravador único do processo (None quando OZY_GRAVACAO_DIR não está definido)
+_gravador = None
+_gravador_lock = threading.Lock()
+
+def obter_gravador() -> Optional[GravadorTurnos]:
+    global _gravador
+    if _gravador is None and PASTA:
+        with _gravador_lock:
+            if _gravador is None:
+                _gravador = GravadorTurnos(PASTA)
+    return _gravador
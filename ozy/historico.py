@@ -0,0 +1,342 @@
+"""
+Histórico de exibição compacto e com limite de tamanho.
+
+Cada mensagem é um objeto pequeno (dataclass com __slots__) e as imagens ficam só como miniatura
+comprimida. A imagem original vai para um armazém em disco, endereçado pelo hash do conteúdo
+(com validade e tamanho máximo, OZY_BLOBS_TTL e OZY_BLOBS_MAX_BYTES), e nunca fica na memória da sessão. Cada sessão tem um limite de mensagens e de bytes:
+passando dele, as mensagens mais antigas (de qualquer persona) são descartadas primeiro.
+
+Com um armazém de conversas (ozy/conversas.py), a memória é só a janela recente: cada mensagem também
+vai para o log durável, a janela é carregada dele na primeira vez que a persona é usada e as páginas
+que não estão mais na memória são lidas de lá. Se outro processo escreveu na conversa (modo com vários
+workers, ver ozy/compartilhado.py), sincronizar() descarta a janela e ela é carregada de novo.
+"""
+import itertools
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from ozy import compartilhado
+
+# Limites padrão por sessão (todas as personas somadas)
+MAX_MENSAGENS = int(os.environ.get("OZY_HISTORICO_MAX_MENSAGENS", 200))
+MAX_BYTES = int(os.environ.get("OZY_HISTORICO_MAX_BYTES", 2 * 1024 * 1024))
+# Quantas mensagens recentes de cada persona são carregadas do armazém de conversas
+JANELA_MEMORIA = int(os.environ.get("OZY_HISTORICO_JANELA", 50))
+# Imagens originais em disco: apagadas depois de tanto tempo sem uso e, passando do tamanho máximo, as menos usadas
+TTL_BLOBS = float(os.environ.get("OZY_BLOBS_TTL", 7 * 24 * 3600))
+MAX_BYTES_BLOBS = int(os.environ.get("OZY_BLOBS_MAX_BYTES", 1024 * 1024 * 1024))
+# De quanto em quanto tempo (segundos) a limpeza da pasta roda, junto com uma gravação
+INTERVALO_LIMPEZA_BLOBS = 600
+
+# Número que só cresce, para saber qual mensagem é a mais antiga entre todas as personas
+_sequencia = itertools.count()
+
+
+@dataclass(slots=True)
+class Mensagem:
+    """Uma mensagem do histórico de exibição."""
+    role: str # "user" ou "assistant"
+    content: str
+    persona: str
+    imagem_hash: Optional[str] = None # Hash da imagem original (no ArmazemBlobs)
+    miniatura: Optional[bytes] = None # Miniatura JPEG para mostrar no chat
+    tempos: Optional[dict] = None # Tempos da resposta (primeiro token, total)
+    seq: int = 0
+
+    def __post_init__(self):
+        self.seq = next(_sequencia)
+
+    def tamanho_estimado(self) -> int:
+        """Bytes aproximados que a mensagem ocupa na memória."""
+        tamanho = sys.getsizeof(self) + sys.getsizeof(self.content)
+        if self.miniatura is not None:
+            tamanho += sys.getsizeof(self.miniatura)
+        if self.tempos is not None:
+            tamanho += sys.getsizeof(self.tempos)
+        return tamanho
+
+
+class HistoricoSessao:
+    """Histórico de todas as personas de uma sessão, com limite de mensagens e de bytes."""
+
+    def __init__(self, max_mensagens: int = MAX_MENSAGENS, max_bytes: int = MAX_BYTES,
+                 usuario: Optional[str] = None, armazem=None):
+        self.max_mensagens = max_mensagens
+        self.max_bytes = max_bytes
+        self.usuario = usuario
+        self.armazem = armazem # ArmazemConversas (None: a conversa fica só na memória)
+        self._conversas = {} # persona -> deque de Mensagem
+        self._completas = set() # Personas com a conversa inteira na memória (nada a buscar no armazém)
+        self._vistos = {} # persona -> id da última linha do armazém que este processo conhece
+        self._bytes = 0
+        self._total = 0
+        self.removidas = 0 # Quantas mensagens já saíram por causa dos limites
+        # A tela lê páginas (MotorOzy.mensagens) enquanto um turno escreve: as deques só mudam com esse lock
+        self._lock = threading.RLock()
+
+    def mensagens(self, persona: str) -> list:
+        """Cópia das mensagens da persona na memória, da mais antiga para a mais nova (vazia se não houver)."""
+        with self._lock:
+            return list(self._conversa(persona))
+
+    def _conversa(self, persona: str) -> deque:
+        """A deque da persona, carregada do armazém na primeira vez. Só com o lock."""
+        if persona not in self._conversas and self.armazem is not None:
+            self._carregar(persona)
+        return self._conversas.get(persona, deque())
+
+    def _carregar(self, persona: str):
+        """Primeira vez que a persona é usada: traz do armazém só a janela das mensagens mais recentes. Só com o lock."""
+        # Antes da página: se alguém escrever no meio, a próxima sincronização carrega de novo (nunca perde nada)
+        self._vistos[persona] = self.armazem.ultimo_id(self.usuario, persona)
+        recentes = self.armazem.pagina(self.usuario, persona, ultimas=JANELA_MEMORIA + 1)
+        if len(recentes) <= JANELA_MEMORIA:
+            self._completas.add(persona)
+        self._conversas[persona] = deque()
+        for mensagem in recentes[-JANELA_MEMORIA:]:
+            self._incluir(persona, mensagem)
+
+    def adicionar(self, persona: str, mensagem: Mensagem) -> int:
+        """Adiciona a mensagem e retorna quantas antigas precisaram sair para respeitar os limites."""
+        with self._lock:
+            if self.armazem is not None:
+                self._conversa(persona) # A janela vem do armazém antes da mensagem nova entrar nela
+                try:
+                    mensagem.seq = self._vistos[persona] = self.armazem.anexar(self.usuario, persona, mensagem)
+                except Exception as e:
+                    print(f"Não foi possível gravar a mensagem no armazém de conversas: {e}") # Debug
+            return self._incluir(persona, mensagem)
+
+    def _incluir(self, persona: str, mensagem: Mensagem) -> int:
+        self._conversas.setdefault(persona, deque()).append(mensagem)
+        self._bytes += mensagem.tamanho_estimado()
+        self._total += 1
+        removidas = 0
+        # Nunca remove a mensagem que acabou de entrar
+        while (self._total > self.max_mensagens or self._bytes > self.max_bytes) and self._total > 1:
+            self._remover_mais_antiga()
+            removidas += 1
+        self.removidas += removidas
+        return removidas
+
+    def _remover_mais_antiga(self):
+        persona, conversa = min(((p, c) for p, c in self._conversas.items() if c), key=lambda item: item[1][0].seq)
+        antiga = conversa.popleft()
+        self._completas.discard(persona) # O que saiu da memória agora só existe no armazém
+        self._bytes -= antiga.tamanho_estimado()
+        self._total -= 1
+
+    def pagina(self, persona: str, ultimas: Optional[int] = None,
+               antes_de: Optional[int] = None, depois_de: Optional[int] = None) -> list:
+        """
+        Mensagens da persona filtradas pelo 'seq', da mais antiga para a mais nova (ver MotorOzy.mensagens).
+        Sai da memória quando ela cobre o pedido; senão, a página é lida do armazém.
+        """
+        with self._lock:
+            conversa = self._conversa(persona)
+            selecionadas = []
+            # Percorre da mais nova para a mais antiga: as páginas do fim não precisam olhar o histórico inteiro
+            for mensagem in reversed(conversa):
+                if depois_de is not None and mensagem.seq <= depois_de:
+                    break
+                if antes_de is not None and mensagem.seq >= antes_de:
+                    continue
+                selecionadas.append(mensagem)
+                if ultimas is not None and len(selecionadas) >= ultimas:
+                    break
+            selecionadas.reverse()
+            cobre = (
+                self.armazem is None or persona in self._completas
+                or (ultimas is not None and len(selecionadas) >= ultimas)
+                or (depois_de is not None and bool(conversa) and conversa[0].seq <= depois_de)
+            )
+        if cobre:
+            return selecionadas
+        return self.armazem.pagina(self.usuario, persona, ultimas, antes_de, depois_de)
+
+    def vazia(self, persona: str) -> bool:
+        """True quando a conversa com a persona ainda não tem nenhuma mensagem (nem no armazém)."""
+        return not self.pagina(persona, ultimas=1)
+
+    def guardar_resumo(self, persona: str, resumo: str, mantidas: int):
+        """
+        Registra no armazém o resumo que o GerenciadorContexto fez: cobre tudo menos as 'mantidas' mensagens
+        mais recentes. Na dúvida cobre menos, e a reconstrução do chat só repete uma mensagem a mais.
+        """
+        with self._lock:
+            conversa = self._conversa(persona)
+            if self.armazem is None or len(conversa) <= mantidas:
+                return
+            try:
+                self._vistos[persona] = self.armazem.guardar_resumo(self.usuario, persona, resumo, conversa[-mantidas - 1].seq)
+            except Exception as e:
+                print(f"Não foi possível gravar o resumo no armazém de conversas: {e}") # Debug
+
+    def para_reconstruir(self, persona: str, limite: int = JANELA_MEMORIA) -> tuple:
+        """
+        O que é preciso para recriar o chat do Gemini de uma conversa que já existia:
+        (resumo mais recente ou None, até 'limite' mensagens que vieram depois dele).
+        """
+        if self.armazem is None:
+            return None, []
+        resumo = self.armazem.ultimo_resumo(self.usuario, persona)
+        texto, ate_id = resumo if resumo else (None, None)
+        return texto, self.armazem.pagina(self.usuario, persona, ultimas=limite, depois_de=ate_id)
+
+    def sincronizar(self, persona: str) -> bool:
+        """
+        True quando outro processo escreveu na conversa desde a última vez que esta memória a viu:
+        a janela é descartada (volta do armazém no próximo acesso) e quem chamou refaz o que dependia dela.
+        """
+        with self._lock:
+            if self.armazem is None or persona not in self._conversas:
+                return False
+            if self.armazem.ultimo_id(self.usuario, persona) == self._vistos.get(persona):
+                return False
+            self._esquecer(persona)
+            return True
+
+    def _esquecer(self, persona: str):
+        with self._lock:
+            for mensagem in self._conversas.pop(persona, ()):
+                self._bytes -= mensagem.tamanho_estimado()
+                self._total -= 1
+            self._completas.discard(persona)
+            self._vistos.pop(persona, None)
+
+    def limpar(self, persona: str):
+        """Apaga o histórico de uma persona."""
+        with self._lock: # Uma leitura no meio não carrega de novo a conversa que está sendo apagada
+            self._esquecer(persona)
+            if self.armazem is not None:
+                self.armazem.limpar(self.usuario, persona)
+
+    def bytes_usados(self) -> int:
+        return self._bytes
+
+    def __len__(self):
+        return self._total
+
+
+# =============================================================================
+# Armazém de Imagens Originais
+# =============================================================================
+
+class ArmazemBlobs:
+    """
+    Guarda arquivos em disco com o hash do conteúdo como nome. O mesmo conteúdo é gravado uma vez só.
+    O mesmo arquivo serve várias mensagens (e sessões), então nada é apagado junto com uma mensagem:
+    uma limpeza periódica apaga os arquivos sem uso há mais de 'ttl' e, se a pasta passar de 'max_bytes',
+    os usados há mais tempo. Quem lê uma imagem que já saiu recebe None (a mensagem fica sem a imagem).
+    """
+
+    def __init__(self, pasta: str, ttl: float = TTL_BLOBS, max_bytes: int = MAX_BYTES_BLOBS):
+        self.pasta = pasta
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(pasta, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ozy-blobs")
+        self._lock = threading.Lock()
+        self._ultima_limpeza = 0.0
+        self.apagados = 0
+
+    def caminho(self, hash_conteudo: str) -> str:
+        # Subpastas pelos dois primeiros caracteres, para não juntar milhares de arquivos numa pasta só
+        return os.path.join(self.pasta, hash_conteudo[:2], hash_conteudo)
+
+    def guardar(self, hash_conteudo: str, dados: bytes):
+        caminho = self.caminho(hash_conteudo)
+        if os.path.exists(caminho):
+            self._usado(caminho)
+            return
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        # Grava num arquivo temporário (nome único: duas threads podem gravar o mesmo hash) e renomeia:
+        # quem lê nunca vê um arquivo pela metade
+        descritor, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho), prefix=f".{hash_conteudo}.", suffix=".tmp")
+        try:
+            with os.fdopen(descritor, "wb") as arquivo:
+                arquivo.write(dados)
+            os.replace(temporario, caminho)
+        except BaseException:
+            try:
+                os.remove(temporario)
+            except OSError:
+                pass
+            raise
+
+    def guardar_em_segundo_plano(self, hash_conteudo: str, dados: bytes):
+        """Mesmo que guardar(), sem fazer o script esperar pela escrita no disco. De tempos em tempos, limpa a pasta."""
+        futuro = self._executor.submit(self.guardar, hash_conteudo, dados)
+        with self._lock:
+            limpar = time.time() - self._ultima_limpeza >= INTERVALO_LIMPEZA_BLOBS
+            if limpar:
+                self._ultima_limpeza = time.time()
+        if limpar:
+            self._executor.submit(self.limpar)
+        return futuro
+
+    def ler(self, hash_conteudo: str) -> Optional[bytes]:
+        caminho = self.caminho(hash_conteudo)
+        try:
+            with open(caminho, "rb") as arquivo:
+                dados = arquivo.read()
+        except FileNotFoundError:
+            return None
+        self._usado(caminho)
+        return dados
+
+    def _usado(self, caminho: str):
+        # A data de modificação marca o último uso: é por ela que a limpeza escolhe o que apagar
+        try:
+            os.utime(caminho)
+        except OSError:
+            pass
+
+    def limpar(self, agora: Optional[float] = None) -> int:
+        """Apaga os arquivos vencidos e, passando do tamanho máximo, os usados há mais tempo. Retorna quantos apagou."""
+        agora = time.time() if agora is None else agora
+        arquivos = []
+        for raiz, _, nomes in os.walk(self.pasta):
+            for nome in nomes:
+                caminho = os.path.join(raiz, nome)
+                try:
+                    estado = os.stat(caminho)
+                except OSError:
+                    continue
+                arquivos.append((estado.st_mtime, estado.st_size, caminho))
+        arquivos.sort()
+        total = sum(tamanho for _, tamanho, _ in arquivos)
+        apagados = 0
+        for usado_em, tamanho, caminho in arquivos:
+            if agora - usado_em < self.ttl and total <= self.max_bytes:
+                break # Do mais antigo para o mais novo: daqui em diante, tudo fica
+            try:
+                os.remove(caminho)
+            except OSError:
+                continue
+            total -= tamanho
+            apagados += 1
+        with self._lock:
+            self.apagados += apagados
+        return apagados
+
+
+_armazem = None
+_armazem_lock = threading.Lock()
+
+def obter_armazem_blobs() -> ArmazemBlobs:
+    """Armazém do processo. A pasta vem de OZY_BLOBS_DIR (padrão: a pasta do estado compartilhado, ou a temporária do sistema)."""
+    global _armazem
+    if _armazem is None:
+        with _armazem_lock:
+            if _armazem is None:
+                padrao = compartilhado.caminho("blobs") if compartilhado.ativo() else os.path.join(tempfile.gettempdir(), "ozy_blobs")
+                _armazem = ArmazemBlobs(os.environ.get("OZY_BLOBS_DIR", padrao))
+    return _armazem
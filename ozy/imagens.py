@@ -0,0 +1,137 @@
+"""
+Preparação das imagens enviadas pelo usuário antes de irem para o Gemini.
+
+Um print de jogo em 4K chega com vários megabytes, mas o modelo enxerga a imagem em blocos de 768x768:
+mandar mais pixels que isso só aumenta o upload e a latência. Aqui a imagem é:
+1. reduzida até o lado maior caber em LADO_MAXIMO;
+2. regravada em JPEG (ou WebP) com qualidade fixa e sem metadados (EXIF, perfis, etc.);
+3. identificada por um hash do conteúdo, para a mesma imagem não ser enviada duas vezes na conversa.
+
+O trabalho pesado roda num pool de threads, então o script do Streamlit não fica travado.
+"""
+import contextvars
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+
+from PIL import Image
+
+from ozy import telemetria
+
+# Lado maior da imagem depois de reduzida (pixels)
+LADO_MAXIMO = int(os.environ.get("OZY_IMAGEM_LADO_MAXIMO", 1024))
+# Formato de saída: "JPEG" ou "WEBP"
+FORMATO = os.environ.get("OZY_IMAGEM_FORMATO", "JPEG").upper()
+# Qualidade da compressão (1 a 100)
+QUALIDADE = int(os.environ.get("OZY_IMAGEM_QUALIDADE", 85))
+# Lado maior e qualidade da miniatura guardada no histórico do chat
+LADO_MINIATURA = 256
+QUALIDADE_MINIATURA = 70
+
+TIPOS_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+@dataclass
+class ImagemPreparada:
+    """Imagem já reduzida e comprimida, pronta para enviar ao Gemini."""
+    hash: str # sha256 do arquivo original enviado pelo usuário
+    dados: bytes # Imagem regravada
+    mime_type: str
+    largura: int
+    altura: int
+    bytes_originais: int
+    miniatura: bytes # Versão pequena para o histórico de exibição
+
+    @property
+    def bytes_economizados(self) -> int:
+        return max(0, self.bytes_originais - len(self.dados))
+
+    def para_gemini(self) -> dict:
+        """Parte de conteúdo no formato que o google.generativeai aceita, sem precisar converter de novo."""
+        return {"mime_type": self.mime_type, "data": self.dados}
+
+    def resumo_economia(self) -> str:
+        """Texto curto com o tamanho antes e depois."""
+        antes, depois = self.bytes_originais / 1024, len(self.dados) / 1024
+        reducao = self.bytes_economizados / self.bytes_originais if self.bytes_originais else 0
+        return f"Imagem otimizada: {antes:,.0f} KB → {depois:,.0f} KB ({reducao:.0%} menor, {self.largura}x{self.altura})"
+
+
+def calcular_hash(dados: bytes) -> str:
+    return hashlib.sha256(dados).hexdigest()
+
+
+def preparar_imagem(dados: bytes, lado_maximo: int = LADO_MAXIMO, formato: str = FORMATO,
+                    qualidade: int = QUALIDADE, hash_imagem: str = None) -> ImagemPreparada:
+    """Reduz, regrava sem metadados e calcula o hash da imagem (roda na thread que chamar)."""
+    with Image.open(io.BytesIO(dados)) as imagem:
+        # draft() deixa o decodificador de JPEG já ler a imagem reduzida, bem mais rápido para fotos grandes
+        imagem.draft("RGB", (lado_maximo, lado_maximo))
+        if imagem.mode in ("RGBA", "LA", "P"):
+            # JPEG não tem transparência: coloca a imagem sobre um fundo branco
+            imagem = imagem.convert("RGBA")
+            fundo = Image.new("RGB", imagem.size, (255, 255, 255))
+            fundo.paste(imagem, mask=imagem.getchannel("A"))
+            imagem = fundo
+        elif imagem.mode != "RGB":
+            imagem = imagem.convert("RGB")
+        imagem.thumbnail((lado_maximo, lado_maximo), Image.Resampling.LANCZOS) # Mantém a proporção
+
+        saida = io.BytesIO()
+        # Sem passar exif/icc_profile, o arquivo novo sai sem metadados
+        imagem.save(saida, format=formato, quality=qualidade, optimize=True)
+
+        # Miniatura feita a partir da imagem já reduzida (bem mais barato que a partir do original)
+        pequena = imagem.copy()
+        pequena.thumbnail((LADO_MINIATURA, LADO_MINIATURA))
+        saida_miniatura = io.BytesIO()
+        pequena.save(saida_miniatura, format="JPEG", quality=QUALIDADE_MINIATURA)
+
+        return ImagemPreparada(
+            hash=hash_imagem or calcular_hash(dados),
+            dados=saida.getvalue(),
+            mime_type=TIPOS_MIME[formato],
+            largura=imagem.width,
+            altura=imagem.height,
+            bytes_originais=len(dados),
+            miniatura=saida_miniatura.getvalue(),
+        )
+
+
+# =============================================================================
+# Processamento em Segundo Plano
+# =============================================================================
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ozy-imagens")
+
+# Imagens já preparadas, pelo hash do original (o mesmo print enviado de novo não é processado outra vez)
+_preparadas = OrderedDict()
+_preparadas_lock = threading.Lock()
+MAX_PREPARADAS_EM_MEMORIA = 64
+
+def _preparar_com_cache(dados: bytes) -> ImagemPreparada:
+    with telemetria.span("imagem.preparar", bytes_entrada=len(dados)) as span:
+        hash_imagem = calcular_hash(dados)
+        with _preparadas_lock:
+            if hash_imagem in _preparadas:
+                _preparadas.move_to_end(hash_imagem)
+                span.definir(do_cache=True, bytes_saida=len(_preparadas[hash_imagem].dados))
+                return _preparadas[hash_imagem]
+        # Decodifica, reduz e regrava a imagem (a parte cara)
+        preparada = preparar_imagem(dados, hash_imagem=hash_imagem)
+        span.definir(do_cache=False, bytes_saida=len(preparada.dados), largura=preparada.largura, altura=preparada.altura)
+        with _preparadas_lock:
+            _preparadas[hash_imagem] = preparada
+            while len(_preparadas) > MAX_PREPARADAS_EM_MEMORIA:
+                _preparadas.popitem(last=False)
+        return preparada
+
+
+def preparar_em_segundo_plano(dados: bytes) -> Future:
+    """Começa a preparar a imagem num pool de threads e retorna um Future com a ImagemPreparada."""
+    # Leva o contexto junto: o span do preparo fica dentro do turno que pediu a imagem (quando houver um)
+    return _executor.submit(contextvars.copy_context().run, _preparar_com_cache, dados)
@@ -0,0 +1,323 @@
+"""
+Respostas em lote para o FAQ: as perguntas comuns de cada jogo respondidas de antemão pelas personas.
+
+    python -m ozy.lote perguntas.jsonl --saida faq.sqlite3 --workers 4 --pesquisador
+
+Cada linha do JSONL é uma pergunta (só "prompt" é obrigatório):
+    {"prompt": "Como eu pulo no Mario?", "jogo": "Super Mario Bros", "imagem": "prints/mario.png",
+     "personas": ["Professor Ozy"], "pesquisador": true}
+"imagem" é relativa à pasta do JSONL; sem "personas" vale --personas (padrão: todas); sem "pesquisador", --pesquisador.
+
+Cada pergunta faz o caminho de uma primeira mensagem, sem histórico: o Pesquisador (ozy/pesquisa.py), quando pedido,
+e o modelo da persona (configurar_modelo_gemini), pelo agendador (limite por minuto e novas tentativas em 429/5xx).
+As perguntas rodam num número limitado de workers. Cada resposta é gravada no armazém (ozy/faq.py) assim que
+fica pronta, então interromper (Ctrl+C) e rodar de novo continua de onde parou; as que falharam são tentadas de novo.
+No fim sai o relatório da execução: vazão, chamadas, tokens (e custo, com --preco-entrada e --preco-saida) e falhas.
+
+Para o app usar as respostas: OZY_FAQ_DB=faq.sqlite3 (os caches de resposta e de busca carregam o armazém na partida).
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+from ozy import imagens, pesquisa
+from ozy.agendador import obter_agendador
+from ozy.cancelamento import PedidoCancelado
+from ozy.faq import STATUS_ERRO, ArmazemFAQ, RespostaFAQ, chave_faq
+from ozy.modelos import MODELO_PERSONAS
+from ozy.motor import BackendGemini, guardar_uso_tokens
+from ozy.personas import PERSONAS, configurar_gemini
+
+# Perguntas na fila do pool além das que estão rodando (o JSONL é lido aos poucos)
+FOLGA_FILA = 2
+
+
+@dataclass
+class Pergunta:
+    """Uma pergunta do JSONL para uma persona."""
+    prompt: str
+    persona: str
+    chave: str
+    jogo: Optional[str] = None
+    imagem: Optional[bytes] = None
+    imagem_hash: Optional[str] = None
+    pesquisador: bool = False
+    linha: int = 0
+
+
+def ler_perguntas(caminho: str, personas: tuple, pesquisador: bool, invalidas: list):
+    """Perguntas do JSONL, uma por persona. Linhas que não dá para usar vão para 'invalidas' (linha, motivo)."""
+    pasta = os.path.dirname(os.path.abspath(caminho))
+    with open(caminho, encoding="utf-8") as arquivo:
+        for numero, linha in enumerate(arquivo, start=1):
+            if not linha.strip():
+                continue
+            try:
+                item = json.loads(linha)
+                prompt = str(item["prompt"]).strip()
+                if not prompt:
+                    raise ValueError("prompt vazio")
+                dados_imagem = None
+                if item.get("imagem"):
+                    with open(os.path.join(pasta, item["imagem"]), "rb") as arquivo_imagem:
+                        dados_imagem = arquivo_imagem.read()
+                personas_item = tuple(item.get("personas") or personas)
+                desconhecidas = set(personas_item) - set(PERSONAS)
+                if desconhecidas:
+                    raise ValueError(f"persona desconhecida: {', '.join(sorted(desconhecidas))}")
+            except (ValueError, KeyError, TypeError, OSError) as e:
+                invalidas.append((numero, f"{type(e).__name__}: {e}"))
+                continue
+            imagem_hash = imagens.calcular_hash(dados_imagem) if dados_imagem else None
+            for persona in personas_item:
+                yield Pergunta(prompt=prompt, persona=persona, chave=chave_faq(persona, prompt, imagem_hash),
+                               jogo=item.get("jogo"), imagem=dados_imagem, imagem_hash=imagem_hash,
+                               pesquisador=bool(item.get("pesquisador", pesquisador)), linha=numero)
+
+
+@dataclass
+class RelatorioLote:
+    """Números de uma execução."""
+    perguntas: int = 0 # Perguntas lidas (uma por persona)
+    puladas: int = 0 # Já estavam prontas no armazém
+    respondidas: int = 0
+    falhas: int = 0
+    nao_feitas: int = 0 # Interrompidas antes de terminar (ficam para a próxima execução)
+    invalidas: int = 0 # Linhas do JSONL que não dava para usar
+    chamadas_persona: int = 0
+    pesquisas: int = 0
+    pesquisas_do_cache: int = 0
+    embeddings: int = 0
+    tokens_entrada: int = 0
+    tokens_saida: int = 0
+    duracao: float = 0.0
+    duracoes: list = field(default_factory=list) # Segundos de cada resposta
+    erros: Counter = field(default_factory=Counter) # Tipo do erro -> quantas vezes
+
+    def para_dict(self, preco_entrada: Optional[float] = None, preco_saida: Optional[float] = None) -> dict:
+        duracoes = sorted(self.duracoes)
+        custo = None
+        if preco_entrada is not None and preco_saida is not None:
+            custo = round((self.tokens_entrada * preco_entrada + self.tokens_saida * preco_saida) / 1e6, 4)
+        return {
+            "perguntas": self.perguntas,
+            "puladas": self.puladas,
+            "respondidas": self.respondidas,
+            "falhas": self.falhas,
+            "nao_feitas": self.nao_feitas,
+            "invalidas": self.invalidas,
+            "duracao_s": round(self.duracao, 2),
+            "respostas_por_minuto": round(60 * self.respondidas / self.duracao, 2) if self.duracao else 0.0,
+            "resposta_p50_s": round(duracoes[len(duracoes) // 2], 3) if duracoes else None,
+            "resposta_p95_s": round(duracoes[int(0.95 * (len(duracoes) - 1))], 3) if duracoes else None,
+            "chamadas": {"persona": self.chamadas_persona, "pesquisas": self.pesquisas,
+                         "pesquisas_do_cache": self.pesquisas_do_cache, "embeddings": self.embeddings},
+            "tokens_entrada": self.tokens_entrada,
+            "tokens_saida": self.tokens_saida,
+            "custo_estimado_usd": custo,
+            "erros": dict(self.erros.most_common(10)),
+        }
+
+
+class ExecucaoLote:
+    """Roda as perguntas num pool limitado de workers e grava cada resposta no armazém."""
+
+    def __init__(self, armazem: ArmazemFAQ, backend=None, workers: int = 4, modo_pesquisa: str = pesquisa.MODO_SEQUENCIAL,
+                 refazer: bool = False):
+        self.armazem = armazem
+        self.backend = backend or BackendGemini()
+        self.workers = workers
+        self.modo_pesquisa = modo_pesquisa
+        self.refazer = refazer # Gera de novo até as que já estão prontas
+        self.id = uuid.uuid4().hex[:12]
+        self.relatorio = RelatorioLote()
+        self.parar = threading.Event() # Ctrl+C: quem espera a vez no agendador desiste e o resto fica para depois
+        self._lock = threading.Lock()
+
+    def _contar(self, **valores):
+        """Soma nos números do relatório (os workers rodam ao mesmo tempo)."""
+        with self._lock:
+            for nome, valor in valores.items():
+                setattr(self.relatorio, nome, getattr(self.relatorio, nome) + valor)
+
+    def responder(self, pergunta: Pergunta) -> RespostaFAQ:
+        """A resposta de uma pergunta: pesquisa (se pedida), persona e embedding da pergunta."""
+        inicio = time.perf_counter()
+        agendador = obter_agendador()
+        registro = RespostaFAQ(chave=pergunta.chave, persona=pergunta.persona, prompt=pergunta.prompt,
+                               jogo=pergunta.jogo, imagem_hash=pergunta.imagem_hash, id_execucao=self.id)
+        conteudo = []
+        if pergunta.imagem is not None:
+            conteudo.append(imagens.preparar_em_segundo_plano(pergunta.imagem).result().para_gemini())
+        conteudo.append(pergunta.prompt)
+
+        if pergunta.pesquisador:
+            resultado = self.backend.pesquisar(pergunta.prompt, f"lote-{pergunta.chave[:16]}", self.modo_pesquisa,
+                                               cancelado=self.parar)
+            self._contar(pesquisas=1, pesquisas_do_cache=int(resultado.do_cache))
+            if resultado.cancelada:
+                raise PedidoCancelado()
+            if resultado.erro:
+                # Resposta do FAQ sem a pesquisa pedida não serve: fica como falha e é tentada de novo depois
+                raise RuntimeError(f"Pesquisador: {resultado.erro}")
+            registro.consulta, registro.contexto = resultado.consulta, resultado.contexto
+            if resultado.contexto:
+                conteudo.append(pesquisa.formatar_contexto(resultado.contexto, pergunta.prompt))
+
+        chat_session = self.backend.iniciar_chat(pergunta.persona)
+        tempos = {}
+        self._contar(chamadas_persona=1)
+        resposta = agendador.executar(MODELO_PERSONAS, chat_session.send_message, conteudo, medida=tempos,
+                                      cancelado=self.parar)
+        guardar_uso_tokens(tempos, resposta)
+        registro.resposta = resposta.text
+        registro.tokens_entrada = tempos.get("tokens_entrada") or 0
+        registro.tokens_saida = tempos.get("tokens_saida") or len(registro.resposta) // 4
+
+        if pergunta.imagem is None:
+            # O mesmo texto que o cache semântico vetoriza (persona + pergunta), já normalizado.
+            # Sem 'cancelado': a resposta já foi paga, então termina mesmo depois do Ctrl+C
+            self._contar(embeddings=1)
+            vetor = np.asarray(agendador.executar(self.backend.modelo_embedding, self.backend.embedding,
+                                                  f"{pergunta.persona}\n{pergunta.prompt}"), dtype=np.float32)
+            norma = np.linalg.norm(vetor)
+            registro.vetor = (vetor / norma if norma else vetor).tobytes()
+            registro.modelo_embedding = self.backend.modelo_embedding
+        registro.duracao = time.perf_counter() - inicio
+        return registro
+
+    def _trabalhar(self, pergunta: Pergunta, vaga: threading.Semaphore):
+        try:
+            if self.parar.is_set():
+                return
+            try:
+                registro = self.responder(pergunta)
+            except PedidoCancelado:
+                return # Desistiu na fila do agendador (Ctrl+C): fica para a próxima execução
+            except Exception as e:
+                print(f"Falha na linha {pergunta.linha} ({pergunta.persona}): {e}") # Debug
+                self.armazem.gravar(RespostaFAQ(chave=pergunta.chave, persona=pergunta.persona, prompt=pergunta.prompt,
+                                                jogo=pergunta.jogo, imagem_hash=pergunta.imagem_hash, status=STATUS_ERRO,
+                                                erro=f"{type(e).__name__}: {e}", id_execucao=self.id))
+                with self._lock:
+                    self.relatorio.falhas += 1
+                    self.relatorio.erros[type(e).__name__] += 1
+                return
+            self.armazem.gravar(registro) # Checkpoint: a partir daqui a pergunta não roda de novo
+            with self._lock:
+                self.relatorio.respondidas += 1
+                self.relatorio.tokens_entrada += registro.tokens_entrada
+                self.relatorio.tokens_saida += registro.tokens_saida
+                self.relatorio.duracoes.append(registro.duracao)
+        finally:
+            vaga.release()
+
+    def rodar(self, perguntas, entrada: str = "") -> RelatorioLote:
+        """Responde as perguntas (iterável de Pergunta) e retorna o relatório. Ctrl+C para no meio sem perder nada."""
+        prontas = set() if self.refazer else self.armazem.prontas()
+        self.armazem.iniciar_execucao(self.id, entrada)
+        # Só deixa ler mais perguntas do arquivo quando há vaga: a memória não cresce com o tamanho do JSONL
+        vaga = threading.Semaphore(self.workers + FOLGA_FILA)
+        inicio = time.perf_counter()
+        enviadas = 0
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ozy-lote")
+        try:
+            for pergunta in perguntas:
+                self.relatorio.perguntas += 1
+                if pergunta.chave in prontas:
+                    self.relatorio.puladas += 1
+                    continue
+                prontas.add(pergunta.chave) # A mesma pergunta repetida no arquivo roda uma vez só
+                while not vaga.acquire(timeout=0.5):
+                    pass # Espera em pedaços curtos: o Ctrl+C chega mesmo com o pool cheio
+                executor.submit(self._trabalhar, pergunta, vaga)
+                enviadas += 1
+            executor.shutdown(wait=True)
+        except KeyboardInterrupt:
+            print("\nInterrompido: terminando as respostas em andamento (Ctrl+C de novo para sair na hora)...", file=sys.stderr)
+            self.parar.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+        self.relatorio.duracao = time.perf_counter() - inicio
+        self.relatorio.nao_feitas = enviadas - self.relatorio.respondidas - self.relatorio.falhas
+        return self.relatorio
+
+
+# =============================================================================
+# Linha de Comando
+# =============================================================================
+
+def imprimir_relatorio(relatorio: dict):
+    print(f"\nPerguntas: {relatorio['perguntas']} · respondidas: {relatorio['respondidas']} · "
+          f"já prontas: {relatorio['puladas']} · falhas: {relatorio['falhas']} · não feitas: {relatorio['nao_feitas']} · "
+          f"linhas inválidas: {relatorio['invalidas']}")
+    print(f"Duração: {relatorio['duracao_s']:.1f}s · {relatorio['respostas_por_minuto']:.1f} respostas/min · "
+          f"resposta p50 {relatorio['resposta_p50_s'] or 0:.2f}s, p95 {relatorio['resposta_p95_s'] or 0:.2f}s")
+    chamadas = relatorio["chamadas"]
+    print(f"Chamadas: {chamadas['persona']} à persona, {chamadas['pesquisas']} pesquisas "
+          f"({chamadas['pesquisas_do_cache']} do cache), {chamadas['embeddings']} embeddings · "
+          f"novas tentativas no agendador: {relatorio['agendador']['retentativas']}")
+    custo = relatorio["custo_estimado_usd"]
+    print(f"Tokens: {relatorio['tokens_entrada']} de entrada, {relatorio['tokens_saida']} de saída"
+          + (f" · custo estimado: US$ {custo:.4f}" if custo is not None else ""))
+    if relatorio["erros"]:
+        print("Erros: " + ", ".join(f"{nome} ({quantas})" for nome, quantas in relatorio["erros"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera em lote as respostas do FAQ do Ozy")
+    parser.add_argument("entrada", help="JSONL com uma pergunta por linha")
+    parser.add_argument("--saida", default=os.environ.get("OZY_FAQ_DB") or "faq.sqlite3", help="Armazém das respostas (SQLite)")
+    parser.add_argument("--workers", type=int, default=4, help="Perguntas respondidas ao mesmo tempo")
+    parser.add_argument("--personas", default=",".join(PERSONAS), help="Personas, separadas por vírgula")
+    parser.add_argument("--pesquisador", action="store_true", help="Usa o Pesquisador nas perguntas que não dizem nada")
+    parser.add_argument("--modo-pesquisa", default=pesquisa.MODO_SEQUENCIAL,
+                        choices=[pesquisa.MODO_SEQUENCIAL, pesquisa.MODO_AGENTE_UNICO])
+    parser.add_argument("--refazer", action="store_true", help="Gera de novo também as respostas que já estão prontas")
+    parser.add_argument("--preco-entrada", type=float, help="US$ por milhão de tokens de entrada (para o custo estimado)")
+    parser.add_argument("--preco-saida", type=float, help="US$ por milhão de tokens de saída")
+    parser.add_argument("--falso", action="store_true", help="Usa o backend falso (sem chave e sem rede, para testar)")
+    args = parser.parse_args()
+
+    personas = tuple(nome.strip() for nome in args.personas.split(",") if nome.strip())
+    if set(personas) - set(PERSONAS):
+        parser.error(f"personas disponíveis: {', '.join(PERSONAS)}")
+    if args.falso:
+        from ozy.backend_falso import BackendFalso
+        backend = BackendFalso()
+    else:
+        if not os.environ.get("GOOGLE_API_KEY"):
+            parser.error("defina GOOGLE_API_KEY (ou use --falso)")
+        configurar_gemini(os.environ["GOOGLE_API_KEY"])
+        backend = BackendGemini()
+
+    armazem = ArmazemFAQ(args.saida)
+    execucao = ExecucaoLote(armazem, backend, max(1, args.workers), args.modo_pesquisa, args.refazer)
+    invalidas = []
+    execucao.rodar(ler_perguntas(args.entrada, personas, args.pesquisador, invalidas), entrada=os.path.abspath(args.entrada))
+    execucao.relatorio.invalidas = len(invalidas)
+    for numero, motivo in invalidas[:10]:
+        print(f"Linha {numero} ignorada: {motivo}", file=sys.stderr)
+
+    relatorio = execucao.relatorio.para_dict(args.preco_entrada, args.preco_saida)
+    relatorio["agendador"] = obter_agendador().estatisticas()
+    relatorio["armazem"] = armazem.estatisticas()
+    armazem.encerrar_execucao(execucao.id, json.dumps(relatorio, ensure_ascii=False))
+    imprimir_relatorio(relatorio)
+    print(f"\nArmazém: {args.saida} ({relatorio['armazem']['respostas']} respostas prontas). "
+          f"Para o app usar: OZY_FAQ_DB={args.saida}")
+    if relatorio["falhas"] or relatorio["nao_feitas"]:
+        sys.exit(1) # Rode de novo para continuar de onde parou
+
+
+if __name__ == "__main__":
+    main()
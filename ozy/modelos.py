@@ -0,0 +1,211 @@
+"""
+Modelos das personas, criados uma vez por processo e compartilhados entre as sessões.
+
+As instruções de sistema das personas têm vários KB. Sem cache, cada sessão nova (ou cada
+"Limpar Histórico") montava um GenerativeModel novo. Aqui cada persona tem um modelo só.
+
+Opcionalmente (OZY_CACHE_CONTEXTO=1) a instrução de sistema vira um CachedContent no servidor do Gemini.
+Ela deixa de ser cobrada como entrada nova a cada mensagem, o que também diminui a latência.
+O cache no servidor tem um TTL, renovado automaticamente quando está perto de expirar.
+Se não der para criar o cache (instrução curta demais para o mínimo da API, modelo sem suporte,
+erro de rede), a persona usa o modelo normal e só tenta de novo depois de um tempo.
+
+A biblioteca do Gemini (google.generativeai, ~0,6 s para importar) também fica aqui: ela só é importada
+e configurada na primeira vez que alguém precisa dela (obter_genai), uma vez por processo, e não a cada
+execução do script do Streamlit. Assim a primeira tela aparece sem esperar por ela.
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from ozy import telemetria
+
+# Modelo usado pelas personas
+MODELO_PERSONAS = "gemini-2.0-flash"
+# Liga o cache da instrução de sistema no servidor do Gemini
+USAR_CACHE_CONTEXTO = os.environ.get("OZY_CACHE_CONTEXTO", "0") == "1"
+# Tempo de vida do cache no servidor (segundos)
+TTL_CACHE_CONTEXTO = int(os.environ.get("OZY_CACHE_CONTEXTO_TTL", 3600))
+# Faltando menos que isso para expirar, o TTL é renovado
+MARGEM_RENOVACAO = 300
+# Depois de uma falha ao criar o cache, espera esse tempo antes de tentar de novo
+ESPERA_APOS_FALHA = 600
+
+
+# =============================================================================
+# Biblioteca do Gemini (importada e configurada uma vez por processo)
+# =============================================================================
+
+_genai = None
+_chave_api = None # Chave guardada por definir_chave_api(), aplicada na próxima obter_genai()
+_chave_configurada = None
+_genai_lock = threading.Lock()
+
+
+def definir_chave_api(api_key: str):
+    """Guarda a chave da API. Não importa nada: a configuração acontece no primeiro obter_genai()."""
+    global _chave_api
+    _chave_api = api_key
+
+
+def obter_genai():
+    """
+    Módulo google.generativeai, importado e configurado na primeira chamada (e de novo só se a chave mudar).
+    OZY_GEMINI_ENDPOINT aponta para outro servidor (ex.: python -m ozy.gemini_falso, para testes sem gastar tokens).
+    """
+    global _genai, _chave_configurada
+    if _genai is not None and _chave_configurada == _chave_api:
+        return _genai
+    with _genai_lock:
+        import google.generativeai as genai
+        if _chave_api is not None and _chave_configurada != _chave_api:
+            endpoint_gemini = os.environ.get("OZY_GEMINI_ENDPOINT")
+            if endpoint_gemini:
+                genai.configure(api_key=_chave_api, transport="rest", client_options={"api_endpoint": endpoint_gemini})
+            else:
+                genai.configure(api_key=_chave_api)
+            _chave_configurada = _chave_api
+        _genai = genai
+    return _genai
+
+
+@dataclass
+class ModeloPersona:
+    """Modelo pronto de uma persona e, se existir, o cache da instrução de sistema no servidor."""
+    modelo: object # genai.GenerativeModel
+    cache: Optional[object] = None # genai.caching.CachedContent
+    expira_em: float = 0.0 # time.monotonic() em que o cache do servidor expira
+    tentar_cache_em: float = 0.0 # Depois de uma falha: quando tentar criar o cache de novo
+    atualizando: bool = False # Uma mensagem está criando ou renovando o cache no servidor agora
+
+
+class ModelosPersonas:
+    """Guarda um modelo por persona e mantém vivo o cache de contexto de cada uma."""
+
+    def __init__(self, usar_cache: bool = USAR_CACHE_CONTEXTO, ttl: int = TTL_CACHE_CONTEXTO,
+                 modelo: str = MODELO_PERSONAS):
+        self.usar_cache = usar_cache
+        self.ttl = ttl
+        self.nome_modelo = modelo
+        self._modelos = {} # persona -> ModeloPersona
+        self._lock = threading.Lock()
+        # Números para mostrar na tela
+        self.criados = 0
+        self.reaproveitados = 0
+        self.caches_criados = 0
+        self.renovacoes = 0
+        self.falhas_cache = 0
+
+    def obter(self, persona: str, instrucao_sistema: str, generation_config: dict, safety_settings: dict):
+        """
+        Modelo da persona, criado só na primeira vez.
+        Chamado a cada mensagem: é isso que renova o TTL do cache do servidor antes de ele expirar.
+        Criar e renovar o cache são chamadas de rede: rodam fora do lock, e enquanto isso as outras
+        mensagens seguem com o modelo atual (o cache antigo ainda vale durante a margem de renovação).
+        """
+        with telemetria.span("modelo.obter", persona=persona) as span:
+            with self._lock:
+                agora = time.monotonic()
+                atual = self._modelos.get(persona)
+                if atual is None:
+                    atual = ModeloPersona(self._modelo_simples(instrucao_sistema, generation_config, safety_settings))
+                    self._modelos[persona] = atual
+                    self.criados += 1
+                    span.definir(criado=True, bytes_entrada=len(instrucao_sistema))
+                else:
+                    self.reaproveitados += 1
+                    span.definir(criado=False)
+                renovar = criar = False
+                if self.usar_cache and not atual.atualizando:
+                    renovar = atual.cache is not None and atual.expira_em - agora < MARGEM_RENOVACAO
+                    criar = atual.cache is None and agora >= atual.tentar_cache_em
+                    atual.atualizando = renovar or criar
+
+            if renovar or criar:
+                try:
+                    if renovar and not self._renovar(atual, agora):
+                        # O cache pode ter expirado ou sido apagado: volta ao modelo normal e cria outro em seguida
+                        simples = self._modelo_simples(instrucao_sistema, generation_config, safety_settings)
+                        with self._lock:
+                            atual.modelo, atual.cache = simples, None
+                        criar = agora >= atual.tentar_cache_em
+                    if criar:
+                        self._criar_cache(persona, atual, instrucao_sistema, generation_config, safety_settings, agora)
+                finally:
+                    with self._lock:
+                        atual.atualizando = False
+            span.definir(cache_contexto=atual.cache is not None)
+            return atual.modelo
+
+    def _modelo_simples(self, instrucao_sistema, generation_config, safety_settings):
+        return obter_genai().GenerativeModel(
+            model_name=self.nome_modelo,
+            generation_config=generation_config,
+            safety_settings=safety_settings,
+            system_instruction=instrucao_sistema,
+        )
+
+    def _criar_cache(self, persona, atual, instrucao_sistema, generation_config, safety_settings, agora):
+        """Cria o cache no servidor (fora do lock) e troca o modelo da persona pelo que usa o cache."""
+        obter_genai() # Configura a chave antes de criar o cache no servidor
+        from google.generativeai import caching
+        try:
+            cache = caching.CachedContent.create(
+                model=f"models/{self.nome_modelo}",
+                display_name=f"ozy-{persona}"[:128],
+                system_instruction=instrucao_sistema,
+                ttl=self.ttl,
+            )
+            modelo = obter_genai().GenerativeModel.from_cached_content(
+                cache, generation_config=generation_config, safety_settings=safety_settings
+            )
+        except Exception as e:
+            # Continua com o modelo normal (instrução enviada em toda mensagem)
+            print(f"Cache de contexto indisponível para {persona}: {e}") # Debug
+            with self._lock:
+                atual.tentar_cache_em = agora + ESPERA_APOS_FALHA
+                self.falhas_cache += 1
+            return
+        with self._lock:
+            atual.modelo, atual.cache = modelo, cache
+            atual.expira_em = agora + self.ttl
+            self.caches_criados += 1
+
+    def _renovar(self, atual, agora) -> bool:
+        """Renova o TTL do cache no servidor (fora do lock)."""
+        try:
+            atual.cache.update(ttl=self.ttl)
+        except Exception as e:
+            print(f"Não foi possível renovar o cache de contexto: {e}") # Debug
+            return False
+        with self._lock:
+            atual.expira_em = agora + self.ttl
+            self.renovacoes += 1
+        return True
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                "modelos": len(self._modelos),
+                "criados": self.criados,
+                "reaproveitados": self.reaproveitados,
+                "caches_ativos": sum(1 for m in self._modelos.values() if m.cache is not None),
+                "caches_criados": self.caches_criados,
+                "renovacoes": self.renovacoes,
+                "falhas_cache": self.falhas_cache,
+            }
+
+
+# Modelos únicos do processo (todas as sessões do Streamlit usam os mesmos)
+_modelos = None
+_modelos_lock = threading.Lock()
+
+def obter_modelos() -> ModelosPersonas:
+    global _modelos
+    if _modelos is None:
+        with _modelos_lock:
+            if _modelos is None:
+                _modelos = ModelosPersonas()
+    return _modelos
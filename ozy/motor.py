@@ -0,0 +1,1196 @@
+"""
+Motor do Ozy: o pipeline de uma mensagem, sem depender do Streamlit.
+
+Tudo que antes rodava no app.py a cada mensagem fica aqui: cache semântico, roteador e Pesquisador, preparo da imagem,
+chat da persona (em stream), histórico, orçamento de tokens e complemento da pesquisa.
+Quem usa o motor (o app.py, a API HTTP em ozy/api.py, benchmarks) manda a mensagem e recebe eventos:
+
+- {"tipo": "pedido", "id"}: primeiro evento, com o id do pedido (para cancelar essa mensagem);
+- {"tipo": "aviso", "nivel": "info" | "aviso" | "erro" | "status", "texto"}: andamento do turno;
+- {"tipo": "progresso", "etapa", "segundos"}: o turno ainda espera (a vez na sessão, a pesquisa, a resposta);
+- {"tipo": "consulta", "texto"}: pergunta simplificada que o Pesquisador usou na busca;
+- {"tipo": "imagem", "hash", "resumo", "miniatura"}: a imagem do usuário já preparada;
+- {"tipo": "inicio_resposta", "persona", "complemento"}: começa uma resposta da persona;
+- {"tipo": "texto", "texto"}: um pedaço da resposta;
+- {"tipo": "fim_resposta", "texto", "tempos", "erro", "reaproveitada"}: a resposta terminou;
+- {"tipo": "fim_turno", "id_pedido", "cancelado"}.
+
+No modo "comparar personas" (OpcoesTurno.comparar) todas as personas respondem à mesma mensagem ao mesmo tempo:
+os eventos das respostas ("inicio_resposta", "texto", "fim_resposta", avisos) chegam misturados e todos levam "persona".
+
+Antes de começar, cada mensagem passa pelo controle de cotas (ozy/cotas.py): passou das cotas da sessão ou do processo,
+ou a fila da API está cheia demais, ela é recusada com um aviso de erro; com a fila cheia, ela pode seguir
+sem o Pesquisador ou só com os turnos recentes da conversa (OpcoesTurno.contexto_curto).
+
+Cada mensagem é um pedido cancelável (ozy/cancelamento.py): uma nova mensagem na sessão, cancelar() e limpar()
+param a anterior, e o que ela ainda receberia é descartado. As chamadas demoradas (pesquisa, envio à persona)
+rodam em outra thread enquanto o turno gera eventos de progresso: o Streamlit só consegue interromper
+o script entre um elemento desenhado e outro, então sem eles um turno esperando a API não pararia.
+
+As chamadas externas (chat do Gemini, Pesquisador e resumo da conversa) passam por um backend trocável
+(BackendGemini é o padrão; ozy/backend_falso.py simula tudo para os benchmarks).
+Com OZY_GRAVACAO_DIR, cada turno é gravado (ozy/gravacao.py) para ser reproduzido offline (ozy/reproducao.py).
+As sessões ficam na memória do processo, como um cache das conversas do armazém (ozy/conversas.py).
+Com vários processos e o estado compartilhado (ozy/compartilhado.py), qualquer processo atende qualquer sessão:
+se outro processo escreveu na conversa, a janela do histórico e o chat do Gemini são recriados do armazém.
+Afinidade pelo id da sessão no balanceador continua ajudando (evita essas recriações), mas não é mais obrigatória.
+"""
+import concurrent.futures
+import contextvars
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Iterator, Optional
+
+from ozy import imagens, pesquisa, telemetria
+from ozy.agendador import erro_de_limite, obter_agendador
+from ozy.antecipacao import Antecipador
+from ozy.cache import obter_cache_busca
+from ozy.cache_semantico import LIMIAR_PADRAO, MODELO_EMBEDDING, embedding_gemini, obter_cache_semantico
+from ozy.cancelamento import (MOTIVO_CLIENTE, MOTIVO_INTERROMPIDO, MOTIVO_LIMPAR, MOTIVO_NOVA_MENSAGEM, Cancelamentos,
+                              Pedido, PedidoCancelado)
+from ozy.contexto import CONFIRMACAO_RESUMO, PREFIXO_RESUMO, TEXTO_IMAGEM_OMITIDA, GerenciadorContexto, resumir_com_gemini
+from ozy.conversas import obter_armazem_conversas
+from ozy.cotas import NIVEL_CONTEXTO_CURTO, ControleCotas
+from ozy.faq import obter_armazem_faq
+from ozy.gravacao import obter_gravador
+from ozy.historico import HistoricoSessao, Mensagem, obter_armazem_blobs
+from ozy.modelos import MODELO_PERSONAS, obter_modelos
+from ozy.personas import PERSONAS, configurar_modelo_gemini
+from ozy.roteador import Roteador, perguntar_ao_modelo
+
+# Quantas sessões ficam na memória (as usadas há mais tempo saem primeiro)
+MAX_SESSOES = int(os.environ.get("OZY_MOTOR_MAX_SESSOES", 1000))
+# Segundos sem uso para uma sessão ser descartada
+TEMPO_OCIOSO = int(os.environ.get("OZY_MOTOR_TEMPO_OCIOSO", 6 * 3600))
+# Quanto uma mensagem espera a anterior da mesma sessão terminar
+ESPERA_TURNO = 30
+# De quanto em quanto tempo um turno esperando (pesquisa, resposta) gera um evento de progresso (segundos)
+INTERVALO_PROGRESSO = 0.25
+# Quanto um envio cancelado ainda espera o agendador confirmar que a chamada não saiu (segundos)
+ESPERA_DESISTENCIA = 0.2
+# Threads das chamadas demoradas (pesquisa, envio à persona) dos turnos em andamento
+MAX_THREADS = int(os.environ.get("OZY_MOTOR_THREADS", 256))
+
+# Etapas dos eventos de progresso
+ETAPA_VEZ = "vez" # Esperando a mensagem anterior da sessão terminar
+ETAPA_PESQUISA = "pesquisa"
+ETAPA_RESPOSTA = "resposta"
+ETAPA_COMPLEMENTO = "complemento"
+
+# Texto adicionado ao final de uma resposta que foi cortada no meio
+AVISO_RESPOSTA_INTERROMPIDA = "\n\n*(Resposta interrompida.)*"
+RESPOSTA_ERRO = "Desculpe, não consegui processar sua solicitação no momento."
+# Quando a API recusou por limite de uso mesmo depois das novas tentativas do agendador
+RESPOSTA_LIMITE = "Muita gente está conversando com o Ozy agora e o limite de uso da API foi atingido. Tente de novo em alguns segundos."
+# Segundos de espera prevista na fila da API a partir dos quais o usuário é avisado
+ESPERA_AVISO_FILA = 1.0
+
+
+# =============================================================================
+# Backend (chamadas externas)
+# =============================================================================
+
+class BackendGemini:
+    """Backend padrão: chats do Gemini com os modelos compartilhados das personas e o Pesquisador (agentes do ADK)."""
+
+    def iniciar_chat(self, persona: str):
+        # history=[] garante que a conversa comece do zero para o MODELO na nova sessão
+        return configurar_modelo_gemini(persona).start_chat(history=[])
+
+    def atualizar_chat(self, chat_session, persona: str):
+        # Pede o modelo de novo: renova o TTL do cache de contexto e, se o cache foi recriado, passa a usar o novo
+        chat_session.model = configurar_modelo_gemini(persona)
+
+    def pesquisar(self, prompt: str, id_sessao: str, modo: str, antecipado: Optional[str] = None,
+                  cancelado: Optional[threading.Event] = None):
+        return pesquisa.pesquisar(prompt, id_sessao, modo, antecipado=antecipado, cancelado=cancelado)
+
+    def pesquisar_em_segundo_plano(self, prompt: str, id_sessao: str, antecipado: Optional[str] = None,
+                                   cancelado: Optional[threading.Event] = None):
+        return pesquisa.pesquisar_em_segundo_plano(prompt, id_sessao, antecipado=antecipado, cancelado=cancelado)
+
+    async def classificar_imagem_async(self, dados: bytes) -> dict:
+        # Pesquisa antecipada: qual jogo e qual tela aparecem no print
+        return await pesquisa.classificar_tela(dados)
+
+    async def buscar_assunto_async(self, consulta: str, id_sessao: str):
+        return await pesquisa.buscar_assunto(consulta, id_sessao)
+
+    def decidir_pesquisa(self, prompt: str, id_sessao: Optional[str] = None) -> bool:
+        # Roteador do Pesquisador: o modelo barato diz se a pergunta precisa de dados da internet
+        return perguntar_ao_modelo(prompt)
+
+    def resumir(self, texto: str) -> str:
+        # Resumo da conversa antiga, quando o histórico passa do orçamento de tokens
+        return resumir_com_gemini(texto)
+
+    # Embeddings das perguntas (respostas prontas do FAQ, ozy/lote.py): o mesmo modelo do cache semântico
+    modelo_embedding = MODELO_EMBEDDING
+
+    def embedding(self, texto: str) -> list:
+        return embedding_gemini(texto)
+
+
+# =============================================================================
+# Sessões e Opções
+# =============================================================================
+
+@dataclass
+class OpcoesTurno:
+    """O que o usuário escolheu na tela para esta mensagem."""
+    persona: str = PERSONAS[0]
+    agentes_ativos: bool = False
+    modo_pesquisa: str = pesquisa.MODO_SEQUENCIAL
+    stream: bool = True
+    cache_semantico_ativo: bool = False
+    limiar_semantico: float = LIMIAR_PADRAO
+    antecipar: bool = False # Pesquisa antecipada (ozy/antecipacao.py): usa e mantém o contexto pesquisado antes
+    forcar_pesquisa: bool = False # Pesquisa em toda mensagem, sem passar pelo roteador (ozy/roteador.py)
+    comparar: bool = False # Todas as personas respondem à mesma mensagem, ao mesmo tempo (ver _turno_comparado)
+    contexto_curto: bool = False # Só os turnos recentes vão junto (ligado pelas cotas com a fila da API cheia)
+
+
+@dataclass
+class SessaoOzy:
+    """Tudo que o motor guarda de um usuário: histórico de exibição e, por persona, o chat do Gemini."""
+    id: str
+    historico: HistoricoSessao = field(default_factory=HistoricoSessao)
+    chats: dict = field(default_factory=dict) # persona -> chat_session do Gemini
+    contextos: dict = field(default_factory=dict) # persona -> GerenciadorContexto
+    imagens_enviadas: dict = field(default_factory=dict) # persona -> hashes das imagens já enviadas ao Gemini
+    lock: threading.Lock = field(default_factory=threading.Lock) # Uma mensagem por vez em cada sessão
+    pedido: Optional[Pedido] = None # Pedido da mensagem mais recente (em andamento ou já terminado)
+    ultimo_uso: float = field(default_factory=time.monotonic)
+
+
+def guardar_uso_tokens(tempos, resposta):
+    """Copia a contagem real de tokens (usage_metadata) da resposta do Gemini para os tempos do turno."""
+    try:
+        uso = resposta.usage_metadata
+        tempos["tokens_entrada"] = uso.prompt_token_count
+        tempos["tokens_saida"] = uso.candidates_token_count
+        tempos["tokens_em_cache"] = uso.cached_content_token_count # Parte da entrada que veio do cache de contexto
+    except Exception:
+        pass # Sem metadados de uso: o rastro fica só com a estimativa local
+
+
+def sem_contexto_de_pesquisa(conteudo):
+    """Cópia do conteúdo do chat sem a parte com o contexto da pesquisa (None se ele não tinha essa parte)."""
+    partes = [parte for parte in conteudo.parts if pesquisa.MARCADOR_CONTEXTO not in parte.text]
+    if len(partes) == len(conteudo.parts):
+        return None
+    return type(conteudo)(role=conteudo.role, parts=partes)
+
+
+def tirar_contexto_do_historico(chat_session):
+    """
+    O contexto da pesquisa vale só para a resposta do turno: depois dela, sai da última mensagem do usuário
+    no histórico do chat (senão ele iria de novo, inteiro, em todas as mensagens seguintes).
+    """
+    try:
+        historico = list(chat_session.history)
+        for indice in range(len(historico) - 1, max(-1, len(historico) - 3), -1):
+            if historico[indice].role == "user":
+                conteudo = sem_contexto_de_pesquisa(historico[indice])
+                if conteudo is not None:
+                    historico[indice] = conteudo
+                    chat_session.history = historico
+                return
+    except Exception as e:
+        print(f"Não foi possível tirar o contexto da pesquisa do histórico: {e}") # Debug
+
+
+def descartar_turno_incompleto(chat_session, texto_parcial):
+    """
+    Desfaz no chat_session um turno cujo stream não terminou (erro ou cancelamento).
+    Sem isso o Gemini recusa a próxima mensagem com 'BrokenResponseError'.
+    Se já havia texto, o turno é recolocado com a parte que chegou, para o modelo saber o que já disse.
+    """
+    try:
+        if chat_session._last_received is not None:
+            # Turno pendente de um stream parado no meio: rewind() (e o getter de history) leriam a resposta
+            # inteira e falhariam com IncompleteIterationError. Ele ainda não entrou em _history: basta descartá-lo
+            mensagem_enviada = chat_session._last_sent
+            historico = list(chat_session._history)
+            chat_session._last_sent = None
+            chat_session._last_received = None
+        else:
+            mensagem_enviada, _ = chat_session.rewind()
+            historico = list(chat_session.history)
+        if texto_parcial:
+            # O contexto da pesquisa também não fica no turno recolocado
+            mensagem_enviada = sem_contexto_de_pesquisa(mensagem_enviada) or mensagem_enviada
+            historico += [mensagem_enviada, {"role": "model", "parts": [texto_parcial]}]
+        chat_session.history = historico
+    except Exception as e:
+        print(f"Não foi possível desfazer o turno incompleto: {e}") # Debug
+
+
+def fechar_stream(resposta):
+    """Fecha o stream de uma resposta que não vai mais ser lida: a API para de gerar (e de cobrar) o resto."""
+    iterador = getattr(resposta, "_iterator", None)
+    for metodo in ("cancel", "close"): # gRPC cancela a chamada; no REST (e no backend falso) o stream é um gerador
+        if hasattr(iterador, metodo):
+            try:
+                getattr(iterador, metodo)()
+            except Exception as e:
+                print(f"Não foi possível fechar o stream da resposta: {e}") # Debug
+            return
+
+
+def _fechar_se_stream(futuro):
+    """Callback de um envio abandonado: se a resposta chegar em stream, ela é fechada logo no primeiro pedaço."""
+    if not futuro.cancelled() and futuro.exception() is None:
+        fechar_stream(futuro.result())
+
+
+# Threads das chamadas que o turno espera sem ficar travado (ver MotorOzy._aguardar)
+_executor = ThreadPoolExecutor(max_workers=MAX_THREADS, thread_name_prefix="ozy-motor")
+
+# Threads que leem a resposta de cada persona no modo comparar. Ficam separadas porque esperam chamadas
+# do _executor (o envio ao Gemini): no mesmo pool, elas poderiam ocupar todas as threads e travar o que esperam
+_executor_comparar = ThreadPoolExecutor(max_workers=MAX_THREADS, thread_name_prefix="ozy-comparar")
+
+def em_segundo_plano(funcao, *args, **kwargs):
+    """Roda a chamada em outra thread e retorna o Future (o span ativo vai junto, como na pesquisa em segundo plano)."""
+    return _executor.submit(contextvars.copy_context().run, funcao, *args, **kwargs)
+
+
+def _para_fila(eventos, persona: str, fila: queue.Queue):
+    """Consome os eventos de uma resposta (modo comparar) e passa para a fila com a persona. None marca o fim."""
+    try:
+        for evento in eventos:
+            if evento["tipo"] != "progresso": # Quem lê a fila gera o próprio progresso
+                fila.put(dict(evento, persona=persona))
+    finally:
+        fila.put(None)
+
+
+# =============================================================================
+# Motor
+# =============================================================================
+
+class MotorOzy:
+    """Guarda as sessões e roda o pipeline de cada mensagem."""
+
+    def __init__(self, backend=None, max_sessoes: int = MAX_SESSOES, tempo_ocioso: float = TEMPO_OCIOSO,
+                 armazem_conversas=None):
+        self.backend = backend or BackendGemini()
+        # Gravação dos turnos para reprodução offline (ozy/gravacao.py), só com OZY_GRAVACAO_DIR:
+        # o backend é envolvido antes de tudo para as pesquisas e o roteador também ficarem gravados
+        self.gravador = obter_gravador()
+        if self.gravador is not None:
+            self.backend = self.gravador.envolver(self.backend)
+        # Log durável das conversas (ozy/conversas.py): sessões descartadas ou de outro processo voltam dele
+        self.armazem_conversas = armazem_conversas or obter_armazem_conversas()
+        self.antecipador = Antecipador(self.backend)
+        self.roteador = Roteador(self.backend)
+        self.cancelamentos = Cancelamentos()
+        self.cotas = ControleCotas()
+        if obter_armazem_faq() is not None:
+            # Respostas e pesquisas prontas do FAQ entram nos caches já na partida, não na primeira mensagem
+            obter_cache_semantico()
+            obter_cache_busca()
+        self.max_sessoes = max_sessoes
+        self.tempo_ocioso = tempo_ocioso
+        self._sessoes = OrderedDict() # id -> SessaoOzy, da usada há mais tempo para a mais recente
+        self._lock = threading.Lock()
+
+    # --- Sessões -----------------------------------------------------------
+
+    def sessao(self, id_sessao: str) -> SessaoOzy:
+        """Sessão com esse id (criada na primeira vez). Sessões antigas ou paradas há muito tempo são descartadas."""
+        with self._lock:
+            sessao = self._sessoes.get(id_sessao)
+            if sessao is None:
+                historico = HistoricoSessao(usuario=id_sessao, armazem=self.armazem_conversas)
+                sessao = self._sessoes[id_sessao] = SessaoOzy(id_sessao, historico=historico)
+            else:
+                self._sessoes.move_to_end(id_sessao)
+            sessao.ultimo_uso = time.monotonic()
+            self._descartar_antigas(id_sessao)
+            return sessao
+
+    def emitir_retomada(self, id_sessao: str) -> Optional[str]:
+        """Token para voltar a esta sessão depois (a tela guarda ele no lugar do id). None sem armazém de conversas."""
+        if self.armazem_conversas is None:
+            return None
+        return self.armazem_conversas.emitir_retomada(id_sessao)
+
+    def retomar(self, token: str) -> Optional[str]:
+        """Id da sessão de um token de retomada (que é gasto), ou None se ele não vale."""
+        if self.armazem_conversas is None:
+            return None
+        return self.armazem_conversas.retomar(token)
+
+    def _descartar_antigas(self, id_atual: str):
+        limite = time.monotonic() - self.tempo_ocioso
+        for id_antiga in list(self._sessoes):
+            antiga = self._sessoes[id_antiga]
+            if id_antiga == id_atual or (len(self._sessoes) <= self.max_sessoes and antiga.ultimo_uso >= limite):
+                break # Daqui em diante todas são mais recentes
+            if not antiga.lock.locked(): # Nunca descarta uma sessão no meio de uma mensagem
+                del self._sessoes[id_antiga]
+                self.antecipador.cancelar(id_antiga)
+                self.cotas.esquecer(id_antiga)
+
+    def mensagens(self, id_sessao: str, persona: str, ultimas: Optional[int] = None,
+                  antes_de: Optional[int] = None, depois_de: Optional[int] = None) -> list:
+        """
+        Histórico de exibição da persona, da mais antiga para a mais nova.
+        antes_de/depois_de filtram pelo 'seq' das mensagens e 'ultimas' limita às N mais recentes do que sobrou:
+        a tela pede só as mensagens novas (depois_de) ou uma página de anteriores (antes_de + ultimas).
+        """
+        sessao = self.sessao(id_sessao)
+        if sessao.lock.acquire(blocking=False): # No meio de uma mensagem a memória já é a mais nova
+            try:
+                self._sincronizar(sessao, persona)
+            finally:
+                sessao.lock.release()
+        return sessao.historico.pagina(persona, ultimas, antes_de, depois_de)
+
+    def _sincronizar(self, sessao: SessaoOzy, persona: str):
+        """Outro processo escreveu na conversa: o chat do Gemini desta memória ficou velho e é recriado do armazém."""
+        if sessao.historico.sincronizar(persona):
+            self._esquecer_chat(sessao, persona)
+
+    def _esquecer_chat(self, sessao: SessaoOzy, persona: str):
+        """Tira o chat do Gemini da persona da memória: a próxima mensagem recria ele a partir do armazém."""
+        sessao.chats.pop(persona, None)
+        sessao.imagens_enviadas.pop(persona, None)
+        sessao.contextos.pop(persona, None)
+
+    def limpar(self, id_sessao: str, persona: str):
+        """Apaga a conversa da persona: histórico de exibição, chat do Gemini e orçamento de tokens."""
+        sessao = self.sessao(id_sessao)
+        self.antecipador.cancelar(id_sessao) # O que estava sendo pesquisado para a conversa antiga não serve mais
+        self.cancelar(id_sessao, MOTIVO_LIMPAR, persona=persona) # A resposta em andamento não entra na conversa limpa
+        with sessao.lock:
+            sessao.historico.limpar(persona)
+            self._esquecer_chat(sessao, persona)
+
+    def cancelar(self, id_sessao: str, motivo: str = MOTIVO_CLIENTE, persona: Optional[str] = None,
+                 id_pedido: Optional[str] = None) -> bool:
+        """
+        Cancela a mensagem em andamento na sessão (só se for da persona ou do id de pedido, quando passados).
+        Retorna True se havia uma para cancelar. O turno cancelado termina logo e descarta o que ainda chegaria.
+        """
+        with self._lock:
+            sessao = self._sessoes.get(id_sessao)
+        pedido = sessao.pedido if sessao is not None else None
+        if pedido is None or (persona and pedido.persona != persona) or (id_pedido and pedido.id != id_pedido):
+            return False
+        return pedido.cancelar(motivo)
+
+    def estatisticas(self, id_sessao: str, persona: str) -> dict:
+        """Números para a tela: memória do histórico, tokens por turno e os caches do processo."""
+        sessao = self.sessao(id_sessao)
+        gerenciador = sessao.contextos.get(persona)
+        return {
+            "historico": {
+                "mensagens": len(sessao.historico),
+                "bytes": sessao.historico.bytes_usados(),
+                "max_bytes": sessao.historico.max_bytes,
+                "removidas": sessao.historico.removidas,
+            },
+            "orcamento_tokens": gerenciador.orcamento if gerenciador else None,
+            "rastro": list(gerenciador.rastro[-10:]) if gerenciador else [],
+            "cache_busca": obter_cache_busca().estatisticas(),
+            "cache_semantico": obter_cache_semantico().relatorio(),
+            "modelos": obter_modelos().estatisticas() if obter_modelos().usar_cache else None,
+            "etapas": telemetria.obter_rastreador().ultimas_etapas(id_sessao), # Painel de depuração
+            "agendador": obter_agendador().estatisticas(), # Fila da API (todas as sessões do processo)
+            "antecipacao": self.antecipador.estatisticas(id_sessao),
+            "roteador": self.roteador.estatisticas(),
+            "cancelamentos": self.cancelamentos.estatisticas(),
+            "cotas": self.cotas.estatisticas(id_sessao),
+            "gravacao": self.gravador.estatisticas() if self.gravador is not None else None,
+        }
+
+    def preparar_imagem(self, dados: bytes):
+        """Começa a preparar a imagem em segundo plano (Future). A mesma imagem não é preparada duas vezes."""
+        return imagens.preparar_em_segundo_plano(dados)
+
+    def antecipar(self, id_sessao: str, imagem: bytes):
+        """Pesquisa antecipada: o print chegou antes da pergunta, o Pesquisador já começa pelo jogo dele."""
+        self.sessao(id_sessao) # Mantém a sessão viva (e dentro do limite de sessões)
+        self.antecipador.antecipar_imagem(id_sessao, imagem)
+
+    # --- Mensagens ---------------------------------------------------------
+
+    def conversar(self, id_sessao: str, prompt: str, opcoes: Optional[OpcoesTurno] = None,
+                  imagem: Optional[bytes] = None, cancelado: Optional[threading.Event] = None) -> Iterator[dict]:
+        """
+        Processa uma mensagem do usuário e gera os eventos do turno.
+        Se quem consome parar no meio (close() no gerador), o que já chegou da resposta fica salvo no histórico.
+        A mensagem anterior da sessão, se ainda estiver em andamento, é cancelada.
+        'cancelado' permite parar o turno de outra thread (ex.: cliente HTTP desconectou).
+        """
+        opcoes = opcoes or OpcoesTurno()
+        eventos = self._conversar(id_sessao, prompt, opcoes, imagem, cancelado)
+        if self.gravador is None or not self.gravador.amostrada(id_sessao):
+            return eventos
+        return self.gravador.gravar_turno(eventos, id_sessao, prompt, opcoes, imagem)
+
+    def _conversar(self, id_sessao: str, prompt: str, opcoes: OpcoesTurno, imagem: Optional[bytes],
+                   cancelado: Optional[threading.Event]) -> Iterator[dict]:
+        sessao = self.sessao(id_sessao)
+        pedido = Pedido(opcoes.persona, sinal=cancelado or threading.Event())
+        with self._lock:
+            anterior, sessao.pedido = sessao.pedido, pedido
+        if anterior is not None:
+            anterior.cancelar(MOTIVO_NOVA_MENSAGEM)
+        try:
+            yield {"tipo": "pedido", "id": pedido.id}
+            inicio_espera = time.perf_counter()
+            if not (yield from self._esperar_vez(sessao, pedido)):
+                if pedido.cancelado:
+                    yield from self._turno_cancelado(sessao, pedido, [prompt])
+                else:
+                    yield {"tipo": "aviso", "nivel": "erro", "texto": "Ainda existe uma mensagem em andamento nesta sessão."}
+                    yield self._fim_turno(pedido)
+                return
+            # Daqui até o fim do turno, qualquer erro (cotas, span, o turno em si) ainda solta o lock da sessão
+            travada = True
+            try:
+                # Cotas e carga da fila da API: a mensagem pode ser recusada ou seguir com menos trabalho
+                admissao = self.cotas.admitir(id_sessao, geracoes=len(PERSONAS) if opcoes.comparar else 1,
+                                              bytes_imagem=len(imagem or b""), pesquisa=opcoes.agentes_ativos)
+                if not admissao.aceita:
+                    sessao.lock.release() # Antes dos eventos: a próxima mensagem não espera quem consome estes
+                    travada = False
+                    yield {"tipo": "aviso", "nivel": "erro", "texto": admissao.avisos[0]}
+                    yield self._fim_turno(pedido)
+                    return
+                if admissao.sem_pesquisa or admissao.nivel >= NIVEL_CONTEXTO_CURTO:
+                    opcoes = replace(opcoes, agentes_ativos=opcoes.agentes_ativos and not admissao.sem_pesquisa,
+                                     contexto_curto=opcoes.contexto_curto or admissao.nivel >= NIVEL_CONTEXTO_CURTO)
+                # Span do turno inteiro: atravessa os yields, então é terminado à mão (ver ozy/telemetria.py)
+                span_turno = telemetria.iniciar_span(
+                    "turno", id_sessao=id_sessao, persona=opcoes.persona, pesquisador=opcoes.agentes_ativos,
+                    modo_pesquisa=opcoes.modo_pesquisa if opcoes.agentes_ativos else None, imagem=imagem is not None,
+                    stream=opcoes.stream, comparar=opcoes.comparar, bytes_entrada=len(prompt) + len(imagem or b""),
+                    espera_sessao_s=round(time.perf_counter() - inicio_espera, 4), id_pedido=pedido.id,
+                    degradada=admissao.motivo, contexto_curto=opcoes.contexto_curto or None,
+                )
+                erro_turno = None
+                try:
+                    for texto in admissao.avisos:
+                        yield {"tipo": "aviso", "nivel": "aviso", "texto": texto}
+                    if opcoes.comparar:
+                        for persona in PERSONAS:
+                            self._sincronizar(sessao, persona)
+                        yield from self._turno_comparado(sessao, prompt, opcoes, imagem, pedido, span_turno)
+                    else:
+                        self._sincronizar(sessao, opcoes.persona)
+                        yield from self._turno(sessao, prompt, opcoes, imagem, pedido, span_turno)
+                except GeneratorExit:
+                    erro_turno = "interrompido"
+                    raise
+                except BaseException as e:
+                    erro_turno = f"{type(e).__name__}: {e}"
+                    raise
+                finally:
+                    if pedido.foi_cancelado():
+                        span_turno.definir(cancelado=pedido.motivo or MOTIVO_CLIENTE)
+                    span_turno.terminar(erro_turno)
+                    self.cotas.liberar(admissao)
+                    if opcoes.contexto_curto and sessao.historico.armazem is not None:
+                        # O chat enxugado não serve para as próximas mensagens: elas recriam ele do armazém, completo.
+                        # Sem armazém não há de onde recriar e a conversa fica só com os turnos recentes
+                        for persona in (PERSONAS if opcoes.comparar else [opcoes.persona]):
+                            sessao.chats.pop(persona, None)
+                            sessao.imagens_enviadas.pop(persona, None)
+                    sessao.ultimo_uso = time.monotonic()
+            finally:
+                if travada:
+                    sessao.lock.release()
+        except GeneratorExit:
+            pedido.cancelar(MOTIVO_INTERROMPIDO) # O que ainda roda em segundo plano para esta mensagem também para
+            raise
+        finally:
+            self._encerrar_pedido(sessao, pedido)
+
+    def _esperar_vez(self, sessao: SessaoOzy, pedido: Pedido):
+        """Espera a mensagem anterior da sessão terminar. Retorna False se o pedido foi cancelado ou cansou de esperar."""
+        inicio = time.perf_counter()
+        while not sessao.lock.acquire(timeout=INTERVALO_PROGRESSO):
+            segundos = time.perf_counter() - inicio
+            if pedido.cancelado or segundos >= ESPERA_TURNO:
+                return False
+            yield {"tipo": "progresso", "etapa": ETAPA_VEZ, "segundos": round(segundos, 1)}
+        if pedido.cancelado: # Uma mensagem mais nova chegou enquanto esta esperava
+            sessao.lock.release()
+            return False
+        return True
+
+    def _aguardar(self, futuro, pedido: Pedido, etapa: str):
+        """
+        Espera o Future gerando eventos de progresso (quem consome pode parar o turno entre um e outro).
+        Retorna o resultado, ou None se o pedido foi cancelado antes dele chegar.
+        """
+        inicio = time.perf_counter()
+        while True:
+            try:
+                return futuro.result(timeout=INTERVALO_PROGRESSO)
+            except concurrent.futures.TimeoutError:
+                if pedido.cancelado:
+                    return None
+                yield {"tipo": "progresso", "etapa": etapa, "segundos": round(time.perf_counter() - inicio, 1)}
+
+    def _fim_turno(self, pedido: Pedido) -> dict:
+        pedido.concluir()
+        return {"tipo": "fim_turno", "id_pedido": pedido.id, "cancelado": pedido.foi_cancelado()}
+
+    def _turno_cancelado(self, sessao: SessaoOzy, pedido: Pedido, conteudo_para_enviar: list):
+        """O pedido foi cancelado antes da resposta da persona: ela não é pedida, e o turno termina aqui."""
+        self._resposta_evitada(sessao, pedido, conteudo_para_enviar)
+        yield {"tipo": "aviso", "nivel": "info", "texto": f"Mensagem cancelada: {pedido.texto_motivo()}."}
+        yield self._fim_turno(pedido)
+
+    def _resposta_evitada(self, sessao: SessaoOzy, pedido: Pedido, conteudo_para_enviar: list):
+        """
+        Conta a chamada à persona que o cancelamento evitou. Os tokens são estimados: a entrada do último turno
+        (o histórico que iria junto) mais a mensagem, e a saída de uma resposta típica.
+        """
+        gerenciador = sessao.contextos.get(pedido.persona)
+        ultimo_turno = gerenciador.rastro[-1] if gerenciador and gerenciador.rastro else {}
+        entrada = (ultimo_turno.get("tokens_entrada") or ultimo_turno.get("historico_estimado") or 0) + sum(
+            len(parte) // 4 if isinstance(parte, str) else 258 for parte in conteudo_para_enviar
+        )
+        pedido.chamadas_evitadas += 1
+        pedido.tokens_economizados += entrada + self.cancelamentos.media_saida()
+
+    def _encerrar_pedido(self, sessao: SessaoOzy, pedido: Pedido):
+        pedido.concluir()
+        if pedido.foi_cancelado():
+            self.cancelamentos.registrar(pedido)
+        with self._lock:
+            if sessao.pedido is pedido:
+                sessao.pedido = None
+
+    def _turno(self, sessao: SessaoOzy, prompt: str, opcoes: OpcoesTurno, imagem: Optional[bytes], pedido: Pedido,
+               span_turno: telemetria.Span):
+        # Marca o início do turno, para saber quanto tempo a resposta custou
+        inicio_turno = time.perf_counter()
+        persona = opcoes.persona
+
+        # Cache semântico: só na primeira mensagem da conversa e sem imagem, quando o histórico não muda a resposta.
+        # As respostas prontas do FAQ (ozy/faq.py) valem mesmo com o cache desligado, para a mesma pergunta
+        consulta_semantica = None
+        if imagem is None and (opcoes.cache_semantico_ativo or obter_cache_semantico().tem_faq()) \
+                and sessao.historico.vazia(persona):
+            consulta_semantica = obter_cache_semantico().consultar(persona, prompt, opcoes.limiar_semantico,
+                                                                   so_faq=not opcoes.cache_semantico_ativo)
+        # Se achou uma pergunta parecida já respondida, nem a pesquisa nem o modelo são chamados
+        resposta_reaproveitada = consulta_semantica.resposta if consulta_semantica else None
+
+        # Pesquisador Ozy (só com o switch ativado)
+        resultado_busca = None
+        consulta_pesquisada = None # Vira assunto da pesquisa antecipada dos próximos turnos
+        pesquisa_em_andamento = None # No modo "complemento" a pesquisa roda enquanto a persona já responde
+        if opcoes.agentes_ativos and resposta_reaproveitada is None:
+            pesquisada = yield from self._pesquisar(sessao, prompt, imagem, opcoes, pedido, span_turno)
+            if pesquisada is None:
+                yield from self._turno_cancelado(sessao, pedido, [prompt])
+                return
+            resultado_pesquisa, pesquisa_em_andamento = pesquisada
+            if resultado_pesquisa is not None:
+                resultado_busca = resultado_pesquisa.contexto
+                consulta_pesquisada = resultado_pesquisa.consulta
+
+        # Chat do Gemini da persona (novo ou existente). Antes da imagem: recriar ou enxugar o chat muda
+        # quais imagens já estão no histórico do Gemini
+        chat_session, gerenciador_contexto, tokens_historico_antes = self._preparar_chat(
+            sessao, persona, span_turno, opcoes.contexto_curto)
+
+        # Conteúdo enviado ao Gemini: imagem (se houver), prompt do usuário e resultado da busca
+        conteudo_para_enviar = []
+        imagem_preparada = None
+        imagem_nova = False # True quando a imagem vai de fato para o Gemini neste turno
+        if imagem is not None:
+            imagem_preparada = yield from self._imagem_do_turno(imagem, span_turno)
+            parte, imagem_nova = self._parte_da_imagem(sessao, persona, imagem_preparada)
+            conteudo_para_enviar.append(parte)
+        conteudo_para_enviar.append(prompt)
+        if resultado_busca:
+            conteudo_para_enviar.append(pesquisa.formatar_contexto(resultado_busca, prompt))
+            yield {"tipo": "aviso", "nivel": "info", "texto": "Resultado da busca incluído no prompt para a IA principal."}
+
+        # Cancelada enquanto a imagem e o chat eram preparados: a pergunta nem entra no histórico
+        if pedido.cancelado:
+            if pesquisa_em_andamento is not None:
+                pedido.pesquisas_canceladas += 1
+            yield from self._turno_cancelado(sessao, pedido, conteudo_para_enviar)
+            return
+
+        # Mensagem do usuário no histórico de exibição
+        self._guardar_no_historico(sessao, persona, self._mensagem_usuario(prompt, imagem_preparada), span_turno)
+
+        # Resposta da persona
+        yield {"tipo": "inicio_resposta", "persona": persona, "complemento": False}
+        reaproveitada = None
+        if resposta_reaproveitada is not None:
+            resposta_ia, tempos_resposta, erro = resposta_reaproveitada, None, None
+            reaproveitada = {"similaridade": consulta_semantica.similaridade,
+                             "latencia_economizada": consulta_semantica.latencia_economizada,
+                             "faq": consulta_semantica.do_faq}
+            # O modelo precisa conhecer essa troca para entender as próximas mensagens da conversa
+            chat_session.history = list(chat_session.history) + [
+                {"role": "user", "parts": [prompt]},
+                {"role": "model", "parts": [resposta_ia]},
+            ]
+            yield {"tipo": "texto", "texto": resposta_ia}
+        else:
+            resposta_ia, tempos_resposta, erro = yield from self._responder(
+                sessao, persona, chat_session, conteudo_para_enviar, opcoes, pedido, span_turno=span_turno
+            )
+            if resultado_busca and not pedido.cancelado: # Cancelado, o chat pode ter sido descartado (ver _enviar)
+                tirar_contexto_do_historico(chat_session)
+        # Vai para o histórico antes do evento: se o consumidor parar logo depois, a resposta não se perde
+        if resposta_ia is not None:
+            self._adicionar_resposta(sessao, persona, resposta_ia, tempos_resposta, span_turno)
+        yield {"tipo": "fim_resposta", "texto": resposta_ia, "tempos": tempos_resposta, "erro": erro,
+               "reaproveitada": reaproveitada}
+        resposta_completa = bool(tempos_resposta) and tempos_resposta.get("total") is not None
+
+        # A imagem só conta como enviada se a resposta chegou (senão o turno não ficou no histórico do Gemini)
+        if imagem_nova and resposta_completa:
+            sessao.imagens_enviadas[persona].add(imagem_preparada.hash)
+
+        # Guarda no cache semântico as respostas novas que chegaram completas (nunca as de erro)
+        if consulta_semantica is not None and resposta_reaproveitada is None and resposta_completa:
+            obter_cache_semantico().guardar(consulta_semantica, resposta_ia, time.perf_counter() - inicio_turno)
+
+        # Modo complemento: espera a pesquisa terminar e pede para a persona complementar a resposta
+        resultado_complemento = None
+        if pesquisa_em_andamento is not None and not pedido.cancelado:
+            yield {"tipo": "aviso", "nivel": "status", "texto": "Pesquisador Ozy terminando a pesquisa..."}
+            span = telemetria.iniciar_span("pesquisa.aguardar", pai=span_turno)
+            try:
+                resultado_complemento = yield from self._aguardar(pesquisa_em_andamento, pedido, ETAPA_COMPLEMENTO)
+            except GeneratorExit:
+                span.terminar("interrompido")
+                raise
+            if resultado_complemento is not None and not resultado_complemento.cancelada and not pedido.cancelado:
+                span.definir(do_cache=resultado_complemento.do_cache, erro_pesquisa=resultado_complemento.erro,
+                             bytes_saida=len(resultado_complemento.contexto or ""))
+                span.terminar()
+            else:
+                span.terminar("cancelado")
+                if resultado_complemento is not None and not resultado_complemento.cancelada:
+                    pedido.resultados_descartados += 1 # Chegou, mas a mensagem já foi cancelada
+                resultado_complemento = None
+        if pesquisa_em_andamento is not None and resultado_complemento is None and pedido.cancelado:
+            pedido.pesquisas_canceladas += 1
+        if resultado_complemento is not None:
+            consulta_pesquisada = resultado_complemento.consulta
+            if not resultado_complemento.do_cache and not resultado_complemento.erro:
+                self.roteador.registrar_pesquisa(resultado_complemento.duracao_total)
+            if resultado_complemento.erro:
+                yield {"tipo": "aviso", "nivel": "aviso",
+                       "texto": f"O Pesquisador Ozy não conseguiu completar a pesquisa: {resultado_complemento.erro}"}
+            if resultado_complemento.contexto:
+                yield {"tipo": "inicio_resposta", "persona": persona, "complemento": True}
+                complemento, tempos_complemento, erro_complemento = yield from self._responder(
+                    sessao, persona, chat_session,
+                    [pesquisa.PEDIDO_COMPLEMENTO, pesquisa.formatar_contexto(resultado_complemento.contexto, prompt)],
+                    opcoes, pedido, prefixo="🔎 ", span_turno=span_turno
+                )
+                if not pedido.cancelado:
+                    tirar_contexto_do_historico(chat_session)
+                if complemento is not None:
+                    self._adicionar_resposta(sessao, persona, "🔎 " + complemento, tempos_complemento, span_turno)
+                yield {"tipo": "fim_resposta", "texto": complemento, "tempos": tempos_complemento,
+                       "erro": erro_complemento, "reaproveitada": None}
+
+        # Registra os tokens do turno e, se o histórico passou do orçamento, compacta antes da próxima mensagem
+        gerenciador_contexto.registrar_turno(tempos_resposta, tokens_historico_antes)
+        if resposta_completa and not pedido.cancelado and not opcoes.contexto_curto: # Enxugado, o chat é recriado
+            yield from self._compactar(sessao, persona, chat_session, gerenciador_contexto, span_turno)
+
+        # Pesquisa antecipada: o assunto deste turno continua pesquisado em segundo plano para os próximos
+        if opcoes.antecipar and opcoes.agentes_ativos and not pedido.cancelado:
+            self.antecipador.refrescar(sessao.id, consulta_pesquisada)
+
+        if pedido.cancelado:
+            yield {"tipo": "aviso", "nivel": "info", "texto": f"Mensagem cancelada: {pedido.texto_motivo()}."}
+        yield self._fim_turno(pedido)
+
+    def _turno_comparado(self, sessao: SessaoOzy, prompt: str, opcoes: OpcoesTurno, imagem: Optional[bytes],
+                         pedido: Pedido, span_turno: telemetria.Span):
+        """
+        Modo "comparar personas": a mesma mensagem respondida por todas as personas ao mesmo tempo.
+        A pesquisa roda uma vez só e o mesmo contexto vai para todas (no modo complemento ela termina antes
+        das respostas, como no agente único). Cada resposta é lida numa thread e os eventos dela chegam
+        misturados, com a persona: o turno leva quase o mesmo que uma resposta só. O cache semântico não é consultado.
+        """
+        resultado_busca = None
+        consulta_pesquisada = None
+        if opcoes.agentes_ativos:
+            pesquisada = yield from self._pesquisar(sessao, prompt, imagem, opcoes, pedido, span_turno, complemento=False)
+            if pesquisada is None:
+                for _ in PERSONAS[1:]:
+                    self._resposta_evitada(sessao, pedido, [prompt])
+                yield from self._turno_cancelado(sessao, pedido, [prompt])
+                return
+            resultado_pesquisa, _ = pesquisada
+            if resultado_pesquisa is not None:
+                resultado_busca = resultado_pesquisa.contexto
+                consulta_pesquisada = resultado_pesquisa.consulta
+
+        imagem_preparada = None
+        if imagem is not None:
+            imagem_preparada = yield from self._imagem_do_turno(imagem, span_turno)
+
+        # Conteúdo e chat de cada persona (a imagem pode já estar no histórico do Gemini de uma e não da outra)
+        envios = {}
+        for persona in PERSONAS:
+            chat_session, gerenciador_contexto, tokens_historico_antes = self._preparar_chat(
+                sessao, persona, span_turno, opcoes.contexto_curto)
+            conteudo_para_enviar = []
+            imagem_nova = False
+            if imagem_preparada is not None:
+                parte, imagem_nova = self._parte_da_imagem(sessao, persona, imagem_preparada)
+                conteudo_para_enviar.append(parte)
+            conteudo_para_enviar.append(prompt)
+            if resultado_busca:
+                conteudo_para_enviar.append(pesquisa.formatar_contexto(resultado_busca, prompt))
+            envios[persona] = {"chat_session": chat_session, "gerenciador_contexto": gerenciador_contexto,
+                               "tokens_historico_antes": tokens_historico_antes,
+                               "conteudo_para_enviar": conteudo_para_enviar, "imagem_nova": imagem_nova}
+        if resultado_busca:
+            yield {"tipo": "aviso", "nivel": "info", "texto": "Resultado da busca incluído no prompt das duas personas."}
+
+        # Cancelada enquanto a imagem e os chats eram preparados: nenhuma persona é chamada
+        if pedido.cancelado:
+            for persona in PERSONAS[1:]:
+                self._resposta_evitada(sessao, pedido, envios[persona]["conteudo_para_enviar"])
+            yield from self._turno_cancelado(sessao, pedido, envios[PERSONAS[0]]["conteudo_para_enviar"])
+            return
+
+        # Uma thread por persona lê a resposta dela; os eventos chegam por uma fila só, na ordem em que saem
+        fila = queue.Queue()
+        lock_historico = threading.Lock() # O histórico da sessão é um só para as duas threads
+        futuros = [
+            _executor_comparar.submit(contextvars.copy_context().run, _para_fila, self._resposta_comparada(
+                sessao, persona, prompt, imagem_preparada, resultado_busca, opcoes, pedido, lock_historico, span_turno,
+                **envio), persona, fila)
+            for persona, envio in envios.items()
+        ]
+        inicio = time.perf_counter()
+        em_andamento = len(futuros)
+        try:
+            while em_andamento:
+                try:
+                    evento = fila.get(timeout=INTERVALO_PROGRESSO)
+                except queue.Empty:
+                    yield {"tipo": "progresso", "etapa": ETAPA_RESPOSTA, "segundos": round(time.perf_counter() - inicio, 1)}
+                    continue
+                if evento is None: # Uma das respostas terminou
+                    em_andamento -= 1
+                else:
+                    yield evento
+        finally:
+            if em_andamento:
+                # Quem consumia parou no meio: as respostas param (o que já chegou fica no histórico de cada persona)
+                pedido.cancelar(MOTIVO_INTERROMPIDO)
+            concurrent.futures.wait(futuros)
+        for futuro in futuros:
+            futuro.result() # Erro inesperado numa das threads: sobe como no turno normal
+
+        if opcoes.antecipar and opcoes.agentes_ativos and not pedido.cancelado:
+            self.antecipador.refrescar(sessao.id, consulta_pesquisada)
+
+        if pedido.cancelado:
+            yield {"tipo": "aviso", "nivel": "info", "texto": f"Mensagem cancelada: {pedido.texto_motivo()}."}
+        yield self._fim_turno(pedido)
+
+    def _resposta_comparada(self, sessao: SessaoOzy, persona: str, prompt: str, imagem_preparada, resultado_busca,
+                            opcoes: OpcoesTurno, pedido: Pedido, lock_historico: threading.Lock,
+                            span_turno: telemetria.Span, chat_session, gerenciador_contexto: GerenciadorContexto,
+                            tokens_historico_antes: int, conteudo_para_enviar: list, imagem_nova: bool):
+        """A resposta de uma persona no modo comparar (roda numa thread, ver _turno_comparado)."""
+        yield {"tipo": "inicio_resposta", "persona": persona, "complemento": False}
+        resposta_ia, tempos_resposta, erro = yield from self._responder(
+            sessao, persona, chat_session, conteudo_para_enviar, opcoes, pedido, span_turno=span_turno
+        )
+        if resultado_busca and not pedido.cancelado:
+            tirar_contexto_do_historico(chat_session)
+        # A pergunta entra no histórico junto com a resposta: uma persona nunca fica com a pergunta sem resposta
+        if resposta_ia is not None:
+            with lock_historico:
+                self._guardar_no_historico(sessao, persona, self._mensagem_usuario(prompt, imagem_preparada), span_turno)
+                self._adicionar_resposta(sessao, persona, resposta_ia, tempos_resposta, span_turno)
+        yield {"tipo": "fim_resposta", "texto": resposta_ia, "tempos": tempos_resposta, "erro": erro,
+               "reaproveitada": None}
+        resposta_completa = bool(tempos_resposta) and tempos_resposta.get("total") is not None
+        if imagem_nova and resposta_completa:
+            sessao.imagens_enviadas[persona].add(imagem_preparada.hash)
+        gerenciador_contexto.registrar_turno(tempos_resposta, tokens_historico_antes)
+        if resposta_completa and not pedido.cancelado and not opcoes.contexto_curto:
+            with lock_historico:
+                yield from self._compactar(sessao, persona, chat_session, gerenciador_contexto, span_turno)
+
+    def _pesquisar(self, sessao: SessaoOzy, prompt: str, imagem: Optional[bytes], opcoes: OpcoesTurno, pedido: Pedido,
+                   span_turno: telemetria.Span, complemento: bool = True):
+        """
+        Roteador e Pesquisador. Retorna (resultado, em_andamento): o ResultadoPesquisa da pesquisa feita agora ou,
+        no modo complemento, o Future da que segue em segundo plano (com complemento=False ela também é feita agora).
+        (None, None) quando o roteador dispensa a pesquisa; None se o pedido foi cancelado no meio.
+        """
+        # Roteador: perguntas que o modelo responde sozinho não pagam as duas chamadas do Pesquisador
+        with telemetria.span("pesquisa.roteador", pai=span_turno, forcada=opcoes.forcar_pesquisa) as span:
+            decisao = self.roteador.decidir(prompt, forcar=opcoes.forcar_pesquisa, id_sessao=sessao.id)
+            span.definir(pesquisar=decisao.pesquisar, fonte=decisao.fonte, motivo=decisao.motivo)
+        if pedido.cancelado:
+            return None
+        if not decisao.pesquisar:
+            yield {"tipo": "aviso", "nivel": "info",
+                   "texto": "Pesquisador Ozy não foi chamado: a pergunta não precisa de dados da internet."}
+            return None, None
+        antecipado = None
+        if opcoes.antecipar:
+            # Contexto que a pesquisa antecipada já trouxe (jogo do print, jogos citados): a busca só cobre o resto
+            with telemetria.span("pesquisa.antecipada", pai=span_turno) as span:
+                antecipado = self.antecipador.contexto_para(sessao.id, prompt, imagem, cancelado=pedido.sinal)
+                span.definir(bytes_saida=len(antecipado or ""))
+            if antecipado:
+                yield {"tipo": "aviso", "nivel": "info", "texto": "Pesquisador Ozy já tinha começado a pesquisar sobre este jogo."}
+        # Só vai para o backend quando existe (backends sem pesquisa antecipada continuam funcionando)
+        extras = {"antecipado": antecipado} if antecipado else {}
+        modo = opcoes.modo_pesquisa
+        if modo == pesquisa.MODO_COMPLEMENTO:
+            if complemento:
+                self.cotas.registrar_pesquisa(sessao.id)
+                with telemetria.ativar(span_turno): # Os spans da pesquisa ficam dentro deste turno
+                    em_andamento = self.backend.pesquisar_em_segundo_plano(prompt, sessao.id, cancelado=pedido.sinal,
+                                                                           **extras)
+                yield {"tipo": "aviso", "nivel": "info", "texto": "Pesquisador Ozy trabalhando em segundo plano..."}
+                return None, em_andamento
+            modo = pesquisa.MODO_AGENTE_UNICO # A mesma pesquisa do complemento, só que antes da resposta
+
+        yield {"tipo": "aviso", "nivel": "info", "texto": "Pesquisador Ozy trabalhando..."}
+        self.cotas.registrar_pesquisa(sessao.id)
+        # Em outra thread: enquanto espera, o turno gera eventos de progresso e pode ser cancelado
+        span = telemetria.iniciar_span("pesquisa", pai=span_turno, modo=modo, antecipada=bool(antecipado))
+        with telemetria.ativar(span): # Os spans dos agentes ficam dentro deste
+            em_andamento = em_segundo_plano(self.backend.pesquisar, prompt, sessao.id, modo, cancelado=pedido.sinal,
+                                            **extras)
+        try:
+            resultado_pesquisa = yield from self._aguardar(em_andamento, pedido, ETAPA_PESQUISA)
+        except GeneratorExit:
+            span.terminar("interrompido")
+            pedido.pesquisas_canceladas += 1 # O sinal é marcado em _conversar() e a pesquisa para
+            self._resposta_evitada(sessao, pedido, [prompt])
+            raise
+        except Exception as e:
+            span.terminar(f"{type(e).__name__}: {e}")
+            raise
+        if resultado_pesquisa is None or resultado_pesquisa.cancelada or pedido.cancelado:
+            # O que a pesquisa trouxer (ou já trouxe) não serve mais: a mensagem foi cancelada
+            span.terminar("cancelado")
+            if resultado_pesquisa is None or resultado_pesquisa.cancelada:
+                pedido.pesquisas_canceladas += 1
+            else:
+                pedido.resultados_descartados += 1
+            return None
+        span.definir(do_cache=resultado_pesquisa.do_cache, erro_pesquisa=resultado_pesquisa.erro,
+                     bytes_saida=len(resultado_pesquisa.contexto or ""))
+        span.terminar()
+        if resultado_pesquisa.consulta:
+            yield {"tipo": "consulta", "texto": resultado_pesquisa.consulta}
+        if resultado_pesquisa.erro:
+            yield {"tipo": "aviso", "nivel": "erro", "texto": f"Erro durante a execução do Pesquisador: {resultado_pesquisa.erro}"}
+        if resultado_pesquisa.do_cache:
+            texto = f"Pesquisador Ozy reaproveitou uma pesquisa recente ({resultado_pesquisa.duracao_total:.1f}s)."
+        else:
+            texto = f"Pesquisador Ozy terminou em {resultado_pesquisa.duracao_total:.1f}s."
+            if not resultado_pesquisa.erro:
+                self.roteador.registrar_pesquisa(resultado_pesquisa.duracao_total)
+        yield {"tipo": "aviso", "nivel": "info", "texto": texto}
+        return resultado_pesquisa, None
+
+    def _parte_da_imagem(self, sessao: SessaoOzy, persona: str, imagem_preparada) -> tuple:
+        """Parte da mensagem com a imagem para o chat da persona. Retorna (parte, True se os bytes vão de novo)."""
+        if imagem_preparada.hash in sessao.imagens_enviadas.setdefault(persona, set()):
+            # A mesma imagem já está no histórico do Gemini: não precisa enviar os bytes de novo
+            return "(A imagem desta mensagem é a mesma que enviei antes nesta conversa.)", False
+        return imagem_preparada.para_gemini(), True
+
+    def _mensagem_usuario(self, prompt: str, imagem_preparada) -> Mensagem:
+        """Mensagem do usuário para o histórico de exibição (o arquivo da imagem é guardado em _imagem_do_turno)."""
+        mensagem_usuario = Mensagem(role="user", content=prompt, persona="Você")
+        if imagem_preparada is not None:
+            mensagem_usuario.imagem_hash = imagem_preparada.hash
+            mensagem_usuario.miniatura = imagem_preparada.miniatura
+        return mensagem_usuario
+
+    def _imagem_do_turno(self, imagem: bytes, span_turno: telemetria.Span):
+        """Espera o preparo da imagem e guarda o original. Gera o evento "imagem" e retorna a ImagemPreparada."""
+        # Se o cliente já pediu o preparo quando a imagem chegou, aqui ela sai pronta do cache
+        with telemetria.span("imagem.aguardar", pai=span_turno, bytes_entrada=len(imagem)) as span:
+            imagem_preparada = self.preparar_imagem(imagem).result()
+            span.definir(bytes_saida=len(imagem_preparada.dados))
+        # Na memória fica só a miniatura; o arquivo original vai para o disco, endereçado pelo hash
+        obter_armazem_blobs().guardar_em_segundo_plano(imagem_preparada.hash, imagem)
+        yield {"tipo": "imagem", "hash": imagem_preparada.hash, "resumo": imagem_preparada.resumo_economia(),
+               "miniatura": imagem_preparada.miniatura}
+        return imagem_preparada
+
+    def _preparar_chat(self, sessao: SessaoOzy, persona: str, span_turno: telemetria.Span, contexto_curto: bool = False):
+        """
+        Chat do Gemini da persona (novo ou existente). Retorna (chat, gerenciador de contexto, tokens do histórico).
+        Com contexto_curto, o chat fica só com os turnos recentes (ver GerenciadorContexto.enxugar).
+        """
+        with telemetria.span("chat.preparar", pai=span_turno, persona=persona) as span:
+            chat_session = sessao.chats.get(persona)
+            span.definir(chat_novo=chat_session is None)
+            gerenciador_contexto = sessao.contextos.setdefault(persona, GerenciadorContexto(resumir=self.backend.resumir))
+            if chat_session is None:
+                chat_session = sessao.chats[persona] = self.backend.iniciar_chat(persona)
+                # Conversa que já existia (página recarregada, servidor reiniciado, outra réplica): volta do armazém
+                span.definir(turnos_reconstruidos=self._reconstruir_chat(sessao, persona, chat_session, gerenciador_contexto))
+            else:
+                self.backend.atualizar_chat(chat_session, persona)
+            if contexto_curto:
+                economia = gerenciador_contexto.enxugar(chat_session)
+                span.definir(tokens_enxugados=economia)
+                if economia:
+                    sessao.imagens_enviadas[persona] = set() # As imagens podem ter saído junto com os turnos antigos
+            # Tamanho (estimado) do histórico que vai junto com esta mensagem
+            tokens_historico_antes = gerenciador_contexto.tokens_historico(chat_session.history)
+            span.definir(tokens_historico=tokens_historico_antes)
+        return chat_session, gerenciador_contexto, tokens_historico_antes
+
+    def _compactar(self, sessao: SessaoOzy, persona: str, chat_session, gerenciador_contexto: GerenciadorContexto,
+                   span_turno: telemetria.Span):
+        """Se o histórico do chat passou do orçamento de tokens, compacta antes da próxima mensagem."""
+        try:
+            if gerenciador_contexto.tokens_historico(chat_session.history) > gerenciador_contexto.orcamento:
+                yield {"tipo": "aviso", "nivel": "status", "texto": "Organizando a memória da conversa..."}
+                with telemetria.span("contexto.ajustar", pai=span_turno) as span:
+                    economia = gerenciador_contexto.ajustar(chat_session)
+                    span.definir(tokens_economizados=economia)
+                if gerenciador_contexto.ultimo_resumo:
+                    # O resumo vai para o armazém: quando o chat for recriado, os turnos antigos não voltam
+                    resumo, mantidos = gerenciador_contexto.ultimo_resumo
+                    gerenciador_contexto.ultimo_resumo = None
+                    sessao.historico.guardar_resumo(persona, resumo, mantidos)
+                if economia:
+                    # Imagens antigas podem ter saído do histórico: se voltarem, precisam ser enviadas de novo
+                    sessao.imagens_enviadas[persona] = set()
+        except Exception as e:
+            print(f"Não foi possível compactar o histórico: {e}") # Debug
+
+    def _reconstruir_chat(self, sessao, persona, chat_session, gerenciador_contexto) -> int:
+        """
+        Recria o histórico do chat do Gemini a partir do armazém: o último resumo e os turnos que vieram depois,
+        dos mais novos para os mais antigos até o orçamento de tokens. Só os turnos recentes levam a imagem
+        de novo; nas mais antigas (e nas que o resumo cobre) ela não é reenviada. Retorna quantos conteúdos entraram.
+        """
+        resumo, anteriores = sessao.historico.para_reconstruir(persona)
+        if resumo is None and not anteriores:
+            return 0
+        turnos = [] # Do mais novo para o mais antigo: [role, partes]
+        tokens = len(resumo or "") // 4
+        imagens_reenviadas = set()
+        sem_resposta = True # A próxima pergunta (indo para trás) não teve resposta: não entra no chat
+        for mensagem in reversed(anteriores):
+            role = "user" if mensagem.role == "user" else "model"
+            if role == "model":
+                # Turno que falhou nunca entrou no histórico do Gemini: a pergunta dele também fica de fora
+                sem_resposta = mensagem.content in (RESPOSTA_ERRO, RESPOSTA_LIMITE)
+                if sem_resposta:
+                    continue
+            elif sem_resposta:
+                continue
+            else:
+                sem_resposta = True
+            partes = [mensagem.content]
+            if mensagem.imagem_hash:
+                dados = None
+                if len(turnos) < 2 * gerenciador_contexto.turnos_recentes:
+                    dados = obter_armazem_blobs().ler(mensagem.imagem_hash)
+                if dados is not None:
+                    partes.insert(0, self.preparar_imagem(dados).result().para_gemini())
+                    imagens_reenviadas.add(mensagem.imagem_hash)
+                else:
+                    partes.insert(0, TEXTO_IMAGEM_OMITIDA)
+            tokens += sum(len(parte) // 4 if isinstance(parte, str) else 258 for parte in partes)
+            if tokens > gerenciador_contexto.orcamento and len(turnos) >= 2:
+                break
+            if turnos and turnos[-1][0] == role:
+                turnos[-1][1][:0] = partes # Duas mensagens seguidas do mesmo lado (ex.: complemento) viram um turno
+            else:
+                turnos.append([role, partes])
+        if turnos and turnos[-1][0] == "model":
+            turnos.pop() # O histórico começa com uma pergunta do usuário
+        historico = []
+        if resumo:
+            historico += [{"role": "user", "parts": [PREFIXO_RESUMO + resumo]}, {"role": "model", "parts": [CONFIRMACAO_RESUMO]}]
+        historico += [{"role": role, "parts": partes} for role, partes in reversed(turnos)]
+        chat_session.history = historico
+        sessao.imagens_enviadas[persona] = imagens_reenviadas
+        return len(historico)
+
+    def _responder(self, sessao, persona, chat_session, conteudo_para_enviar, opcoes, pedido, prefixo="",
+                   span_turno=None):
+        """
+        Envia a mensagem ao Gemini e gera um evento "texto" para cada pedaço que chega.
+        Retorna (texto, tempos, erro). Se o consumidor parar no meio, o que já chegou é salvo no histórico.
+        """
+        span = telemetria.iniciar_span(
+            "gemini.send_message", pai=span_turno, stream=opcoes.stream, complemento=bool(prefixo),
+            bytes_entrada=sum(len(parte["data"]) if isinstance(parte, dict) else len(parte) for parte in conteudo_para_enviar),
+        )
+        try:
+            texto, tempos, erro = yield from self._enviar(sessao, persona, chat_session, conteudo_para_enviar, opcoes,
+                                                          pedido, prefixo, span_turno)
+        except GeneratorExit:
+            span.terminar("interrompido")
+            raise
+        span.definir(primeiro_token_s=tempos["primeiro_token"], tokens_entrada=tempos.get("tokens_entrada"),
+                     tokens_saida=tempos.get("tokens_saida"), tokens_em_cache=tempos.get("tokens_em_cache"),
+                     bytes_saida=len(texto or ""), cancelado=pedido.cancelado or None,
+                     espera_fila_s=tempos.get("espera_fila"), tentativas=tempos.get("tentativas"))
+        span.terminar(erro)
+        return texto, tempos, erro
+
+    def _enviar(self, sessao, persona, chat_session, conteudo_para_enviar, opcoes, pedido, prefixo, span_turno):
+        """O envio em si, sem o span (ver _responder)."""
+        pedacos = [] # Guarda os pedaços de texto recebidos até agora
+        tempos = {"primeiro_token": None, "total": None}
+        inicio = time.perf_counter()
+        agendador = obter_agendador()
+        # Fila cheia ou limite por minuto no fim: avisa antes de ficar esperando a vez
+        previsao = agendador.previsao(MODELO_PERSONAS)
+        if previsao["espera_estimada"] >= ESPERA_AVISO_FILA or previsao["em_andamento"] >= agendador.max_concorrencia:
+            yield {"tipo": "aviso", "nivel": "status",
+                   "texto": f"Muita gente usando o Ozy agora: {previsao['na_fila']} mensagens na fila na sua frente..."}
+        # Pelo agendador: limite por minuto do modelo, vagas e novas tentativas em 429/5xx.
+        # Em outra thread, para o turno continuar podendo ser cancelado enquanto espera a vez e o primeiro pedaço
+        envio = em_segundo_plano(agendador.executar, MODELO_PERSONAS, chat_session.send_message, conteudo_para_enviar,
+                                 stream=opcoes.stream, medida=tempos, cancelado=pedido.sinal)
+        resposta = None
+        try:
+            resposta = yield from self._aguardar(envio, pedido, ETAPA_RESPOSTA)
+            if resposta is None:
+                self._abandonar_envio(sessao, persona, envio, pedido, conteudo_para_enviar)
+                return None, tempos, None
+            if opcoes.stream:
+                for pedaco in resposta:
+                    if pedido.cancelado:
+                        break
+                    try:
+                        texto = pedaco.text
+                    except ValueError:
+                        continue # Pedaço sem texto (só metadados), pula
+                    if not texto:
+                        continue
+                    if tempos["primeiro_token"] is None:
+                        tempos["primeiro_token"] = time.perf_counter() - inicio
+                    pedacos.append(texto)
+                    yield {"tipo": "texto", "texto": texto}
+            elif pedido.cancelado:
+                pedido.resultados_descartados += 1 # A resposta chegou inteira, mas a mensagem já foi cancelada
+            else:
+                # Sem stream não existe "primeiro token": só o tempo total
+                pedacos.append(resposta.text)
+                yield {"tipo": "texto", "texto": resposta.text}
+        except PedidoCancelado:
+            # Cancelada enquanto esperava a vez no agendador: a chamada nem saiu
+            self._resposta_evitada(sessao, pedido, conteudo_para_enviar)
+            return None, tempos, None
+        except Exception as e:
+            # Erro da API no meio do stream: mantém o que já chegou (se chegou algo)
+            texto_parcial = "".join(pedacos)
+            descartar_turno_incompleto(chat_session, texto_parcial)
+            erro = f"Erro ao comunicar com a API Gemini ou gerar resposta: {e}"
+            if not texto_parcial:
+                return (RESPOSTA_LIMITE if erro_de_limite(e) else RESPOSTA_ERRO), tempos, erro
+            return texto_parcial + AVISO_RESPOSTA_INTERROMPIDA, tempos, erro
+        except GeneratorExit:
+            # Quem consumia os eventos parou no meio (o Streamlit interrompeu o script, o cliente desconectou).
+            # Salvamos o que já chegou no histórico e deixamos o gerador ser fechado.
+            pedido.cancelar(MOTIVO_INTERROMPIDO)
+            if resposta is None:
+                self._abandonar_envio(sessao, persona, envio, pedido, conteudo_para_enviar)
+                raise
+            texto_parcial = "".join(pedacos)
+            self._parar_stream(resposta, opcoes, pedido, texto_parcial)
+            descartar_turno_incompleto(chat_session, texto_parcial)
+            if texto_parcial:
+                self._adicionar_resposta(sessao, persona, prefixo + texto_parcial + AVISO_RESPOSTA_INTERROMPIDA,
+                                         tempos, span_turno)
+            raise
+
+        if pedido.cancelado:
+            texto_parcial = "".join(pedacos)
+            self._parar_stream(resposta, opcoes, pedido, texto_parcial)
+            descartar_turno_incompleto(chat_session, texto_parcial)
+            return (texto_parcial + AVISO_RESPOSTA_INTERROMPIDA if texto_parcial else None), tempos, None
+        tempos["total"] = time.perf_counter() - inicio
+        guardar_uso_tokens(tempos, resposta) # No stream, o uso só vem completo depois do último pedaço
+        texto = "".join(pedacos)
+        self.cancelamentos.registrar_resposta(tempos.get("tokens_saida") or len(texto) // 4)
+        return texto, tempos, None
+
+    def _parar_stream(self, resposta, opcoes, pedido, texto_parcial):
+        """Fecha o stream de uma resposta cancelada no meio: o que faltava gerar é economizado."""
+        if opcoes.stream:
+            fechar_stream(resposta)
+            pedido.tokens_economizados += max(0, self.cancelamentos.media_saida() - len(texto_parcial) // 4)
+
+    def _abandonar_envio(self, sessao, persona, envio, pedido, conteudo_para_enviar):
+        """
+        O pedido foi cancelado antes da resposta chegar. Se a chamada ainda não tinha saído do agendador,
+        ela desiste e nada é gasto. Se já estava na API, o resultado é descartado quando chegar (um stream é fechado
+        no primeiro pedaço) e o chat, que a chamada ainda vai alterar, sai da memória: a próxima mensagem recria
+        ele do armazém.
+        """
+        if envio.cancel():
+            self._resposta_evitada(sessao, pedido, conteudo_para_enviar)
+            return
+        try:
+            envio.result(timeout=ESPERA_DESISTENCIA)
+        except PedidoCancelado:
+            self._resposta_evitada(sessao, pedido, conteudo_para_enviar)
+            return
+        except Exception:
+            pass # Já na API (ou falhou lá): tratado como descartado
+        pedido.resultados_descartados += 1
+        envio.add_done_callback(_fechar_se_stream)
+        self._esquecer_chat(sessao, persona)
+
+    def _adicionar_resposta(self, sessao, persona, resposta_ia, tempos=None, span_turno=None):
+        """Adiciona a resposta da IA (completa ou parcial) ao histórico de exibição da persona."""
+        mensagem_ia = Mensagem(role="assistant", content=resposta_ia, persona=persona)
+        # Guarda os tempos medidos para mostrar embaixo da resposta nas próximas execuções
+        if tempos and tempos.get("primeiro_token") is not None:
+            mensagem_ia.tempos = tempos
+        self._guardar_no_historico(sessao, persona, mensagem_ia, span_turno)
+
+    def _guardar_no_historico(self, sessao, persona, mensagem, span_turno=None):
+        with telemetria.span("historico.adicionar", pai=span_turno, role=mensagem.role,
+                             bytes_entrada=len(mensagem.content) + len(mensagem.miniatura or b"")) as span:
+            sessao.historico.adicionar(persona, mensagem)
+            span.definir(historico_bytes=sessao.historico.bytes_usados(), historico_mensagens=len(sessao.historico))
+
+
+# Motor único do processo
+_motor = None
+_motor_lock = threading.Lock()
+
+def obter_motor() -> MotorOzy:
+    global _motor
+    if _motor is None:
+        with _motor_lock:
+            if _motor is None:
+                _motor = MotorOzy()
+    return _motor
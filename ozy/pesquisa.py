@@ -0,0 +1,349 @@
+"""
+Pipeline do Pesquisador Ozy rodando sobre asyncio.
+
+Três modos:
+- sequencial: agent_simplifier e depois agent_searcher (o comportamento original);
+- agente único: um só agente que simplifica e pesquisa na mesma chamada;
+- complemento: a persona responde na hora e a pesquisa roda em segundo plano,
+  entrando depois como uma mensagem de complemento.
+
+Cada etapa tem um tempo máximo e existe um tempo máximo para a pesquisa inteira.
+Resultados de busca passam pelo cache (ozy/cache.py): um acerto pula o agent_searcher.
+Pesquisas iguais que chegam ao mesmo tempo (de qualquer sessão) viram uma chamada só (ozy/agendador.py).
+Com a pesquisa antecipada (ozy/antecipacao.py), o contexto do jogo já pode estar pronto quando a pergunta
+chega: o buscador (sem o simplificador antes) só pesquisa o que faltar, com um prazo curto; se não terminar a tempo,
+fica o contexto antecipado.
+Os agentes devolvem resultados estruturados (ozy/resultados_busca.py); a persona recebe só um contexto
+compacto montado a partir deles, e só na mensagem do turno (não fica no histórico do chat).
+Se o pedido da mensagem for cancelado (ozy/cancelamento.py), a pesquisa para no meio da chamada ao agente.
+O ADK (ozy/agentes.py) leva alguns segundos para importar: ele só é carregado quando o Pesquisador é ligado.
+"""
+import asyncio
+import contextvars
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+from ozy import imagens, resultados_busca, telemetria
+from ozy.agendador import obter_agendador
+from ozy.cache import normalizar_consulta, obter_cache_busca
+from ozy.cancelamento import INTERVALO_VERIFICACAO
+
+# =============================================================================
+# Modos e Limites de Tempo
+# =============================================================================
+
+MODO_SEQUENCIAL = "sequencial"
+MODO_AGENTE_UNICO = "agente_unico"
+MODO_COMPLEMENTO = "complemento"
+
+# Modelo barato que reconhece o jogo e a tela de um print (pesquisa antecipada)
+MODELO_CLASSIFICADOR = "gemini-2.0-flash-lite"
+
+# Nome de cada modo como aparece na barra lateral
+NOMES_MODOS = {
+    MODO_SEQUENCIAL: "Sequencial (simplificar e depois pesquisar)",
+    MODO_AGENTE_UNICO: "Agente único (mais rápido)",
+    MODO_COMPLEMENTO: "Responder na hora e complementar depois",
+}
+
+
+@dataclass
+class LimitesPesquisa:
+    """Tempo máximo, em segundos, de cada etapa e da pesquisa inteira."""
+    simplificador: float = 10.0
+    buscador: float = 25.0
+    agente_unico: float = 25.0
+    total: float = 30.0
+    # Com contexto antecipado a busca só complementa: passando disso, a pesquisa fica com o que já havia
+    com_antecipado: float = 6.0
+
+
+@dataclass
+class ResultadoPesquisa:
+    """O que a pesquisa produziu. 'contexto' fica None quando não há nada útil para mandar à persona."""
+    consulta: Optional[str] = None # Pergunta usada na busca (prompt simplificado)
+    contexto: Optional[str] = None # Resultados da busca (lista JSON, ver ozy/resultados_busca.py)
+    erro: Optional[str] = None
+    do_cache: bool = False # True quando o resultado veio do cache e nenhuma busca foi feita
+    cancelada: bool = False # O pedido foi cancelado e a pesquisa parou no meio
+    duracoes: dict = field(default_factory=dict) # etapa -> segundos
+    duracao_total: float = 0.0
+
+
+# =============================================================================
+# Carregamento dos Agentes
+# =============================================================================
+
+_carregamento = None # Future da importação do ADK em segundo plano
+_carregamento_lock = threading.Lock()
+
+def obter_registro():
+    """Registro dos agentes (ozy/agentes.py). Na primeira chamada do processo, importa o ADK."""
+    from ozy.agentes import obter_registro as obter
+    return obter()
+
+
+def carregar_agentes():
+    """
+    Começa a importar o ADK numa thread, uma vez por processo (chamado quando o Pesquisador é ligado).
+    A tela não espera pela importação; se a primeira pesquisa chegar antes do fim, ela espera o que faltar.
+    """
+    global _carregamento
+    with _carregamento_lock:
+        if _carregamento is None:
+            _carregamento = _executor.submit(obter_registro)
+    return _carregamento
+
+
+# =============================================================================
+# Etapas (cada uma é uma chamada de agente)
+# =============================================================================
+
+async def _chamar_agente(nome: str, entrada: str, consulta: str, id_usuario: str, variante: str = "") -> str:
+    """
+    Chama o agente pelo registro. Se a mesma consulta já está sendo pesquisada por outra sessão,
+    espera e usa o resultado dela em vez de fazer outra chamada.
+    'variante' separa pedidos diferentes para a mesma consulta (ex.: busca só do que falta).
+    """
+    return await obter_agendador().coalescer_async(
+        (nome, normalizar_consulta(consulta), variante),
+        lambda: obter_registro().call_agent_async(nome, entrada, id_usuario),
+    )
+
+
+def _so_o_que_falta(ja_pesquisado: Optional[str]) -> tuple:
+    """Texto que pede ao agente só o que o contexto antecipado não cobre, e a variante para juntar pedidos iguais."""
+    if not ja_pesquisado:
+        return "", ""
+    # Só os títulos (ou links) do que já temos: o contexto inteiro deixaria a chamada maior que a busca normal
+    paginas = [resultado.titulo or resultado.url for resultado in resultados_busca.ler_resultados(ja_pesquisado)]
+    texto = ("\nJá temos resultados destas páginas, pesquisadas antes. Não repita o que elas cobrem: "
+             f"busque apenas o que faltar para responder.\n{'; '.join(pagina for pagina in paginas if pagina)}")
+    return texto, hashlib.sha256(ja_pesquisado.encode("utf-8")).hexdigest()[:16]
+
+
+async def agent_simplifier(user_prompt: str, id_usuario: str) -> str:
+    """Usa um agente para simplificar um prompt para uma busca no Google."""
+    entrance_agent_simplifier = f"Simplifique e estruture o seguinte prompt para uma pergunta de busca no Google: '{user_prompt}'"
+    with telemetria.span("pesquisa.simplificador", bytes_entrada=len(entrance_agent_simplifier)) as span:
+        simplification = await _chamar_agente("agent_simplifier", entrance_agent_simplifier, user_prompt, id_usuario)
+        span.definir(bytes_saida=len(simplification or ""))
+    return simplification
+
+
+async def agent_searcher(simplification_prompt: str, id_usuario: str, ja_pesquisado: Optional[str] = None) -> str:
+    """Usa um agente para realizar uma busca no Google com um prompt simplificado (só do que falta, se já houver contexto)."""
+    falta, variante = _so_o_que_falta(ja_pesquisado)
+    entrance_agent_searcher = f"Realize uma busca no Google com o seguinte prompt e retorne as informações relevantes: '{simplification_prompt}'.{falta}"
+    with telemetria.span("pesquisa.buscador", bytes_entrada=len(entrance_agent_searcher), parcial=bool(falta)) as span:
+        searching = await _chamar_agente("agent_searcher", entrance_agent_searcher, simplification_prompt, id_usuario, variante)
+        resultados = resultados_busca.ler_resultados(searching)
+        span.definir(bytes_saida=len(searching or ""), resultados=len(resultados))
+    return resultados_busca.serializar(resultados)
+
+
+async def agent_pesquisador(user_prompt: str, id_usuario: str, ja_pesquisado: Optional[str] = None) -> tuple:
+    """Simplifica e pesquisa em uma única chamada. Retorna (pergunta usada, resultado da busca)."""
+    falta, variante = _so_o_que_falta(ja_pesquisado)
+    entrance = f"Mensagem do usuário: '{user_prompt}'{falta}"
+    with telemetria.span("pesquisa.agente_unico", bytes_entrada=len(entrance), parcial=bool(falta)) as span:
+        resposta = await _chamar_agente("agent_pesquisador", entrance, user_prompt, id_usuario, variante)
+        span.definir(bytes_saida=len(resposta or ""))
+    # A primeira linha traz a pergunta usada na busca ("Pergunta: ...")
+    consulta = None
+    primeira_linha, _, resto = resposta.partition("\n")
+    if primeira_linha.lower().startswith("pergunta:"):
+        consulta, resposta = primeira_linha.split(":", 1)[1].strip(), resto
+    return consulta, resultados_busca.serializar(resultados_busca.ler_resultados(resposta))
+
+
+# =============================================================================
+# Pipeline
+# =============================================================================
+
+async def _etapa(resultado: ResultadoPesquisa, nome: str, coro, limite: float, prazo_final: float):
+    """Roda uma etapa respeitando o limite dela e o que sobra do tempo total. Guarda a duração."""
+    tempo_restante = prazo_final - time.perf_counter()
+    if tempo_restante <= 0:
+        coro.close() # A etapa nem começa: fecha a corrotina para não gerar aviso
+        raise asyncio.TimeoutError
+    inicio = time.perf_counter()
+    try:
+        return await asyncio.wait_for(coro, timeout=min(limite, tempo_restante))
+    finally:
+        resultado.duracoes[nome] = time.perf_counter() - inicio
+
+
+def _juntar(antecipado: Optional[str], novo: Optional[str]) -> Optional[str]:
+    """Contexto antecipado + o que o buscador trouxe a mais."""
+    if not antecipado:
+        return novo
+    return resultados_busca.juntar(antecipado, novo)
+
+
+async def _cancelar_quando(cancelado: threading.Event, tarefa: asyncio.Task):
+    """Cancela a tarefa da pesquisa assim que o pedido for cancelado (a chamada ao agente para no meio)."""
+    while not cancelado.is_set():
+        await asyncio.sleep(INTERVALO_VERIFICACAO)
+    tarefa.cancel()
+
+
+async def pesquisar_async(user_prompt: str, id_usuario: str, modo: str = MODO_SEQUENCIAL,
+                          limites: Optional[LimitesPesquisa] = None, antecipado: Optional[str] = None,
+                          cancelado: Optional[threading.Event] = None) -> ResultadoPesquisa:
+    """
+    Roda o Pesquisador no modo escolhido. Nunca lança erro: problemas ficam em 'resultado.erro'.
+    'antecipado' é o contexto que a pesquisa antecipada já trouxe (do jogo desta pergunta, ver Antecipador.contexto_para):
+    a busca só cobre o que faltar, sem o simplificador e com o prazo curto de 'limites.com_antecipado'.
+    'cancelado' é o sinal do pedido da mensagem: marcado, a pesquisa para e volta com 'cancelada'.
+    """
+    limites = limites or LimitesPesquisa()
+    resultado = ResultadoPesquisa()
+    inicio = time.perf_counter()
+    prazo_final = inicio + (min(limites.total, limites.com_antecipado) if antecipado else limites.total)
+    vigia = asyncio.ensure_future(_cancelar_quando(cancelado, asyncio.current_task())) if cancelado else None
+    try:
+        cache = obter_cache_busca()
+        if modo == MODO_SEQUENCIAL:
+            if antecipado:
+                # O assunto já está pesquisado: o buscador recebe a própria mensagem, sem esperar o simplificador
+                chave = user_prompt
+            else:
+                chave = resultado.consulta = await _etapa(
+                    resultado, "simplificador", agent_simplifier(user_prompt, id_usuario), limites.simplificador, prazo_final
+                )
+            # A pergunta já foi pesquisada antes? Então não precisa do agent_searcher
+            guardado = cache.buscar(chave)
+            if guardado is not None:
+                resultado.do_cache = True
+                resultado.contexto = _juntar(antecipado, guardado)
+            else:
+                resultado.contexto = _juntar(antecipado, await _etapa(
+                    resultado, "buscador", agent_searcher(chave, id_usuario, antecipado),
+                    limites.buscador, prazo_final
+                ))
+                if resultado.contexto:
+                    cache.guardar(chave, resultado.contexto)
+        else:
+            # Agente único: usado tanto no modo "agente único" quanto no "complemento"
+            # Aqui não existe pergunta simplificada antes da busca, então a chave é o próprio prompt
+            guardado = cache.buscar(user_prompt)
+            if guardado is not None:
+                resultado.do_cache = True
+                resultado.contexto = _juntar(antecipado, guardado)
+            else:
+                resultado.consulta, novo = await _etapa(
+                    resultado, "agente_unico", agent_pesquisador(user_prompt, id_usuario, antecipado),
+                    limites.agente_unico, prazo_final
+                )
+                resultado.contexto = _juntar(antecipado, novo)
+                if resultado.contexto:
+                    cache.guardar(user_prompt, resultado.contexto)
+                    if resultado.consulta:
+                        # Também guarda pela pergunta usada, para o modo sequencial aproveitar
+                        cache.guardar(resultado.consulta, resultado.contexto)
+    except asyncio.TimeoutError:
+        if not antecipado: # Com o contexto antecipado, o prazo curto é esperado: fica o que já havia
+            resultado.erro = "A pesquisa demorou demais e foi interrompida."
+    except asyncio.CancelledError:
+        if vigia is None or not cancelado.is_set():
+            raise
+        asyncio.current_task().uncancel() # O cancelamento veio do vigia e termina aqui
+        resultado.cancelada = True
+        resultado.erro = "A pesquisa foi cancelada."
+    except Exception as e:
+        resultado.erro = str(e)
+    finally:
+        if vigia is not None:
+            vigia.cancel()
+
+    if antecipado and not resultado.contexto:
+        resultado.contexto = antecipado # A busca falhou ou não terminou no prazo, mas o contexto antecipado ainda serve
+    if resultado.contexto is not None and not resultado.contexto.strip():
+        resultado.contexto = None
+    resultado.duracao_total = time.perf_counter() - inicio
+    return resultado
+
+
+def pesquisar(user_prompt: str, id_usuario: str, modo: str = MODO_SEQUENCIAL,
+              limites: Optional[LimitesPesquisa] = None, antecipado: Optional[str] = None,
+              cancelado: Optional[threading.Event] = None) -> ResultadoPesquisa:
+    """Versão síncrona de pesquisar_async, para quem não está dentro de um event loop (o script do Streamlit)."""
+    return asyncio.run(pesquisar_async(user_prompt, id_usuario, modo, limites, antecipado, cancelado))
+
+
+# Threads para as pesquisas que rodam enquanto a persona já está respondendo
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ozy-pesquisa")
+
+def pesquisar_em_segundo_plano(user_prompt: str, id_usuario: str, limites: Optional[LimitesPesquisa] = None,
+                               antecipado: Optional[str] = None, cancelado: Optional[threading.Event] = None):
+    """Começa a pesquisa (agente único) em outra thread e retorna um Future com o ResultadoPesquisa."""
+    # Leva o contexto junto: os spans dos agentes ficam dentro do turno que pediu a pesquisa
+    return _executor.submit(contextvars.copy_context().run, pesquisar, user_prompt, id_usuario, MODO_AGENTE_UNICO,
+                            limites, antecipado, cancelado)
+
+
+# =============================================================================
+# Pesquisa Antecipada (ver ozy/antecipacao.py)
+# =============================================================================
+
+INSTRUCAO_CLASSIFICADOR = (
+    "Este é um print de um jogo. Responda apenas com um JSON no formato "
+    '{"jogo": "<nome do jogo ou null se não souber>", "tela": "<o que aparece: menu, luta contra chefe, mapa, '
+    'inventário, quebra-cabeça...>"}'
+)
+
+
+async def classificar_tela(dados: bytes) -> dict:
+    """Reconhece o jogo e a tela de um print com o modelo barato. Retorna {"jogo", "tela"} (jogo None se não souber)."""
+    from ozy.modelos import obter_genai
+    preparada = await asyncio.wrap_future(imagens.preparar_em_segundo_plano(dados))
+    modelo = obter_genai().GenerativeModel(MODELO_CLASSIFICADOR, generation_config={"response_mime_type": "application/json"})
+    with telemetria.span("pesquisa.classificador", bytes_entrada=len(preparada.dados)) as span:
+        resposta = await obter_agendador().executar_async(
+            MODELO_CLASSIFICADOR, lambda: modelo.generate_content_async([preparada.para_gemini(), INSTRUCAO_CLASSIFICADOR])
+        )
+        try:
+            classificacao = json.loads(resposta.text)
+        except ValueError:
+            classificacao = {}
+        span.definir(jogo=classificacao.get("jogo"))
+    return {"jogo": classificacao.get("jogo") or None, "tela": classificacao.get("tela") or ""}
+
+
+# Usuário do ADK das pesquisas antecipadas: id da sessão + este sufixo
+SUFIXO_USUARIO_ANTECIPACAO = "_antecipacao"
+
+
+async def buscar_assunto(consulta: str, id_usuario: str) -> Optional[str]:
+    """
+    Pesquisa um assunto antes de alguém perguntar e guarda no cache de busca (para a pergunta usar depois).
+    Usa um usuário próprio no ADK, para as chamadas em segundo plano ficarem separadas das da pergunta.
+    """
+    contexto = await agent_searcher(consulta, f"{id_usuario}{SUFIXO_USUARIO_ANTECIPACAO}")
+    if contexto:
+        obter_cache_busca().guardar(consulta, contexto)
+        return contexto
+    return None
+
+
+# Começo do contexto da pesquisa na mensagem: é por ele que o motor tira o contexto do histórico depois do turno
+MARCADOR_CONTEXTO = "--- Contexto de Pesquisa do Google ---"
+
+
+def formatar_contexto(contexto: str, consulta: str = "") -> str:
+    """Contexto compacto da busca (sem repetições, ordenado e dentro do orçamento) para o modelo Gemini usar."""
+    return f"\n\n{MARCADOR_CONTEXTO}\n{resultados_busca.montar_contexto(contexto, consulta)}\n--- Fim do Contexto ---"
+
+
+# Mensagem enviada à persona no modo complemento, depois da resposta inicial
+PEDIDO_COMPLEMENTO = (
+    "O Pesquisador Ozy acabou de trazer informações atualizadas da internet sobre a minha última pergunta. "
+    "Use-as para complementar ou corrigir a sua resposta anterior, sem repetir o que já foi dito. "
+    "Se não houver nada novo ou relevante, diga isso em uma frase curta."
+)
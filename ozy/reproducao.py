@@ -0,0 +1,257 @@
+"""
+Backend do motor que reproduz uma gravação de produção (ozy/gravacao.py), sem chave e sem rede.
+
+As respostas, pesquisas e decisões do roteador gravadas voltam com os tempos gravados, divididos pelo
+fator de aceleração:
+
+- resposta da persona: achada pela persona e pela pergunta (a parte de texto da mensagem igual ao prompt
+  gravado; no complemento, a pergunta do turno anterior). O primeiro pedaço chega no tempo até o primeiro
+  token gravado (sem a espera na fila da API, que a reprodução tem a sua) e o resto se espalha até o tempo
+  total. Os tokens de entrada são contados do pedido que este build monta (histórico, contexto); os de saída
+  são os gravados;
+- pesquisa: a gravada para a mesma pergunta, passando pelo cache de busca como a pesquisa de verdade
+  (uma consulta já pesquisada volta do cache sem esperar o buscador), então o acerto do cache é o deste build;
+- roteador: a decisão gravada (ou, se o modelo do roteador não foi perguntado, se houve pesquisa).
+
+O que a gravação não tem (perguntas que não estão nela, respostas que falharam, resumo da conversa, embeddings,
+pesquisa antecipada) fica com o backend falso (ozy/backend_falso.py), também acelerado, e é contado como sintético.
+Uso: MotorOzy(backend=BackendReproducao(ler_gravacao("gravacoes/")[0], aceleracao=10))
+"""
+import copy
+import threading
+import time
+from collections import deque
+from dataclasses import replace
+from typing import Optional
+
+from google.generativeai import protos
+
+from ozy import pesquisa
+from ozy.backend_falso import BackendFalso, ClienteGeminiFalso, ConfiguracaoFalso, _tokens, _tokens_do_pedido
+from ozy.cache import obter_cache_busca
+from ozy.personas import configurar_modelo_gemini
+
+
+def _resposta_completa(resposta: dict) -> bool:
+    tempos = resposta.get("tempos") or {}
+    return resposta.get("texto") is not None and not resposta.get("erro") and tempos.get("total") is not None
+
+
+class ClienteReproducao(ClienteGeminiFalso):
+    """Cliente da API de uma persona: responde com a resposta gravada para a pergunta ou, sem ela, como o falso."""
+
+    def __init__(self, reproducao: "BackendReproducao", persona: str):
+        super().__init__(reproducao.configuracao)
+        self.reproducao = reproducao
+        self.persona = persona
+
+    def _gravada(self, pedido) -> Optional[dict]:
+        if not pedido.contents:
+            return None
+        textos = [parte.text for parte in pedido.contents[-1].parts if parte.text]
+        complemento = bool(textos) and textos[0] == pesquisa.PEDIDO_COMPLEMENTO
+        if complemento:
+            # O pedido de complemento não repete a pergunta: ela está no turno anterior do histórico
+            textos = [parte.text for parte in pedido.contents[-3].parts if parte.text] if len(pedido.contents) >= 3 else []
+        for texto in textos:
+            gravada = self.reproducao.proxima_resposta(self.persona, texto, complemento)
+            if gravada is not None:
+                return gravada
+        self.reproducao.contar(respostas_sinteticas=1)
+        return None
+
+    def _pedacos_gravados(self, pedido, gravada: dict) -> list:
+        texto = gravada["texto"]
+        tokens_saida = (gravada.get("tempos") or {}).get("tokens_saida") or _tokens(texto)
+        tamanho = self.configuracao.tokens_por_pedaco * 4 # ~4 caracteres por token
+        pedacos = []
+        for inicio in range(0, max(1, len(texto)), tamanho):
+            pedacos.append(protos.GenerateContentResponse(candidates=[protos.Candidate(
+                content=protos.Content(role="model", parts=[protos.Part(text=texto[inicio:inicio + tamanho])]), index=0,
+            )]))
+        ultima = pedacos[-1]
+        ultima.candidates[0].finish_reason = protos.Candidate.FinishReason.STOP
+        tokens_entrada = _tokens_do_pedido(pedido)
+        ultima.usage_metadata = protos.GenerateContentResponse.UsageMetadata(
+            prompt_token_count=tokens_entrada, candidates_token_count=tokens_saida,
+            total_token_count=tokens_entrada + tokens_saida,
+        )
+        return pedacos
+
+    def generate_content(self, pedido, **opcoes):
+        gravada = self._gravada(pedido)
+        if gravada is None:
+            return super().generate_content(pedido, **opcoes)
+        self.chamadas += 1
+        _, total = self.reproducao.tempos_resposta(gravada)
+        time.sleep(total)
+        resposta = self._pedacos_gravados(pedido, gravada)[-1]
+        resposta.candidates[0].content.parts[0].text = gravada["texto"]
+        return resposta
+
+    def stream_generate_content(self, pedido, **opcoes):
+        gravada = self._gravada(pedido)
+        if gravada is None:
+            return super().stream_generate_content(pedido, **opcoes)
+        self.chamadas += 1
+        return self._stream_gravado(pedido, gravada)
+
+    def _stream_gravado(self, pedido, gravada: dict):
+        primeiro, total = self.reproducao.tempos_resposta(gravada)
+        pedacos = self._pedacos_gravados(pedido, gravada)
+        intervalo = (total - primeiro) / max(1, len(pedacos) - 1)
+        time.sleep(primeiro)
+        for i, pedaco in enumerate(pedacos):
+            if i:
+                time.sleep(intervalo)
+            yield pedaco
+
+
+class BackendReproducao(BackendFalso):
+    """Backend do motor com as respostas e pesquisas de uma gravação (mesma interface do BackendGemini)."""
+
+    def __init__(self, turnos: list, aceleracao: float = 1.0, configuracao: ConfiguracaoFalso = None):
+        configuracao = configuracao or ConfiguracaoFalso()
+        # O que cai no backend falso fica tão mais rápido quanto o que foi gravado
+        super().__init__(replace(
+            configuracao, latencia=configuracao.latencia / aceleracao,
+            tokens_por_segundo=configuracao.tokens_por_segundo * aceleracao,
+            latencia_pesquisa=configuracao.latencia_pesquisa / aceleracao,
+            latencia_resumo=configuracao.latencia_resumo / aceleracao,
+            latencia_roteador=configuracao.latencia_roteador / aceleracao,
+        ))
+        self.aceleracao = aceleracao
+        self._respostas = {} # (persona, prompt, complemento) -> respostas gravadas, na ordem
+        self._pesquisas = {} # prompt -> pesquisas gravadas, na ordem
+        self._decisoes = {} # (sessão anônima, prompt) -> decisão gravada do roteador
+        self._lock = threading.Lock()
+        self.respostas_gravadas = 0
+        self.respostas_sinteticas = 0
+        self.pesquisas_gravadas = 0
+        self.pesquisas_sinteticas = 0
+        for turno in turnos:
+            self._indexar(turno)
+
+    def _indexar(self, turno: dict):
+        prompt = turno["prompt"]
+        for resposta in turno["respostas"]:
+            # As do cache semântico não têm tempos, mas o texto serve se este build chamar o modelo
+            if _resposta_completa(resposta) or (resposta.get("reaproveitada") and resposta.get("texto")):
+                chave = (resposta["persona"], prompt, resposta["complemento"])
+                self._respostas.setdefault(chave, deque()).append(resposta)
+        for gravada in turno.get("pesquisas", []):
+            if not gravada["cancelada"]:
+                self._pesquisas.setdefault(prompt, deque()).append(gravada)
+        chave = (turno["sessao"], prompt)
+        if turno.get("roteador") is not None:
+            self._decisoes[chave] = turno["roteador"]
+        elif turno.get("pesquisas"):
+            self._decisoes.setdefault(chave, True)
+
+    def _proxima(self, gravadas: Optional[deque]) -> Optional[dict]:
+        """A próxima gravada da fila; a última fica (a mesma pergunta repetida, ou uma nova tentativa, reaproveita)."""
+        if not gravadas:
+            return None
+        with self._lock:
+            return gravadas.popleft() if len(gravadas) > 1 else gravadas[0]
+
+    def proxima_resposta(self, persona: str, prompt: str, complemento: bool) -> Optional[dict]:
+        gravada = self._proxima(self._respostas.get((persona, prompt, complemento)))
+        if gravada is not None:
+            self.contar(respostas_gravadas=1)
+        return gravada
+
+    def contar(self, **valores):
+        with self._lock:
+            for nome, valor in valores.items():
+                setattr(self, nome, getattr(self, nome) + valor)
+
+    def tempos_resposta(self, gravada: dict) -> tuple:
+        """(segundos até o primeiro pedaço, segundos até o fim) da resposta gravada, já acelerados."""
+        tempos = gravada.get("tempos") or {}
+        if tempos.get("primeiro_token") is None or tempos.get("total") is None:
+            primeiro = self.configuracao.latencia
+            return primeiro, primeiro + _tokens(gravada["texto"]) / self.configuracao.tokens_por_segundo
+        espera = tempos.get("espera_fila") or 0.0 # A fila da API da reprodução tem a sua própria espera
+        primeiro = max(0.0, tempos["primeiro_token"] - espera) / self.aceleracao
+        return primeiro, max(primeiro, (tempos["total"] - espera) / self.aceleracao)
+
+    def _modelo(self, persona: str):
+        if persona not in self._modelos:
+            # Um cliente por persona: a resposta gravada é procurada pela persona e pela pergunta
+            modelo = copy.copy(configurar_modelo_gemini(persona))
+            modelo._client = ClienteReproducao(self, persona)
+            self._modelos[persona] = modelo
+        return self._modelos[persona]
+
+    def pesquisar(self, prompt: str, id_sessao: str, modo: str, antecipado=None, cancelado=None):
+        gravada = self._proxima(self._pesquisas.get(prompt))
+        if gravada is None:
+            self.contar(pesquisas_sinteticas=1)
+            return super().pesquisar(prompt, id_sessao, modo, antecipado, cancelado)
+        self.contar(pesquisas=1, pesquisas_gravadas=1)
+        resultado = pesquisa.ResultadoPesquisa()
+        inicio = time.perf_counter()
+        duracoes = gravada["duracoes"]
+        if gravada["do_cache"] or not duracoes:
+            # Em produção veio do cache: o tempo da busca de verdade não foi gravado
+            busca = self.configuracao.latencia_pesquisa
+            simplificador = busca if modo == pesquisa.MODO_SEQUENCIAL else 0.0
+        else:
+            simplificador = duracoes.get("simplificador", 0.0) / self.aceleracao if modo == pesquisa.MODO_SEQUENCIAL else 0.0
+            busca = max(0.0, gravada["duracao_total"] / self.aceleracao - simplificador)
+
+        def esperar(segundos: float) -> bool:
+            """True se o pedido foi cancelado durante a espera."""
+            if cancelado is None:
+                time.sleep(segundos)
+                return False
+            return cancelado.wait(segundos)
+
+        # Como a pesquisa de verdade: no sequencial a chave do cache é a pergunta simplificada, no agente único o prompt
+        cache = obter_cache_busca()
+        if modo == pesquisa.MODO_SEQUENCIAL:
+            resultado.consulta = gravada["consulta"] or prompt
+            if esperar(simplificador):
+                resultado.cancelada, resultado.erro = True, "A pesquisa foi cancelada."
+                resultado.duracao_total = time.perf_counter() - inicio
+                return resultado
+            resultado.duracoes["simplificador"] = simplificador
+        chave = resultado.consulta if modo == pesquisa.MODO_SEQUENCIAL else prompt
+        resultado.contexto = cache.buscar(chave)
+        if resultado.contexto is not None:
+            resultado.do_cache = True
+        else:
+            if esperar(busca):
+                resultado.cancelada, resultado.erro = True, "A pesquisa foi cancelada."
+                resultado.duracao_total = time.perf_counter() - inicio
+                return resultado
+            resultado.duracoes["buscador" if modo == pesquisa.MODO_SEQUENCIAL else "agente_unico"] = busca
+            resultado.erro = gravada["erro"]
+            # Com antecipado na gravação, o contexto gravado já vem junto com ele
+            resultado.contexto = gravada["contexto"] if gravada["antecipado"] else pesquisa._juntar(antecipado, gravada["contexto"])
+            if modo != pesquisa.MODO_SEQUENCIAL:
+                resultado.consulta = gravada["consulta"]
+            if resultado.contexto:
+                cache.guardar(chave, resultado.contexto)
+                if resultado.consulta and chave != resultado.consulta:
+                    cache.guardar(resultado.consulta, resultado.contexto)
+        if resultado.erro and antecipado and not resultado.contexto:
+            resultado.contexto = antecipado
+        resultado.duracao_total = time.perf_counter() - inicio
+        return resultado
+
+    def decidir_pesquisa(self, prompt: str, id_sessao: Optional[str] = None) -> bool:
+        # A reprodução usa a sessão anônima da gravação como id da sessão (ver benchmarks/benchmark_reproducao.py)
+        chave = (id_sessao, prompt)
+        if chave not in self._decisoes:
+            return super().decidir_pesquisa(prompt, id_sessao)
+        time.sleep(self.configuracao.latencia_roteador)
+        return self._decisoes[chave]
+
+    def estatisticas(self) -> dict:
+        clientes = [modelo._client for modelo in self._modelos.values()]
+        return {"chamadas_gemini": sum(cliente.chamadas for cliente in clientes), "pesquisas": self.pesquisas,
+                "resumos": self.resumos, "respostas_gravadas": self.respostas_gravadas,
+                "respostas_sinteticas": self.respostas_sinteticas, "pesquisas_gravadas": self.pesquisas_gravadas,
+                "pesquisas_sinteticas": self.pesquisas_sinteticas}
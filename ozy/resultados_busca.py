@@ -0,0 +1,172 @@
+"""
+Resultados do Pesquisador em formato estruturado, e o contexto compacto montado a partir deles.
+
+O agent_searcher devolvia um texto livre, sem limite de tamanho, que ia inteiro para o prompt da persona.
+Agora os agentes devolvem uma lista JSON de resultados (título, trecho, url, data e pontuação), que é o que
+fica guardado no cache de busca. Na hora de mandar para a persona, o contexto é montado só com o necessário:
+
+- resultados repetidos (mesma página, ou o mesmo trecho vindo de páginas diferentes) viram um só;
+- os que sobram são ordenados pela pontuação do agente, pelos termos da pergunta que aparecem neles
+  e pela data (os mais recentes primeiro, entre os parecidos);
+- entram os melhores até o orçamento de tokens (OZY_PESQUISA_ORCAMENTO), com cada trecho cortado num tamanho máximo.
+
+Textos no formato antigo ("conteúdo" + "Link: url", de entradas antigas do cache) também são lidos.
+"""
+import json
+import os
+import re
+from dataclasses import asdict, dataclass
+from datetime import date
+from typing import Optional
+
+from ozy.cache import normalizar_consulta
+
+# Tokens (estimados) que o contexto da pesquisa pode ocupar na mensagem enviada à persona
+ORCAMENTO_CONTEXTO = int(os.environ.get("OZY_PESQUISA_ORCAMENTO", 600))
+# Caracteres de cada trecho que vão para a persona
+MAX_TRECHO = 400
+# Dois trechos com pelo menos essa fração de palavras em comum são o mesmo resultado
+LIMIAR_REPETIDO = 0.8
+
+_URL = re.compile(r"https?://\S+")
+
+
+@dataclass
+class ResultadoBusca:
+    """Um resultado da busca."""
+    titulo: str
+    trecho: str
+    url: str = ""
+    data: Optional[str] = None # 'AAAA-MM-DD' (ou só 'AAAA-MM' / 'AAAA') quando a página informa
+    pontuacao: float = 0.0 # Relevância dada pelo agente, de 0 a 1
+
+
+def _de_dict(item: dict) -> Optional[ResultadoBusca]:
+    # Aceita os nomes em inglês também: o agente às vezes responde com eles
+    trecho = str(item.get("trecho") or item.get("snippet") or item.get("conteudo") or "").strip()
+    url = str(item.get("url") or item.get("link") or "").strip()
+    if not trecho and not url:
+        return None
+    try:
+        pontuacao = min(1.0, max(0.0, float(item.get("pontuacao", item.get("score", 0)) or 0)))
+    except (TypeError, ValueError):
+        pontuacao = 0.0
+    return ResultadoBusca(titulo=str(item.get("titulo") or item.get("title") or "").strip(), trecho=trecho, url=url,
+                          data=str(item.get("data") or item.get("date") or "").strip() or None, pontuacao=pontuacao)
+
+
+def _ler_texto_livre(texto: str) -> list:
+    """Formato antigo: blocos separados por linha em branco, com o conteúdo e depois 'Link: url'."""
+    resultados = []
+    for bloco in re.split(r"\n\s*\n", texto.strip()):
+        url = _URL.search(bloco)
+        conteudo = _URL.sub("", bloco).replace("Link:", "").strip(" \n[]")
+        if not conteudo:
+            continue
+        resultados.append(ResultadoBusca(titulo="", trecho=" ".join(conteudo.split()), url=url.group(0) if url else ""))
+    return resultados
+
+
+def ler_resultados(texto: Optional[str]) -> list:
+    """Lista de ResultadoBusca a partir do que o agente (ou o cache) devolveu. Nunca lança erro."""
+    if not texto or not texto.strip():
+        return []
+    inicio, fim = texto.find("["), texto.rfind("]")
+    if inicio != -1 and fim > inicio:
+        try:
+            itens = json.loads(texto[inicio:fim + 1])
+        except ValueError:
+            itens = None
+        if isinstance(itens, list) and all(isinstance(item, dict) for item in itens):
+            return [resultado for resultado in map(_de_dict, itens) if resultado is not None]
+    return _ler_texto_livre(texto)
+
+
+def serializar(resultados: list) -> Optional[str]:
+    """Texto JSON dos resultados (o que vai para o cache de busca). None quando não há resultado."""
+    if not resultados:
+        return None
+    return json.dumps([asdict(resultado) for resultado in resultados], ensure_ascii=False)
+
+
+def juntar(*textos: Optional[str]) -> Optional[str]:
+    """Junta os resultados de várias buscas numa lista só (as repetições saem quando o contexto é montado)."""
+    return serializar([resultado for texto in textos for resultado in ler_resultados(texto)])
+
+
+# =============================================================================
+# Contexto Compacto
+# =============================================================================
+
+def _chave_url(url: str) -> str:
+    """A mesma página com ou sem https, www, parâmetros ou barra no fim."""
+    url = re.sub(r"^https?://(www\.)?", "", url.lower())
+    return re.split(r"[?#]", url)[0].rstrip("/")
+
+
+def _palavras(texto: str) -> set:
+    return {palavra for palavra in normalizar_consulta(texto).split() if len(palavra) > 2}
+
+
+def _idade_em_dias(data: Optional[str]) -> Optional[int]:
+    partes = re.match(r"(\d{4})(?:-(\d{1,2}))?(?:-(\d{1,2}))?", data or "")
+    if not partes:
+        return None
+    try:
+        quando = date(int(partes.group(1)), int(partes.group(2) or 1), int(partes.group(3) or 1))
+    except ValueError:
+        return None
+    return max(0, (date.today() - quando).days)
+
+
+def _sem_repetidos(resultados: list) -> list:
+    """Tira as repetições, ficando com a de maior pontuação (na posição da primeira)."""
+    unicos = []
+    for resultado in resultados:
+        palavras = _palavras(resultado.trecho)
+        for indice, outro in enumerate(unicos):
+            mesma_pagina = resultado.url and _chave_url(resultado.url) == _chave_url(outro.url)
+            palavras_outro = _palavras(outro.trecho)
+            em_comum = len(palavras & palavras_outro) / max(1, min(len(palavras), len(palavras_outro)))
+            if mesma_pagina or (palavras and em_comum >= LIMIAR_REPETIDO):
+                if resultado.pontuacao > outro.pontuacao:
+                    unicos[indice] = resultado
+                break
+        else:
+            unicos.append(resultado)
+    return unicos
+
+
+def _nota(resultado: ResultadoBusca, posicao: int, termos: set) -> float:
+    nota = resultado.pontuacao
+    if termos:
+        nota += 0.5 * len(termos & _palavras(f"{resultado.titulo} {resultado.trecho}")) / len(termos)
+    idade = _idade_em_dias(resultado.data)
+    if idade is not None:
+        nota += 0.3 * max(0.0, 1 - idade / 365) # Até um ano: quanto mais novo, mais pesa
+    return nota + 0.1 / (1 + posicao) # Empate: vale a ordem em que o agente listou
+
+
+def _formatar(resultado: ResultadoBusca, numero: int) -> str:
+    trecho = resultado.trecho if len(resultado.trecho) <= MAX_TRECHO else resultado.trecho[:MAX_TRECHO].rsplit(" ", 1)[0] + "…"
+    cabecalho = " · ".join(parte for parte in (resultado.titulo, resultado.data) if parte)
+    linhas = [f"[{numero}] {cabecalho}" if cabecalho else f"[{numero}]", trecho]
+    if resultado.url:
+        linhas.append(f"Fonte: {resultado.url}")
+    return "\n".join(linhas)
+
+
+def montar_contexto(texto: Optional[str], consulta: str = "", orcamento: int = ORCAMENTO_CONTEXTO) -> str:
+    """Contexto para a persona: resultados sem repetição, do mais útil para o menos, até o orçamento de tokens."""
+    resultados = _sem_repetidos(ler_resultados(texto))
+    termos = _palavras(consulta)
+    ordenados = sorted(enumerate(resultados), key=lambda item: _nota(item[1], item[0], termos), reverse=True)
+    blocos, tokens = [], 0
+    for numero, (_, resultado) in enumerate(ordenados, start=1):
+        bloco = _formatar(resultado, numero)
+        custo = len(bloco) // 4 # ~4 caracteres por token
+        if blocos and tokens + custo > orcamento:
+            break # O primeiro sempre entra, mesmo sozinho passando do orçamento
+        blocos.append(bloco)
+        tokens += custo
+    return "\n\n".join(blocos)
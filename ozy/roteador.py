@@ -0,0 +1,161 @@
+"""
+Roteador do Pesquisador: decide, mensagem a mensagem, se vale pesquisar na internet.
+
+Com o Pesquisador ligado, toda mensagem pagava o agent_simplifier e o agent_searcher (duas idas à API),
+até "o que é XP?", que o modelo da persona responde sozinho. O roteador fica na frente dos agentes:
+
+- pistas de algo recente ou que muda com o tempo (patch, atualização, lançamento, temporada, um ano...)
+  sempre vão para a pesquisa;
+- perguntas de conceito ("o que é", "o que significa", "diferença entre"...) e conversa
+  ("oi", "valeu") sem nenhuma dessas pistas não pesquisam;
+- o resto, se OZY_ROTEADOR_MODELO=1, é decidido pelo modelo barato; senão pesquisa, como antes.
+
+"Sempre pesquisar" (OpcoesTurno.forcar_pesquisa) passa por cima do roteador.
+Os números (quantas pesquisas foram puladas e o tempo que isso economizou) vão para a tela.
+"""
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from ozy.cache import normalizar_consulta
+
+# Deixa o modelo barato decidir as perguntas que as regras não resolvem (custa uma chamada curta)
+USAR_MODELO = os.environ.get("OZY_ROTEADOR_MODELO", "0") == "1"
+MODELO_ROTEADOR = "gemini-2.0-flash-lite"
+
+# De onde veio a decisão
+FONTE_FORCADA = "forcada"
+FONTE_REGRA = "regra"
+FONTE_MODELO = "modelo"
+FONTE_PADRAO = "padrao"
+
+# As regras rodam sobre o texto normalizado (minúsculo, sem acento nem pontuação; ver normalizar_consulta)
+_PISTAS_RECENTES = re.compile(
+    r"\b("
+    r"patch(es)?|atualizac(ao|oes)|update|hotfix|versao|versoes|"
+    r"lancamento|lancou|lancad[oa]s?|vai lancar|quando (sai|chega|lanca)|saiu|data de|"
+    r"novidades?|nov[oa]s?|recentes?|recentemente|ultim[oa]s?|atual|atualmente|hoje|agora|esta semana|este mes|"
+    r"temporadas?|season|evento|dlc|expansao|beta|trailer|anuncio|anunciad[oa]|noticias?|"
+    r"nerf|nerfad[oa]|buff|buffad[oa]|meta|tier ?list|"
+    r"preco|quanto custa|promocao|servidor(es)?|fora do ar|"
+    r"20[2-9]\d"
+    r")\b"
+)
+_PERGUNTAS_DE_CONCEITO = re.compile(
+    r"^(o )?(que|oq) (e|sao|significa|significam|quer dizer)\b|"
+    r"\b(o que (e|sao|significa)|significado de|defina|definicao de|explique o que|diferenca entre|"
+    r"como funciona|como funcionam|pra que serve|para que serve)\b"
+)
+_CONVERSA = re.compile(r"^(oi|ola|opa|e ai|bom dia|boa tarde|boa noite|obrigad[oa]|valeu|vlw|blz|beleza|ok|tchau)\b")
+
+INSTRUCAO_ROTEADOR = (
+    "Você decide se a pergunta abaixo, feita a um assistente de videogames, precisa de uma pesquisa na internet "
+    "(dados recentes, específicos ou que mudam com o tempo) ou se um modelo de linguagem responde bem só com o que "
+    "já sabe. Responda apenas PESQUISAR ou RESPONDER.\n\nPergunta: "
+)
+
+
+@dataclass
+class Decisao:
+    """O que o roteador decidiu para uma mensagem."""
+    pesquisar: bool
+    fonte: str # 'forcada', 'regra', 'modelo' ou 'padrao'
+    motivo: str
+    duracao: float = 0.0 # Quanto a decisão custou (segundos)
+
+
+def decidir_por_regras(prompt: str):
+    """Decisão só com as regras locais: True/False, ou None quando as regras não sabem. Retorna (decisão, motivo)."""
+    texto = normalizar_consulta(prompt)
+    pista = _PISTAS_RECENTES.search(texto)
+    if pista:
+        return True, f"pista de algo recente: '{pista.group(0)}'"
+    if _CONVERSA.match(texto) and len(texto.split()) <= 4:
+        return False, "conversa"
+    if _PERGUNTAS_DE_CONCEITO.search(texto):
+        return False, "pergunta de conceito"
+    return None, "sem pista"
+
+
+def perguntar_ao_modelo(prompt: str) -> bool:
+    """Pergunta ao modelo barato se a mensagem precisa de pesquisa (passa pelo agendador da API)."""
+    from ozy.agendador import obter_agendador
+    from ozy.modelos import obter_genai
+    modelo = obter_genai().GenerativeModel(MODELO_ROTEADOR, generation_config={"max_output_tokens": 5, "temperature": 0})
+    resposta = obter_agendador().executar(MODELO_ROTEADOR, modelo.generate_content, INSTRUCAO_ROTEADOR + prompt)
+    return "RESPONDER" not in resposta.text.upper()
+
+
+class Roteador:
+    """Decide se cada mensagem vai para o Pesquisador e conta o que foi economizado."""
+
+    def __init__(self, backend, usar_modelo: bool = USAR_MODELO):
+        self.backend = backend
+        self.usar_modelo = usar_modelo
+        self._lock = threading.Lock()
+        # Números para mostrar na tela
+        self.decisoes = 0
+        self.puladas = 0
+        self.forcadas = 0
+        self.por_fonte = {FONTE_FORCADA: 0, FONTE_REGRA: 0, FONTE_MODELO: 0, FONTE_PADRAO: 0}
+        self.falhas_modelo = 0
+        self.tempo_decisoes = 0.0
+        # Duração das pesquisas que rodaram de verdade: dá o tempo que cada pesquisa pulada economizou
+        self.pesquisas_medidas = 0
+        self.tempo_pesquisas = 0.0
+
+    def decidir(self, prompt: str, forcar: bool = False, id_sessao: Optional[str] = None) -> Decisao:
+        inicio = time.perf_counter()
+        if forcar:
+            decisao = Decisao(True, FONTE_FORCADA, "sempre pesquisar")
+        else:
+            pesquisar, motivo = decidir_por_regras(prompt)
+            if pesquisar is not None:
+                decisao = Decisao(pesquisar, FONTE_REGRA, motivo)
+            elif self.usar_modelo:
+                decisao = self._perguntar_ao_modelo(prompt, id_sessao)
+            else:
+                decisao = Decisao(True, FONTE_PADRAO, motivo)
+        decisao.duracao = time.perf_counter() - inicio
+        with self._lock:
+            self.decisoes += 1
+            self.por_fonte[decisao.fonte] += 1
+            self.puladas += not decisao.pesquisar
+            self.forcadas += forcar
+            self.tempo_decisoes += decisao.duracao
+        return decisao
+
+    def _perguntar_ao_modelo(self, prompt: str, id_sessao: Optional[str]) -> Decisao:
+        try:
+            pesquisar = self.backend.decidir_pesquisa(prompt, id_sessao)
+        except Exception as e:
+            print(f"Erro no roteador do Pesquisador: {e}") # Debug
+            with self._lock:
+                self.falhas_modelo += 1
+            return Decisao(True, FONTE_PADRAO, "modelo falhou") # Na dúvida, pesquisa
+        return Decisao(pesquisar, FONTE_MODELO, "modelo pediu pesquisa" if pesquisar else "modelo responde sem pesquisa")
+
+    def registrar_pesquisa(self, duracao: float):
+        """Duração de uma pesquisa que rodou de verdade (sem vir do cache)."""
+        with self._lock:
+            self.pesquisas_medidas += 1
+            self.tempo_pesquisas += duracao
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            pesquisa_media = self.tempo_pesquisas / self.pesquisas_medidas if self.pesquisas_medidas else 0.0
+            return {
+                "decisoes": self.decisoes,
+                "puladas": self.puladas,
+                "forcadas": self.forcadas,
+                "taxa_pulo": self.puladas / self.decisoes if self.decisoes else 0.0,
+                "por_fonte": dict(self.por_fonte),
+                "falhas_modelo": self.falhas_modelo,
+                "tempo_medio_decisao": self.tempo_decisoes / self.decisoes if self.decisoes else 0.0,
+                "pesquisa_media": pesquisa_media,
+                # Estimativa: cada pesquisa pulada teria custado a duração média das que rodaram (menos a decisão)
+                "latencia_economizada": max(0.0, self.puladas * pesquisa_media - self.tempo_decisoes),
+            }
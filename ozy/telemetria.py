@@ -0,0 +1,395 @@
+"""
+Telemetria do Ozy: spans de cada etapa de uma mensagem, métricas e exportação.
+
+Cada etapa (preparo da imagem, agentes do Pesquisador, modelo da persona, send_message, histórico,
+execução do script do Streamlit) vira um span com a duração e, quando fizer sentido, tokens e tamanhos:
+
+- tokens_entrada / tokens_saida / tokens_em_cache: somados nas métricas por etapa;
+- bytes_entrada / bytes_saida: tamanho do que a etapa recebeu e produziu;
+- qualquer outro atributo fica só no span.
+
+Os spans de um mesmo turno formam uma árvore (turno > pesquisa > pesquisa.simplificador...).
+O pai vem de 'pai=' ou, se não for passado, do span ativo no contexto (contextvars).
+Dentro de geradores use iniciar_span()/terminar(): o span() ativa o contexto e não pode atravessar um yield.
+
+Saídas:
+- exportar_otlp(): JSON no formato OTLP/HTTP do OpenTelemetry (o mesmo que um coletor aceita em /v1/traces);
+- exportar_prometheus(): métricas no formato texto do Prometheus;
+- OZY_OTLP_ENDPOINT=http://coletor:4318/v1/traces envia os spans em lotes para um coletor;
+- OZY_METRICAS_PORTA=9464 sobe /metrics e /spans neste processo (útil no Streamlit, que não tem rotas próprias),
+  só em 127.0.0.1 a não ser que OZY_METRICAS_HOST diga outro endereço;
+- ultimas_etapas(id_sessao): a duração mais recente de cada etapa de uma sessão, para o painel de depuração.
+
+Eventos que não são etapas (ex.: mensagens recusadas pelas cotas) usam contar(nome, **rótulos): viram
+ozy_<nome>_total em /metrics, com a descrição registrada em descrever_contador().
+"""
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+# Quantos spans terminados ficam na memória (os mais antigos saem primeiro)
+MAX_SPANS = int(os.environ.get("OZY_TELEMETRIA_MAX_SPANS", 5000))
+# Sessões com as últimas etapas guardadas para o painel de depuração
+MAX_SESSOES_PAINEL = 1000
+# Limites dos baldes do histograma de duração (segundos)
+BALDES_DURACAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Envio para um coletor OpenTelemetry
+ENDPOINT_OTLP = os.environ.get("OZY_OTLP_ENDPOINT")
+# Endereço do servidor de métricas: só a própria máquina por padrão (os spans mostram o que cada sessão fez)
+HOST_METRICAS = os.environ.get("OZY_METRICAS_HOST", "127.0.0.1")
+INTERVALO_EXPORTACAO = 5.0
+NOME_SERVICO = os.environ.get("OZY_NOME_SERVICO", "ozy-assistente")
+
+# Atributos que viram contadores nas métricas
+ATRIBUTOS_TOKENS = ("tokens_entrada", "tokens_saida", "tokens_em_cache")
+ATRIBUTOS_BYTES = ("bytes_entrada", "bytes_saida")
+
+# Contador -> descrição (linha HELP do Prometheus)
+DESCRICOES_CONTADORES = {}
+
+_span_ativo = contextvars.ContextVar("ozy_span_ativo", default=None)
+
+
+# =============================================================================
+# Spans
+# =============================================================================
+
+class Span:
+    """Uma etapa medida. Termina com terminar() (ou ao sair do 'with span(...)')."""
+    __slots__ = ("nome", "id_trace", "id_span", "id_pai", "id_sessao", "inicio_ns", "fim_ns", "atributos", "erro",
+                 "_rastreador")
+
+    def __init__(self, rastreador, nome: str, pai: Optional["Span"] = None, id_sessao: Optional[str] = None,
+                 inicio_ns: Optional[int] = None, atributos: Optional[dict] = None):
+        self._rastreador = rastreador
+        self.nome = nome
+        self.id_trace = pai.id_trace if pai is not None else os.urandom(16).hex()
+        self.id_span = os.urandom(8).hex()
+        self.id_pai = pai.id_span if pai is not None else None
+        self.id_sessao = id_sessao or (pai.id_sessao if pai is not None else None)
+        self.inicio_ns = inicio_ns or time.time_ns()
+        self.fim_ns = None
+        self.atributos = atributos or {}
+        self.erro = None
+
+    def definir(self, **atributos):
+        """Acrescenta atributos (valores None são ignorados)."""
+        self.atributos.update({chave: valor for chave, valor in atributos.items() if valor is not None})
+
+    @property
+    def duracao(self) -> float:
+        """Segundos (até agora, se ainda não terminou)."""
+        return ((self.fim_ns or time.time_ns()) - self.inicio_ns) / 1e9
+
+    def terminar(self, erro: Optional[str] = None):
+        if self.fim_ns is not None:
+            return # Já terminado
+        self.fim_ns = time.time_ns()
+        self.erro = erro
+        self._rastreador.registrar(self)
+
+
+class Rastreador:
+    """Guarda os spans terminados, as métricas agregadas por etapa e as últimas etapas de cada sessão."""
+
+    def __init__(self, max_spans: int = MAX_SPANS, max_sessoes: int = MAX_SESSOES_PAINEL):
+        self._spans = deque(maxlen=max_spans)
+        self._ultimas = OrderedDict() # id_sessao -> {etapa: resumo}
+        self.max_sessoes = max_sessoes
+        self._duracoes = {} # etapa -> {"contagem", "soma", "baldes", "erros"}
+        self._tokens = {} # (etapa, tipo) -> total
+        self._bytes = {} # (etapa, direção) -> total
+        self._contadores = {} # (nome, rótulos ordenados) -> total
+        self._pendentes = [] # Spans ainda não enviados ao coletor (só com OZY_OTLP_ENDPOINT)
+        self.exportar_para_coletor = False
+        self._lock = threading.Lock()
+
+    def iniciar_span(self, nome: str, pai: Optional[Span] = None, id_sessao: Optional[str] = None,
+                     inicio_ns: Optional[int] = None, **atributos) -> Span:
+        span = Span(self, nome, pai if pai is not None else _span_ativo.get(), id_sessao, inicio_ns)
+        span.definir(**atributos)
+        return span
+
+    def registrar(self, span: Span):
+        """Chamado quando um span termina."""
+        duracao = span.duracao
+        with self._lock:
+            self._spans.append(span)
+            if self.exportar_para_coletor:
+                self._pendentes.append(span)
+
+            metrica = self._duracoes.get(span.nome)
+            if metrica is None:
+                metrica = self._duracoes[span.nome] = {"contagem": 0, "soma": 0.0, "erros": 0,
+                                                       "baldes": [0] * len(BALDES_DURACAO)}
+            metrica["contagem"] += 1
+            metrica["soma"] += duracao
+            metrica["erros"] += 1 if span.erro else 0
+            for i, limite in enumerate(BALDES_DURACAO):
+                if duracao <= limite:
+                    metrica["baldes"][i] += 1
+                    break
+            for chave in ATRIBUTOS_TOKENS:
+                if isinstance(span.atributos.get(chave), (int, float)):
+                    tipo = chave[len("tokens_"):]
+                    self._tokens[(span.nome, tipo)] = self._tokens.get((span.nome, tipo), 0) + span.atributos[chave]
+            for chave in ATRIBUTOS_BYTES:
+                if isinstance(span.atributos.get(chave), (int, float)):
+                    direcao = chave[len("bytes_"):]
+                    self._bytes[(span.nome, direcao)] = self._bytes.get((span.nome, direcao), 0) + span.atributos[chave]
+
+            if span.id_sessao:
+                etapas = self._ultimas.get(span.id_sessao)
+                if etapas is None:
+                    etapas = self._ultimas[span.id_sessao] = {}
+                else:
+                    self._ultimas.move_to_end(span.id_sessao)
+                etapas[span.nome] = {"etapa": span.nome, "duracao_ms": round(duracao * 1000, 1),
+                                     "quando": span.fim_ns, "erro": span.erro, **span.atributos}
+                while len(self._ultimas) > self.max_sessoes:
+                    self._ultimas.popitem(last=False)
+
+    def contar(self, nome: str, quantidade: int = 1, **rotulos):
+        """Soma num contador avulso (ozy_<nome>_total), um total por combinação de rótulos."""
+        chave = (nome, tuple(sorted((rotulo, str(valor)) for rotulo, valor in rotulos.items())))
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + quantidade
+
+    # --- Consultas ---------------------------------------------------------
+
+    def spans(self, id_sessao: Optional[str] = None, limite: Optional[int] = None) -> list:
+        with self._lock:
+            spans = [s for s in self._spans if id_sessao is None or s.id_sessao == id_sessao]
+        return spans[-limite:] if limite else spans
+
+    def ultimas_etapas(self, id_sessao: str) -> list:
+        """Última medida de cada etapa da sessão, na ordem em que terminaram."""
+        with self._lock:
+            etapas = list(self._ultimas.get(id_sessao, {}).values())
+        return sorted(etapas, key=lambda etapa: etapa["quando"])
+
+    def limpar(self):
+        with self._lock:
+            self._spans.clear()
+            self._ultimas.clear()
+            self._duracoes.clear()
+            self._tokens.clear()
+            self._bytes.clear()
+            self._contadores.clear()
+            self._pendentes.clear()
+
+    # --- Exportação --------------------------------------------------------
+
+    def exportar_otlp(self, spans: Optional[list] = None) -> dict:
+        """Spans no formato JSON do OTLP (ExportTraceServiceRequest)."""
+        spans = self.spans() if spans is None else spans
+        return {"resourceSpans": [{
+            "resource": {"attributes": [_atributo_otlp("service.name", NOME_SERVICO)]},
+            "scopeSpans": [{"scope": {"name": "ozy"}, "spans": [_span_otlp(span) for span in spans]}],
+        }]}
+
+    def exportar_prometheus(self) -> str:
+        """Métricas no formato texto do Prometheus (versão 0.0.4)."""
+        with self._lock:
+            duracoes = {nome: dict(m, baldes=list(m["baldes"])) for nome, m in self._duracoes.items()}
+            tokens = dict(self._tokens)
+            tamanhos = dict(self._bytes)
+            contadores = dict(self._contadores)
+        linhas = [
+            "# HELP ozy_etapa_duracao_segundos Duração de cada etapa de uma mensagem.",
+            "# TYPE ozy_etapa_duracao_segundos histogram",
+        ]
+        for nome, metrica in sorted(duracoes.items()):
+            acumulado = 0
+            for limite, quantidade in zip(BALDES_DURACAO, metrica["baldes"]):
+                acumulado += quantidade
+                linhas.append(f'ozy_etapa_duracao_segundos_bucket{{etapa="{nome}",le="{limite}"}} {acumulado}')
+            linhas.append(f'ozy_etapa_duracao_segundos_bucket{{etapa="{nome}",le="+Inf"}} {metrica["contagem"]}')
+            linhas.append(f'ozy_etapa_duracao_segundos_sum{{etapa="{nome}"}} {metrica["soma"]:.6f}')
+            linhas.append(f'ozy_etapa_duracao_segundos_count{{etapa="{nome}"}} {metrica["contagem"]}')
+        linhas += ["# HELP ozy_etapa_erros_total Etapas que terminaram com erro.", "# TYPE ozy_etapa_erros_total counter"]
+        linhas += [f'ozy_etapa_erros_total{{etapa="{nome}"}} {m["erros"]}' for nome, m in sorted(duracoes.items())]
+        linhas += ["# HELP ozy_tokens_total Tokens contados em cada etapa.", "# TYPE ozy_tokens_total counter"]
+        linhas += [f'ozy_tokens_total{{etapa="{nome}",tipo="{tipo}"}} {total}' for (nome, tipo), total in sorted(tokens.items())]
+        linhas += ["# HELP ozy_bytes_total Tamanho do que cada etapa recebeu e produziu.", "# TYPE ozy_bytes_total counter"]
+        linhas += [f'ozy_bytes_total{{etapa="{nome}",direcao="{direcao}"}} {total}'
+                   for (nome, direcao), total in sorted(tamanhos.items())]
+        for nome in sorted({nome for nome, _ in contadores}):
+            linhas += [f"# HELP ozy_{nome}_total {DESCRICOES_CONTADORES.get(nome, nome)}", f"# TYPE ozy_{nome}_total counter"]
+            linhas += [f"ozy_{nome}_total{_rotulos(rotulos)} {total}"
+                       for (contador, rotulos), total in sorted(contadores.items()) if contador == nome]
+        return "\n".join(linhas) + "\n"
+
+    def enviar_pendentes(self, endpoint: str):
+        """Manda ao coletor os spans terminados desde o último envio."""
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, []
+        if not pendentes:
+            return
+        pedido = urllib.request.Request(endpoint, data=json.dumps(self.exportar_otlp(pendentes)).encode("utf-8"),
+                                        headers={"Content-Type": "application/json"}, method="POST")
+        try:
+            urllib.request.urlopen(pedido, timeout=10).close()
+        except Exception as e:
+            print(f"Não foi possível enviar os spans ao coletor: {e}") # Debug
+
+
+def _rotulos(rotulos: tuple) -> str:
+    if not rotulos:
+        return ""
+    return "{" + ",".join(f'{rotulo}="{valor}"' for rotulo, valor in rotulos) + "}"
+
+
+def _atributo_otlp(chave: str, valor) -> dict:
+    if isinstance(valor, bool):
+        return {"key": chave, "value": {"boolValue": valor}}
+    if isinstance(valor, int):
+        return {"key": chave, "value": {"intValue": str(valor)}} # O OTLP/JSON manda inteiros como texto
+    if isinstance(valor, float):
+        return {"key": chave, "value": {"doubleValue": valor}}
+    return {"key": chave, "value": {"stringValue": str(valor)}}
+
+
+def sessao_anonima(id_sessao: str) -> str:
+    """Id da sessão para fora do processo: agrupa o que é da mesma conversa sem mostrar o id de verdade."""
+    return hashlib.sha256(id_sessao.encode("utf-8")).hexdigest()[:16]
+
+
+def _span_otlp(span: Span) -> dict:
+    atributos = dict(span.atributos)
+    if span.id_sessao:
+        # O id da sessão é a única credencial da conversa (?sessao=, /sessoes/{id}): nunca sai em claro
+        atributos["ozy.sessao"] = sessao_anonima(span.id_sessao)
+    item = {
+        "traceId": span.id_trace,
+        "spanId": span.id_span,
+        "name": span.nome,
+        "kind": 1, # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(span.inicio_ns),
+        "endTimeUnixNano": str(span.fim_ns or time.time_ns()),
+        "attributes": [_atributo_otlp(chave, valor) for chave, valor in atributos.items()],
+        "status": {"code": 2, "message": span.erro} if span.erro else {"code": 1},
+    }
+    if span.id_pai:
+        item["parentSpanId"] = span.id_pai
+    return item
+
+
+# =============================================================================
+# Servidor de Métricas e Envio ao Coletor
+# =============================================================================
+
+def iniciar_servidor_metricas(porta: int, rastreador: Rastreador, host: str = HOST_METRICAS) -> ThreadingHTTPServer:
+    """Sobe /metrics (Prometheus) e /spans (OTLP/JSON, com as sessões anônimas) numa thread."""
+
+    class Manipulador(BaseHTTPRequestHandler):
+        def log_message(self, formato, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.startswith("/metrics"):
+                corpo, tipo = rastreador.exportar_prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+            elif self.path.startswith("/spans"):
+                corpo, tipo = json.dumps(rastreador.exportar_otlp()).encode("utf-8"), "application/json"
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+    servidor = ThreadingHTTPServer((host, porta), Manipulador)
+    threading.Thread(target=servidor.serve_forever, daemon=True, name="ozy-metricas").start()
+    return servidor
+
+
+def _enviar_periodicamente(rastreador: Rastreador, endpoint: str):
+    while True:
+        time.sleep(INTERVALO_EXPORTACAO)
+        rastreador.enviar_pendentes(endpoint)
+
+
+# =============================================================================
+# Rastreador do Processo
+# =============================================================================
+
+_rastreador = None
+_rastreador_lock = threading.Lock()
+
+def obter_rastreador() -> Rastreador:
+    global _rastreador
+    if _rastreador is None:
+        with _rastreador_lock:
+            if _rastreador is None:
+                rastreador = Rastreador()
+                if ENDPOINT_OTLP:
+                    rastreador.exportar_para_coletor = True
+                    threading.Thread(target=_enviar_periodicamente, args=(rastreador, ENDPOINT_OTLP),
+                                     daemon=True, name="ozy-otlp").start()
+                if os.environ.get("OZY_METRICAS_PORTA"):
+                    try:
+                        iniciar_servidor_metricas(int(os.environ["OZY_METRICAS_PORTA"]), rastreador)
+                    except OSError as e:
+                        # Porta ocupada (ex.: outro processo do mesmo servidor já expõe as métricas)
+                        print(f"Servidor de métricas não iniciado: {e}") # Debug
+                _rastreador = rastreador
+    return _rastreador
+
+
+def iniciar_span(nome: str, pai: Optional[Span] = None, id_sessao: Optional[str] = None,
+                 inicio_ns: Optional[int] = None, **atributos) -> Span:
+    """Começa um span sem ativá-lo no contexto (para usar dentro de geradores). Termine com span.terminar()."""
+    return obter_rastreador().iniciar_span(nome, pai, id_sessao, inicio_ns, **atributos)
+
+
+def descrever_contador(nome: str, descricao: str):
+    """Registra a descrição (linha HELP) de um contador avulso. Ele só aparece em /metrics depois da primeira contagem."""
+    DESCRICOES_CONTADORES[nome] = descricao
+
+
+def contar(nome: str, quantidade: int = 1, **rotulos):
+    """Soma no contador ozy_<nome>_total do rastreador do processo."""
+    obter_rastreador().contar(nome, quantidade, **rotulos)
+
+
+@contextmanager
+def span(nome: str, pai: Optional[Span] = None, id_sessao: Optional[str] = None, **atributos):
+    """
+    Mede o bloco e ativa o span no contexto: spans abertos dentro do bloco (inclusive em asyncio.run) viram filhos dele.
+    Um erro dentro do bloco fica registrado no span e continua subindo.
+    """
+    atual = iniciar_span(nome, pai, id_sessao, **atributos)
+    token = _span_ativo.set(atual)
+    try:
+        yield atual
+    except BaseException as e:
+        atual.terminar(erro=f"{type(e).__name__}: {e}" if str(e) else type(e).__name__)
+        raise
+    finally:
+        _span_ativo.reset(token)
+        atual.terminar()
+
+
+def span_ativo() -> Optional[Span]:
+    return _span_ativo.get()
+
+
+@contextmanager
+def ativar(atual: Optional[Span]):
+    """Torna um span já iniciado o pai dos spans abertos dentro do bloco (sem terminá-lo na saída)."""
+    token = _span_ativo.set(atual)
+    try:
+        yield atual
+    finally:
+        _span_ativo.reset(token)